@@ -19,7 +19,6 @@ from __future__ import division
 from __future__ import print_function
 
 import os
-import pickle
 import time
 import traceback
 import tensorflow as tf
@@ -28,6 +27,7 @@ from tensorflow.core.framework import summary_pb2
 from tensorflow.core.protobuf import saver_pb2
 
 from lingvo import base_trial
+from lingvo.core import checkpoint_watcher
 from lingvo.core import cluster_factory
 from lingvo.core import early_stop
 from lingvo.core import py_utils
@@ -39,6 +39,24 @@ tf.flags.DEFINE_integer(
 tf.flags.DEFINE_integer('saver_max_to_keep', 100,
                         'Maximum number of recent checkpoints to keep.')
 
+tf.flags.DEFINE_enum(
+    'checkpoint_watcher', 'poll', ['poll', 'inotify'],
+    'How evalers and decoders discover new checkpoints. "poll" checks the '
+    'checkpoint state file with an interval growing from '
+    '--checkpoint_poll_min_secs to --checkpoint_poll_max_secs while no '
+    'checkpoint arrives. "inotify" waits for file events in a local '
+    'directory and requires inotify_simple. Checkpoints saved by a '
+    'controller in the same process are always noticed immediately.')
+tf.flags.DEFINE_float('checkpoint_poll_min_secs', 5.0,
+                      'Minimum seconds between checks for new checkpoints.')
+tf.flags.DEFINE_float('checkpoint_poll_max_secs', 300.0,
+                      'Maximum seconds between checks for new checkpoints.')
+tf.flags.DEFINE_bool(
+    'eval_all_checkpoints', False,
+    'If True, evalers and decoders process every checkpoint in order. '
+    'Otherwise, they skip to the newest checkpoint. Checkpoints deleted '
+    'before they are processed are skipped either way.')
+
 FLAGS = tf.flags.FLAGS
 
 
@@ -78,6 +96,10 @@ class BaseRunner(object):
     # trials.
     self._container_id = self._trial.Name()
     self._should_report_metrics = False
+    # If True, the variables are shared with other runners through the
+    # container, and checkpoints are restored into them by the owner of those
+    # runners, e.g., trainer.EvalMultiplexer.
+    self._skip_checkpoint_restore = False
 
     # To early terminate a runner, we set max_steps here and that will trigger
     # appropriate ShouldStop behavior in the threads. This is used by Vizier
@@ -162,25 +184,46 @@ class BaseRunner(object):
 
   def _LoadCheckpointForEval(self, sess, checkpoint_path):
     """Load the checkpoint for evaluation."""
+    if self._skip_checkpoint_restore:
+      return
     tf.logging.info('Load from checkpoint %s.', checkpoint_path)
     self._saver.restore(sess, checkpoint_path)
     tf.logging.info('Load checkpoint done.')
 
-  @py_utils.Retry(initial_delay_sec=300, max_delay_sec=300)
+  def _GetCheckpointWatcher(self):
+    """Returns the watcher of self._train_dir shared by this process."""
+    if FLAGS.checkpoint_watcher == 'inotify':
+      backend_cls = checkpoint_watcher.InotifyBackend
+    else:
+      backend_cls = checkpoint_watcher.PollingBackend
+    return checkpoint_watcher.GetCheckpointWatcher(
+        self._train_dir, lambda: backend_cls(
+            min_secs=FLAGS.checkpoint_poll_min_secs,
+            max_secs=FLAGS.checkpoint_poll_max_secs))
+
   def _FindNewCheckpoint(self, prev_path, sess):
-    """Returns the path to a new checkpoint, or raises RuntimeError."""
-    if self._trial.ShouldStop() or self._ShouldStop(sess, 0):
-      return None
-    path = tf.train.latest_checkpoint(self._train_dir)
-    if not path:
-      msg = 'No check point is found in %s' % self._train_dir
-      tf.logging.info('%s', msg)
-      raise RuntimeError(msg)
-    if path == prev_path:
-      msg = 'No new check point is found: %s' % path
-      tf.logging.info('%s', msg)
-      raise RuntimeError(msg)
-    return path
+    """Waits for a new checkpoint and returns its path.
+
+    Args:
+      prev_path: The previously processed checkpoint, or None.
+      sess: the tf Session.
+
+    Returns:
+      The path to the checkpoint after `prev_path`, which is the newest one
+      unless --eval_all_checkpoints, or None if the job should stop.
+    """
+    watcher = self._GetCheckpointWatcher()
+    while True:
+      if self._trial.ShouldStop() or self._ShouldStop(sess, 0):
+        return None
+      path = watcher.WaitForNewCheckpoint(
+          prev_path,
+          timeout=FLAGS.checkpoint_poll_max_secs,
+          in_order=FLAGS.eval_all_checkpoints)
+      if path:
+        return path
+      tf.logging.info('No new checkpoint is found in %s after %s',
+                      self._train_dir, prev_path)
 
   @py_utils.Retry()
   def _RunLoop(self, job_name, loop_func, loop_args=()):
@@ -363,11 +406,6 @@ class BaseRunner(object):
       with tf.gfile.FastGFile(text_filename, 'w') as f:
         f.write('\n'.join(status_metrics))
 
-  def _WriteKeyValuePairs(self, filename, key_value_pairs):
-    """Writes `key_value_pairs` to `filename`."""
-    with open(filename, 'wb') as f:
-      pickle.dump(key_value_pairs, f, protocol=pickle.HIGHEST_PROTOCOL)
-
   def _ExportMetrics(self, **kwargs):
     """Exports metrics externally."""
     pass
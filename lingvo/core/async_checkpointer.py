@@ -0,0 +1,195 @@
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Writes checkpoints on a background thread."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import threading
+import time
+
+from six.moves import queue
+from six.moves import zip
+import tensorflow as tf
+
+from tensorflow.core.protobuf import saver_pb2
+
+
+class AsyncCheckpointer(object):
+  """Saves checkpoints without blocking the caller on the file system.
+
+  Save() snapshots the variables into host memory with a single session run
+  and returns. A background thread then writes the snapshots, in order, with a
+  saver over a staging copy of the variables in a local graph. The checkpoint
+  state file is updated only after a checkpoint is completely written, so
+  readers never see a partially written checkpoint.
+
+  At most `max_pending` snapshots are held in memory at any time, in addition
+  to the staging copy, which takes as much host memory as the variables.
+
+  If writing a checkpoint fails, the next call to Save(), Wait() or Close()
+  raises the error.
+  """
+
+  def __init__(self,
+               variables,
+               global_step,
+               save_path,
+               max_pending=1,
+               max_to_keep=5,
+               keep_checkpoint_every_n_hours=10000.0,
+               done_callback=None):
+    """Constructor.
+
+    Args:
+      variables: The list of variables to save.
+      global_step: The global step variable. Checkpoint file names are
+        suffixed with its value.
+      save_path: The prefix of the checkpoint file names.
+      max_pending: The maximum number of snapshots which are not completely
+        written yet.
+      max_to_keep: See tf.train.Saver.
+      keep_checkpoint_every_n_hours: See tf.train.Saver.
+      done_callback: If not None, called on the background thread as
+        done_callback(global_step, path, snapshot_seconds, write_seconds) after
+        every checkpoint is written.
+    """
+    assert max_pending > 0
+    self._variables = variables
+    self._global_step = global_step
+    self._save_path = save_path
+    self._done_callback = done_callback
+
+    # Staging variables with the same names and save slices as 'variables'.
+    self._graph = tf.Graph()
+    with self._graph.as_default(), tf.device('/cpu:0'):
+      self._placeholders = []
+      staging_vars = []
+      for v in variables:
+        placeholder = tf.placeholder(v.dtype.base_dtype, v.shape)
+        staging_var = tf.Variable(
+            placeholder, trainable=False, collections=[], name=v.op.name)
+        # pylint: disable=protected-access
+        staging_var._save_slice_info = v._save_slice_info
+        # pylint: enable=protected-access
+        self._placeholders.append(placeholder)
+        staging_vars.append(staging_var)
+      self._load_op = tf.group(*[v.initializer for v in staging_vars])
+      self._saver = tf.train.Saver(
+          staging_vars,
+          max_to_keep=max_to_keep,
+          keep_checkpoint_every_n_hours=keep_checkpoint_every_n_hours,
+          pad_step_number=True,  # %08d
+          write_version=saver_pb2.SaverDef.V2)
+    self._sess = tf.Session(graph=self._graph)
+
+    self._pending = threading.Semaphore(max_pending)
+    self._error_lock = threading.Lock()
+    self._error = None
+    self._queue = queue.Queue()
+    self._thread = threading.Thread(target=self._WriteLoop)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def Save(self, sess, block=False):
+    """Snapshots the variables in `sess` to be written in the background.
+
+    Args:
+      sess: The session holding the variables.
+      block: If True, waits until fewer than `max_pending` snapshots are
+        pending. Otherwise, skips the snapshot if there are that many.
+
+    Returns:
+      True iff a snapshot is taken.
+
+    Raises:
+      The error of writing an earlier checkpoint, if any.
+    """
+    self._RaiseWriteError()
+    if not self._pending.acquire(block):
+      tf.logging.info('Skip checkpoint: previous checkpoints are pending.')
+      return False
+    try:
+      start = time.time()
+      values = sess.run([self._global_step] + self._variables)
+    except:
+      self._pending.release()
+      raise
+    snapshot_seconds = time.time() - start
+    tf.logging.info('Snapshot checkpoint @%d: %.2f seconds', values[0],
+                    snapshot_seconds)
+    self._queue.put((values[0], values[1:], snapshot_seconds))
+    return True
+
+  def Wait(self):
+    """Waits until all snapshots taken so far are written.
+
+    Raises:
+      The error of writing an earlier checkpoint, if any.
+    """
+    self._queue.join()
+    self._RaiseWriteError()
+
+  def Close(self):
+    """Writes all pending snapshots and stops the background thread.
+
+    Raises:
+      The error of writing an earlier checkpoint, if any.
+    """
+    self._queue.put(None)
+    self._thread.join()
+    self._sess.close()
+    self._RaiseWriteError()
+
+  def _RaiseWriteError(self):
+    """Raises, once, the first error the background thread ran into."""
+    with self._error_lock:
+      error, self._error = self._error, None
+    if error is not None:
+      raise error
+
+  def _WriteLoop(self):
+    while True:
+      item = self._queue.get()
+      if item is None:
+        self._queue.task_done()
+        return
+      global_step, values, snapshot_seconds = item
+      del item
+      try:
+        start = time.time()
+        self._sess.run(
+            self._load_op, feed_dict=dict(zip(self._placeholders, values)))
+        del values
+        path = self._saver.save(
+            self._sess,
+            self._save_path,
+            global_step=global_step,
+            write_meta_graph=False)
+        write_seconds = time.time() - start
+        tf.logging.info('Write checkpoint done: %s: %.2f seconds', path,
+                        write_seconds)
+        if self._done_callback:
+          self._done_callback(global_step, path, snapshot_seconds,
+                              write_seconds)
+      except Exception as e:  # pylint: disable=broad-except
+        tf.logging.error('Failed to write checkpoint @%d: %s', global_step, e)
+        with self._error_lock:
+          if self._error is None:
+            self._error = e
+      finally:
+        self._pending.release()
+        self._queue.task_done()
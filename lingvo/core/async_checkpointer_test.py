@@ -0,0 +1,123 @@
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for async_checkpointer."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import numpy as np
+import tensorflow as tf
+
+from lingvo.core import async_checkpointer
+
+
+class AsyncCheckpointerTest(tf.test.TestCase):
+
+  def testSaveAndRestore(self):
+    train_dir = os.path.join(self.get_temp_dir(), 'save_and_restore')
+    save_path = os.path.join(train_dir, 'ckpt')
+    done = []
+
+    def DoneCallback(global_step, path, snapshot_seconds, write_seconds):
+      done.append((global_step, path))
+      self.assertGreaterEqual(snapshot_seconds, 0)
+      self.assertGreaterEqual(write_seconds, 0)
+
+    with self.session(graph=tf.Graph()) as sess:
+      global_step = tf.train.get_or_create_global_step()
+      w = tf.get_variable('layer/w', initializer=tf.ones([2, 3]))
+      with tf.variable_scope('layer'):
+        b = tf.get_variable(
+            'b', [4], partitioner=tf.fixed_size_partitioner(2),
+            initializer=tf.zeros_initializer())
+      variables = tf.global_variables()
+      checkpointer = async_checkpointer.AsyncCheckpointer(
+          variables,
+          global_step,
+          save_path,
+          max_pending=2,
+          done_callback=DoneCallback)
+      sess.run(tf.global_variables_initializer())
+      self.assertTrue(checkpointer.Save(sess, block=True))
+      sess.run([
+          tf.assign(global_step, 10),
+          tf.assign(w, 2 * tf.ones([2, 3])),
+          b.assign(tf.range(4, dtype=tf.float32)),
+      ])
+      self.assertTrue(checkpointer.Save(sess, block=True))
+      # The variables are snapshotted when Save() returns.
+      sess.run(tf.assign(w, 3 * tf.ones([2, 3])))
+      checkpointer.Wait()
+      checkpointer.Close()
+
+    self.assertEqual([0, 10], [step for step, _ in done])
+    self.assertEqual(done[-1][1], tf.train.latest_checkpoint(train_dir))
+
+    # A regular saver restores the checkpoint, including the partitioned
+    # variable.
+    with self.session(graph=tf.Graph()) as sess:
+      global_step = tf.train.get_or_create_global_step()
+      w = tf.get_variable('layer/w', [2, 3])
+      with tf.variable_scope('layer'):
+        b = tf.get_variable('b', [4], partitioner=tf.fixed_size_partitioner(2))
+      tf.train.Saver().restore(sess, tf.train.latest_checkpoint(train_dir))
+      self.assertEqual(10, sess.run(global_step))
+      self.assertAllEqual(2 * np.ones([2, 3]), sess.run(w))
+      self.assertAllEqual(np.arange(4), sess.run(tf.convert_to_tensor(b)))
+
+  def testSkipWhenPending(self):
+    train_dir = os.path.join(self.get_temp_dir(), 'skip_when_pending')
+    with self.session(graph=tf.Graph()) as sess:
+      global_step = tf.train.get_or_create_global_step()
+      checkpointer = async_checkpointer.AsyncCheckpointer(
+          tf.global_variables(), global_step, os.path.join(train_dir, 'ckpt'))
+      sess.run(tf.global_variables_initializer())
+      # Holds the only pending slot.
+      self.assertTrue(checkpointer._pending.acquire(False))
+      self.assertFalse(checkpointer.Save(sess))
+      checkpointer._pending.release()
+      self.assertTrue(checkpointer.Save(sess))
+      checkpointer.Close()
+    self.assertIsNotNone(tf.train.latest_checkpoint(train_dir))
+
+  def testWriteError(self):
+    train_dir = os.path.join(self.get_temp_dir(), 'write_error')
+
+    def DoneCallback(global_step, path, snapshot_seconds, write_seconds):
+      del path, snapshot_seconds, write_seconds
+      raise ValueError('Failed @%d' % global_step)
+
+    with self.session(graph=tf.Graph()) as sess:
+      global_step = tf.train.get_or_create_global_step()
+      checkpointer = async_checkpointer.AsyncCheckpointer(
+          tf.global_variables(),
+          global_step,
+          os.path.join(train_dir, 'ckpt'),
+          done_callback=DoneCallback)
+      sess.run(tf.global_variables_initializer())
+      self.assertTrue(checkpointer.Save(sess, block=True))
+      with self.assertRaisesRegexp(ValueError, 'Failed @0'):
+        checkpointer.Wait()
+      # The error is raised only once.
+      self.assertTrue(checkpointer.Save(sess, block=True))
+      with self.assertRaisesRegexp(ValueError, 'Failed @0'):
+        checkpointer.Close()
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -18,6 +18,8 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import uuid
+
 import six
 from six.moves import range
 import tensorflow as tf
@@ -28,6 +30,7 @@ from tensorflow.python.ops import io_ops
 from lingvo.core import base_layer
 from lingvo.core import input_generator_helper as ig_helper
 from lingvo.core import py_utils
+from lingvo.core import summary_utils
 from lingvo.core import tokenizers
 from lingvo.core.ops import py_x_ops
 
@@ -235,8 +238,17 @@ class BaseInputGeneratorFromFiles(BaseInputGenerator):
         'file_buffer_size', 10000,
         'How many records are buffered for random shuffling. This param '
         'affects how much RAM a train/test job needs. E.g., if an average '
-        'record is about 500KB, the buffer needs 5GB ram.')
+        'record is about 500KB, the buffer needs 5GB ram. Records of '
+        '"indexed:" files are read in a random order, so they need a much '
+        'smaller buffer.')
     p.Define('file_parallelism', 16, 'How many files to read concurrently.')
+    p.Define(
+        'num_file_shards', 1, 'If larger than 1, only reads every '
+        'num_file_shards-th file, starting at file_shard_index, of the sorted '
+        'files matched by each file pattern. Input generators with different '
+        'file_shard_index thus read disjoint slices of the data, e.g., for '
+        'sharded evaluation.')
+    p.Define('file_shard_index', 0, 'The file shard to read.')
     p.Define(
         'flush_every_n', 0, 'If non-zero, flushes all batches buffered '
         'so far every these many records are yielded.')
@@ -247,6 +259,10 @@ class BaseInputGeneratorFromFiles(BaseInputGenerator):
         'different input sources within batch or across batches (the '
         'default option). This option only takes effect when file_pattern'
         ' is a list of file patterns with weights.')
+    p.Define(
+        'input_stats_summaries', False, 'If True, adds summaries of the '
+        'counters of the input ops, e.g., the seconds spent waiting for '
+        'input batches, which tell whether training is input-bound.')
     return p
 
   @base_layer.initializer
@@ -255,6 +271,8 @@ class BaseInputGeneratorFromFiles(BaseInputGenerator):
     if self.params.use_per_host_infeed and self.params.file_random_seed != 0:
       raise ValueError('file_random_seed needs to be 0 when '
                        'use_per_host_infeed == True.')
+    if not 0 <= self.params.file_shard_index < self.params.num_file_shards:
+      raise ValueError('file_shard_index must be in [0, num_file_shards).')
 
   def CommonInputOpArgs(self):
     """Common input params."""
@@ -264,9 +282,15 @@ class BaseInputGeneratorFromFiles(BaseInputGenerator):
         'file_random_seed': p.file_random_seed,
         'file_buffer_size': p.file_buffer_size,
         'file_parallelism': p.file_parallelism,
+        'num_file_shards': p.num_file_shards,
+        'file_shard_index': p.file_shard_index,
         'flush_every_n': p.flush_every_n,
         'num_threads': p.num_batcher_threads,
     })
+    if p.input_stats_summaries:
+      # Unique in the process, so that InputStats ops of other graphs with
+      # the same op names do not report this op's counters.
+      args['stats_key'] = uuid.uuid4().hex
     args.update(self._InputOpBucketingArgs())
     return args
 
@@ -384,17 +408,45 @@ class BaseInputGeneratorFromFiles(BaseInputGenerator):
       ValueError: If unknown token type.
     """
     p = self.params
+    graph = tf.get_default_graph()
+    num_ops = len(graph.get_operations())
     input_file_pattern = p.file_pattern
     if isinstance(input_file_pattern, six.string_types):
-      return self._DataSourceFromFilePattern(input_file_pattern)
+      ret = self._DataSourceFromFilePattern(input_file_pattern)
     elif isinstance(input_file_pattern, list):
       if p.use_within_batch_mixing:
-        return self._BuildWithinBatchMixingDataSource()
+        ret = self._BuildWithinBatchMixingDataSource()
       else:
         # Otherwise fall back to MixByWeight-based approach.
-        return self._BuildCrossBatchMixingDataSource()
+        ret = self._BuildCrossBatchMixingDataSource()
     else:
       raise ValueError()
+    if p.input_stats_summaries:
+      for op in graph.get_operations()[num_ops:]:
+        if op.type == 'GenericInput' and op.get_attr('stats_key'):
+          self._AddInputStatsSummaries(op)
+    return ret
+
+  def _AddInputStatsSummaries(self, input_op):
+    """Adds summaries of the counters of `input_op`, a GenericInput op."""
+    (epoch, records_yielded, records_skipped, bucket_batches,
+     shard_records_per_sec, buffer_fill, yielder_wait_seconds,
+     batcher_wait_seconds) = py_x_ops.input_stats(
+         stats_key=input_op.get_attr('stats_key'))
+    prefix = 'input_stats/%s/' % input_op.name
+    summary_utils.scalar(prefix + 'epoch', epoch)
+    summary_utils.scalar(prefix + 'records_yielded', records_yielded)
+    summary_utils.scalar(prefix + 'records_skipped', records_skipped)
+    summary_utils.scalar(prefix + 'buffer_fill', buffer_fill)
+    summary_utils.scalar(prefix + 'yielder_wait_seconds',
+                         yielder_wait_seconds)
+    summary_utils.scalar(prefix + 'batcher_wait_seconds', batcher_wait_seconds)
+    summary_utils.histogram(prefix + 'shard_records_per_sec',
+                            shard_records_per_sec)
+    num_buckets = len(input_op.get_attr('bucket_upper_bound'))
+    for i in range(num_buckets):
+      summary_utils.scalar(prefix + 'bucket_batches/%d' % i,
+                           bucket_batches[i])
 
 
 class BaseSequenceInputGenerator(BaseInputGeneratorFromFiles):
@@ -412,7 +464,21 @@ class BaseSequenceInputGenerator(BaseInputGeneratorFromFiles):
         'upper bounds are skipped.')
     p.Define(
         'bucket_batch_limit', [8], 'For each bucket, desired batch size. '
-        'Must be the same length as bucket_upper_bound.')
+        'Must be the same length as bucket_upper_bound. If None, it is '
+        'computed from bucket_max_tokens as bucket_max_tokens // '
+        'bucket_upper_bound[i] for each bucket.')
+    p.Define(
+        'bucket_max_tokens', 0, 'If positive, the maximum number of padded '
+        'tokens (batch size times the longest bucket key in the batch) per '
+        'batch. A batch is closed as soon as the next example would exceed '
+        'it, or bucket_batch_limit examples are reached.')
+    p.Define(
+        'packing_factor', None,
+        'If set, several short examples are packed into each row of length '
+        'source_max_length/target_max_length, and the batch has segment_ids '
+        'and segment_pos. Each packed batch is packed from packing_factor '
+        'times bucket_batch_limit examples, and has bucket_batch_limit rows. '
+        'Only supported by some input generators.')
     p.Define('source_max_length', None,
              'The maximum length of the source sequence.')
     p.Define('target_max_length', 300,
@@ -455,8 +521,15 @@ class BaseSequenceInputGenerator(BaseInputGeneratorFromFiles):
     p = self.params
     if not hasattr(self, '_scaled_bucket_batch_limit'):
       cluster = self.cluster
+      bucket_batch_limit = p.bucket_batch_limit
+      if bucket_batch_limit is None:
+        assert p.bucket_max_tokens > 0, (
+            'bucket_max_tokens is required when bucket_batch_limit is None.')
+        bucket_batch_limit = [
+            max(1, p.bucket_max_tokens // b) for b in p.bucket_upper_bound
+        ]
       self._scaled_bucket_batch_limit = [
-          b * cluster.num_splits_per_client for b in p.bucket_batch_limit
+          b * cluster.num_splits_per_client for b in bucket_batch_limit
       ]
       if p.use_per_host_infeed and cluster.num_tpu_hosts > 0:
         self._scaled_bucket_batch_limit = [
@@ -464,6 +537,15 @@ class BaseSequenceInputGenerator(BaseInputGeneratorFromFiles):
         ]
     return self._scaled_bucket_batch_limit
 
+  @property  # Adjust the token budget according to the cluster spec.
+  def scaled_bucket_max_tokens(self):
+    p = self.params
+    cluster = self.cluster
+    max_tokens = p.bucket_max_tokens * cluster.num_splits_per_client
+    if p.use_per_host_infeed and cluster.num_tpu_hosts > 0:
+      max_tokens //= cluster.num_tpu_hosts
+    return max_tokens
+
   def InputBatchSize(self):
     if self._input_batch_size is None:
       raise ValueError('No input batch size is defined.')
@@ -472,10 +554,16 @@ class BaseSequenceInputGenerator(BaseInputGeneratorFromFiles):
   def _InputOpBucketingArgs(self):
     p = self.params
     bucket_batch_limit = self.scaled_bucket_batch_limit
+    if p.packing_factor:
+      # Read enough examples to fill the packed rows.
+      bucket_batch_limit = [
+          max(1, int(b * p.packing_factor)) for b in bucket_batch_limit
+      ]
     tf.logging.info('bucket_batch_limit %r', bucket_batch_limit)
     return {
         'bucket_upper_bound': p.bucket_upper_bound,
         'bucket_batch_limit': bucket_batch_limit,
+        'bucket_max_tokens': self.scaled_bucket_max_tokens,
     }
 
   def StringsToIds(self,
@@ -100,6 +100,11 @@ class BaseTask(base_layer.BaseLayer):
     tp.Define('max_steps', 4 * 10**6, 'Maximum number of training steps.')
     tp.Define('tpu_steps_per_loop', 100, 'The number of training steps per '
               'training loop for TPUs.')
+    tp.Define(
+        'steps_per_loop', 1, 'The number of training steps per session run '
+        'for non-TPU trainers. If larger than 1, the steps run in a '
+        'tf.while_loop and only the eval metrics averaged over the loop are '
+        'fetched. Per-example tensors are not fetched in this mode.')
     tp.Define(
         'vn_start_step', 200000000,
         'Step starting from which variational noise is added to '
@@ -1016,6 +1021,11 @@ class BaseModel(base_layer.BaseLayer):
     tp.Define('max_steps', 4 * 10**6, 'Training max of 4M steps.')
     tp.Define('tpu_steps_per_loop', 100, 'The number of training steps per '
               'training loop for TPUs.')
+    tp.Define(
+        'steps_per_loop', 1, 'The number of training steps per session run '
+        'for non-TPU trainers. If larger than 1, the steps run in a '
+        'tf.while_loop and only the eval metrics averaged over the loop are '
+        'fetched. Per-example tensors are not fetched in this mode.')
     tp.Define(
         'ema_decay', 0.0,
         'If > 0, enable ExponentialMovingAverage during training '
@@ -1122,6 +1132,7 @@ class SingleTaskModel(BaseModel):
       tp.start_up_delay_steps = p.task.train.start_up_delay_steps
       tp.max_steps = p.task.train.max_steps
       tp.tpu_steps_per_loop = p.task.train.tpu_steps_per_loop
+      tp.steps_per_loop = p.task.train.steps_per_loop
       tp.ema_decay = p.task.train.ema_decay
       # init_from_checkpoint_rules does not need to be copied.
       tp.early_stop = p.task.train.early_stop
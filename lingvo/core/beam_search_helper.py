@@ -23,9 +23,11 @@ from __future__ import print_function
 
 import collections
 
+import six
 import tensorflow as tf
 
 from lingvo.core import base_layer
+from lingvo.core import kv_cache
 from lingvo.core import py_utils
 from lingvo.core.ops import py_x_ops
 
@@ -44,7 +46,7 @@ from lingvo.core.ops import py_x_ops
 #  topk_hyps: A string Tensor of shape [batch_size, num_hyps_per_beam].
 #    topk_hyps[b, h] is the h-th hypothesis for the sample 'b' in the
 #    batch, which can either be an empty string or a serialized Hypothesis
-#    proto.
+#    proto. All strings are empty if p.topk_hyps_as_protos is False.
 #  topk_ids: Int32 Tensor of shape [batch_size * num_hyps_per_beam,
 #    target_seq_len] which contains the IDs of the targets in each of the
 #    hypotheses in the beam for the samples in the batch. For sample
@@ -59,15 +61,20 @@ from lingvo.core.ops import py_x_ops
 #    contains the decoded target strings in each of the hypotheses in the
 #    beam for the samples in the batch. The 'h'-th hyp for sample 'b' can
 #    be found at topk_decoded[b * num_hyps_per_beam + h]
+#  topk_alignments: None, or an Int32 Tensor of shape
+#    [batch_size * num_hyps_per_beam, target_seq_len, atten_alignment_k] which
+#    contains the source positions with the highest attention probs at each
+#    step of each of the hypotheses, padded with -1. Only set if
+#    p.topk_hyps_as_protos is False and p.atten_alignment_k is positive.
 BeamSearchDecodeOutput = collections.namedtuple(
     'BeamSearchDecodeOutput',
     [
         'done_hyps', 'topk_hyps', 'topk_ids', 'topk_lens', 'topk_scores',
-        'topk_decoded', 'other_states'
+        'topk_decoded', 'other_states', 'topk_alignments'
     ],
 )
-# Make the last attribute default to None.
-BeamSearchDecodeOutput.__new__.__defaults__ = (None,)
+# Make the last two attributes default to None.
+BeamSearchDecodeOutput.__new__.__defaults__ = (None, None)
 
 
 class BeamSearchHelper(base_layer.BaseLayer):
@@ -204,6 +211,22 @@ class BeamSearchHelper(base_layer.BaseLayer):
         'force_eos_in_last_step', False,
         'For all active hyps that are still on the beam after target_seq_len '
         'steps, return partial hyps with EOS set as the last token.')
+    p.Define(
+        'atten_vecs_in_hypothesis_protos', True, 'If True, the terminated '
+        'Hypothesis protos contain the attention probs of every step. If '
+        'False, they only contain their sum, which is enough for the '
+        'coverage penalty, and are much smaller for long sources.')
+    p.Define(
+        'atten_alignment_k', 0, 'If positive, the number of source positions '
+        'with the highest attention probs to keep for each step of the '
+        'terminated hyps, e.g., 1 for an argmax alignment. They are returned '
+        'in topk_alignments if topk_hyps_as_protos is False.')
+    p.Define(
+        'topk_hyps_as_protos', True, 'If True, the top k hyps are returned as '
+        'serialized Hypothesis protos in topk_hyps and unpacked into '
+        'topk_ids, topk_lens and topk_scores. If False, they are computed '
+        'directly as dense tensors, and topk_hyps only contains empty '
+        'strings, which keeps the decoder output small.')
     p.Define(
         'batch_major_state', True, 'If True, we use batch as the major '
         'dimension of the hyp states. Otherwise, timing becomes the major '
@@ -244,6 +267,8 @@ class BeamSearchHelper(base_layer.BaseLayer):
           This `.NestedMap` is managed and updated by the client. It is
           expected that each of its member tensors are of rank >= 1. t[i, ...]
           is the state of the i-th hyp at the beginning of this search step.
+          It may contain `kv_cache` KV caches, which are reordered without
+          moving their keys and values.
       num_hyps_per_beam: Num of hyps to keep per beam.
       pre_beam_search_step_callback: The `PreBeamSearchStepCallback` callback.
           See class header comments for more details.
@@ -283,7 +308,9 @@ class BeamSearchHelper(base_layer.BaseLayer):
          merge_paths=p.merge_paths,
          allow_empty_terminated_hyp=p.allow_empty_terminated_hyp,
          ensure_full_beam=p.ensure_full_beam,
-         force_eos_in_last_step=p.force_eos_in_last_step)
+         force_eos_in_last_step=p.force_eos_in_last_step,
+         atten_vecs_in_hypothesis_protos=p.atten_vecs_in_hypothesis_protos,
+         atten_alignment_k=p.atten_alignment_k)
 
     new_step_ids = tf.reshape(out_hyps[cur_step, :], tf.shape(step_ids))
     new_step_ids.set_shape(step_ids.get_shape())
@@ -307,7 +334,19 @@ class BeamSearchHelper(base_layer.BaseLayer):
       else:
         return x_in
 
-    new_other_states = other_states.Transform(ReOrderHyps)
+    def ReOrderStates(states):
+      """Reorders states, but only the written steps of KV caches."""
+      if kv_cache.IsKVCache(states):
+        return kv_cache.ReorderKVCache(states, old_hyp_ids)
+      elif isinstance(states, py_utils.NestedMap):
+        return py_utils.NestedMap(
+            {k: ReOrderStates(v) for k, v in six.iteritems(states)})
+      elif isinstance(states, list):
+        return [ReOrderStates(x) for x in states]
+      else:
+        return ReOrderHyps(states)
+
+    new_other_states = ReOrderStates(other_states)
 
     final_other_states = post_beam_search_step_callback(
         theta, encoder_outputs, new_step_ids, new_other_states)
@@ -417,27 +456,48 @@ class BeamSearchHelper(base_layer.BaseLayer):
       source_seq_lengths = tf.to_int32(
           tf.reduce_sum(1.0 - tf.transpose(source_paddings), 1))
 
-    # [num_beams, num_hyps_per_beam].
-    topk_hyps = py_x_ops.top_k_terminated_hyps(
-        final_done_hyps,
-        source_seq_lengths,
-        k=num_hyps_per_beam,
-        num_hyps_per_beam=num_hyps_per_beam,
-        length_normalization=p.length_normalization,
-        coverage_penalty=p.coverage_penalty,
-        target_seq_length_ratio=p.target_seq_length_ratio,
-        eoc_id=p.target_eoc_id,
-        merge_paths=p.merge_paths)
-    # [num_beams * num_hyps_per_beam, ...].
     max_seq_length = 0 if isinstance(max_steps, tf.Tensor) else max_steps
-    topk_ids, topk_lens, topk_scores = py_x_ops.unpack_hyp(
-        tf.reshape(topk_hyps, [-1]), max_seq_length=max_seq_length)
+    topk_alignments = None
+    if p.topk_hyps_as_protos:
+      # [num_beams, num_hyps_per_beam].
+      topk_hyps = py_x_ops.top_k_terminated_hyps(
+          final_done_hyps,
+          source_seq_lengths,
+          k=num_hyps_per_beam,
+          num_hyps_per_beam=num_hyps_per_beam,
+          length_normalization=p.length_normalization,
+          coverage_penalty=p.coverage_penalty,
+          target_seq_length_ratio=p.target_seq_length_ratio,
+          eoc_id=p.target_eoc_id,
+          merge_paths=p.merge_paths)
+      # [num_beams * num_hyps_per_beam, ...].
+      topk_ids, topk_lens, topk_scores = py_x_ops.unpack_hyp(
+          tf.reshape(topk_hyps, [-1]), max_seq_length=max_seq_length)
+    else:
+      # [num_beams * num_hyps_per_beam, ...].
+      (topk_ids, topk_lens, topk_scores,
+       alignments) = py_x_ops.top_k_terminated_hyps_dense(
+           final_done_hyps,
+           source_seq_lengths,
+           k=num_hyps_per_beam,
+           num_hyps_per_beam=num_hyps_per_beam,
+           length_normalization=p.length_normalization,
+           coverage_penalty=p.coverage_penalty,
+           target_seq_length_ratio=p.target_seq_length_ratio,
+           eoc_id=p.target_eoc_id,
+           merge_paths=p.merge_paths,
+           max_seq_length=max_seq_length,
+           atten_alignment_k=p.atten_alignment_k)
+      if p.atten_alignment_k > 0:
+        topk_alignments = alignments
+      # [num_beams, num_hyps_per_beam]. Callers use its shape.
+      topk_hyps = tf.fill([num_beams, num_hyps_per_beam], '')
     # [num_beams, num_hyps_per_beam].
     topk_scores = tf.reshape(topk_scores, tf.shape(topk_hyps))
 
     return BeamSearchDecodeOutput(final_done_hyps, topk_hyps, topk_ids,
                                   topk_lens, topk_scores, None,
-                                  final_other_states)
+                                  final_other_states, topk_alignments)
 
 
 def _GetShapes(tensors, none_shapes=False):
@@ -529,6 +589,10 @@ def MergeBeamSearchOutputs(max_hyps_per_beam, beam_search_outputs):
       v = tf.reshape(v, [total_hyps, -1])
     elif k in ('topk_lens', 'topk_scores', 'topk_decoded'):
       v = tf.reshape(v, [total_hyps])
+    elif k == 'topk_alignments':
+      v = tf.reshape(
+          v, [total_hyps, -1,
+              tf.shape(beam_search_outputs[0].topk_alignments)[-1]])
     else:
       raise ValueError('Unexpected field: %s' % k)
     top[k] = v
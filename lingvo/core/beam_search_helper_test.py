@@ -94,6 +94,99 @@ class BeamSearchHelperTest(tf.test.TestCase):
       self.assertEqual(expected_topk_lens, topk_lens.tolist())
       self.assertAllClose(expected_topk_scores, topk_scores)
 
+  def _BeamSearchDecode(self, atten_width=5, **kwargs):
+    """Decodes random logits with a BeamSearchHelper with params `kwargs`."""
+    vocab_size = 12
+    src_len = 5
+    num_hyps_per_beam = 3
+    src_batch_size = 2
+    tgt_batch_size = src_batch_size * num_hyps_per_beam
+    p = beam_search_helper.BeamSearchHelper.Params().Set(
+        name='bsh', target_seq_len=7, **kwargs)
+    bs_helper = p.cls(p)
+    atten_probs = tf.constant(
+        np.random.RandomState(9384758).uniform(
+            size=(tgt_batch_size, atten_width)),
+        dtype=tf.float32)
+
+    def InitBeamSearchCallBack(unused_theta, unused_encoder_outputs,
+                               unused_num_hyps_per_beam):
+      return (py_utils.NestedMap({
+          'log_probs': tf.zeros([tgt_batch_size, vocab_size]),
+          'atten_probs': atten_probs
+      }), py_utils.NestedMap({'atten_probs': atten_probs}))
+
+    def PreBeamSearchStepCallback(unused_theta, unused_encoder_outputs,
+                                  unused_step_ids, states,
+                                  unused_num_hyps_per_beam):
+      logits = tf.random_normal([tgt_batch_size, vocab_size], seed=8273747)
+      return (py_utils.NestedMap({
+          'atten_probs': tf.identity(states.atten_probs),
+          'log_probs': logits
+      }), states)
+
+    def PostBeamSearchStepCallback(unused_theta, unused_encoder_outputs,
+                                   unused_new_step_ids, states):
+      return states
+
+    encoder_outputs = py_utils.NestedMap(
+        encoded=tf.zeros([src_len, src_batch_size, 8]),
+        padding=tf.constant(
+            [[0.0, 0.0], [0.0, 0.0], [0.0, 0.0], [0.0, 1.0], [1.0, 1.0]],
+            dtype=tf.float32))
+    return bs_helper.BeamSearchDecode(
+        py_utils.NestedMap(), encoder_outputs, num_hyps_per_beam,
+        InitBeamSearchCallBack, PreBeamSearchStepCallback,
+        PostBeamSearchStepCallback)
+
+  def testBeamSearchHelperDense(self):
+    with self.session(use_gpu=False) as sess:
+      tf.set_random_seed(8274758)
+      protos = self._BeamSearchDecode(coverage_penalty=0.2)
+      dense = self._BeamSearchDecode(
+          coverage_penalty=0.2,
+          atten_vecs_in_hypothesis_protos=False,
+          atten_alignment_k=2,
+          topk_hyps_as_protos=False)
+      self.assertIsNone(protos.topk_alignments)
+      fetches = ['topk_ids', 'topk_lens', 'topk_scores']
+      protos_out, dense_out, topk_hyps, topk_alignments = sess.run([
+          [getattr(protos, k) for k in fetches],
+          [getattr(dense, k) for k in fetches], dense.topk_hyps,
+          dense.topk_alignments
+      ])
+      # The compact hyps have the same coverage penalty.
+      for protos_value, dense_value in zip(protos_out, dense_out):
+        self.assertAllClose(protos_value, dense_value)
+      self.assertAllEqual([[b'', b'', b''], [b'', b'', b'']], topk_hyps)
+      self.assertEqual((6, 7, 2), topk_alignments.shape)
+      for i, length in enumerate(dense_out[1]):
+        alignments = topk_alignments[i]
+        self.assertTrue(np.all(alignments[:length] >= 0))
+        self.assertTrue(np.all(alignments[:length] < 5))
+        self.assertTrue(np.all(alignments[length:] == -1))
+        # The two positions of a step are distinct.
+        self.assertTrue(
+            np.all(alignments[:length, 0] != alignments[:length, 1]))
+
+  def testBeamSearchHelperDenseWithoutAttention(self):
+    with self.session(use_gpu=False) as sess:
+      tf.set_random_seed(8274758)
+      protos = self._BeamSearchDecode(
+          atten_width=0, coverage_penalty=0.2, length_normalization=0.5)
+      dense = self._BeamSearchDecode(
+          atten_width=0,
+          coverage_penalty=0.2,
+          length_normalization=0.5,
+          atten_vecs_in_hypothesis_protos=False,
+          topk_hyps_as_protos=False)
+      fetches = ['topk_ids', 'topk_lens', 'topk_scores']
+      protos_out, dense_out = sess.run([[getattr(protos, k) for k in fetches],
+                                        [getattr(dense, k) for k in fetches]])
+      # The compact hyps are normalized by the same lengths.
+      for protos_value, dense_value in zip(protos_out, dense_out):
+        self.assertAllClose(protos_value, dense_value)
+
 
 class MergeBeamSearchOutputsTest(tf.test.TestCase):
 
@@ -0,0 +1,257 @@
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Watches a directory for new checkpoints.
+
+There is one CheckpointWatcher per checkpoint directory in a process, shared
+by all runners, e.g., the evalers and decoders of different datasets. Its
+thread re-reads the checkpoint state file only when a backend tells it that
+the file may have changed, and wakes up every runner waiting for a new
+checkpoint. A checkpoint saved in the same process can wake it up immediately
+with NotifyNewCheckpoint().
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import re
+import threading
+import time
+
+import tensorflow as tf
+
+try:
+  # pylint: disable=g-import-not-at-top
+  import inotify_simple
+  HAS_INOTIFY = True
+except ImportError:
+  HAS_INOTIFY = False
+
+# The name of the checkpoint state file written by tf.train.Saver.
+_CHECKPOINT_STATE_FILENAME = 'checkpoint'
+# Seconds to wait before retrying after a backend failed.
+_RETRY_SECS = 5.0
+
+
+def _CheckpointStep(path):
+  """Returns the step of a checkpoint path like /dir/ckpt-00001000."""
+  m = re.search(r'-(\d+)$', path)
+  return int(m.group(1)) if m else -1
+
+
+class PollingBackend(object):
+  """Polls the checkpoint state file with an adaptive interval.
+
+  The interval starts at `min_secs` after a change and grows by `growth` up
+  to `max_secs` while nothing changes, so that a job which just saw a
+  checkpoint checks often for the next one, and an idle job rarely touches
+  the file system.
+  """
+
+  def __init__(self, min_secs=5.0, max_secs=300.0, growth=1.5):
+    self._min_secs = min_secs
+    self._max_secs = max_secs
+    self._growth = growth
+    self._delay = min_secs
+    self._wake = threading.Event()
+
+  def Wait(self, train_dir, changed):
+    """Blocks until the state file in `train_dir` may have changed.
+
+    Args:
+      train_dir: The checkpoint directory.
+      changed: Whether the state file changed since the previous Wait().
+    """
+    del train_dir  # Unused.
+    if changed:
+      self._delay = self._min_secs
+    else:
+      self._delay = min(self._delay * self._growth, self._max_secs)
+    self._wake.wait(self._delay)
+    self._wake.clear()
+
+  def Wake(self):
+    """Makes Wait() return now."""
+    self._wake.set()
+
+
+class InotifyBackend(PollingBackend):
+  """Waits for inotify events on a local checkpoint directory.
+
+  tf.train.Saver replaces the state file by renaming a temporary file, so a
+  rename into the directory signals a new checkpoint. The directory is still
+  re-read every `max_secs`. If it cannot be watched, e.g., because it is not
+  local, it is polled like in PollingBackend. Requires inotify_simple.
+  """
+
+  def __init__(self, min_secs=5.0, max_secs=300.0, growth=1.5):
+    if not HAS_INOTIFY:
+      raise ImportError('InotifyBackend depends on inotify_simple.')
+    super(InotifyBackend, self).__init__(min_secs, max_secs, growth)
+    self._inotify = inotify_simple.INotify()
+    self._watch_dir = None
+    self._polling = False
+
+  def Wait(self, train_dir, changed):
+    if self._polling:
+      super(InotifyBackend, self).Wait(train_dir, changed)
+      return
+    if self._watch_dir is None and tf.gfile.IsDirectory(train_dir):
+      flags = inotify_simple.flags
+      try:
+        self._inotify.add_watch(train_dir,
+                                flags.MOVED_TO | flags.CLOSE_WRITE)
+      except OSError as e:
+        tf.logging.warning('Cannot watch %s, polling it instead: %s',
+                           train_dir, e)
+        self._polling = True
+        super(InotifyBackend, self).Wait(train_dir, changed)
+        return
+      self._watch_dir = train_dir
+    deadline = time.time() + self._max_secs
+    while not self._wake.is_set() and time.time() < deadline:
+      if self._watch_dir is None:
+        # Waits for the directory to be created.
+        self._wake.wait(self._min_secs)
+        break
+      # Reads with a short timeout so that Wake() takes effect promptly.
+      events = self._inotify.read(timeout=1000)
+      if any(e.name == _CHECKPOINT_STATE_FILENAME for e in events):
+        break
+    self._wake.clear()
+
+
+class CheckpointWatcher(object):
+  """Tracks the checkpoints listed in the state file of a directory."""
+
+  def __init__(self, train_dir, backend):
+    self._train_dir = train_dir
+    self._backend = backend
+    self._cv = threading.Condition()
+    # The checkpoint paths in the state file, oldest first.
+    self._paths = []
+    self._thread = threading.Thread(target=self._Loop)
+    self._thread.daemon = True
+    self._thread.start()
+
+  def _Loop(self):
+    """Refreshes the checkpoints until the process exits.
+
+    Errors are logged and retried, since runners would otherwise wait for a
+    new checkpoint forever.
+    """
+    while True:
+      changed = False
+      try:
+        changed = self._Refresh()
+      except Exception as e:  # pylint: disable=broad-except
+        tf.logging.warning('Failed to read checkpoint state in %s: %s',
+                           self._train_dir, e)
+      try:
+        self._backend.Wait(self._train_dir, changed)
+      except Exception as e:  # pylint: disable=broad-except
+        tf.logging.warning('Failed to wait for checkpoints in %s: %s',
+                           self._train_dir, e)
+        time.sleep(_RETRY_SECS)
+
+  def _Refresh(self):
+    """Re-reads the state file. Returns True if the checkpoints changed."""
+    state_file = os.path.join(self._train_dir, _CHECKPOINT_STATE_FILENAME)
+    if not tf.gfile.Exists(state_file):
+      return False
+    # The file is small, so it is simply re-read: its mtime and length may
+    # stay the same when the checkpoints rotate.
+    state = tf.train.get_checkpoint_state(self._train_dir)
+    if not state:
+      return False
+    paths = list(state.all_model_checkpoint_paths)
+    if (state.model_checkpoint_path and
+        state.model_checkpoint_path not in paths):
+      paths.append(state.model_checkpoint_path)
+    with self._cv:
+      if paths == self._paths:
+        return False
+      self._paths = paths
+      self._cv.notify_all()
+    return True
+
+  def Notify(self):
+    """Makes the watcher re-read the state file now."""
+    self._backend.Wake()
+
+  def _NextCheckpoint(self, prev_path, in_order):
+    """Returns the checkpoint to process after `prev_path`, or None."""
+    if in_order:
+      prev_step = _CheckpointStep(prev_path) if prev_path else -1
+      for path in self._paths:
+        # Skips checkpoints which were deleted before they were processed.
+        if (_CheckpointStep(path) > prev_step and
+            tf.train.checkpoint_exists(path)):
+          return path
+      return None
+    if (self._paths and self._paths[-1] != prev_path and
+        tf.train.checkpoint_exists(self._paths[-1])):
+      return self._paths[-1]
+    return None
+
+  def WaitForNewCheckpoint(self, prev_path, timeout, in_order=False):
+    """Waits for a checkpoint other than `prev_path`.
+
+    Args:
+      prev_path: The previously processed checkpoint, or None.
+      timeout: The maximum number of seconds to wait.
+      in_order: If True, returns the oldest checkpoint after `prev_path`, so
+        that every checkpoint is processed. Otherwise, returns the newest one.
+
+    Returns:
+      The path to the checkpoint, or None on timeout.
+    """
+    deadline = time.time() + timeout
+    with self._cv:
+      while True:
+        path = self._NextCheckpoint(prev_path, in_order)
+        if path:
+          return path
+        remaining = deadline - time.time()
+        if remaining <= 0:
+          return None
+        self._cv.wait(remaining)
+
+
+_watchers = {}
+_watchers_lock = threading.Lock()
+
+
+def GetCheckpointWatcher(train_dir, backend_fn=PollingBackend):
+  """Returns the watcher of `train_dir` shared by this process.
+
+  Args:
+    train_dir: The checkpoint directory.
+    backend_fn: A callable returning the backend, used only when the watcher
+      of `train_dir` is created.
+  """
+  with _watchers_lock:
+    if train_dir not in _watchers:
+      _watchers[train_dir] = CheckpointWatcher(train_dir, backend_fn())
+    return _watchers[train_dir]
+
+
+def NotifyNewCheckpoint(train_dir):
+  """Tells the watcher of `train_dir`, if any, that a checkpoint was saved."""
+  with _watchers_lock:
+    watcher = _watchers.get(train_dir)
+  if watcher:
+    watcher.Notify()
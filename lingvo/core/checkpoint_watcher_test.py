@@ -0,0 +1,148 @@
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for checkpoint_watcher."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import time
+import unittest
+
+import tensorflow as tf
+
+from lingvo.core import checkpoint_watcher
+
+
+class CheckpointWatcherTest(tf.test.TestCase):
+
+  def _Backend(self):
+    return checkpoint_watcher.PollingBackend(min_secs=0.1, max_secs=0.5)
+
+  def testWaitForNewCheckpoint(self):
+    train_dir = os.path.join(self.get_temp_dir(), 'wait_for_new_checkpoint')
+    tf.gfile.MakeDirs(train_dir)
+    watcher = checkpoint_watcher.GetCheckpointWatcher(train_dir,
+                                                      self._Backend)
+    self.assertIs(watcher,
+                  checkpoint_watcher.GetCheckpointWatcher(train_dir))
+    self.assertIsNone(watcher.WaitForNewCheckpoint(None, timeout=0.5))
+
+    with self.session(graph=tf.Graph()) as sess:
+      global_step = tf.train.get_or_create_global_step()
+      saver = tf.train.Saver(pad_step_number=True)
+      sess.run(tf.global_variables_initializer())
+      paths = []
+      for step in (10, 20, 30):
+        sess.run(tf.assign(global_step, step))
+        paths.append(
+            saver.save(sess, os.path.join(train_dir, 'ckpt'), global_step))
+        checkpoint_watcher.NotifyNewCheckpoint(train_dir)
+
+    self.assertEqual(paths[-1], watcher.WaitForNewCheckpoint(None, timeout=5))
+    self.assertIsNone(watcher.WaitForNewCheckpoint(paths[-1], timeout=0.5))
+    # In order, every checkpoint is returned.
+    self.assertEqual(paths[0],
+                     watcher.WaitForNewCheckpoint(None, 5, in_order=True))
+    self.assertEqual(paths[1],
+                     watcher.WaitForNewCheckpoint(paths[0], 5, in_order=True))
+    self.assertEqual(paths[2],
+                     watcher.WaitForNewCheckpoint(paths[1], 5, in_order=True))
+    self.assertIsNone(
+        watcher.WaitForNewCheckpoint(paths[2], 0.5, in_order=True))
+
+  def testRotatedCheckpoints(self):
+    train_dir = os.path.join(self.get_temp_dir(), 'rotated_checkpoints')
+    tf.gfile.MakeDirs(train_dir)
+    watcher = checkpoint_watcher.GetCheckpointWatcher(train_dir,
+                                                      self._Backend)
+    with self.session(graph=tf.Graph()) as sess:
+      global_step = tf.train.get_or_create_global_step()
+      saver = tf.train.Saver(max_to_keep=2, pad_step_number=True)
+      sess.run(tf.global_variables_initializer())
+      prev_path = None
+      for step in (10, 20, 30, 40):
+        sess.run(tf.assign(global_step, step))
+        # The state file keeps its length as the checkpoints rotate.
+        path = saver.save(sess, os.path.join(train_dir, 'ckpt'), global_step)
+        checkpoint_watcher.NotifyNewCheckpoint(train_dir)
+        self.assertEqual(path, watcher.WaitForNewCheckpoint(prev_path, 5))
+        prev_path = path
+    self.assertFalse(watcher._Refresh())
+
+  def _SaveCheckpoint(self, train_dir, step):
+    with self.session(graph=tf.Graph()) as sess:
+      global_step = tf.train.get_or_create_global_step()
+      saver = tf.train.Saver(pad_step_number=True)
+      sess.run(tf.global_variables_initializer())
+      sess.run(tf.assign(global_step, step))
+      return saver.save(sess, os.path.join(train_dir, 'ckpt'), global_step)
+
+  def testBackendError(self):
+    train_dir = os.path.join(self.get_temp_dir(), 'backend_error')
+    tf.gfile.MakeDirs(train_dir)
+    backend = self._Backend()
+    wait = backend.Wait
+    num_calls = [0]
+
+    def _Wait(watch_dir, changed):
+      num_calls[0] += 1
+      if num_calls[0] == 1:
+        raise RuntimeError('wait failed')
+      wait(watch_dir, changed)
+
+    backend.Wait = _Wait
+    with tf.test.mock.patch.object(checkpoint_watcher, '_RETRY_SECS', 0.1):
+      watcher = checkpoint_watcher.CheckpointWatcher(train_dir, backend)
+      path = self._SaveCheckpoint(train_dir, 10)
+      # The watcher keeps running after the backend failed.
+      self.assertEqual(path, watcher.WaitForNewCheckpoint(None, timeout=5))
+    self.assertGreater(num_calls[0], 1)
+
+  @unittest.skipUnless(checkpoint_watcher.HAS_INOTIFY,
+                       'Requires inotify_simple.')
+  def testInotifyBackend(self):
+    train_dir = os.path.join(self.get_temp_dir(), 'inotify_backend')
+    tf.gfile.MakeDirs(train_dir)
+    # A long max_secs, so that only an inotify event wakes up the watcher.
+    backend = checkpoint_watcher.InotifyBackend(min_secs=0.1, max_secs=60)
+    watcher = checkpoint_watcher.CheckpointWatcher(train_dir, backend)
+    deadline = time.time() + 5
+    while backend._watch_dir is None and time.time() < deadline:
+      time.sleep(0.1)
+    self.assertEqual(train_dir, backend._watch_dir)
+    path = self._SaveCheckpoint(train_dir, 10)
+    self.assertEqual(path, watcher.WaitForNewCheckpoint(None, timeout=5))
+
+  @unittest.skipUnless(checkpoint_watcher.HAS_INOTIFY,
+                       'Requires inotify_simple.')
+  def testInotifyBackendFallsBackToPolling(self):
+    train_dir = os.path.join(self.get_temp_dir(), 'inotify_backend_polling')
+    tf.gfile.MakeDirs(train_dir)
+    backend = checkpoint_watcher.InotifyBackend(min_secs=0.1, max_secs=0.5)
+    # As for a directory which is not local.
+    backend._inotify = tf.test.mock.Mock()
+    backend._inotify.add_watch.side_effect = OSError('not local')
+    watcher = checkpoint_watcher.CheckpointWatcher(train_dir, backend)
+    path = self._SaveCheckpoint(train_dir, 10)
+    self.assertEqual(path, watcher.WaitForNewCheckpoint(None, timeout=5))
+    self.assertTrue(backend._polling)
+    self.assertIsNone(backend._watch_dir)
+    self.assertEqual(1, backend._inotify.add_watch.call_count)
+
+
+if __name__ == '__main__':
+  tf.test.main()
@@ -126,3 +126,25 @@ def SplitDictOfTensors(t_dict, num_splits):
     ret_list.append(d)
 
   return ret_list
+
+
+def ApplyPacking(inputs, padding_value, indices_in_input, segment_pos):
+  """Gathers the packed rows of a batch, as computed by `pack_sequences`.
+
+  Args:
+    inputs: A tensor of shape [N, T] with one unpacked example per row.
+    padding_value: A python scalar. The value of padded positions.
+    indices_in_input: An int32 tensor of shape [B, L]: the row of `inputs` each
+      packed position comes from, or -1 for padding.
+    segment_pos: An int32 tensor of shape [B, L]: the column of `inputs` each
+      packed position comes from.
+
+  Returns:
+    A tensor of shape [B, L] and the dtype of `inputs`.
+  """
+  gather_indices = tf.stack(
+      [tf.maximum(indices_in_input, 0), segment_pos], axis=-1)
+  packed = tf.gather_nd(inputs, gather_indices)
+  return tf.where(
+      tf.greater_equal(indices_in_input, 0), packed,
+      tf.fill(tf.shape(packed), tf.constant(padding_value, inputs.dtype)))
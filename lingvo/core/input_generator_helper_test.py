@@ -225,6 +225,16 @@ class InputGeneratorHelperTest(tf.test.TestCase):
         ValueError, 'can\'t split axis of size 2 into pieces of size \[2,1\]'):
       splits = input_generator_helper.SplitDictOfTensors(tensor_dict,
                                                          num_splits)
+  def testApplyPacking(self):
+    with self.session(use_gpu=False) as sess:
+      inputs = tf.constant([[1, 2, 3], [4, 5, 0], [6, 0, 0]])
+      indices_in_input = tf.constant([[0, 0, 0, 2], [1, 1, -1, -1]])
+      segment_pos = tf.constant([[0, 1, 2, 0], [0, 1, 0, 0]])
+      packed = input_generator_helper.ApplyPacking(inputs, -1,
+                                                   indices_in_input,
+                                                   segment_pos)
+      self.assertAllEqual([[1, 2, 3, 6], [4, 5, -1, -1]], sess.run(packed))
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -0,0 +1,217 @@
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Sharded, indexed key/value record files.
+
+A table with prefix `path` and N shards consists of the files
+
+  path-00000-of-0000N, ..., path-0000{N-1}-of-0000N
+
+which are TFRecord files whose records are pickled (key, value) pairs, and
+one index file per shard, named like the shard with an '.index' suffix, whose
+TFRecords are pickled (key, offset) pairs. Keys are assigned to shards by a
+hash which is stable across processes. Both files of a shard are append-only,
+so pairs can be written as they are produced, and a reader can look up a key
+by loading the index of a single shard.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import re
+import struct
+import zlib
+
+import six
+from six.moves import cPickle as pickle
+from six.moves import range
+import tensorflow as tf
+
+# A TFRecord is framed by a uint64 length and a uint32 crc in front of the
+# data, and another uint32 crc after it.
+_RECORD_HEADER_BYTES = 12
+_RECORD_FOOTER_BYTES = 4
+
+
+def _ShardPath(path, shard, num_shards):
+  return '%s-%05d-of-%05d' % (path, shard, num_shards)
+
+
+def _IndexPath(shard_path):
+  return shard_path + '.index'
+
+
+def _ShardForKey(key, num_shards):
+  return zlib.crc32(tf.compat.as_bytes(key)) % num_shards
+
+
+class ShardedKeyValueWriter(object):
+  """Appends (key, value) pairs to a sharded, indexed table.
+
+  Memory usage is constant in the number of pairs written. Shards are created
+  when the first pair is written to them.
+  """
+
+  def __init__(self, path, num_shards=1):
+    """Constructor.
+
+    Args:
+      path: The prefix of the table file names.
+      num_shards: The number of shards.
+    """
+    assert num_shards > 0
+    self._path = path
+    self._num_shards = num_shards
+    self._writers = [None] * num_shards
+    self._offsets = [0] * num_shards
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.Close()
+
+  def _GetWriters(self, shard):
+    if self._writers[shard] is None:
+      shard_path = _ShardPath(self._path, shard, self._num_shards)
+      data_writer = tf.python_io.TFRecordWriter(shard_path)
+      try:
+        index_writer = tf.python_io.TFRecordWriter(_IndexPath(shard_path))
+      except:
+        data_writer.close()
+        raise
+      self._writers[shard] = (data_writer, index_writer)
+    return self._writers[shard]
+
+  def Write(self, key, value):
+    """Appends a (key, value) pair. The last value written for a key wins."""
+    shard = _ShardForKey(key, self._num_shards)
+    data_writer, index_writer = self._GetWriters(shard)
+    record = pickle.dumps((key, value), pickle.HIGHEST_PROTOCOL)
+    data_writer.write(record)
+    index_writer.write(
+        pickle.dumps((key, self._offsets[shard]), pickle.HIGHEST_PROTOCOL))
+    self._offsets[shard] += (
+        _RECORD_HEADER_BYTES + len(record) + _RECORD_FOOTER_BYTES)
+
+  def WriteAll(self, key_value_pairs):
+    """Appends a list of (key, value) pairs."""
+    for key, value in key_value_pairs:
+      self.Write(key, value)
+
+  def Close(self):
+    """Closes all shards. Must be called before the table is read."""
+    writers = [w for ws in self._writers if ws is not None for w in ws]
+    self._writers = [None] * self._num_shards
+    # Closes every writer, even if closing one of them fails, and then raises
+    # the first error.
+    error = None
+    for w in writers:
+      try:
+        w.close()
+      except Exception as e:  # pylint: disable=broad-except
+        if error is None:
+          error = e
+    if error is not None:
+      raise error
+
+
+class ShardedKeyValueReader(object):
+  """Reads a table written by ShardedKeyValueWriter.
+
+  The index of a shard is loaded on the first lookup of a key in that shard.
+  Iteration reads the shards sequentially without loading any index.
+  """
+
+  def __init__(self, path):
+    """Constructor.
+
+    Args:
+      path: The prefix of the table file names.
+
+    Raises:
+      IOError: If there is no table with prefix `path`.
+    """
+    self._path = path
+    pattern = re.compile(re.escape(path) + r'-\d{5}-of-(\d{5})$')
+    num_shards = None
+    for f in tf.gfile.Glob(path + '-?????-of-?????'):
+      m = pattern.match(f)
+      if m:
+        num_shards = int(m.group(1))
+        break
+    if num_shards is None:
+      raise IOError('No key/value table found at %s' % path)
+    self._num_shards = num_shards
+    self._indices = [None] * num_shards
+
+  @property
+  def num_shards(self):
+    return self._num_shards
+
+  def _ShardPaths(self):
+    for shard in range(self._num_shards):
+      shard_path = _ShardPath(self._path, shard, self._num_shards)
+      if tf.gfile.Exists(shard_path):
+        yield shard, shard_path
+
+  def _GetIndex(self, shard):
+    """Returns the key -> offset dict of `shard`."""
+    if self._indices[shard] is None:
+      index = {}
+      shard_path = _ShardPath(self._path, shard, self._num_shards)
+      if tf.gfile.Exists(shard_path):
+        for record in tf.python_io.tf_record_iterator(_IndexPath(shard_path)):
+          key, offset = pickle.loads(record)
+          index[key] = offset
+      self._indices[shard] = index
+    return self._indices[shard]
+
+  def Get(self, key, default=None):
+    """Returns the value of `key`, or `default` if there is none."""
+    shard = _ShardForKey(key, self._num_shards)
+    offset = self._GetIndex(shard).get(key)
+    if offset is None:
+      return default
+    shard_path = _ShardPath(self._path, shard, self._num_shards)
+    with tf.gfile.GFile(shard_path, 'rb') as f:
+      f.seek(offset)
+      length, = struct.unpack('<Q', f.read(_RECORD_HEADER_BYTES)[:8])
+      _, value = pickle.loads(f.read(length))
+    return value
+
+  def __contains__(self, key):
+    shard = _ShardForKey(key, self._num_shards)
+    return key in self._GetIndex(shard)
+
+  def __getitem__(self, key):
+    if key not in self:
+      raise KeyError(key)
+    return self.Get(key)
+
+  def Keys(self):
+    """Yields all keys, loading the index of every shard."""
+    for shard in range(self._num_shards):
+      for key in six.iterkeys(self._GetIndex(shard)):
+        yield key
+
+  def __iter__(self):
+    """Yields all (key, value) pairs in the order they were written to shards.
+
+    Keys written more than once are yielded once per write.
+    """
+    for _, shard_path in self._ShardPaths():
+      for record in tf.python_io.tf_record_iterator(shard_path):
+        yield pickle.loads(record)
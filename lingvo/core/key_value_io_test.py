@@ -0,0 +1,83 @@
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for key_value_io."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from lingvo.core import key_value_io
+
+
+class KeyValueIoTest(tf.test.TestCase):
+
+  def testWriteAndRead(self):
+    path = os.path.join(self.get_temp_dir(), 'write_and_read')
+    pairs = [('key%d' % i, 'value%d' % i * (i + 1)) for i in range(100)]
+    with key_value_io.ShardedKeyValueWriter(path, num_shards=4) as writer:
+      writer.WriteAll(pairs[:50])
+      for key, value in pairs[50:]:
+        writer.Write(key, value)
+      writer.Write('key7', b'overwritten')
+
+    reader = key_value_io.ShardedKeyValueReader(path)
+    self.assertEqual(4, reader.num_shards)
+    for key, value in reversed(pairs):
+      if key != 'key7':
+        self.assertEqual(value, reader[key])
+    self.assertEqual(b'overwritten', reader['key7'])
+    self.assertNotIn('key100', reader)
+    self.assertIsNone(reader.Get('key100'))
+    with self.assertRaises(KeyError):
+      _ = reader['key100']
+    self.assertItemsEqual([k for k, _ in pairs], list(reader.Keys()))
+    self.assertEqual(101, len(list(reader)))
+
+  def testEmptyShards(self):
+    path = os.path.join(self.get_temp_dir(), 'empty_shards')
+    with key_value_io.ShardedKeyValueWriter(path, num_shards=16) as writer:
+      writer.Write('a', 1)
+    reader = key_value_io.ShardedKeyValueReader(path)
+    self.assertEqual(16, reader.num_shards)
+    self.assertEqual([('a', 1)], list(reader))
+    self.assertEqual(1, reader['a'])
+    self.assertNotIn('b', reader)
+
+  def testCloseError(self):
+    num_shards = 1000
+    writer = key_value_io.ShardedKeyValueWriter(
+        os.path.join(self.get_temp_dir(), 'close_error'), num_shards)
+    writers = [tf.test.mock.Mock() for _ in range(2 * num_shards)]
+    writers[1].close.side_effect = IOError('first')
+    writers[-1].close.side_effect = IOError('last')
+    writer._writers = list(zip(writers[::2], writers[1::2]))
+    with self.assertRaisesRegexp(IOError, 'first'):
+      writer.Close()
+    # Every shard is closed, even after an error.
+    for w in writers:
+      w.close.assert_called_once_with()
+
+  def testNoTable(self):
+    with self.assertRaises(IOError):
+      key_value_io.ShardedKeyValueReader(
+          os.path.join(self.get_temp_dir(), 'no_table'))
+
+
+if __name__ == '__main__':
+  tf.test.main()
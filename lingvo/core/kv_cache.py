@@ -0,0 +1,150 @@
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""A preallocated key/value cache for step-by-step self-attention.
+
+When decoding one step at a time, masked self-attention needs the keys and
+values of all previous steps. Growing them by concatenation copies the whole
+cache at every step. A KV cache instead preallocates the keys and values of
+all steps and writes each step in place.
+
+A KV cache is a `.NestedMap`, so that it can be carried through tf.while_loop
+as a decoding state, with the following fields:
+
+  - key: [max_len, batch, num_heads * dim_per_head]. key[s, b] is the key of
+    step s of hyp b. Its rows reshape without a copy to the
+    [max_len, batch * num_heads, dim_per_head] layout of multi-headed
+    attention.
+  - value: [max_len, batch, num_heads * dim_per_head], like key.
+  - num_steps: A scalar int32, the number of steps written so far.
+
+The keys and values of a prefix are read by ReadKVCache() as a slice of the
+leading rows, which does not copy them. Only reordering the hyps of a beam
+search by ReorderKVCache() moves the rows written so far.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import tensorflow as tf
+
+from tensorflow.python.ops import inplace_ops
+from lingvo.core import py_utils
+
+
+def IsKVCache(state):
+  """Returns True if `state` is a KV cache."""
+  return (isinstance(state, py_utils.NestedMap) and
+          sorted(state.keys()) == ['key', 'num_steps', 'value'])
+
+
+def ZeroKVCache(max_len, batch_size, dim, dtype=tf.float32):
+  """Returns an empty KV cache.
+
+  Args:
+    max_len: The maximum number of steps.
+    batch_size: The number of hyps.
+    dim: The dimension of keys and values, num_heads * dim_per_head.
+    dtype: The dtype of keys and values.
+
+  Returns:
+    A KV cache `.NestedMap`.
+  """
+  return py_utils.NestedMap(
+      key=tf.zeros([max_len, batch_size, dim], dtype=dtype),
+      value=tf.zeros([max_len, batch_size, dim], dtype=dtype),
+      num_steps=tf.constant(0, dtype=tf.int32))
+
+
+def ExtendKVCache(cache, t, key, value):
+  """Writes the keys and values of step `t` of every hyp in place.
+
+  Args:
+    cache: A KV cache.
+    t: A scalar, the current step, 0-based.
+    key: [batch, num_heads * dim_per_head].
+    value: [batch, num_heads * dim_per_head].
+
+  Returns:
+    The updated KV cache.
+  """
+  return py_utils.NestedMap(
+      key=inplace_ops.alias_inplace_update(cache.key, t, key),
+      value=inplace_ops.alias_inplace_update(cache.value, t, value),
+      num_steps=tf.convert_to_tensor(t + 1, dtype=tf.int32))
+
+
+def ExtendKVCacheChunk(cache, t, keys, values):
+  """Writes the keys and values of steps [t, t + k) of every hyp in place.
+
+  Rows beyond the steps which are eventually kept, e.g., the rejected tokens
+  of a speculative chunk, are simply overwritten by the next write.
+
+  Args:
+    cache: A KV cache.
+    t: A scalar, the first step of the chunk, 0-based.
+    keys: [k, batch, num_heads * dim_per_head].
+    values: [k, batch, num_heads * dim_per_head].
+
+  Returns:
+    The updated KV cache.
+  """
+  k = tf.shape(keys)[0]
+  steps = tf.range(t, t + k)
+  return py_utils.NestedMap(
+      key=inplace_ops.alias_inplace_update(cache.key, steps, keys),
+      value=inplace_ops.alias_inplace_update(cache.value, steps, values),
+      num_steps=tf.convert_to_tensor(t + k, dtype=tf.int32))
+
+
+def ReorderKVCache(cache, hyp_ids):
+  """Reorders the hyps of `cache`, e.g., after a beam search step.
+
+  Only the rows of the steps written so far are gathered, and written back in
+  place.
+
+  Args:
+    cache: A KV cache.
+    hyp_ids: [batch] int32. The new hyp b continues the old hyp hyp_ids[b].
+
+  Returns:
+    The reordered KV cache.
+  """
+  steps = tf.range(cache.num_steps)
+
+  def _Reorder(x):
+    return inplace_ops.alias_inplace_update(
+        x, steps, tf.gather(x[:cache.num_steps], hyp_ids, axis=1))
+
+  return py_utils.NestedMap(
+      key=_Reorder(cache.key),
+      value=_Reorder(cache.value),
+      num_steps=cache.num_steps)
+
+
+def ReadKVCache(cache, t):
+  """Returns the keys and values of steps [0, t] of every hyp.
+
+  They are slices of the leading rows of the cache, which do not copy them.
+
+  Args:
+    cache: A KV cache.
+    t: A scalar, the current step, 0-based.
+
+  Returns:
+    A pair (key, value), each of shape [t + 1, batch, num_heads *
+    dim_per_head].
+  """
+  return cache.key[:t + 1], cache.value[:t + 1]
@@ -0,0 +1,80 @@
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for kv_cache."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+
+from lingvo.core import kv_cache
+from lingvo.core import py_utils
+
+
+class KVCacheTest(tf.test.TestCase):
+
+  def testIsKVCache(self):
+    self.assertTrue(kv_cache.IsKVCache(kv_cache.ZeroKVCache(4, 3, 2)))
+    self.assertFalse(
+        kv_cache.IsKVCache(
+            py_utils.NestedMap(key=tf.zeros([0]), value=tf.zeros([0]))))
+    self.assertFalse(kv_cache.IsKVCache(tf.zeros([0])))
+
+  def testExtendReorderRead(self):
+    with self.session() as sess:
+      max_len, batch, dim = 4, 3, 2
+      # keys[t][b] is the key of step t written for hyp b.
+      keys = np.random.uniform(size=[max_len, batch, dim]).astype(np.float32)
+      cache = kv_cache.ZeroKVCache(max_len, batch, dim)
+      cache = kv_cache.ExtendKVCache(cache, 0, keys[0], -keys[0])
+      # The hyp 0 is continued twice, and the hyp 1 is dropped.
+      cache = kv_cache.ReorderKVCache(cache, [0, 0, 2])
+      cache = kv_cache.ExtendKVCache(cache, 1, keys[1], -keys[1])
+      cache = kv_cache.ReorderKVCache(cache, [2, 1, 0])
+      cache = kv_cache.ExtendKVCache(cache, 2, keys[2], -keys[2])
+      key, value, num_steps = sess.run(
+          kv_cache.ReadKVCache(cache, 2) + (cache.num_steps,))
+
+      # The prefixes of the hyps are the keys written for the hyps [2, 2, 0],
+      # [0, 1, 1] and [0, 0, 2] at the steps 0, 1 and 2.
+      expected = np.stack([
+          keys[0][[2, 0, 0]],
+          keys[1][[2, 1, 0]],
+          keys[2],
+      ])
+      self.assertEqual(3, num_steps)
+      self.assertEqual((3, batch, dim), key.shape)
+      self.assertAllClose(expected, key)
+      self.assertAllClose(-expected, value)
+
+  def testExtendChunk(self):
+    with self.session() as sess:
+      max_len, batch, dim = 5, 2, 3
+      keys = np.random.uniform(size=[max_len, batch, dim]).astype(np.float32)
+      cache = kv_cache.ZeroKVCache(max_len, batch, dim)
+      cache = kv_cache.ExtendKVCache(cache, 0, keys[0], -keys[0])
+      # Writes a chunk of 3 steps, which is then rejected and overwritten.
+      cache = kv_cache.ExtendKVCacheChunk(cache, 1, keys[1:4] + 1,
+                                          -keys[1:4] - 1)
+      cache = kv_cache.ExtendKVCacheChunk(cache, 1, keys[1:5], -keys[1:5])
+      key, value = sess.run(kv_cache.ReadKVCache(cache, max_len - 1))
+      self.assertAllClose(keys, key)
+      self.assertAllClose(-keys, value)
+
+
+if __name__ == '__main__':
+  tf.test.main()
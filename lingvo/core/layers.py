@@ -1817,6 +1817,26 @@ class PositionalEmbeddingLayer(base_layer.BaseLayer):
     position = tf.cast(position_tensor, py_utils.FPropDtype(self.params))
     return self._PosEmbeddingsFromPositions(theta, position)
 
+  def FPropAt(self, theta, positions):
+    """Generates the positional embeddings of the given positions only.
+
+    Meant for step-by-step decoding, where it costs O(embedding_dim) per step
+    instead of generating all positions up to the current one with FProp.
+    FPropAt(theta, positions)[i] equals FProp(theta, n)[positions[i]].
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      positions: An int tensor of shape [n], or a scalar.
+
+    Returns:
+      a Tensor of shape [n], or [1] for a scalar, by embedding_dim.
+    """
+    position = tf.reshape(
+        tf.cast(positions, py_utils.FPropDtype(self.params)), [1, -1])
+    pos_emb = self._PosEmbeddingsFromPositions(theta, position)
+    return tf.reshape(pos_emb, [-1, self.params.embedding_dim])
+
 
 class SoftmaxLayer(quant_utils.QuantizableLayer):
   """Base class for softmax layers."""
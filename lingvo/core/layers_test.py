@@ -2061,6 +2061,31 @@ class EmbeddingLayerTest(tf.test.TestCase):
       print('actual_position_embs:', actual_position_embs)
       self.assertAllClose(actual_position_embs, expected_output)
 
+  def testPositionalEmbeddingLayerFPropAt(self):
+    with self.session(use_gpu=False) as sess:
+      p = layers.PositionalEmbeddingLayer.Params()
+      p.name = 'position_emb'
+      p.min_timescale = 1
+      p.max_timescale = 7
+      p.embedding_dim = 4
+      p.trainable_scaling = True
+      p.trainable_scaling_init = 2.0
+
+      pos_emb_layer = layers.PositionalEmbeddingLayer(p)
+      position_embs = pos_emb_layer.FPropDefaultTheta(11)
+      step_embs = [
+          pos_emb_layer.FPropAt(pos_emb_layer.theta, tf.constant(t))
+          for t in range(11)
+      ]
+      some_embs = pos_emb_layer.FPropAt(pos_emb_layer.theta, [7, 0, 3])
+      tf.global_variables_initializer().run()
+      actual_position_embs, actual_step_embs, actual_some_embs = sess.run(
+          [position_embs, step_embs, some_embs])
+
+      self.assertAllClose(actual_position_embs,
+                          np.concatenate(actual_step_embs, axis=0))
+      self.assertAllClose(actual_position_embs[[7, 0, 3]], actual_some_embs)
+
   def testPositionalEmbeddingLayerWithPosition(self):
     with self.session(use_gpu=False) as sess:
       p = layers.PositionalEmbeddingLayer.Params()
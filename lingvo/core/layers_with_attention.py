@@ -22,6 +22,7 @@ import tensorflow as tf
 
 from lingvo.core import attention
 from lingvo.core import base_layer
+from lingvo.core import kv_cache
 from lingvo.core import layers
 from lingvo.core import py_utils
 
@@ -202,8 +203,9 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
         layer and its children layers.
       query_vec: [target_batch, dim]
       prefix_state: dict, containing tensors which are the results of previous
-          attentions, used for fast decoding.
-      t: a scalar, the current time step, 0-based.
+          attentions, used for fast decoding, or a `kv_cache` KV cache.
+      t: a scalar, the current time step, 0-based. Required if prefix_state is
+          a KV cache.
     Returns:
       A triplet (cur_output, atten_prob, new_state) where cur_output is a tensor
       representing the output from the current state, and new_state is the new
@@ -214,26 +216,51 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
     unnormalized_query_vec = query_vec
     query_vec = self.layer_norm.FProp(theta.layer_norm, query_vec)
 
-    cached_packed_src = py_utils.NestedMap(
-        source_vecs=prefix_state.key,
-        source_contexts=prefix_state.value,
-        source_padding=None,
-        source_segment_id=None)
-    extended_packed_src = self.atten.ExtendSourcePacked(
-        theta.atten, query_vec, query_vec, None, None, cached_packed_src, t)
-    if t is not None:
-      source_seq_len = tf.shape(extended_packed_src.source_vecs)[0]
-      zero_padding = tf.fill([source_seq_len],
-                             tf.constant(0.0, dtype=query_vec.dtype))
-      per_step_source_padding = tf.where(
-          tf.less(tf.range(source_seq_len), tf.fill([source_seq_len], t + 1)),
-          zero_padding, tf.ones_like(zero_padding, dtype=query_vec.dtype))
-      query_batch_size = tf.shape(query_vec)[0]
-      per_step_source_padding = tf.tile(
-          tf.expand_dims(per_step_source_padding, axis=0),
-          [query_batch_size, 1])
-    else:
+    if kv_cache.IsKVCache(prefix_state):
+      assert t is not None
+      # Only the key and value of the current step are computed, and written
+      # in place.
+      batch_size = tf.shape(query_vec)[0]
+      packed_step = self.atten.InitForSourcePacked(
+          theta.atten, tf.expand_dims(query_vec, 0),
+          tf.expand_dims(query_vec, 0),
+          tf.zeros([1, batch_size], dtype=query_vec.dtype))
+      new_states = kv_cache.ExtendKVCache(
+          prefix_state, t,
+          tf.reshape(packed_step.source_vecs, [batch_size, -1]),
+          tf.reshape(packed_step.source_contexts, [batch_size, -1]))
+      key, value = kv_cache.ReadKVCache(new_states, t)
+      extended_packed_src = py_utils.NestedMap(
+          source_vecs=key,
+          source_contexts=value,
+          source_padding=None,
+          source_segment_id=None)
       per_step_source_padding = None
+    else:
+      cached_packed_src = py_utils.NestedMap(
+          source_vecs=prefix_state.key,
+          source_contexts=prefix_state.value,
+          source_padding=None,
+          source_segment_id=None)
+      extended_packed_src = self.atten.ExtendSourcePacked(
+          theta.atten, query_vec, query_vec, None, None, cached_packed_src, t)
+      new_states = py_utils.NestedMap(
+          key=extended_packed_src.source_vecs,
+          value=extended_packed_src.source_contexts)
+      if t is not None:
+        source_seq_len = tf.shape(extended_packed_src.source_vecs)[0]
+        zero_padding = tf.fill([source_seq_len],
+                               tf.constant(0.0, dtype=query_vec.dtype))
+        per_step_source_padding = tf.where(
+            tf.less(tf.range(source_seq_len), tf.fill([source_seq_len],
+                                                       t + 1)),
+            zero_padding, tf.ones_like(zero_padding, dtype=query_vec.dtype))
+        query_batch_size = tf.shape(query_vec)[0]
+        per_step_source_padding = tf.tile(
+            tf.expand_dims(per_step_source_padding, axis=0),
+            [query_batch_size, 1])
+      else:
+        per_step_source_padding = None
     ctx_vec, atten_prob, _ = self.atten.ComputeContextVectorWithCachedSource(
         theta.atten,
         extended_packed_src,
@@ -245,9 +272,70 @@ class TransformerAttentionLayer(base_layer.BaseLayer):
         unnormalized_query_vec if p.add_unnormalized_input else query_vec)
     h = input_to_add + tf.reshape(ctx_vec, tf.shape(query_vec))
 
-    new_states = py_utils.NestedMap(
-        key=extended_packed_src.source_vecs,
-        value=extended_packed_src.source_contexts)
+    return h, atten_prob, new_states
+
+  def ExtendChunk(self, theta, query_vecs, prefix_state, t):
+    """Extend prefix by k more time steps at once.
+
+    Equivalent to k calls of ExtendStep() at the time steps t, ..., t + k - 1,
+    but runs every projection as one matmul over the chunk. Used to verify
+    several speculated tokens in one pass.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this
+        layer and its children layers.
+      query_vecs: [k, target_batch, dim]
+      prefix_state: a `kv_cache` KV cache, containing the keys and values of
+          the steps before t. Steps from t on are overwritten.
+      t: a scalar, the time step of query_vecs[0], 0-based.
+    Returns:
+      A triplet (cur_output, atten_prob, new_state) where cur_output is a tensor
+      of shape [k, target_batch, dim], atten_prob is of shape [k, target_batch,
+      t + k], and new_state is the updated KV cache.
+    """
+    p = self.params
+    assert p.is_masked  # Must be causal attention.
+    assert kv_cache.IsKVCache(prefix_state)
+    unnormalized_query_vecs = query_vecs
+    query_vecs = self.layer_norm.FProp(theta.layer_norm, query_vecs)
+
+    chunk_len = tf.shape(query_vecs)[0]
+    batch_size = tf.shape(query_vecs)[1]
+    packed_chunk = self.atten.InitForSourcePacked(
+        theta.atten, query_vecs, query_vecs,
+        tf.zeros([chunk_len, batch_size], dtype=query_vecs.dtype))
+    new_states = kv_cache.ExtendKVCacheChunk(
+        prefix_state, t,
+        tf.reshape(packed_chunk.source_vecs, [chunk_len, batch_size, -1]),
+        tf.reshape(packed_chunk.source_contexts, [chunk_len, batch_size, -1]))
+    source_seq_len = t + chunk_len
+    key, value = kv_cache.ReadKVCache(new_states, source_seq_len - 1)
+    extended_packed_src = py_utils.NestedMap(
+        source_vecs=key,
+        source_contexts=value,
+        source_padding=None,
+        source_segment_id=None)
+    # Step t + i of the chunk attends to the steps up to t + i.
+    # [k, source_seq_len]
+    causal_padding = 1.0 - tf.sequence_mask(
+        t + 1 + tf.range(chunk_len), source_seq_len, dtype=query_vecs.dtype)
+    # [k * target_batch, source_seq_len]
+    per_step_source_padding = tf.reshape(
+        tf.tile(tf.expand_dims(causal_padding, 1), [1, batch_size, 1]),
+        [-1, source_seq_len])
+    query_dim = tf.shape(query_vecs)[-1]
+    ctx_vec, atten_prob, _ = self.atten.ComputeContextVectorWithCachedSource(
+        theta.atten,
+        extended_packed_src,
+        tf.reshape(query_vecs, [-1, query_dim]),
+        per_step_source_padding=per_step_source_padding)
+
+    ctx_vec = self.residual_dropout.FProp(theta.residual_dropout, ctx_vec)
+    input_to_add = (
+        unnormalized_query_vecs if p.add_unnormalized_input else query_vecs)
+    h = input_to_add + tf.reshape(ctx_vec, tf.shape(query_vecs))
+    atten_prob = tf.reshape(atten_prob,
+                            [chunk_len, batch_size, source_seq_len])
     return h, atten_prob, new_states
 
 
@@ -516,7 +604,7 @@ class TransformerLayer(base_layer.BaseLayer):
         layer and its children layers.
       source_vecs: [source_batch, dim].
       prefix_states: dict, containing tensors which are the results of previous
-          attentions, used for fast decoding.
+          attentions, used for fast decoding, or a `kv_cache` KV cache.
       aux_vecs: [aux_time, aux_batch, dim]
       aux_paddings: [aux_time, aux_batch]
       t: a scalar, the current time step, 0-based.
@@ -552,6 +640,57 @@ class TransformerLayer(base_layer.BaseLayer):
     h = tf.squeeze(h, 0)
     return h, atten_prob, new_states
 
+  def ExtendChunk(self,
+                  theta,
+                  source_vecs,
+                  prefix_states,
+                  t,
+                  aux_vecs=None,
+                  aux_paddings=None):
+    """Transformer Layer, extend k steps at once in decoding.
+
+    Equivalent to k calls of ExtendStep() at the time steps t, ..., t + k - 1.
+    See TransformerAttentionLayer.ExtendChunk().
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this
+        layer and its children layers.
+      source_vecs: [k, source_batch, dim].
+      prefix_states: a `kv_cache` KV cache.
+      t: a scalar, the time step of source_vecs[0], 0-based.
+      aux_vecs: [aux_time, aux_batch, dim]
+      aux_paddings: [aux_time, aux_batch]
+    Returns:
+      The attention context vectors, [k, target_batch, source_dim]
+
+      The attention probability vectors, [k, target_batch, source_time]
+
+      Updated prefix states
+    """
+    p = self.params
+
+    if p.has_aux_atten:
+      assert aux_vecs is not None
+      assert aux_paddings is not None
+
+    chunk_len = tf.shape(source_vecs)[0]
+    batch_size = tf.shape(source_vecs)[1]
+
+    # First the self-attention layer.
+    atten_vec, atten_prob, new_states = self.self_atten.ExtendChunk(
+        theta.self_atten, source_vecs, prefix_states, t)
+
+    # Next the source attention layer.
+    if p.has_aux_atten:
+      atten_vec, atten_prob = self.atten.FProp(theta.atten, atten_vec,
+                                               aux_paddings, aux_vecs)
+
+    # Finally, the feedforward layer.
+    h = self.fflayer.FProp(
+        theta.fflayer, atten_vec,
+        tf.zeros([chunk_len, batch_size], dtype=py_utils.FPropDtype(p)))
+    return h, atten_prob, new_states
+
 
 class MergerLayer(base_layer.BaseLayer):
   """Merges a list of input tensors with various options into a single tensor.
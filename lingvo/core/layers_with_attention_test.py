@@ -22,6 +22,7 @@ import numpy as np
 import tensorflow as tf
 
 from lingvo.core import attention
+from lingvo.core import kv_cache
 from lingvo.core import layers
 from lingvo.core import layers_with_attention
 from lingvo.core import py_utils
@@ -519,6 +520,49 @@ class LayersWithAttentionTest(tf.test.TestCase):
       self.assertAllClose(h1_v, h2_v)
       self.assertAllClose(probs1_v, probs2_v)
 
+  def testTransformerLayerExtendChunk(self):
+    with self.session(use_gpu=True) as sess:
+      np.random.seed(6348575)
+      depth = 4
+      p = layers_with_attention.TransformerLayer.Params()
+      p.name = 'transformer'
+      p.source_dim = depth
+      p.has_aux_atten = True
+      p.mask_self_atten = True
+      p.tr_fflayer_tpl.hidden_dim = 7
+      p.tr_atten_tpl.num_attention_heads = 2
+      transformer = layers_with_attention.TransformerLayer(p)
+
+      (source_vecs, _, aux_vecs,
+       aux_paddings) = self._testTransformerAttentionLayerInputs(depth=depth)
+      source_padding = tf.zeros([5, 2])
+
+      h1, probs1 = transformer.FPropDefaultTheta(
+          source_vecs,
+          source_padding,
+          aux_vecs=aux_vecs,
+          aux_paddings=aux_paddings)
+
+      prefix_states = kv_cache.ZeroKVCache(5, 2, 4)
+      h_step, probs_step, prefix_states = transformer.ExtendStep(
+          transformer.theta, source_vecs[0, :, :], prefix_states, aux_vecs,
+          aux_paddings, t=0)
+      # A rejected chunk, which is overwritten by the next one.
+      _, _, prefix_states = transformer.ExtendChunk(
+          transformer.theta, source_vecs[2:4, :, :] + 1.0, prefix_states, 1,
+          aux_vecs, aux_paddings)
+      h_chunk, probs_chunk, prefix_states = transformer.ExtendChunk(
+          transformer.theta, source_vecs[1:, :, :], prefix_states, 1, aux_vecs,
+          aux_paddings)
+
+      h2 = tf.concat([tf.expand_dims(h_step, 0), h_chunk], 0)
+      probs2 = tf.concat([probs_step, probs_chunk], 0)
+
+      tf.global_variables_initializer().run()
+      h1_v, probs1_v, h2_v, probs2_v = sess.run([h1, probs1, h2, probs2])
+      self.assertAllClose(h1_v, h2_v)
+      self.assertAllClose(probs1_v, probs2_v)
+
   def testMergerLayerMean(self):
     with self.session(use_gpu=True) as sess:
       np.random.seed(505837249)
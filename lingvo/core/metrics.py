@@ -60,6 +60,17 @@ class BaseMetric(object):
     """
     return CreateScalarSummary(name, self.value)
 
+  def Merge(self, other):
+    """Accumulates the statistics of `other`, a metric of the same class.
+
+    Metrics computed on disjoint slices of a dataset and then merged have the
+    same value as the metric computed on the whole dataset.
+
+    Args:
+      other: A `BaseMetric` of the same class as this metric.
+    """
+    raise NotImplementedError('%s can not be merged.' % type(self).__name__)
+
 
 class AverageMetric(BaseMetric):
   """Class to compute a weighted (arithmetic) average value metric."""
@@ -97,6 +108,11 @@ class AverageMetric(BaseMetric):
     return (self._total_value /
             self._total_weight if self._total_weight > 0 else 0)
 
+  def Merge(self, other):
+    """Adds the statistics of another `AverageMetric` to this one."""
+    self._total_value += other.total_value
+    self._total_weight += other.total_weight
+
 
 class F1Metric(BaseMetric):
   """Class to compute F1 metrics."""
@@ -115,6 +131,12 @@ class F1Metric(BaseMetric):
   def UpdateFalseNegative(self, count=1.0):
     self._false_neg += count
 
+  def Merge(self, other):
+    """Adds the statistics of another `F1Metric` to this one."""
+    self._true_pos += other._true_pos  # pylint: disable=protected-access
+    self._false_pos += other._false_pos  # pylint: disable=protected-access
+    self._false_neg += other._false_neg  # pylint: disable=protected-access
+
   @property
   def value(self):
     if (self._true_pos + self._false_pos) > 0:
@@ -140,6 +162,19 @@ class CorpusBleuMetric(BaseMetric):
   def Update(self, ref_str, hyp_str):
     self._scorer.AddSentence(ref_str, hyp_str)
 
+  def UpdateBatch(self, ref_strs, hyp_strs, num_workers=1):
+    """Updates with a batch of sentences, see `BleuScorer.AddSentences`."""
+    self._scorer.AddSentences(ref_strs, hyp_strs, num_workers=num_workers)
+
+  @property
+  def stats(self):
+    """Sufficient statistics, see `BleuScorer.stats`."""
+    return self._scorer.stats
+
+  def Merge(self, other):
+    """Adds the statistics of another `CorpusBleuMetric` to this one."""
+    self._scorer.MergeStats(other.stats)
+
   @property
   def unsegmenter(self):
     return self._scorer.unsegmenter
@@ -149,15 +184,15 @@ class CorpusBleuMetric(BaseMetric):
     return self._scorer.ComputeOverallScore()
 
 
-class TpuEvalMetrics(object):
-  """Manages computation of metrics during TPU execution.
+class LoopEvalMetrics(object):
+  """Manages computation of metrics during a training loop on device.
 
-  TPU execution runs a training loop on device. To get eval metrics out of this,
-  metric values and weights must be carried through the loop. This requires
-  passing initial values to the loop setup, updated the values during the loop,
-  and doing a final aggregation after the loop. This class wraps the metrics
-  dictionary so that the needed ops can be built at the right time as the
-  training loop is built.
+  A training loop runs several training steps per session run. To get eval
+  metrics out of this, metric values and weights must be carried through the
+  loop. This requires passing initial values to the loop setup, updated the
+  values during the loop, and doing a final aggregation after the loop. This
+  class wraps the metrics dictionary so that the needed ops can be built at the
+  right time as the training loop is built.
 
   Note that because the model is not constructed until the loop body function is
   called, the initial values must be known statically. This is done currently by
@@ -165,9 +200,9 @@ class TpuEvalMetrics(object):
   count to float32, regardless of the number of actual metrics the model
   produced.
 
-  Note that this implementation computes the metrics over all replicas, for the
-  last step of the loop only (could be changed to average over all loop steps
-  instead).
+  The loop body is expected to add the values returned by SetMetrics() to the
+  loop-carried values, so that the final metrics are the weighted averages
+  over all steps of the loop.
   """
 
   def __init__(self):
@@ -232,8 +267,7 @@ class TpuEvalMetrics(object):
   def FinalizeMetrics(self, loop_result):
     """Compute final average of the metrics, given loop_result tensors.
 
-    To be called outside the training loop body , but still in the scope of
-    tpu.batch_parallel.
+    To be called outside the training loop body.
 
     Args:
       loop_result: Result of the training loop.
@@ -243,8 +277,7 @@ class TpuEvalMetrics(object):
     """
     # Each metric has two tensors in the loop carrying result.
     metrics = loop_result[:2 * len(self._metrics.Flatten())]
-    # Aggregate across tpu replicas.
-    metrics = [tf.contrib.tpu.cross_replica_sum(x) for x in metrics]
+    metrics = self._SumAcrossReplicas(metrics)
     ret = []
     for (value, weight) in self._Zip(metrics):
       value, weight = py_utils.WeightedAvg(value / weight, weight)
@@ -255,6 +288,21 @@ class TpuEvalMetrics(object):
     """Packs numpy values into a NestedMap of metrics."""
     return self.metrics.Pack(self._Zip(values))
 
+  def _SumAcrossReplicas(self, values):
+    """Returns `values` summed across replicas of the training loop."""
+    return values
+
+
+class TpuEvalMetrics(LoopEvalMetrics):
+  """Manages computation of metrics during TPU execution.
+
+  Metrics are also aggregated across TPU replicas, so FinalizeMetrics() must be
+  called in the scope of tpu.batch_parallel.
+  """
+
+  def _SumAcrossReplicas(self, values):
+    return [tf.contrib.tpu.cross_replica_sum(x) for x in values]
+
 
 class AUCMetric(BaseMetric):
   """Class to compute the AUC score for binary classification."""
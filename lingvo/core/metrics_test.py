@@ -45,6 +45,19 @@ class MetricsTest(tf.test.TestCase):
     m.Update(1.0)
     self.assertEqual(1.0 + 2.0*10.0 + 1.0, m.total_value)
 
+  def testAverageMetricMerge(self):
+    m = metrics.AverageMetric()
+    m.Update(1.0)
+    m.Update(2.0, 10.0)
+    m0 = metrics.AverageMetric()
+    m0.Update(1.0)
+    m1 = metrics.AverageMetric()
+    m1.Update(2.0, 10.0)
+    m0.Merge(m1)
+    self.assertEqual(m.total_value, m0.total_value)
+    self.assertEqual(m.total_weight, m0.total_weight)
+    self.assertEqual(m.value, m0.value)
+
   def testF1Metric(self):
     m = metrics.F1Metric()
     m.UpdateTruePositive(count=2.0)
@@ -74,6 +87,17 @@ class MetricsTest(tf.test.TestCase):
         tf.Summary(value=[tf.Summary.Value(tag=name, simple_value=1.0)]),
         m.Summary(name))
 
+  def testCorpusBleuMetricMerge(self):
+    m = metrics.CorpusBleuMetric()
+    m.UpdateBatch(['a b c d', 'a b c'], ['a b c d', 'a b d'])
+    m0 = metrics.CorpusBleuMetric()
+    m0.Update('a b c d', 'a b c d')
+    m1 = metrics.CorpusBleuMetric()
+    m1.Update('a b c', 'a b d')
+    m0.Merge(m1)
+    self.assertEqual(m.stats, m0.stats)
+    self.assertAlmostEqual(m.value, m0.value)
+
 
 if __name__ == '__main__':
   tf.test.main()
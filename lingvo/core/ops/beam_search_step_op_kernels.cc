@@ -14,6 +14,9 @@ limitations under the License.
 ==============================================================================*/
 
 #include "lingvo/core/ops/beam_search_step_op_kernels.h"
+
+#include <numeric>  // std::iota
+
 #include "tensorflow/core/framework/op_kernel.h"
 #include "tensorflow/core/framework/tensor.h"
 #include "tensorflow/core/framework/tensor_shape.h"
@@ -33,40 +36,69 @@ namespace debug {
 static string IdsToStr(const google::protobuf::RepeatedField<int32>& ids) {
   return debug::IdsToStr(std::vector<int32>(ids.begin(), ids.end()));
 }
+
+static string IdsToStr(const IdPrefix* ids) {
+  return debug::IdsToStr(IdPrefixToVector(ids));
+}
 }  // namespace debug
 
-bool IdsMatchUpToIndex(const std::vector<int>& cur_hyp_ids,
-                       const std::vector<int>& other_hyp_ids, const int index) {
-  CHECK_LE(index, cur_hyp_ids.size());
-  CHECK_LE(index, other_hyp_ids.size());
-  return std::equal(cur_hyp_ids.begin(), cur_hyp_ids.begin() + index,
-                    other_hyp_ids.begin());
+const IdPrefix* IdPrefixArena::Append(const IdPrefix* prefix, int32 id) {
+  // A polynomial hash modulo 2^64, which can be extended one id at a time.
+  static const uint64 kMultiplier = 0x100000001b3ULL;
+  const uint64 parent_hash = prefix == nullptr ? 0 : prefix->hash;
+  nodes_.push_back({prefix, id, IdPrefixLength(prefix) + 1,
+                    parent_hash * kMultiplier + static_cast<uint32>(id) + 1});
+  return &nodes_.back();
+}
+
+const IdPrefix* IdPrefixArena::FromIds(const std::vector<int32>& ids) {
+  const IdPrefix* prefix = nullptr;
+  for (const int32 id : ids) {
+    prefix = Append(prefix, id);
+  }
+  return prefix;
+}
+
+bool IdPrefixEqual(const IdPrefix* x, const IdPrefix* y) {
+  // The two sequences are equal as soon as they share a node.
+  while (x != y) {
+    if (x == nullptr || y == nullptr || x->length != y->length ||
+        x->hash != y->hash || x->id != y->id) {
+      return false;
+    }
+    x = x->parent;
+    y = y->parent;
+  }
+  return true;
+}
+
+std::vector<int32> IdPrefixToVector(const IdPrefix* prefix) {
+  std::vector<int32> ids(IdPrefixLength(prefix));
+  for (; prefix != nullptr; prefix = prefix->parent) {
+    ids[prefix->length - 1] = prefix->id;
+  }
+  return ids;
 }
 
 bool IsDuplicateHyp(const Hyp& cur_hyp, const Hyp& other_hyp,
                     const int epsilon_id) {
-  const std::vector<int>& cur_hyp_ids = cur_hyp.prev_ids;
-  const std::vector<int>& other_hyp_ids = other_hyp.prev_ids;
+  const IdPrefix* cur_hyp_ids = cur_hyp.prev_ids;
+  const IdPrefix* other_hyp_ids = other_hyp.prev_ids;
   // Note word_id refers to id of current label, which could be grapheme,
   // phoneneme, wordpiece, ectc.
   if (cur_hyp.word_id == other_hyp.word_id) {
     // If the cur step is the same (epsilon or otherwise), just need to compare
     // prev ids which already has epsilons stripped.
-    return (
-        cur_hyp_ids.size() == other_hyp_ids.size() &&
-        IdsMatchUpToIndex(cur_hyp_ids, other_hyp_ids, other_hyp_ids.size()));
+    return IdPrefixEqual(cur_hyp_ids, other_hyp_ids);
   } else if (cur_hyp.word_id == epsilon_id) {
     // If exactly one of the hyps has a cur step of epsilon, then need to
     // compare that hyp's final prev id to other hyp's current step id,
     // then compare the rest of the prev ids.
-    return (
-        cur_hyp_ids.size() == other_hyp_ids.size() + 1 &&
-        cur_hyp_ids[cur_hyp_ids.size() - 1] == other_hyp.word_id &&
-        IdsMatchUpToIndex(cur_hyp_ids, other_hyp_ids, other_hyp_ids.size()));
+    return (cur_hyp_ids != nullptr && cur_hyp_ids->id == other_hyp.word_id &&
+            IdPrefixEqual(cur_hyp_ids->parent, other_hyp_ids));
   } else if (other_hyp.word_id == epsilon_id) {
-    return (other_hyp_ids.size() == cur_hyp_ids.size() + 1 &&
-            other_hyp_ids[other_hyp_ids.size() - 1] == cur_hyp.word_id &&
-            IdsMatchUpToIndex(other_hyp_ids, cur_hyp_ids, cur_hyp_ids.size()));
+    return (other_hyp_ids != nullptr && other_hyp_ids->id == cur_hyp.word_id &&
+            IdPrefixEqual(other_hyp_ids->parent, cur_hyp_ids));
   } else {
     // If the cur step is not the same for the two hyps and neither is an
     // epsilon then this cannot be a duplicate hyp.
@@ -74,6 +106,39 @@ bool IsDuplicateHyp(const Hyp& cur_hyp, const Hyp& other_hyp,
   }
 }
 
+// Records the attention probs 'probs' of one step of 'hypothesis'. Either
+// appends them to its atten_vecs, or only adds them to its
+// cumulative_atten_probs. Also appends the 'alignment_k' positions with the
+// highest probs to its alignment.
+void AddAttenProbs(const std::vector<float>& probs, bool keep_atten_vecs,
+                   int alignment_k, Hypothesis* hypothesis) {
+  if (keep_atten_vecs) {
+    auto* att_vec = hypothesis->add_atten_vecs();
+    for (const float prob : probs) {
+      att_vec->add_prob(prob);
+    }
+  } else {
+    auto* cumulative = hypothesis->mutable_cumulative_atten_probs();
+    if (cumulative->empty()) {
+      cumulative->Resize(probs.size(), 0.0f);
+    }
+    for (int j = 0; j < probs.size(); ++j) {
+      *cumulative->Mutable(j) += probs[j];
+    }
+  }
+  if (alignment_k > 0) {
+    std::vector<int32> positions(probs.size());
+    std::iota(positions.begin(), positions.end(), 0);
+    const int k = std::min<int>(alignment_k, positions.size());
+    std::partial_sort(
+        positions.begin(), positions.begin() + k, positions.end(),
+        [&probs](int32 x, int32 y) { return probs[x] > probs[y]; });
+    for (int i = 0; i < alignment_k; ++i) {
+      hypothesis->add_alignment(i < k ? positions[i] : -1);
+    }
+  }
+}
+
 float LogSumExp(float a, float b) {
   const float m = std::max(a, b);
   return m + log(exp(a - m) + exp(b - m));
@@ -222,7 +287,7 @@ void ComputeTopKPlusM(const std::vector<Hyp>& hyps, const Tensor& scores,
                     // Only allow an empty hyp (all <epsilon>s) to be
                     // considered terminated, if explicitly permitted.
                     // 'prev_ids' contains only non-epsilons.
-                    (allow_empty_terminated_hyp || !e.prev_ids.empty())) {
+                    (allow_empty_terminated_hyp || e.prev_ids != nullptr)) {
                   (*eos_in_topk)[hyp_id] = true;
                   (*eos_hyps)[hyp_id] = e;
                   (*terminal_syms)[hyp_id] = eoc_id;
@@ -267,8 +332,13 @@ class BeamSearchStepOp : public OpKernel {
     OP_REQUIRES_OK(ctx, ctx->GetAttr("ensure_full_beam", &ensure_full_beam_));
     OP_REQUIRES_OK(
         ctx, ctx->GetAttr("force_eos_in_last_step", &force_eos_in_last_step_));
+    OP_REQUIRES_OK(ctx, ctx->GetAttr("atten_vecs_in_hypothesis_protos",
+                                     &atten_vecs_in_hypothesis_protos_));
+    OP_REQUIRES_OK(ctx,
+                   ctx->GetAttr("atten_alignment_k", &atten_alignment_k_));
 
     CHECK_GE(eos_id_, 0);
+    CHECK_GE(atten_alignment_k_, 0);
     CHECK_GT(beam_size_, 0.0);
     CHECK_GT(num_hyps_per_beam_, 0);
   }
@@ -313,6 +383,7 @@ class BeamSearchStepOp : public OpKernel {
     hypothesis.set_beam_id(hyp.beam_id);
     // Add one to account for t-th step (terminal sym).
     const float average_step_score = hyp.global_score / (t + 1);
+    std::vector<float> probs(atten_probs.dim_size(1));
     for (int i = 0; i < t; i++) {
       const int hyp_id = hyp_ids[i];
       hypothesis.add_ids(t_out_hyps(i, hyp_id));
@@ -324,10 +395,11 @@ class BeamSearchStepOp : public OpKernel {
       const float score_this_step =
           (merge_paths_ ? average_step_score : t_out_scores(i, hyp_id));
       hypothesis.add_scores(score_this_step);
-      auto* att_vec = hypothesis.add_atten_vecs();
-      for (int j = 0; j < atten_probs.dim_size(1); ++j) {
-        att_vec->add_prob(t_out_atten_probs(i, hyp_id, j));
+      for (int j = 0; j < probs.size(); ++j) {
+        probs[j] = t_out_atten_probs(i, hyp_id, j);
       }
+      AddAttenProbs(probs, atten_vecs_in_hypothesis_protos_,
+                    atten_alignment_k_, &hypothesis);
     }
     // Now add the terminal symbol.
     hypothesis.add_ids(terminal_sym);
@@ -335,11 +407,12 @@ class BeamSearchStepOp : public OpKernel {
     const float score_this_step =
         merge_paths_ ? average_step_score : hyp.local_score;
     hypothesis.add_scores(score_this_step);
-    auto* att_vec = hypothesis.add_atten_vecs();
     auto t_atten_probs = atten_probs.matrix<float>();
-    for (int j = 0; j < atten_probs.dim_size(1); ++j) {
-      att_vec->add_prob(t_atten_probs(hyp.hyp_id, j));
+    for (int j = 0; j < probs.size(); ++j) {
+      probs[j] = t_atten_probs(hyp.hyp_id, j);
     }
+    AddAttenProbs(probs, atten_vecs_in_hypothesis_protos_, atten_alignment_k_,
+                  &hypothesis);
     return hypothesis.SerializeAsString();
   }
 
@@ -507,24 +580,40 @@ class BeamSearchStepOp : public OpKernel {
 
     VLOG(2) << "BeamSearchStepOp(" << num_hyps_per_beam_ << ") step=" << t;
     auto t_cumulative_scores = cumulative_scores.vec<float>();
+    // Marks the hyps at each step from which the current hyps descend. Other
+    // hyps have fallen off the beams, and their ids are never looked at.
+    std::vector<std::vector<bool>> alive(t, std::vector<bool>(num_hyps));
+    if (t > 0) {
+      alive[t - 1].assign(num_hyps, true);
+    }
+    for (int j = t - 1; j > 0; --j) {
+      for (int i = 0; i < num_hyps; ++i) {
+        if (alive[j][i]) {
+          alive[j - 1][in_prev_hyps.matrix<int>()(j, i)] = true;
+        }
+      }
+    }
+    // Determines the sequence of prev ids that each hypothesis represents, as
+    // a prefix tree in which hypotheses share their common prefixes.
+    IdPrefixArena prefixes;
+    std::vector<const IdPrefix*> prev_ids(num_hyps, nullptr);
+    std::vector<const IdPrefix*> cur_ids(num_hyps, nullptr);
+    for (int j = 0; j < t; ++j) {
+      for (int i = 0; i < num_hyps; ++i) {
+        if (!alive[j][i]) continue;
+        const IdPrefix* prefix =
+            j == 0 ? nullptr : prev_ids[in_prev_hyps.matrix<int>()(j, i)];
+        const int id = in_hyps.matrix<int>()(j, i);
+        cur_ids[i] = id == eoc_id_ ? prefix : prefixes.Append(prefix, id);
+      }
+      std::swap(prev_ids, cur_ids);
+    }
     std::vector<Hyp> hyps(num_hyps);
     for (int i = 0; i < num_hyps; ++i) {
       hyps[i].beam_id = i % num_beams;
       hyps[i].hyp_id = i;
       hyps[i].global_score = t_cumulative_scores(i);
-      // Determines the sequence of prev ids that this hypothesis represents.
-      std::vector<int> hyp_id_at_step(t);
-      int hyp_id = i;
-      for (int j = t - 1; j >= 0; --j) {
-        hyp_id_at_step[j] = hyp_id;
-        hyp_id = in_prev_hyps.matrix<int>()(j, hyp_id);
-      }
-      for (int j = 0; j < t; ++j) {
-        const int prev_id = in_hyps.matrix<int>()(j, hyp_id_at_step[j]);
-        if (prev_id != eoc_id_) {
-          hyps[i].prev_ids.push_back(prev_id);
-        }
-      }
+      hyps[i].prev_ids = prev_ids[i];
       VLOG(3) << "Step " << t << " hyp " << i
               << " score=" << hyps[i].global_score
               << " toks=" << debug::IdsToStr(hyps[i].prev_ids);
@@ -645,6 +734,8 @@ class BeamSearchStepOp : public OpKernel {
   bool allow_empty_terminated_hyp_ = true;
   bool ensure_full_beam_ = false;
   bool force_eos_in_last_step_ = false;
+  bool atten_vecs_in_hypothesis_protos_ = true;
+  int atten_alignment_k_ = 0;
 };
 
 REGISTER_KERNEL_BUILDER(Name("BeamSearchStep").Device(DEVICE_CPU),
@@ -670,9 +761,12 @@ class TopKTerminatedHypsOp : public OpKernel {
     CHECK_GT(k_, 0);
   }
 
+  // Computes the top k terminated hyps of each beam, sorted by decreasing
+  // normalized score, into 'topk'.
   void ComputeTopK(const Tensor& in_done_hyps,
                    const std::vector<int32> src_seq_lengths, const int32 k,
-                   const int32 num_beams, Tensor* topk_hyps) {
+                   const int32 num_beams,
+                   std::vector<std::vector<Hypothesis>>* topk) {
     VLOG(1) << "Topk clear, num_beams: " << num_beams;
     int hyps_size = in_done_hyps.dim_size(1);
     int num_steps = in_done_hyps.dim_size(0);
@@ -718,13 +812,13 @@ class TopKTerminatedHypsOp : public OpKernel {
             }
           });
 
-    auto t_topk_hyps = topk_hyps->matrix<string>();
+    topk->resize(num_beams);
     for (int i = 0; i < num_beams; ++i) {
-      auto ith_topk = topk_vec[i].Get();
+      auto& ith_topk = (*topk)[i];
+      ith_topk = topk_vec[i].Get();
       CHECK_LE(ith_topk.size(), k);
       std::sort(ith_topk.begin(), ith_topk.end(), BetterTerminatedHyp());
       for (int j = 0; j < ith_topk.size(); ++j) {
-        t_topk_hyps(i, j) = ith_topk[j].SerializeAsString();
         VLOG(2) << "TopK(" << i << ", " << j << ") = "
                 << debug::IdsToStr(ith_topk[j].ids());
       }
@@ -733,10 +827,19 @@ class TopKTerminatedHypsOp : public OpKernel {
 
   float NormalizedScore(const Hypothesis& hypothesis,
                         const int src_size) const {
-    int length = hypothesis.atten_vecs_size();
+    // Every step adds one id, whether or not its attention probs are kept.
+    const int length = hypothesis.ids_size();
     Tensor cumulative_atten_prob(DT_FLOAT, {src_size});
     auto cumulative_atten_prob_vec = cumulative_atten_prob.vec<float>();
     cumulative_atten_prob_vec.setZero();
+    // Compact hyps carry the sum of their attention probs instead of the
+    // attention probs of every step.
+    const int hyp_prob_size = hypothesis.cumulative_atten_probs_size();
+    for (int src_id = 0; src_id < src_size && src_id < hyp_prob_size;
+         ++src_id) {
+      cumulative_atten_prob_vec(src_id) =
+          hypothesis.cumulative_atten_probs(src_id);
+    }
     for (int step = 0; step < hypothesis.atten_vecs_size(); ++step) {
       const int hyp_prob_size = hypothesis.atten_vecs(step).prob_size();
       for (int src_id = 0; src_id < src_size; ++src_id) {
@@ -793,15 +896,29 @@ class TopKTerminatedHypsOp : public OpKernel {
     for (int i = 0; i < num_beams; ++i) {
       src_seq_lengths[i] = in_src_seq_lens.flat<int>()(i);
     }
+    std::vector<std::vector<Hypothesis>> topk;
+    ComputeTopK(in_done_hyps, src_seq_lengths, k_, num_beams, &topk);
     // Set the output tensors.
+    SetOutputs(ctx, topk);
+    VLOG(1) << "TopKTerminatedHypsOp(" << num_hyps_per_beam_ << ") done";
+  }
+
+ protected:
+  // Sets the outputs of the op from the top k hyps of each beam.
+  virtual void SetOutputs(OpKernelContext* ctx,
+                          const std::vector<std::vector<Hypothesis>>& topk) {
+    const int num_beams = topk.size();
     Tensor* out_topk_hyps = nullptr;
     OP_REQUIRES_OK(ctx, ctx->allocate_output(0, TensorShape{num_beams, k_},
                                              &out_topk_hyps));
-    ComputeTopK(in_done_hyps, src_seq_lengths, k_, num_beams, out_topk_hyps);
-    VLOG(1) << "TopKTerminatedHypsOp(" << num_hyps_per_beam_ << ") done";
+    auto t_topk_hyps = out_topk_hyps->matrix<string>();
+    for (int i = 0; i < num_beams; ++i) {
+      for (int j = 0; j < topk[i].size(); ++j) {
+        t_topk_hyps(i, j) = topk[i][j].SerializeAsString();
+      }
+    }
   }
 
- private:
   int32 num_hyps_per_beam_;
   float length_normalization_;
   float coverage_penalty_;
@@ -814,6 +931,89 @@ class TopKTerminatedHypsOp : public OpKernel {
 REGISTER_KERNEL_BUILDER(Name("TopKTerminatedHyps").Device(DEVICE_CPU),
                         TopKTerminatedHypsOp);
 
+// Same as TopKTerminatedHypsOp, but returns the top k hyps as dense tensors
+// instead of serialized Hypothesis protos.
+class TopKTerminatedHypsDenseOp : public TopKTerminatedHypsOp {
+ public:
+  explicit TopKTerminatedHypsDenseOp(OpKernelConstruction* ctx)
+      : TopKTerminatedHypsOp(ctx) {
+    OP_REQUIRES_OK(ctx, ctx->GetAttr("max_seq_length", &max_seq_length_));
+    OP_REQUIRES_OK(ctx,
+                   ctx->GetAttr("atten_alignment_k", &atten_alignment_k_));
+    CHECK_GE(max_seq_length_, 0);
+    CHECK_GE(atten_alignment_k_, 0);
+  }
+
+ protected:
+  void SetOutputs(OpKernelContext* ctx,
+                  const std::vector<std::vector<Hypothesis>>& topk) override {
+    const int num_beams = topk.size();
+    const int batch_size = num_beams * k_;
+    int max_seq_length = max_seq_length_;
+    if (max_seq_length <= 0) {
+      // Derive max_seq_length from the top k hyps.
+      for (const auto& ith_topk : topk) {
+        for (const Hypothesis& hyp : ith_topk) {
+          max_seq_length = std::max(max_seq_length, hyp.ids_size());
+        }
+      }
+    }
+    Tensor* out_ids;
+    OP_REQUIRES_OK(
+        ctx, ctx->allocate_output(0, TensorShape({batch_size, max_seq_length}),
+                                  &out_ids));
+    Tensor* out_seq_lens;
+    OP_REQUIRES_OK(
+        ctx, ctx->allocate_output(1, TensorShape({batch_size}), &out_seq_lens));
+    Tensor* out_scores;
+    OP_REQUIRES_OK(
+        ctx, ctx->allocate_output(2, TensorShape({batch_size}), &out_scores));
+    Tensor* out_alignments;
+    OP_REQUIRES_OK(ctx, ctx->allocate_output(
+                            3,
+                            TensorShape({batch_size, max_seq_length,
+                                         atten_alignment_k_}),
+                            &out_alignments));
+    auto t_out_ids = out_ids->matrix<int32>();
+    auto t_out_seq_lens = out_seq_lens->vec<int32>();
+    auto t_out_scores = out_scores->vec<float>();
+    auto t_out_alignments = out_alignments->tensor<int32, 3>();
+    t_out_ids.setZero();
+    t_out_seq_lens.setZero();
+    t_out_scores.setZero();
+    t_out_alignments.setConstant(-1);
+    for (int i = 0; i < num_beams; ++i) {
+      for (int j = 0; j < topk[i].size(); ++j) {
+        const Hypothesis& hyp = topk[i][j];
+        const int row = i * k_ + j;
+        const int len = std::min(hyp.ids_size(), max_seq_length);
+        for (int l = 0; l < len; ++l) {
+          t_out_ids(row, l) = hyp.ids(l);
+        }
+        t_out_seq_lens(row) = len;
+        t_out_scores(row) = hyp.normalized_score();
+        if (atten_alignment_k_ > 0) {
+          const int alignment_len =
+              std::min(len, hyp.alignment_size() / atten_alignment_k_);
+          for (int l = 0; l < alignment_len; ++l) {
+            for (int a = 0; a < atten_alignment_k_; ++a) {
+              t_out_alignments(row, l, a) =
+                  hyp.alignment(l * atten_alignment_k_ + a);
+            }
+          }
+        }
+      }
+    }
+  }
+
+ private:
+  int32 max_seq_length_ = 0;
+  int32 atten_alignment_k_ = 0;
+};
+
+REGISTER_KERNEL_BUILDER(Name("TopKTerminatedHypsDense").Device(DEVICE_CPU),
+                        TopKTerminatedHypsDenseOp);
+
 class UnpackHypOp : public OpKernel {
  public:
   explicit UnpackHypOp(OpKernelConstruction* ctx) : OpKernel(ctx) {
@@ -17,6 +17,7 @@ limitations under the License.
 #define LINGVO_CORE_OPS_BEAM_SEARCH_STEP_OP_KERNELS_H_
 
 #include <algorithm>   // std::sort
+#include <deque>
 #include <functional>  // std::greater
 #include <vector>
 
@@ -27,14 +28,50 @@ limitations under the License.
 namespace tensorflow {
 namespace lingvo {
 
+// A node in a prefix tree of token id sequences. Hyps which share a prefix
+// share its nodes, so a candidate extending a hyp refers to the hyp's ids
+// instead of copying them. nullptr represents the empty sequence.
+struct IdPrefix {
+  const IdPrefix* parent;  // The sequence without its last id.
+  int32 id;                // The last id of the sequence.
+  int32 length;            // The number of ids in the sequence.
+  uint64 hash;             // A rolling hash of the ids in the sequence.
+};
+
+// Owns the IdPrefix nodes, which stay valid as long as the arena does.
+class IdPrefixArena {
+ public:
+  // Returns the sequence 'prefix' followed by 'id'.
+  const IdPrefix* Append(const IdPrefix* prefix, int32 id);
+
+  // Returns a new sequence made of 'ids'.
+  const IdPrefix* FromIds(const std::vector<int32>& ids);
+
+ private:
+  // A deque never moves its elements when it grows.
+  std::deque<IdPrefix> nodes_;
+};
+
+// Returns the number of ids in 'prefix'.
+inline int32 IdPrefixLength(const IdPrefix* prefix) {
+  return prefix == nullptr ? 0 : prefix->length;
+}
+
+// Returns true if 'x' and 'y' represent the same sequence. Sequences with
+// different lengths or hashes are told apart in O(1).
+bool IdPrefixEqual(const IdPrefix* x, const IdPrefix* y);
+
+// Returns the ids in 'prefix', e.g., for logging.
+std::vector<int32> IdPrefixToVector(const IdPrefix* prefix);
+
 // Simple tuple for book keeping during beam pruning.
 struct Hyp {
-  int32 beam_id;                // The beam that this hyp belongs to.
-  int32 hyp_id;                 // The hypothesis id.
-  int32 word_id;                // The id for the predicted next word.
-  float local_score;            // Local score from the current step.
-  float global_score;           // Cumulative score till the current step.
-  std::vector<int32> prev_ids;  // The (non-epsilon) token ids up to this step.
+  int32 beam_id;             // The beam that this hyp belongs to.
+  int32 hyp_id;              // The hypothesis id.
+  int32 word_id;             // The id for the predicted next word.
+  float local_score;         // Local score from the current step.
+  float global_score;        // Cumulative score till the current step.
+  const IdPrefix* prev_ids;  // The (non-epsilon) token ids up to this step.
 
   string DebugString() const {
     return strings::StrCat(beam_id, " ", hyp_id, " ", word_id, " ", local_score,
@@ -641,5 +641,60 @@ class BeamSearchOpTest(tf.test.TestCase):
       self.assertAllClose(k4, [1.35659194, 1.02759778, 1.21130753, 1.0267117])
 
 
+class BeamSearchStepOpBenchmark(tf.test.Benchmark):
+  """Benchmarks the latency of beam_search_step late in long decodes.
+
+  Run with --benchmarks=BeamSearchStepOpBenchmark.
+  """
+
+  def _BenchmarkStep(self,
+                     seq_len=300,
+                     num_beams=8,
+                     num_hyps_per_beam=8,
+                     vocab_size=16000,
+                     src_len=8,
+                     eoc_id=-1):
+    np.random.seed(12345)
+    b_size = num_beams * num_hyps_per_beam
+    with tf.Graph().as_default(), tf.Session() as sess:
+      cur_step = tf.placeholder(tf.int32, [])
+      # Every hyp extends a random hyp of its beam from the previous step.
+      prev_hyps = (
+          np.arange(b_size) % num_beams + num_beams * np.random.randint(
+              num_hyps_per_beam, size=[seq_len, b_size]))
+      outputs = py_x_ops.beam_search_step(
+          np.log(np.random.uniform(size=[b_size, vocab_size])).astype(
+              np.float32),
+          np.random.uniform(size=[b_size, src_len]).astype(np.float32),
+          tf.zeros([num_beams]),
+          -np.random.uniform(size=[b_size]).astype(np.float32),
+          tf.zeros([seq_len, b_size]),
+          np.random.randint(3, vocab_size, size=[seq_len, b_size]).astype(
+              np.int32),
+          prev_hyps.astype(np.int32),
+          tf.as_string(tf.zeros([seq_len, b_size], dtype=tf.int32)),
+          tf.zeros([seq_len, b_size, src_len]),
+          np.zeros([b_size], np.bool) if eoc_id >= 0 else [],
+          cur_step,
+          eos_id=2,
+          eoc_id=eoc_id,
+          beam_size=3.0,
+          num_hyps_per_beam=num_hyps_per_beam,
+          merge_paths=eoc_id >= 0)
+      for step in [1, seq_len // 2, seq_len - 1]:
+        self.run_op_benchmark(
+            sess,
+            outputs,
+            feed_dict={cur_step: step},
+            min_iters=20,
+            name='beam_search_step_eoc_%d_step_%d' % (eoc_id, step))
+
+  def benchmarkBeamSearchStep(self):
+    self._BenchmarkStep()
+
+  def benchmarkBeamSearchStepMergePaths(self):
+    self._BenchmarkStep(eoc_id=0)
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -20,25 +20,26 @@ namespace tensorflow {
 namespace lingvo {
 namespace {
 
+using ::testing::ElementsAre;
 using ::testing::Eq;
 using ::testing::FloatEq;
 using ::testing::FloatNear;
 using ::testing::SizeIs;
 
 template <typename T>
-void Populate(T* top_k) {
+void Populate(T* top_k, IdPrefixArena* ids) {
   // Add 3 distinct hyps.
   float bottom_of_topk;
   // Hyp struct consists of:
   //  beam_id, hyp_id, word_id, local_score, global_score, prev_ids
-  bottom_of_topk = top_k->Add({0, 2, 3, -0.4, -2.0, {1, 2, 3}});
+  bottom_of_topk = top_k->Add({0, 2, 3, -0.4, -2.0, ids->FromIds({1, 2, 3})});
   EXPECT_THAT(bottom_of_topk, FloatEq(std::numeric_limits<float>::lowest()));
-  bottom_of_topk = top_k->Add({0, 1, 8, -0.7, -1.3, {1, 7, 2}});
+  bottom_of_topk = top_k->Add({0, 1, 8, -0.7, -1.3, ids->FromIds({1, 7, 2})});
   EXPECT_THAT(bottom_of_topk, FloatEq(std::numeric_limits<float>::lowest()));
-  bottom_of_topk = top_k->Add({0, 6, 2, -0.1, -1.7, {1, 9, 5}});
+  bottom_of_topk = top_k->Add({0, 6, 2, -0.1, -1.7, ids->FromIds({1, 9, 5})});
   // No resize yet, since we haven't gotten to k * 2 = 4 elements yet.
   EXPECT_THAT(bottom_of_topk, FloatEq(std::numeric_limits<float>::lowest()));
-  bottom_of_topk = top_k->Add({0, 4, 3, -0.5, -2.5, {1, 2, 4}});
+  bottom_of_topk = top_k->Add({0, 4, 3, -0.5, -2.5, ids->FromIds({1, 2, 4})});
   // After fourth element we resize down to two best elements.
   EXPECT_THAT(bottom_of_topk, FloatNear(-1.7, 0.001));
 
@@ -50,21 +51,23 @@ void Populate(T* top_k) {
   EXPECT_THAT(hyps[1].global_score, FloatNear(-1.7, 0.001));
 
   // Add a dupe.
-  top_k->Add({0, 5, 8, -0.7, -1.5, {1, 7, 2}});
+  top_k->Add({0, 5, 8, -0.7, -1.5, ids->FromIds({1, 7, 2})});
 }
 
 template <typename T>
-void PopulateWithEpsilons(T* top_k) {
+void PopulateWithEpsilons(T* top_k, IdPrefixArena* ids) {
   // Add 3 distinct hyps.
   float bottom_of_topk;
-  bottom_of_topk = top_k->Add({0, 2, 3, -0.4, -2.0, {1, 2, 3}});
+  bottom_of_topk = top_k->Add({0, 2, 3, -0.4, -2.0, ids->FromIds({1, 2, 3})});
   EXPECT_THAT(bottom_of_topk, FloatEq(std::numeric_limits<float>::lowest()));
-  bottom_of_topk = top_k->Add({0, 1, 8, -0.7, -1.3, {1, 7, 2}});
+  bottom_of_topk = top_k->Add({0, 1, 8, -0.7, -1.3, ids->FromIds({1, 7, 2})});
   EXPECT_THAT(bottom_of_topk, FloatEq(std::numeric_limits<float>::lowest()));
-  bottom_of_topk = top_k->Add({0, 6, 2, -0.1, -1.7, {1, 3, 4, 9, 5}});
+  bottom_of_topk = top_k->Add(
+      {0, 6, 2, -0.1, -1.7, ids->FromIds({1, 3, 4, 9, 5})});
   // No resize yet, since we haven't gotten to k * 2 = 4 elements yet.
   EXPECT_THAT(bottom_of_topk, FloatEq(std::numeric_limits<float>::lowest()));
-  bottom_of_topk = top_k->Add({0, 4, 3, -0.5, -2.5, {1, 2, 4, 3}});
+  bottom_of_topk = top_k->Add(
+      {0, 4, 3, -0.5, -2.5, ids->FromIds({1, 2, 4, 3})});
   // After fourth element we resize down to two best elements.
   EXPECT_THAT(bottom_of_topk, FloatNear(-1.7, 0.001));
 
@@ -78,25 +81,23 @@ void PopulateWithEpsilons(T* top_k) {
   // Add a dupe.  Doing the dedupe requires comparing last prev id of this hyp
   // with cur id of candidate hyp since cur id for this hyp is epsilon.
   const int epsilon_id = 0;
-  bottom_of_topk = top_k->Add({0, 5, epsilon_id, -0.7, -1.5, {1, 7, 2, 8}});
+  bottom_of_topk = top_k->Add(
+      {0, 5, epsilon_id, -0.7, -1.5, ids->FromIds({1, 7, 2, 8})});
 }
 
 bool IsDupe(const Hyp& hyp1, const Hyp& hyp2) {
   if (hyp1.word_id != hyp2.word_id) {
     return false;
   }
-  if (hyp1.prev_ids.size() != hyp2.prev_ids.size()) {
-    return false;
-  }
-  return std::equal(hyp1.prev_ids.begin(), hyp1.prev_ids.end(),
-                    hyp2.prev_ids.begin());
+  return IdPrefixToVector(hyp1.prev_ids) == IdPrefixToVector(hyp2.prev_ids);
 }
 
 // Tests that when we use the default Insert, there is NO deduping.
 TEST(TopKTest, TestInsertDefault) {
   const int k = 2;
+  IdPrefixArena ids;
   TopK<Hyp, HigherScore, ExtractGlobalScore> top_k(k, /* epsilon id */ -1);
-  Populate<TopK<Hyp, HigherScore, ExtractGlobalScore>>(&top_k);
+  Populate<TopK<Hyp, HigherScore, ExtractGlobalScore>>(&top_k, &ids);
   // Check contents: The two items in the TopK are duplicates.
   const auto& new_hyps = top_k.Get();
   EXPECT_THAT(new_hyps, SizeIs(2));
@@ -109,11 +110,12 @@ TEST(TopKTest, TestInsertDefault) {
 // to be less than zero, there is NO deduping.
 TEST(TopKTest, TestInsertNoDedupe) {
   const int k = 2;
+  IdPrefixArena ids;
   TopK<Hyp, HigherScore, ExtractGlobalScore, InsertHypWithEpsilonDedupe> top_k(
       k, /* epsilon_id */ -1);
   Populate<
       TopK<Hyp, HigherScore, ExtractGlobalScore, InsertHypWithEpsilonDedupe>>(
-      &top_k);
+      &top_k, &ids);
   // Check contents: The two items in the TopK are duplicates.
   const auto& new_hyps = top_k.Get();
   EXPECT_THAT(new_hyps, SizeIs(2));
@@ -126,12 +128,13 @@ TEST(TopKTest, TestInsertNoDedupe) {
 // to be greater than or equal to zero, there IS deduping.
 TEST(TopKTest, TestInsertWithDedupe) {
   const int k = 2;
+  IdPrefixArena ids;
   const int epsilon_id = 0;
   TopK<Hyp, HigherScore, ExtractGlobalScore, InsertHypWithEpsilonDedupe> top_k(
       k, epsilon_id);
   Populate<
       TopK<Hyp, HigherScore, ExtractGlobalScore, InsertHypWithEpsilonDedupe>>(
-      &top_k);
+      &top_k, &ids);
   // Check contents: The two items in the TopK are not duplicates.  The dupe
   // has been merged into one of them.
   const auto& new_hyps = top_k.Get();
@@ -148,12 +151,13 @@ TEST(TopKTest, TestInsertWithDedupe) {
 // Tests that the deduping ignores epsilons.
 TEST(TopKTest, TestInsertWithDedupeEpsilon) {
   const int k = 2;
+  IdPrefixArena ids;
   const int epsilon_id = 0;
   TopK<Hyp, HigherScore, ExtractGlobalScore, InsertHypWithEpsilonDedupe> top_k(
       k, epsilon_id);
   PopulateWithEpsilons<
       TopK<Hyp, HigherScore, ExtractGlobalScore, InsertHypWithEpsilonDedupe>>(
-      &top_k);
+      &top_k, &ids);
   // Check contents: The two items in the TopK are not duplicates.  The dupe
   // has been merged into one of them.
   const auto& new_hyps = top_k.Get();
@@ -167,6 +171,33 @@ TEST(TopKTest, TestInsertWithDedupeEpsilon) {
   EXPECT_TRUE(!IsDupe(new_hyps[0], new_hyps[1]));
 }
 
+TEST(IdPrefixTest, SharesPrefixes) {
+  IdPrefixArena ids;
+  const IdPrefix* a = ids.FromIds({1, 2});
+  const IdPrefix* b = ids.Append(a, 3);
+  const IdPrefix* c = ids.Append(a, 4);
+  EXPECT_THAT(b->parent, Eq(a));
+  EXPECT_THAT(c->parent, Eq(a));
+  EXPECT_THAT(IdPrefixLength(nullptr), Eq(0));
+  EXPECT_THAT(IdPrefixLength(b), Eq(3));
+  EXPECT_THAT(IdPrefixToVector(b), ElementsAre(1, 2, 3));
+  EXPECT_THAT(IdPrefixToVector(nullptr), SizeIs(0));
+}
+
+TEST(IdPrefixTest, Equal) {
+  IdPrefixArena ids;
+  const IdPrefix* a = ids.FromIds({1, 2, 3});
+  // Built separately, so that no node is shared with 'a'.
+  const IdPrefix* b = ids.FromIds({1, 2, 3});
+  EXPECT_TRUE(IdPrefixEqual(a, a));
+  EXPECT_TRUE(IdPrefixEqual(a, b));
+  EXPECT_TRUE(IdPrefixEqual(nullptr, nullptr));
+  EXPECT_FALSE(IdPrefixEqual(a, nullptr));
+  EXPECT_FALSE(IdPrefixEqual(a, a->parent));
+  EXPECT_FALSE(IdPrefixEqual(a, ids.FromIds({1, 2, 4})));
+  EXPECT_FALSE(IdPrefixEqual(a, ids.FromIds({0, 2, 3})));
+}
+
 }  // namespace
 }  // namespace lingvo
 }  // namespace tensorflow
@@ -20,6 +20,7 @@ limitations under the License.
 #include "tensorflow/core/framework/op_kernel.h"
 #include "tensorflow/core/framework/tensor.h"
 #include "tensorflow/core/framework/tensor_shape.h"
+#include "tensorflow/core/framework/tensor_util.h"
 #include "tensorflow/core/framework/types.h"
 #include "tensorflow/core/lib/core/threadpool.h"
 #include "tensorflow/core/platform/env.h"
@@ -96,40 +97,11 @@ class GenericInputProcessor : public RecordProcessor {
 
   Status Process(const Rope& record, int64* bucket_key,
                  TensorVec* sample) override {
-    // We expect that this input processor is used in conjunction with
-    // RecordBatcher, which uses multiple threads to call this input
-    // processor's Process(). Therefore, there is not much need for
-    // processing each individual record using multiple threads
-    // (tf_compute).
-    FunctionLibraryRuntime::Options opts;
-    // Create a step container that uses resource manager to cleanup state
-    // after the step is complete.
-    ScopedStepContainer step_container(
-        step_id_counter_.fetch_add(1),
-        [this](const string& name) {
-          auto status = flib_->device()->resource_manager()->Cleanup(name);
-          if (!status.ok()) {
-            LOG(ERROR) << "Error cleaning up resources:" << status;
-          }
-        },
-        "GenericInputProcessor");
-    opts.step_container = &step_container;
-    opts.runner = ThreadLocalRunner::PerThread().runner();
-
     // The input is a single scalar string tensor.
-    TensorVec args(1);
-    args[0] = Tensor(DT_STRING, {});
-    record.AppendTo(&args[0].scalar<string>()());
+    Tensor input(DT_STRING, {});
+    record.AppendTo(&input.scalar<string>()());
     *bucket_key = 1;
-    sample->clear();
-    Status status;
-    Notification done;
-    flib_->Run(opts, handle_, args, sample, [&](const Status& s) {
-      status = s;
-      done.Notify();
-    });
-    done.WaitForNotification();
-    TF_RETURN_IF_ERROR(status);
+    TF_RETURN_IF_ERROR(RunProcessor(input, sample));
     if (sample->size() < 2) {
       LOG(FATAL)
           << "Generic input processor must return at least 2 tensors. but got "
@@ -146,6 +118,64 @@ class GenericInputProcessor : public RecordProcessor {
     return Status::OK();
   }
 
+  Status ProcessBatch(const std::vector<Rope>& records,
+                      std::vector<int64>* bucket_keys,
+                      std::vector<TensorVec>* samples) override {
+    // The input is a string vector of all records. The processor returns
+    // tensors whose 1st dimension is the batch dimension, the last one
+    // being an int32 vector of per-record bucket keys.
+    const int64 n = records.size();
+    Tensor input(DT_STRING, {n});
+    for (int64 i = 0; i < n; ++i) {
+      records[i].AppendTo(&input.vec<string>()(i));
+    }
+    TensorVec outs;
+    TF_RETURN_IF_ERROR(RunProcessor(input, &outs));
+    if (outs.size() < 2) {
+      return errors::InvalidArgument(
+          "Generic input processor must return at least 2 tensors. but got ",
+          outs.size());
+    }
+    const auto& bucket_key_tensor = outs[outs.size() - 1];
+    if (bucket_key_tensor.dtype() != DT_INT32 ||
+        !TensorShapeUtils::IsVector(bucket_key_tensor.shape()) ||
+        bucket_key_tensor.dim_size(0) != n) {
+      return errors::InvalidArgument(
+          "Bucket key tensor is not an int32 vector of size ", n, ": ",
+          DataTypeString(bucket_key_tensor.dtype()), " ",
+          bucket_key_tensor.shape().DebugString());
+    }
+    bucket_keys->clear();
+    for (int64 i = 0; i < n; ++i) {
+      bucket_keys->push_back(bucket_key_tensor.vec<int32>()(i));
+    }
+
+    // Splits every output along the batch dimension into per-record
+    // samples, which RecordBatcher buckets and merges as usual. Any padding
+    // the processor added across the records it processed together is kept.
+    for (int j = 0; j < outs.size() - 1; ++j) {
+      const Tensor& out = outs[j];
+      if (out.dims() < 1 || out.dim_size(0) != n) {
+        return errors::InvalidArgument("Output ", j,
+                                       " does not have batch size ", n, ": ",
+                                       out.shape().DebugString());
+      }
+    }
+    samples->clear();
+    samples->resize(n);
+    for (int j = 0; j < outs.size() - 1; ++j) {
+      const Tensor& out = outs[j];
+      TensorShape shape(out.shape());
+      shape.RemoveDim(0);
+      for (int64 i = 0; i < n; ++i) {
+        Tensor sample;
+        CHECK(sample.CopyFrom(tensor::DeepCopy(out.Slice(i, i + 1)), shape));
+        (*samples)[i].push_back(std::move(sample));
+      }
+    }
+    return Status::OK();
+  }
+
   Status Merge(int64 bucket_id, const std::vector<TensorVec>& samples,
                TensorVec* batch) override {
     CHECK(!samples.empty());
@@ -269,6 +299,41 @@ class GenericInputProcessor : public RecordProcessor {
   }
 
  private:
+  // Runs the processor function on 'input' and returns its outputs in
+  // 'outs'.
+  Status RunProcessor(const Tensor& input, TensorVec* outs) {
+    // We expect that this input processor is used in conjunction with
+    // RecordBatcher, which uses multiple threads to call this input
+    // processor's Process(). Therefore, there is not much need for
+    // processing each individual record using multiple threads
+    // (tf_compute).
+    FunctionLibraryRuntime::Options opts;
+    // Create a step container that uses resource manager to cleanup state
+    // after the step is complete.
+    ScopedStepContainer step_container(
+        step_id_counter_.fetch_add(1),
+        [this](const string& name) {
+          auto status = flib_->device()->resource_manager()->Cleanup(name);
+          if (!status.ok()) {
+            LOG(ERROR) << "Error cleaning up resources:" << status;
+          }
+        },
+        "GenericInputProcessor");
+    opts.step_container = &step_container;
+    opts.runner = ThreadLocalRunner::PerThread().runner();
+
+    TensorVec args = {input};
+    outs->clear();
+    Status status;
+    Notification done;
+    flib_->Run(opts, handle_, args, outs, [&](const Status& s) {
+      status = s;
+      done.Notify();
+    });
+    done.WaitForNotification();
+    return status;
+  }
+
   std::unique_ptr<FunctionLibraryDefinition> fld_;
   std::unique_ptr<ProcessFunctionLibraryRuntime> pflr_;
   FunctionLibraryRuntime* flib_ = nullptr;  // Not owned.
@@ -21,6 +21,7 @@ from __future__ import print_function
 import collections
 import os
 import pickle
+import time
 
 import numpy as np
 from six.moves import range
@@ -117,6 +118,131 @@ class GenericInputOpTest(tf.test.TestCase):
           self.assertTrue(np.all(vals[j, n:] == 0))
         self.assertAllEqual(vals, np.transpose(transposed_vals, [0, 2, 1, 3]))
 
+  def testMaxTokens(self):
+    # Generate a test file w/ 50 records of different lengths.
+    tmp = os.path.join(tf.test.get_temp_dir(), 'max_tokens')
+    with tf.python_io.TFRecordWriter(tmp) as w:
+      for n in range(1, 50):
+        w.write(pickle.dumps(np.full([n], n, np.int32)))
+
+    g = tf.Graph()
+    with g.as_default():
+
+      def _process(record):
+        num = tf.py_func(pickle.loads, [record], tf.int32)
+        return num, tf.shape(num)[0]
+
+      # Batches hold at most 8 examples and at most 64 padded tokens.
+      vals_t, = self.get_test_input(
+          tmp,
+          bucket_upper_bound=[50],
+          bucket_max_tokens=64,
+          processor=_process,
+          dynamic_padding_dimensions=[0],
+          dynamic_padding_constants=[0])
+
+    with self.session(graph=g) as sess:
+      batch_sizes = set()
+      for _ in range(50):
+        vals = sess.run(vals_t)
+        batch_size, max_len = vals.shape
+        self.assertEqual(max_len, np.amax(vals))
+        self.assertLessEqual(batch_size, 8)
+        # A single example may exceed the budget on its own.
+        if batch_size > 1:
+          self.assertLessEqual(batch_size * max_len, 64)
+        batch_sizes.add(batch_size)
+      # Short examples are batched together, long ones are not.
+      self.assertIn(1, batch_sizes)
+      self.assertGreater(max(batch_sizes), 1)
+
+  def testProcessBatch(self):
+    # Generate a test file w/ 100 records.
+    tmp = os.path.join(tf.test.get_temp_dir(), 'process_batch')
+    with tf.python_io.TFRecordWriter(tmp) as w:
+      for i in range(100):
+        w.write('%08d' % i)
+
+    g = tf.Graph()
+    with g.as_default():
+
+      # A record processor which processes a vector of records at once.
+      def _process(records):
+        nums = tf.string_to_number(records)
+        bucket_keys = tf.to_int32(nums) % 2 + 1
+        return records, tf.stack([nums, tf.square(nums)], 1), bucket_keys
+
+      strs, vals = self.get_test_input(
+          tmp,
+          bucket_upper_bound=[1, 2],
+          bucket_batch_limit=[8, 8],
+          processor=_process,
+          process_batch_size=5)
+
+    with self.session(graph=g) as sess:
+      record_seen = set()
+      for i in range(100):
+        ans_strs, ans_vals = sess.run([strs, vals])
+        for s in ans_strs:
+          record_seen.add(s)
+        self.assertEqual(ans_strs.shape, (8,))
+        self.assertEqual(ans_vals.shape, (8, 2))
+        self.assertAllEqual(np.square(ans_vals[:, 0]), ans_vals[:, 1])
+        # Samples are still bucketed one by one.
+        self.assertEqual(len(set(ans_vals[:, 0].astype(np.int32) % 2)), 1)
+      for i in range(100):
+        self.assertTrue('%08d' % i in record_seen)
+
+  def testInputStats(self):
+    # Generate a test file w/ 100 records of lengths 1 to 10.
+    tmp = os.path.join(tf.test.get_temp_dir(), 'input_stats')
+    with tf.python_io.TFRecordWriter(tmp) as w:
+      for i in range(100):
+        w.write('x' * (1 + i % 10))
+
+    g = tf.Graph()
+    with g.as_default():
+
+      def _process(record):
+        return record, tf.size(tf.string_split([record], delimiter='').values)
+
+      # Records longer than 8 are skipped.
+      strs, = self.get_test_input(
+          tmp,
+          bucket_upper_bound=[4, 8],
+          bucket_batch_limit=[8, 8],
+          processor=_process,
+          stats_key='input_stats_test')
+      # Not reported by the op above.
+      other_stats = py_x_ops.input_stats(stats_key=strs.op.name)
+      stats = py_x_ops.input_stats(stats_key='input_stats_test')
+
+    with self.session(graph=g) as sess:
+      for _ in range(20):
+        sess.run(strs)
+      (epoch, records_yielded, records_skipped, bucket_batches,
+       shard_records_per_sec, buffer_fill, yielder_wait_seconds,
+       batcher_wait_seconds) = sess.run(stats)
+      self.assertGreaterEqual(epoch, 1)
+      self.assertGreaterEqual(records_yielded, 20 * 8)
+      self.assertGreater(records_skipped, 0)
+      self.assertEqual(bucket_batches.shape, (2,))
+      self.assertGreaterEqual(np.sum(bucket_batches), 20)
+      self.assertEqual(shard_records_per_sec.shape[0] % 4, 0)
+      self.assertGreater(np.sum(shard_records_per_sec), 0)
+      self.assertTrue(0 <= buffer_fill <= 1)
+      self.assertGreaterEqual(yielder_wait_seconds, 0)
+      self.assertGreaterEqual(batcher_wait_seconds, 0)
+      self.assertEqual(sess.run(other_stats[1]), 0)
+
+  def testInputStatsUnknownOp(self):
+    with self.session() as sess:
+      epoch, _, _, bucket_batches, shard_records_per_sec = sess.run(
+          py_x_ops.input_stats(stats_key='no_such_op')[:5])
+      self.assertEqual(epoch, 0)
+      self.assertEqual(bucket_batches.shape, (0,))
+      self.assertEqual(shard_records_per_sec.shape, (0,))
+
 
 class GenericInputOpWithinBatchMixingTest(GenericInputOpTest):
   # Runs all GenericInputOp tests plus some more.
@@ -181,5 +307,72 @@ class GenericInputOpWithinBatchMixingTest(GenericInputOpTest):
       self.assertAlmostEqual(mix_ratios['input3'], 0.5, delta=0.01)
 
 
+class GenericInputOpBenchmark(tf.test.Benchmark):
+  """Benchmarks for batched record processing.
+
+  Run with --benchmarks=GenericInputOpBenchmark.
+  """
+
+  def _RecordsPerSecond(self, path, process_batch_size, num_batches=200):
+    batch_size = 128
+    g = tf.Graph()
+    with g.as_default():
+      features = {'ids': tf.VarLenFeature(tf.int64)}
+
+      def _process(record):
+        ids = tf.parse_single_example(record, features)['ids'].values
+        return ids, tf.size(ids)
+
+      def _process_batch(records):
+        ids = tf.sparse_tensor_to_dense(
+            tf.parse_example(records, features)['ids'])
+        return ids, tf.reduce_sum(tf.to_int32(tf.not_equal(ids, 0)), 1)
+
+      ids_t, = py_x_ops.generic_input(
+          file_pattern='tfrecord:' + path,
+          file_random_seed=0,
+          file_buffer_size=1000,
+          file_parallelism=4,
+          bucket_upper_bound=[64],
+          bucket_batch_limit=[batch_size],
+          processor=_process_batch if process_batch_size > 1 else _process,
+          dynamic_padding_dimensions=[0],
+          dynamic_padding_constants=[0],
+          process_batch_size=process_batch_size)
+
+    with tf.Session(graph=g) as sess:
+      # Warms up the input pipeline.
+      sess.run(ids_t)
+      start = time.time()
+      for _ in range(num_batches):
+        sess.run(ids_t)
+      wall_time = time.time() - start
+    return wall_time, num_batches * batch_size / wall_time
+
+  def benchmarkProcessBatch(self):
+    # Generate a test file w/ 10000 short tf.Examples.
+    np.random.seed(12345)
+    tmp = os.path.join(tf.test.get_temp_dir(), 'process_batch_benchmark')
+    with tf.python_io.TFRecordWriter(tmp) as w:
+      for _ in range(10000):
+        ids = np.random.randint(1, 32000, size=np.random.randint(5, 64))
+        w.write(
+            tf.train.Example(
+                features=tf.train.Features(
+                    feature={
+                        'ids':
+                            tf.train.Feature(
+                                int64_list=tf.train.Int64List(value=ids))
+                    })).SerializeToString())
+    for process_batch_size in [1, 64]:
+      wall_time, records_per_sec = self._RecordsPerSecond(
+          tmp, process_batch_size)
+      self.report_benchmark(
+          iters=1,
+          wall_time=wall_time,
+          name='GenericInput_process_batch_size_%d' % process_batch_size,
+          extras={'records_per_sec': records_per_sec})
+
+
 if __name__ == '__main__':
   tf.test.main()
@@ -14,6 +14,10 @@ limitations under the License.
 ==============================================================================*/
 
 #include "lingvo/core/ops/input_common.h"
+
+#include <unordered_map>
+
+#include "lingvo/core/ops/mutex.h"
 #include "lingvo/core/ops/weighted_mix_record_yielder.h"
 
 namespace tensorflow {
@@ -22,7 +26,8 @@ namespace lingvo {
 RecordYielder* ConstructYielder(const string& file_pattern,
                                 const std::vector<float>& input_source_weights,
                                 int64 file_random_seed, int64 file_buffer_size,
-                                int64 file_parallelism) {
+                                int64 file_parallelism, int64 num_file_shards,
+                                int64 file_shard_index) {
   std::vector<string> file_patterns;
   if (input_source_weights.empty()) {
     LOG(INFO) << "Input source weights are empty, fall back to legacy "
@@ -51,6 +56,8 @@ RecordYielder* ConstructYielder(const string& file_pattern,
     }
     yopts.bufsize = file_buffer_size;
     yopts.parallelism = file_parallelism;
+    yopts.num_file_shards = num_file_shards;
+    yopts.file_shard_index = file_shard_index;
     yielders.push_back(BasicRecordYielder::New(yopts));
   }
 
@@ -64,5 +71,46 @@ RecordYielder* ConstructYielder(const string& file_pattern,
   return yielder;
 }
 
+namespace {
+
+// Batchers of the input ops alive in this process, keyed by their stats_key.
+struct BatcherRegistry {
+  Mutex mu;
+  std::unordered_map<string, RecordBatcher*> batchers GUARDED_BY(mu);
+};
+
+BatcherRegistry* GetBatcherRegistry() {
+  static BatcherRegistry* registry = new BatcherRegistry;
+  return registry;
+}
+
+}  // namespace
+
+void RegisterRecordBatcher(const string& key, RecordBatcher* batcher) {
+  BatcherRegistry* registry = GetBatcherRegistry();
+  MutexLock l(&registry->mu);
+  registry->batchers[key] = batcher;
+}
+
+void UnregisterRecordBatcher(const string& key, RecordBatcher* batcher) {
+  BatcherRegistry* registry = GetBatcherRegistry();
+  MutexLock l(&registry->mu);
+  auto iter = registry->batchers.find(key);
+  if (iter != registry->batchers.end() && iter->second == batcher) {
+    registry->batchers.erase(iter);
+  }
+}
+
+bool GetRecordBatcherStats(const string& key, RecordBatcher::Stats* stats) {
+  BatcherRegistry* registry = GetBatcherRegistry();
+  // Holds the lock while reading the batcher so that it cannot be deleted
+  // concurrently.
+  MutexLock l(&registry->mu);
+  auto iter = registry->batchers.find(key);
+  if (iter == registry->batchers.end()) return false;
+  iter->second->GetStats(stats);
+  return true;
+}
+
 }  // namespace lingvo
 }  // namespace tensorflow
@@ -30,7 +30,21 @@ namespace lingvo {
 RecordYielder* ConstructYielder(const string& file_pattern,
                                 const std::vector<float>& input_source_weights,
                                 int64 file_random_seed, int64 file_buffer_size,
-                                int64 file_parallelism);
+                                int64 file_parallelism, int64 num_file_shards,
+                                int64 file_shard_index);
+
+// Registers 'batcher' under 'key', the stats_key of the input op owning it, so
+// that InputStats ops can look up its counters. A later registration under the
+// same key, e.g., by a kernel of the same op in another session, replaces the
+// earlier one.
+void RegisterRecordBatcher(const string& key, RecordBatcher* batcher);
+
+// Undoes RegisterRecordBatcher(key, batcher) unless it has been replaced.
+void UnregisterRecordBatcher(const string& key, RecordBatcher* batcher);
+
+// Fills in 'stats' of the batcher registered under 'key'. Returns false if
+// there is no such batcher.
+bool GetRecordBatcherStats(const string& key, RecordBatcher::Stats* stats);
 
 // Base class for op kernels that emit training examples.
 template <class RecordProcessorClass>
@@ -51,11 +65,16 @@ class InputOp : public OpKernel {
     GETATTR(int64, file_random_seed);
     GETATTR(int64, file_buffer_size);
     GETATTR(int64, file_parallelism);
+    GETATTR(int64, num_file_shards);
+    GETATTR(int64, file_shard_index);
     GETATTR(Int64Vec, bucket_upper_bound);
     GETATTR(Int64Vec, bucket_batch_limit);
+    GETATTR(int64, bucket_max_tokens);
     GETATTR(int64, flush_every_n);
     GETATTR(int64, num_threads);
+    GETATTR(int64, process_batch_size);
 #undef GETATTR
+    OP_REQUIRES_OK(ctx, ctx->GetAttr("stats_key", &stats_key_));
     OP_REQUIRES(
         ctx,
         std::is_sorted(bucket_upper_bound.begin(), bucket_upper_bound.end()),
@@ -64,17 +83,28 @@ class InputOp : public OpKernel {
     processor_ = new RecordProcessorClass(ctx);
     RecordYielder* yielder = CHECK_NOTNULL(
         ConstructYielder(file_pattern, input_source_weights, file_random_seed,
-                         file_buffer_size, file_parallelism));
+                         file_buffer_size, file_parallelism, num_file_shards,
+                         file_shard_index));
     LOG(INFO) << "Create batcher";
     RecordBatcher::Options bopts;
     bopts.bucket_upper_bound = bucket_upper_bound;
     bopts.bucket_batch_limit = bucket_batch_limit;
+    bopts.bucket_max_tokens = bucket_max_tokens;
     bopts.flush_every_n = flush_every_n;
     bopts.num_threads = num_threads;
+    bopts.process_batch_size = process_batch_size;
     batcher_ = new RecordBatcher(bopts, yielder, processor_);
+    if (!stats_key_.empty()) {
+      RegisterRecordBatcher(stats_key_, batcher_);
+    }
   }
 
-  ~InputOp() override { delete batcher_; }
+  ~InputOp() override {
+    if (!stats_key_.empty()) {
+      UnregisterRecordBatcher(stats_key_, batcher_);
+    }
+    delete batcher_;
+  }
 
   void Compute(OpKernelContext* ctx) override {
     int64 bucket_id;
@@ -95,6 +125,7 @@ class InputOp : public OpKernel {
  private:
   // Owned.
   RecordBatcher* batcher_ = nullptr;
+  string stats_key_;
 };
 
 }  // namespace lingvo
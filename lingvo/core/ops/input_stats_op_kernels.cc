@@ -0,0 +1,97 @@
+/* Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+==============================================================================*/
+
+#include <algorithm>
+#include <vector>
+
+#include "tensorflow/core/framework/op_kernel.h"
+#include "tensorflow/core/framework/tensor.h"
+#include "tensorflow/core/framework/tensor_shape.h"
+#include "tensorflow/core/platform/env.h"
+#include "lingvo/core/ops/input_common.h"
+#include "lingvo/core/ops/mutex.h"
+
+namespace tensorflow {
+namespace lingvo {
+namespace {
+
+class InputStatsOp : public OpKernel {
+ public:
+  explicit InputStatsOp(OpKernelConstruction* ctx) : OpKernel(ctx) {
+    OP_REQUIRES_OK(ctx, ctx->GetAttr("stats_key", &stats_key_));
+    last_micros_ = Env::Default()->NowMicros();
+  }
+
+  void Compute(OpKernelContext* ctx) override {
+    RecordBatcher::Stats stats;
+    if (!GetRecordBatcherStats(stats_key_, &stats)) {
+      VLOG(1) << "No input op with stats_key " << stats_key_ << " yet.";
+    }
+    const RecordYielderStats& ystats = stats.yielder;
+
+    Tensor* out;
+#define SCALAR_OUTPUT(INDEX, TYPE, VALUE)                               \
+  OP_REQUIRES_OK(ctx, ctx->allocate_output(INDEX, TensorShape({}), &out)); \
+  out->scalar<TYPE>()() = VALUE;
+
+    SCALAR_OUTPUT(0, int64, ystats.epoch);
+    SCALAR_OUTPUT(1, int64, stats.records_yielded);
+    SCALAR_OUTPUT(2, int64, stats.records_skipped);
+    SCALAR_OUTPUT(5, float,
+                  ystats.buf_capacity > 0
+                      ? static_cast<float>(ystats.buf_size) /
+                            ystats.buf_capacity
+                      : 0.0f);
+    SCALAR_OUTPUT(6, float, ystats.wait_seconds);
+    SCALAR_OUTPUT(7, float, stats.wait_seconds);
+#undef SCALAR_OUTPUT
+
+    const int64 num_buckets = stats.bucket_batches.size();
+    OP_REQUIRES_OK(ctx,
+                   ctx->allocate_output(3, TensorShape({num_buckets}), &out));
+    for (int64 i = 0; i < num_buckets; ++i) {
+      out->vec<int64>()(i) = stats.bucket_batches[i];
+    }
+
+    const int64 num_shards = ystats.shard_records.size();
+    OP_REQUIRES_OK(ctx,
+                   ctx->allocate_output(4, TensorShape({num_shards}), &out));
+    MutexLock l(&mu_);
+    const uint64 now_micros = Env::Default()->NowMicros();
+    const double secs = std::max<double>(1e-6 * (now_micros - last_micros_),
+                                         1e-6);
+    last_shard_records_.resize(num_shards, 0);
+    for (int64 i = 0; i < num_shards; ++i) {
+      out->vec<float>()(i) =
+          (ystats.shard_records[i] - last_shard_records_[i]) / secs;
+    }
+    last_shard_records_ = ystats.shard_records;
+    last_micros_ = now_micros;
+  }
+
+ private:
+  string stats_key_;
+
+  Mutex mu_;
+  // The per-shard record counters and the time of the previous run.
+  std::vector<int64> last_shard_records_ GUARDED_BY(mu_);
+  uint64 last_micros_ GUARDED_BY(mu_);
+};
+
+REGISTER_KERNEL_BUILDER(Name("InputStats").Device(DEVICE_CPU), InputStatsOp);
+
+}  // namespace
+}  // namespace lingvo
+}  // namespace tensorflow
@@ -0,0 +1,143 @@
+/* Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+==============================================================================*/
+
+#include <algorithm>
+#include <numeric>
+#include <vector>
+
+#include "tensorflow/core/framework/op_kernel.h"
+#include "tensorflow/core/framework/tensor.h"
+#include "tensorflow/core/framework/tensor_shape.h"
+
+namespace tensorflow {
+namespace lingvo {
+namespace {
+
+class PackSequencesOp : public OpKernel {
+ public:
+  explicit PackSequencesOp(OpKernelConstruction* ctx) : OpKernel(ctx) {
+    OP_REQUIRES_OK(ctx, ctx->GetAttr("packed_batch_size", &batch_));
+    OP_REQUIRES_OK(ctx, ctx->GetAttr("packed_src_seq_len", &src_len_));
+    OP_REQUIRES_OK(ctx, ctx->GetAttr("packed_tgt_seq_len", &tgt_len_));
+    OP_REQUIRES(ctx, batch_ > 0 && src_len_ > 0 && tgt_len_ > 0,
+                errors::InvalidArgument(
+                    "The packed batch size and sequence lengths must be "
+                    "positive."));
+  }
+
+  void Compute(OpKernelContext* ctx) override {
+    const Tensor& src_actual_seq_len = ctx->input(0);
+    const Tensor& tgt_actual_seq_len = ctx->input(1);
+    OP_REQUIRES(
+        ctx, TensorShapeUtils::IsVector(src_actual_seq_len.shape()),
+        errors::InvalidArgument("src_actual_seq_len must be a vector: ",
+                                src_actual_seq_len.shape().DebugString()));
+    OP_REQUIRES(ctx,
+                src_actual_seq_len.shape() == tgt_actual_seq_len.shape(),
+                errors::InvalidArgument(
+                    "src_actual_seq_len and tgt_actual_seq_len must have the "
+                    "same shape: ",
+                    src_actual_seq_len.shape().DebugString(), " vs. ",
+                    tgt_actual_seq_len.shape().DebugString()));
+    const auto src_lens = src_actual_seq_len.vec<int32>();
+    const auto tgt_lens = tgt_actual_seq_len.vec<int32>();
+    const int32 n = src_lens.size();
+    for (int32 i = 0; i < n; ++i) {
+      OP_REQUIRES(ctx, src_lens(i) >= 0 && tgt_lens(i) >= 0,
+                  errors::InvalidArgument("Negative sequence length at ", i));
+    }
+
+    // Longest first, ties in input order.
+    std::vector<int32> order(n);
+    std::iota(order.begin(), order.end(), 0);
+    std::stable_sort(order.begin(), order.end(), [&](int32 a, int32 b) {
+      return src_lens(a) + tgt_lens(a) > src_lens(b) + tgt_lens(b);
+    });
+
+    // First fit. rows[r] is the list of pairs packed into the r-th row.
+    std::vector<std::vector<int32>> rows(batch_);
+    std::vector<int32> src_used(batch_, 0);
+    std::vector<int32> tgt_used(batch_, 0);
+    int32 num_dropped = 0;
+    for (const int32 i : order) {
+      int32 r = 0;
+      while (r < batch_ && (src_used[r] + src_lens(i) > src_len_ ||
+                            tgt_used[r] + tgt_lens(i) > tgt_len_)) {
+        ++r;
+      }
+      if (r == batch_) {
+        ++num_dropped;
+        continue;
+      }
+      rows[r].push_back(i);
+      src_used[r] += src_lens(i);
+      tgt_used[r] += tgt_lens(i);
+    }
+    VLOG(1) << "Packed " << n - num_dropped << " sequences into " << batch_
+            << " rows, dropped " << num_dropped;
+
+    Fill(ctx, 0, src_len_, src_lens, rows);
+    Fill(ctx, 3, tgt_len_, tgt_lens, rows);
+  }
+
+ private:
+  int64 batch_;
+  int64 src_len_;
+  int64 tgt_len_;
+
+  // Fills outputs [first_output, first_output + 3) for one side.
+  void Fill(OpKernelContext* ctx, int first_output, int64 seq_len,
+            TTypes<int32>::ConstVec lens,
+            const std::vector<std::vector<int32>>& rows) {
+    Tensor* segment_ids;
+    Tensor* segment_pos;
+    Tensor* indices_in_input;
+    const TensorShape shape({batch_, seq_len});
+    OP_REQUIRES_OK(ctx,
+                   ctx->allocate_output(first_output, shape, &segment_ids));
+    OP_REQUIRES_OK(ctx,
+                   ctx->allocate_output(first_output + 1, shape, &segment_pos));
+    OP_REQUIRES_OK(ctx, ctx->allocate_output(first_output + 2, shape,
+                                             &indices_in_input));
+    auto ids = segment_ids->matrix<int32>();
+    auto pos = segment_pos->matrix<int32>();
+    auto indices = indices_in_input->matrix<int32>();
+    for (int64 r = 0; r < batch_; ++r) {
+      int64 t = 0;
+      int32 segment = 0;
+      for (int32 s = 0; s < rows[r].size(); ++s) {
+        segment = s;
+        const int32 i = rows[r][s];
+        for (int32 j = 0; j < lens(i); ++j, ++t) {
+          ids(r, t) = segment;
+          pos(r, t) = j;
+          indices(r, t) = i;
+        }
+      }
+      for (; t < seq_len; ++t) {
+        ids(r, t) = segment;
+        pos(r, t) = 0;
+        indices(r, t) = -1;
+      }
+    }
+  }
+};
+
+REGISTER_KERNEL_BUILDER(Name("PackSequences").Device(DEVICE_CPU),
+                        PackSequencesOp);
+
+}  // namespace
+}  // namespace lingvo
+}  // namespace tensorflow
@@ -0,0 +1,67 @@
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for pack_ops."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import numpy as np
+import tensorflow as tf
+from lingvo.core.ops import py_x_ops
+
+
+class PackOpsTest(tf.test.TestCase):
+
+  def testPackSequences(self):
+    with self.session() as sess:
+      outs = py_x_ops.pack_sequences(
+          src_actual_seq_len=[3, 2, 4, 1, 5],
+          tgt_actual_seq_len=[2, 2, 3, 1, 2],
+          packed_batch_size=2,
+          packed_src_seq_len=6,
+          packed_tgt_seq_len=5)
+      (src_segment_ids, src_segment_pos, src_indices, tgt_segment_ids,
+       tgt_segment_pos, tgt_indices) = sess.run(outs)
+    # Longest first: 2 (4+3), 4 (5+2), 0 (3+2), 1 (2+2), 3 (1+1).
+    # Row 0: 2, 1. Row 1: 4, 3. Pair 0 fits in neither row and is dropped.
+    self.assertAllEqual(src_indices,
+                        [[2, 2, 2, 2, 1, 1], [4, 4, 4, 4, 4, 3]])
+    self.assertAllEqual(src_segment_ids,
+                        [[0, 0, 0, 0, 1, 1], [0, 0, 0, 0, 0, 1]])
+    self.assertAllEqual(src_segment_pos,
+                        [[0, 1, 2, 3, 0, 1], [0, 1, 2, 3, 4, 0]])
+    self.assertAllEqual(tgt_indices, [[2, 2, 2, 1, 1], [4, 4, 3, -1, -1]])
+    self.assertAllEqual(tgt_segment_ids, [[0, 0, 0, 1, 1], [0, 0, 1, 1, 1]])
+    self.assertAllEqual(tgt_segment_pos, [[0, 1, 2, 0, 1], [0, 1, 0, 0, 0]])
+
+  def testPackSequencesEmptyRows(self):
+    with self.session() as sess:
+      outs = py_x_ops.pack_sequences(
+          src_actual_seq_len=[2],
+          tgt_actual_seq_len=[3],
+          packed_batch_size=3,
+          packed_src_seq_len=4,
+          packed_tgt_seq_len=4)
+      src_segment_ids, _, src_indices, _, _, tgt_indices = sess.run(outs)
+    self.assertAllEqual(src_segment_ids, np.zeros([3, 4]))
+    self.assertAllEqual(src_indices,
+                        [[0, 0, -1, -1], [-1, -1, -1, -1], [-1, -1, -1, -1]])
+    self.assertAllEqual(tgt_indices,
+                        [[0, 0, 0, -1], [-1, -1, -1, -1], [-1, -1, -1, -1]])
+
+
+if __name__ == '__main__':
+  tf.test.main()
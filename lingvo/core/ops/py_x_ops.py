@@ -41,11 +41,14 @@ for v in gen_x_ops.__dict__.values():
 assert_shape_match = gen_x_ops.assert_shape_match
 assert_same_dim0 = gen_x_ops.assert_same_dim0
 random_permutation_sequence = gen_x_ops.random_permutation_sequence
+pack_sequences = gen_x_ops.pack_sequences
+input_stats = gen_x_ops.input_stats
 
 best_step = gen_x_ops.best_step
 
 beam_search_step = gen_x_ops.beam_search_step
 top_k_terminated_hyps = gen_x_ops.top_k_terminated_hyps
+top_k_terminated_hyps_dense = gen_x_ops.top_k_terminated_hyps_dense
 unpack_hyp = gen_x_ops.unpack_hyp
 hyps_from_beam_search_outs = gen_x_ops.hyps_from_beam_search_outs
 
@@ -21,14 +21,16 @@ limitations under the License.
 // * Processor threads
 //
 //   * call the yielder to get a record (a string) and process it into
-//     a TensorVec.
+//     a TensorVec. If process_batch_size > 1, they get that many
+//     records and process them with a single ProcessBatch() call,
+//     which amortizes the per-call overhead of the processor.
 //
 //   * Processed TensorVec are put into buckets according to the
 //     bucket key returned by processor->Process().
 //
-//   * When one bucket is full (according to bucket_batch_limit), all
-//     TensorVec accumulated in that bucket is handed off to
-//     to_flush_.
+//   * When one bucket is full (according to bucket_batch_limit, or
+//     bucket_max_tokens if set), all TensorVec accumulated in that
+//     bucket is handed off to to_flush_.
 //
 //   * If to_flush_ is non-empty, the processor thread blocks.
 //
@@ -69,6 +71,27 @@ limitations under the License.
 namespace tensorflow {
 namespace lingvo {
 
+Status RecordProcessor::ProcessBatch(const std::vector<Rope>& records,
+                                     std::vector<int64>* bucket_keys,
+                                     std::vector<TensorVec>* samples) {
+  bucket_keys->clear();
+  samples->clear();
+  for (const Rope& record : records) {
+    int64 bucket_key;
+    TensorVec sample;
+    Status s = Process(record, &bucket_key, &sample);
+    if (!s.ok()) {
+      if (!errors::IsCancelled(s)) {
+        LOG(WARNING) << s;
+      }
+      continue;
+    }
+    bucket_keys->push_back(bucket_key);
+    samples->push_back(std::move(sample));
+  }
+  return Status::OK();
+}
+
 RecordBatcher::RecordBatcher(const Options& opts, RecordYielder* yielder,
                              RecordProcessor* processor)
     : opts_(opts),
@@ -85,10 +108,12 @@ RecordBatcher::RecordBatcher(const Options& opts, RecordYielder* yielder,
       to_flush_empty_(this, &ME::ToFlushEmpty),
       to_flush_non_empty_(this, &ME::ToFlushNonEmpty) {
   CHECK_EQ(opts_.bucket_upper_bound.size(), opts_.bucket_batch_limit.size());
-  buckets_.resize(opts_.bucket_upper_bound.size());
   start_time_ = std::time(nullptr);
   {
     MutexLock l(&mu_);
+    buckets_.resize(opts_.bucket_upper_bound.size());
+    bucket_max_keys_.resize(opts_.bucket_upper_bound.size(), 0);
+    bucket_batches_.resize(opts_.bucket_upper_bound.size(), 0);
     last_log_update_time_ = start_time_;
   }
   for (int i = 0; i < opts_.num_threads; i++) {
@@ -118,6 +143,24 @@ void RecordBatcher::GetNext(int64* bucket, TensorVec* batch) {
   curr_.clear();
 }
 
+void RecordBatcher::GetStats(Stats* stats) {
+  *stats = Stats();
+  yielder_->GetStats(&stats->yielder);
+  MutexLock l(&mu_);
+  stats->records_yielded = total_records_yielded_;
+  stats->records_skipped = total_records_skipped_;
+  stats->bucket_batches = bucket_batches_;
+  stats->wait_seconds = wait_seconds_;
+}
+
+bool RecordBatcher::BucketFull(int id, int64 bucket_key) const {
+  const int64 n = buckets_[id].size();
+  if (n == opts_.bucket_batch_limit[id]) return true;
+  if (opts_.bucket_max_tokens <= 0 || n == 0) return false;
+  const int64 max_key = std::max(bucket_max_keys_[id], bucket_key);
+  return (n + 1) * max_key > opts_.bucket_max_tokens;
+}
+
 void RecordBatcher::ProcessorLoop() {
   // Multiply next_status_update_duration_seconds_ by 2 every update.
   const int64 status_update_duration_multiplier = 2;
@@ -128,79 +171,128 @@ void RecordBatcher::ProcessorLoop() {
       if (stop_) return;
     }
 
-    // Get the next record.
-    Rope record;
-    Status s = yielder_->Yield(&record);
-    if (!s.ok()) {
-      LOG(WARNING) << s;
-      continue;
-    }
-
-    // Parse the record.
-    int64 bucket;
-    TensorVec sample;
-    s = processor_->Process(record, &bucket, &sample);
-    if (!s.ok()) {
-      // Print error message except for CANCELLED error. NmtExampleProcessor
-      // uses CANCELLED for data that are filtered out.
-      if (!errors::IsCancelled(s)) {
+    // Get the next records.
+    const int64 batch_size = std::max<int64>(1, opts_.process_batch_size);
+    std::vector<Rope> records;
+    records.reserve(batch_size);
+    while (static_cast<int64>(records.size()) < batch_size) {
+      Rope record;
+      Status s = yielder_->Yield(&record);
+      if (!s.ok()) {
         LOG(WARNING) << s;
+        break;
       }
-      continue;
+      records.push_back(std::move(record));
     }
+    if (records.empty()) continue;
 
-    // Figure out which bucket it belongs to.
-    auto iter = std::lower_bound(opts_.bucket_upper_bound.begin(),
-                                 opts_.bucket_upper_bound.end(), bucket);
+    // Parse the records.
+    std::vector<int64> buckets;
+    std::vector<TensorVec> samples;
+    if (batch_size == 1) {
+      int64 bucket;
+      TensorVec sample;
+      Status s = processor_->Process(records[0], &bucket, &sample);
+      if (!s.ok()) {
+        // Print error message except for CANCELLED error. NmtExampleProcessor
+        // uses CANCELLED for data that are filtered out.
+        if (!errors::IsCancelled(s)) {
+          LOG(WARNING) << s;
+        }
+        continue;
+      }
+      buckets.push_back(bucket);
+      samples.push_back(std::move(sample));
+    } else {
+      Status s = processor_->ProcessBatch(records, &buckets, &samples);
+      if (!s.ok()) {
+        // Retries the records one by one so that only the ones which fail to
+        // process are left out.
+        VLOG(1) << "Failed to process a batch of " << records.size()
+                << " records: " << s;
+        buckets.clear();
+        samples.clear();
+        for (const Rope& record : records) {
+          std::vector<int64> record_buckets;
+          std::vector<TensorVec> record_samples;
+          s = processor_->ProcessBatch({record}, &record_buckets,
+                                       &record_samples);
+          if (!s.ok()) {
+            if (!errors::IsCancelled(s)) {
+              LOG(WARNING) << s;
+            }
+            continue;
+          }
+          for (int j = 0; j < record_samples.size(); ++j) {
+            buckets.push_back(record_buckets[j]);
+            samples.push_back(std::move(record_samples[j]));
+          }
+        }
+      }
+      CHECK_EQ(buckets.size(), samples.size());
+    }
 
     MutexLock l(&mu_);
 
-    if (iter == opts_.bucket_upper_bound.end()) {
-      VLOG(1) << "Skip. bucket out-of-range " << bucket;
-      if (out_of_range_buckets.size() < 10) {
-        out_of_range_buckets.push_back(bucket);
-      }
-      ++total_records_skipped_;
-    } else {
-      if (opts_.flush_every_n > 0 && records_yielded_ >= opts_.flush_every_n) {
-        WaitForToFlushEmpty();
-        if (stop_) return;
+    for (int j = 0; j < samples.size(); ++j) {
+      const int64 bucket = buckets[j];
+      TensorVec& sample = samples[j];
+
+      // Figure out which bucket it belongs to.
+      auto iter = std::lower_bound(opts_.bucket_upper_bound.begin(),
+                                   opts_.bucket_upper_bound.end(), bucket);
+
+      if (iter == opts_.bucket_upper_bound.end()) {
+        VLOG(1) << "Skip. bucket out-of-range " << bucket;
+        if (out_of_range_buckets.size() < 10) {
+          out_of_range_buckets.push_back(bucket);
+        }
+        ++total_records_skipped_;
+      } else {
         if (opts_.flush_every_n > 0 &&
             records_yielded_ >= opts_.flush_every_n) {
-          CHECK(to_flush_.empty());
+          WaitForToFlushEmpty();
+          if (stop_) return;
+          if (opts_.flush_every_n > 0 &&
+              records_yielded_ >= opts_.flush_every_n) {
+            CHECK(to_flush_.empty());
 
-          // Need to flush all buckets.
-          records_yielded_ = 0;
-          for (int i = 0; i < buckets_.size(); ++i) {
-            if (!buckets_[i].empty()) {
-              CHECK_LE(static_cast<int64>(buckets_[i].size()),
-                       opts_.bucket_batch_limit[i]);
-              to_flush_.push_back({i, std::move(buckets_[i])});
-              buckets_[i].clear();
+            // Need to flush all buckets.
+            records_yielded_ = 0;
+            for (int i = 0; i < buckets_.size(); ++i) {
+              if (!buckets_[i].empty()) {
+                CHECK_LE(static_cast<int64>(buckets_[i].size()),
+                         opts_.bucket_batch_limit[i]);
+                to_flush_.push_back({i, std::move(buckets_[i])});
+                buckets_[i].clear();
+                bucket_max_keys_[i] = 0;
+              }
             }
           }
         }
-      }
 
-      // Figure out which buckets we should return to the consumer.
-      // A bucket (id-th) is full.
-      const int id = iter - opts_.bucket_upper_bound.begin();
-      const int64 batch_limit = opts_.bucket_batch_limit[id];
-      CHECK_LE(buckets_[id].size(), batch_limit);  // invariant.
-      while (buckets_[id].size() == batch_limit) {
-        if (!to_flush_.empty()) {
-          WaitForToFlushEmpty();
-          if (stop_) return;
-          continue;
+        // Figure out which buckets we should return to the consumer.
+        // A bucket (id-th) is full.
+        const int id = iter - opts_.bucket_upper_bound.begin();
+        const int64 batch_limit = opts_.bucket_batch_limit[id];
+        CHECK_LE(buckets_[id].size(), batch_limit);  // invariant.
+        while (BucketFull(id, bucket)) {
+          if (!to_flush_.empty()) {
+            WaitForToFlushEmpty();
+            if (stop_) return;
+            continue;
+          }
+          to_flush_.push_back({id, std::move(buckets_[id])});
+          buckets_[id].clear();
+          bucket_max_keys_[id] = 0;
         }
-        to_flush_.push_back({id, std::move(buckets_[id])});
-        buckets_[id].clear();
-      }
-      buckets_[id].push_back(std::move(sample));
-      CHECK_LE(buckets_[id].size(), batch_limit);  // invariant.
+        buckets_[id].push_back(std::move(sample));
+        bucket_max_keys_[id] = std::max(bucket_max_keys_[id], bucket);
+        CHECK_LE(buckets_[id].size(), batch_limit);  // invariant.
 
-      ++records_yielded_;
-      ++total_records_yielded_;
+        ++records_yielded_;
+        ++total_records_yielded_;
+      }
     }
 
     std::time_t current_time = std::time(nullptr);
@@ -248,6 +340,7 @@ void RecordBatcher::MergerLoop() {
         if (stop_) return;
         curr_bucket_ = id;
         curr_ = std::move(merged);
+        ++bucket_batches_[id];
       }
     }
     to_flush.clear();
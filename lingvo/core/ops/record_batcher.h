@@ -51,6 +51,16 @@ class RecordProcessor {
   virtual Status Process(const Rope& record, int64* bucket_key,
                          TensorVec* sample) = 0;
 
+  // Processes 'records' at once and fills in one bucket key and one
+  // training example per record into 'bucket_keys' and 'samples'.
+  // Records which fail to process are left out. The default
+  // implementation calls Process() on every record. If it returns an error,
+  // RecordBatcher calls it again on every record alone, so that only the
+  // records which fail are left out, e.g. with CANCELLED for filtered ones.
+  virtual Status ProcessBatch(const std::vector<Rope>& records,
+                              std::vector<int64>* bucket_keys,
+                              std::vector<TensorVec>* samples);
+
   // Gives a list of training 'samples', all of which returned by Process() and
   // bucketized into 'bucket_id'-th bucket, merges them into a single 'batch'.
   virtual Status Merge(int64 bucket_id, const std::vector<TensorVec>& samples,
@@ -70,15 +80,27 @@ class RecordBatcher {
   // is put into i-th bucket and as soon as i-th bucket contains
   // more than bucket_batch_limit[i] samples, RecordBatcher yields
   // one training batch.
+  //
+  // If 'bucket_max_tokens' is positive, a bucket also yields its batch
+  // as soon as adding the next sample would make the batch exceed
+  // 'bucket_max_tokens' padded tokens, i.e., the number of samples
+  // times the largest bucket_key among them.
   struct Options {
     // REQUIRES: bucket_upper_bound.size() == bucket_batch_limit.size()
     std::vector<int64> bucket_upper_bound;
     std::vector<int64> bucket_batch_limit;
 
+    // If positive, the maximum number of padded tokens per batch.
+    int64 bucket_max_tokens = 0;
+
     // If non-zero, flushes all batches buffered so far every these
     // many records are yielded.
     int64 flush_every_n = 0;
 
+    // If larger than 1, records are handed to the processor's
+    // ProcessBatch() this many at a time.
+    int64 process_batch_size = 1;
+
     // Number of threads to use for record batcher, each thread
     // fills separate batches based on bucket limits.
     int64 num_threads = 1;
@@ -92,6 +114,26 @@ class RecordBatcher {
   // from 'bucket_id'-th bucket.
   void GetNext(int64* bucket_id, TensorVec* batch);
 
+  // Counters describing the progress of a RecordBatcher.
+  struct Stats {
+    // Counters of the underlying yielder.
+    RecordYielderStats yielder;
+
+    // Number of records put into buckets and number of records skipped
+    // because their bucket_key exceeds the last bucket_upper_bound.
+    int64 records_yielded = 0;
+    int64 records_skipped = 0;
+
+    // Number of batches produced by each bucket.
+    std::vector<int64> bucket_batches;
+
+    // Total seconds GetNext() spent blocked waiting for a batch.
+    double wait_seconds = 0;
+  };
+
+  // Fills in 'stats' with the current counters.
+  void GetStats(Stats* stats);
+
  private:
   typedef RecordBatcher ME;
   typedef std::vector<TensorVec> Batch;
@@ -115,6 +157,12 @@ class RecordBatcher {
   int64 total_records_yielded_ GUARDED_BY(mu_) = 0;
   int64 total_records_skipped_ GUARDED_BY(mu_) = 0;
   std::vector<Batch> buckets_ GUARDED_BY(mu_);
+  // The largest bucket_key of the samples in each of buckets_.
+  std::vector<int64> bucket_max_keys_ GUARDED_BY(mu_);
+  // The number of batches produced by each of buckets_.
+  std::vector<int64> bucket_batches_ GUARDED_BY(mu_);
+  // Total seconds spent in WaitForCurrNonEmpty().
+  double wait_seconds_ GUARDED_BY(mu_) = 0;
   FlushList to_flush_ GUARDED_BY(mu_);
   Condition to_flush_empty_;
   Condition to_flush_non_empty_;
@@ -140,10 +188,15 @@ class RecordBatcher {
     return stop_ || !to_flush_.empty();
   }
 
+  // Returns true if 'id'-th bucket must be flushed before a sample
+  // with 'bucket_key' is added to it.
+  bool BucketFull(int id, int64 bucket_key) const SHARED_LOCKS_REQUIRED(mu_);
+
   void ProcessorLoop();
   void MergerLoop();
 
-  // For performance debugging.
+  // For performance debugging. WaitForCurrNonEmpty() also accumulates the
+  // time it blocks into wait_seconds_.
   void WaitForCurrEmpty() EXCLUSIVE_LOCKS_REQUIRED(mu_);
   void WaitForCurrNonEmpty() EXCLUSIVE_LOCKS_REQUIRED(mu_);
   void WaitForToFlushEmpty() EXCLUSIVE_LOCKS_REQUIRED(mu_);
@@ -144,6 +144,41 @@ TEST(RecordBatcher, BasicMultiThread) {
   }
 }
 
+TEST(RecordBatcher, MaxTokens) {
+  const string filename = io::JoinPath("/tmp", "max_tokens");
+  GenerateTestData(filename, 1000, true /* random_value */);
+
+  BasicRecordYielder::Options yopts;
+  yopts.file_pattern = strings::StrCat("tfrecord:", filename);
+  yopts.seed = 301;
+  yopts.bufsize = 10;
+  yopts.parallelism = 1;
+
+  RecordBatcher::Options bopts;
+  bopts.bucket_upper_bound = {20, 50, 100};
+  bopts.bucket_batch_limit = {64, 64, 64};
+  bopts.bucket_max_tokens = 200;
+
+  RecordBatcher batcher(bopts, BasicRecordYielder::New(yopts), new TestRP());
+  int64 bucket_id;
+  TensorVec batch;
+  int64 max_batch_size = 0;
+  for (int i = 0; i < 1000; ++i) {
+    batcher.GetNext(&bucket_id, &batch);
+    const Tensor& t = batch[0];
+    ASSERT_LE(t.dim_size(0), bopts.bucket_batch_limit[bucket_id]);
+    int64 maxlen = 0;
+    for (int j = 0; j < t.dim_size(0); ++j) {
+      maxlen = std::max<int64>(maxlen, t.vec<string>()(j).size());
+    }
+    // The number of padded tokens is within the budget.
+    EXPECT_LE(t.dim_size(0) * maxlen, bopts.bucket_max_tokens);
+    max_batch_size = std::max(max_batch_size, t.dim_size(0));
+  }
+  // Batch sizes adapt to the lengths: short samples go in large batches.
+  EXPECT_GT(max_batch_size, 10);
+}
+
 TEST(RecordBatcher, FullEpoch) {
   const int N = 1000;
   const string filename =
@@ -180,5 +215,147 @@ TEST(RecordBatcher, FullEpoch) {
   }
 }
 
+TEST(RecordBatcher, ProcessBatch) {
+  const int N = 1000;
+  const string filename = io::JoinPath("/tmp", "process_batch");
+  GenerateTestData(filename, N, false /* random_value */);
+
+  BasicRecordYielder::Options yopts;
+  yopts.file_pattern = strings::StrCat("tfrecord:", filename);
+  yopts.seed = 301;
+  yopts.bufsize = 10;
+  yopts.parallelism = 1;
+
+  RecordBatcher::Options bopts;
+  bopts.bucket_upper_bound = {20, 50, 90, 120};
+  bopts.bucket_batch_limit = {8, 4, 2, 1};
+  bopts.flush_every_n = N;  // Same number of records in the data file.
+  bopts.process_batch_size = 7;
+
+  RecordBatcher batcher(bopts, BasicRecordYielder::New(yopts), new TestRP());
+  int64 bucket_id;
+  TensorVec batch;
+  std::vector<string> records;
+  while (records.size() < N) {
+    batcher.GetNext(&bucket_id, &batch);
+    const Tensor& t = batch[0];
+    ASSERT_LE(t.dim_size(0), bopts.bucket_batch_limit[bucket_id]);
+    for (int j = 0; j < t.dim_size(0); ++j) {
+      records.push_back(t.vec<string>()(j));
+    }
+  }
+  ASSERT_EQ(N, records.size());
+  // Samples of a processed batch are still bucketed one by one, so we
+  // expect to see exactly non-duplicated N records.
+  std::sort(records.begin(), records.end());
+  for (int i = 0; i < N; ++i) {
+    EXPECT_EQ(strings::Printf("%010d", i), records[i]);
+  }
+}
+
+// Filters out every 10th record, but fails batches containing one.
+class FilterRP : public TestRP {
+ public:
+  Status ProcessBatch(const std::vector<Rope>& records,
+                      std::vector<int64>* bucket_keys,
+                      std::vector<TensorVec>* samples) override {
+    for (const Rope& record : records) {
+      if (string(record).back() == '0') {
+        if (records.size() > 1) {
+          return errors::InvalidArgument("Batch contains a filtered record.");
+        }
+        return errors::Cancelled("Filtered.");
+      }
+    }
+    return RecordProcessor::ProcessBatch(records, bucket_keys, samples);
+  }
+};
+
+TEST(RecordBatcher, ProcessBatchFailure) {
+  const int N = 1000;
+  const string filename = io::JoinPath("/tmp", "process_batch_failure");
+  GenerateTestData(filename, N, false /* random_value */);
+
+  BasicRecordYielder::Options yopts;
+  yopts.file_pattern = strings::StrCat("tfrecord:", filename);
+  yopts.seed = 301;
+  yopts.bufsize = 10;
+  yopts.parallelism = 1;
+
+  const int kept = N - N / 10;
+  RecordBatcher::Options bopts;
+  bopts.bucket_upper_bound = {20, 50, 90, 120};
+  bopts.bucket_batch_limit = {8, 4, 2, 1};
+  bopts.flush_every_n = kept;  // Number of records kept in the data file.
+  bopts.process_batch_size = 7;
+
+  RecordBatcher batcher(bopts, BasicRecordYielder::New(yopts), new FilterRP());
+  int64 bucket_id;
+  TensorVec batch;
+  std::vector<string> records;
+  while (records.size() < kept) {
+    batcher.GetNext(&bucket_id, &batch);
+    const Tensor& t = batch[0];
+    for (int j = 0; j < t.dim_size(0); ++j) {
+      records.push_back(t.vec<string>()(j));
+    }
+  }
+  ASSERT_EQ(kept, records.size());
+  // Only the filtered records are left out of the failed batches.
+  std::sort(records.begin(), records.end());
+  std::vector<string> expected;
+  for (int i = 0; i < N; ++i) {
+    if (i % 10 != 0) expected.push_back(strings::Printf("%010d", i));
+  }
+  EXPECT_EQ(expected, records);
+}
+
+TEST(RecordBatcher, Stats) {
+  const string filename = io::JoinPath("/tmp", "stats");
+  GenerateTestData(filename, 1000, true /* random_value */);
+
+  BasicRecordYielder::Options yopts;
+  yopts.file_pattern = strings::StrCat("tfrecord:", filename);
+  yopts.seed = 301;
+  yopts.bufsize = 10;
+  yopts.parallelism = 1;
+
+  RecordBatcher::Options bopts;
+  bopts.bucket_upper_bound = {20, 50, 90, 95};
+  bopts.bucket_batch_limit = {8, 4, 2, 1};
+
+  RecordBatcher batcher(bopts, BasicRecordYielder::New(yopts), new TestRP());
+  int64 bucket_id;
+  TensorVec batch;
+  std::vector<int64> bucket_batches(bopts.bucket_upper_bound.size(), 0);
+  int64 num_records = 0;
+  for (int i = 0; i < 1000; ++i) {
+    batcher.GetNext(&bucket_id, &batch);
+    ++bucket_batches[bucket_id];
+    num_records += batch[0].dim_size(0);
+  }
+
+  RecordBatcher::Stats stats;
+  batcher.GetStats(&stats);
+  EXPECT_LE(1, stats.yielder.epoch);
+  ASSERT_EQ(1, stats.yielder.shard_records.size());
+  // Records of length 96 to 100 are out of range.
+  EXPECT_LT(0, stats.records_skipped);
+  EXPECT_LE(num_records, stats.records_yielded);
+  EXPECT_LE(stats.records_yielded + stats.records_skipped,
+            stats.yielder.shard_records[0]);
+  EXPECT_LE(stats.yielder.buf_size, 10);
+  EXPECT_EQ(10, stats.yielder.buf_capacity);
+  EXPECT_LE(0, stats.wait_seconds);
+  // The merger may have produced one more batch than we have consumed.
+  ASSERT_EQ(bucket_batches.size(), stats.bucket_batches.size());
+  int64 total_batches = 0;
+  for (int i = 0; i < bucket_batches.size(); ++i) {
+    EXPECT_LE(bucket_batches[i], stats.bucket_batches[i]);
+    total_batches += stats.bucket_batches[i];
+  }
+  EXPECT_LE(total_batches, 1001);
+}
+
 }  // namespace lingvo
 }  // namespace tensorflow
@@ -25,8 +25,9 @@ void BasicRecordYielder::WaitForBufEnough() {
   if (!BufEnough()) {
     auto start = Env::Default()->NowMicros();
     mu_.Await(buf_enough_);
-    VLOG(1) << "Wait for buf containing enough records: "
-            << (Env::Default()->NowMicros() - start) * 1e-6
+    const double secs = (Env::Default()->NowMicros() - start) * 1e-6;
+    wait_seconds_ += secs;
+    VLOG(1) << "Wait for buf containing enough records: " << secs
             << " Hint: Check network condition (e.g., are files in the same "
             << "data center) and/or increase file_parallelism.";
   }
@@ -47,8 +48,9 @@ void RecordBatcher::WaitForCurrNonEmpty() {
   if (!CurrNonEmpty()) {
     auto start = Env::Default()->NowMicros();
     mu_.Await(curr_non_empty_);
-    VLOG(1) << "Wait for curr non empty: "
-            << (Env::Default()->NowMicros() - start) * 1e-6
+    const double secs = (Env::Default()->NowMicros() - start) * 1e-6;
+    wait_seconds_ += secs;
+    VLOG(1) << "Wait for curr non empty: " << secs
             << " Hint: Consider improving Merge() method.";
   }
 }
@@ -13,11 +13,15 @@ See the License for the specific language governing permissions and
 limitations under the License.
 ==============================================================================*/
 
+#include <algorithm>
+#include <atomic>
+#include <random>
 #include <string>
 #include <unordered_map>
 
 #include "lingvo/core/ops/record_yielder.h"
 
+#include "tensorflow/core/lib/core/coding.h"
 #include "tensorflow/core/lib/hash/hash.h"
 #include "tensorflow/core/lib/io/buffered_inputstream.h"
 #include "tensorflow/core/lib/io/random_inputstream.h"
@@ -134,6 +138,82 @@ class TFRecordIterator : public RecordIterator {
   }
 };
 
+const char IndexedRecordWriter::kMagic[] = "LVIDXREC";
+
+Status IndexedRecordWriter::WriteRecord(StringPiece record) {
+  TF_RETURN_IF_ERROR(file_->Append(record));
+  offsets_.push_back(offsets_.back() + record.size());
+  return Status::OK();
+}
+
+Status IndexedRecordWriter::Close() {
+  string footer;
+  for (const uint64 offset : offsets_) {
+    core::PutFixed64(&footer, offset);
+  }
+  core::PutFixed64(&footer, offsets_.size() - 1);
+  footer.append(kMagic, 8);
+  offsets_.clear();
+  return file_->Append(footer);
+}
+
+class IndexedRecordIterator : public RecordIterator {
+ public:
+  explicit IndexedRecordIterator(const string& filename) {
+    Status s = Env::Default()->NewReadOnlyMemoryRegionFromFile(filename,
+                                                               &region_);
+    if (s.ok()) {
+      data_ = StringPiece(static_cast<const char*>(region_->data()),
+                          region_->length());
+    } else {
+      // Not all file systems support memory-mapping.
+      VLOG(1) << "Reading " << filename << " in memory: " << s;
+      TF_CHECK_OK(ReadFileToString(Env::Default(), filename, &contents_));
+      data_ = contents_;
+    }
+    const size_t kTrailerSize = 16;
+    CHECK_GE(data_.size(), kTrailerSize) << "Bad indexed record file "
+                                         << filename;
+    const char* trailer = data_.data() + data_.size() - kTrailerSize;
+    CHECK_EQ(StringPiece(trailer + 8, 8),
+             StringPiece(IndexedRecordWriter::kMagic, 8))
+        << "Bad indexed record file " << filename;
+    const uint64 n = core::DecodeFixed64(trailer);
+    CHECK_LE((n + 1) * 8 + kTrailerSize, data_.size())
+        << "Bad indexed record file " << filename;
+    offsets_ = trailer - (n + 1) * 8;
+    order_.resize(n);
+    for (uint64 i = 0; i < n; ++i) order_[i] = i;
+  }
+
+  void Shuffle(uint64 seed) override {
+    CHECK_EQ(next_, 0);
+    std::mt19937_64 rnd(seed);
+    std::shuffle(order_.begin(), order_.end(), rnd);
+  }
+
+  bool Next(string* key, Rope* value) override {
+    if (next_ == order_.size()) return false;
+    const uint64 i = order_[next_++];
+    const uint64 start = core::DecodeFixed64(offsets_ + i * 8);
+    const uint64 limit = core::DecodeFixed64(offsets_ + (i + 1) * 8);
+    CHECK_LE(start, limit);
+    CHECK_LE(limit, static_cast<uint64>(offsets_ - data_.data()));
+    *key = strings::Printf("%08llu", static_cast<unsigned long long>(i));
+    value->assign(data_.data() + start, limit - start);
+    return true;
+  }
+
+ private:
+  std::unique_ptr<ReadOnlyMemoryRegion> region_;
+  string contents_;
+  StringPiece data_;
+  // The N + 1 encoded offsets in the footer.
+  const char* offsets_ = nullptr;
+  std::vector<uint64> order_;
+  uint64 next_ = 0;
+};
+
 namespace {
 
 bool register_text_iterator = RecordIterator::Register(
@@ -144,6 +224,10 @@ bool register_tf_record_iterator = RecordIterator::Register(
     "tfrecord",
     [](const string& filename) { return new TFRecordIterator(filename); });
 
+bool register_indexed_record_iterator = RecordIterator::Register(
+    "indexed",
+    [](const string& filename) { return new IndexedRecordIterator(filename); });
+
 }  // namespace
 
 RecordYielder::~RecordYielder() {}
@@ -165,6 +249,7 @@ BasicRecordYielder::BasicRecordYielder(const Options& opts)
       buf_not_full_(this, &ME::BufNotFull),
       buf_enough_(this, &ME::BufEnough) {
   LOG(INFO) << this << " Record yielder start";
+  shard_records_.resize(opts_.parallelism, 0);
   if (opts_.seed == 0) {
     LOG(INFO) << "Randomly seed RecordYielder.";
     rnd_.seed(std::random_device{}());
@@ -173,6 +258,9 @@ BasicRecordYielder::BasicRecordYielder(const Options& opts)
   if (!file_type_.empty()) {
     opts_.file_pattern.erase(0, file_type_.size() + 1);
   }
+  CHECK_GE(opts_.num_file_shards, 1);
+  CHECK_GE(opts_.file_shard_index, 0);
+  CHECK_LT(opts_.file_shard_index, opts_.num_file_shards);
 }
 
 BasicRecordYielder::~BasicRecordYielder() {}
@@ -204,6 +292,16 @@ Status BasicRecordYielder::Yield(Rope* value) {
   return status_;
 }
 
+void BasicRecordYielder::GetStats(RecordYielderStats* stats) {
+  MutexLock l(&mu_);
+  stats->epoch = std::max<int64>(stats->epoch, epoch_);
+  stats->shard_records.insert(stats->shard_records.end(),
+                              shard_records_.begin(), shard_records_.end());
+  stats->buf_size += buf_.size();
+  stats->buf_capacity += opts_.bufsize;
+  stats->wait_seconds += wait_seconds_;
+}
+
 bool BasicRecordYielder::ShouldFinish(const Status& s) {
   MutexLock l(&mu_);
   status_.Update(s);
@@ -225,6 +323,21 @@ void BasicRecordYielder::MainLoop() {
       LOG(FATAL) << "Found no files at " << opts_.file_pattern;
     }
 
+    if (opts_.num_file_shards > 1) {
+      std::sort(filenames.begin(), filenames.end());
+      std::vector<string> shard_filenames;
+      for (int j = opts_.file_shard_index; j < filenames.size();
+           j += opts_.num_file_shards) {
+        shard_filenames.push_back(filenames[j]);
+      }
+      if (shard_filenames.empty()) {
+        LOG(FATAL) << "Found no files for file shard "
+                   << opts_.file_shard_index << " of "
+                   << opts_.num_file_shards << " at " << opts_.file_pattern;
+      }
+      filenames.swap(shard_filenames);
+    }
+
     int shuffle_seed = opts_.seed;
     if (opts_.seed == 0) {
       MutexLock l(&mu_);
@@ -241,6 +354,7 @@ void BasicRecordYielder::MainLoop() {
     for (int i = 0; i < N; ++i) {
       Shard* shard = &shards[i];
       shard->index = i;
+      shard->seed = Hash64Combine(epoch_, shuffle_seed);
       for (int j = i; j < filenames.size(); j += N) {
         shard->filenames.push_back(filenames[j]);
       }
@@ -266,9 +380,10 @@ void BasicRecordYielder::MainLoop() {
   main_loop_done_.Notify();
 }
 
-bool BasicRecordYielder::Add(std::vector<Rope>* values) {
+bool BasicRecordYielder::Add(int shard_index, std::vector<Rope>* values) {
   MutexLock l(&mu_);
   mu_.Await(buf_not_full_);
+  const int64 num_values = values->size();
   while (BufNotFull() && !values->empty()) {
     // Adds values->back(). Swaps its position with another random
     // element.
@@ -281,6 +396,7 @@ bool BasicRecordYielder::Add(std::vector<Rope>* values) {
     }
     values->pop_back();
   }
+  shard_records_[shard_index] += num_values - values->size();
   return stop_;
 }
 
@@ -375,11 +491,12 @@ void BasicRecordYielder::ShardLoop(Shard* shard) {
     VLOG(1) << "Shard " << shard->index << " " << filename;
     std::unique_ptr<RecordIterator> iter(
         RecordIterator::New(file_type_, filename));
+    iter->Shuffle(Hash64Combine(shard->seed, Hash64(filename)));
     string key;
     Rope val;
     while (iter->Next(&key, &val)) {
       values.emplace_back(val);
-      if (values.size() >= kRecords && Add(&values)) {
+      if (values.size() >= kRecords && Add(shard->index, &values)) {
         shard->status = errors::Aborted("stopped");
         break;
       }
@@ -387,7 +504,7 @@ void BasicRecordYielder::ShardLoop(Shard* shard) {
   }
   // Adds the remaining values of this shard to buf_.
   while (!values.empty()) {
-    Add(&values);
+    Add(shard->index, &values);
   }
   shard->done.Notify();
 }
@@ -26,7 +26,9 @@ limitations under the License.
 
 #include "tensorflow/core/lib/core/errors.h"
 #include "tensorflow/core/lib/core/status.h"
+#include "tensorflow/core/lib/core/stringpiece.h"
 #include "tensorflow/core/lib/core/threadpool.h"
+#include "tensorflow/core/platform/file_system.h"
 #include "tensorflow/core/platform/macros.h"
 #include "tensorflow/core/platform/thread_annotations.h"
 #include "lingvo/core/ops/mutex.h"
@@ -44,6 +46,11 @@ class RecordIterator {
   // fills in 'key' and 'value'.
   virtual bool Next(string* key, Rope* value) = 0;
 
+  // Iterators which can visit their records in any order, e.g. of the
+  // "indexed" type, yield them in a random order determined by 'seed'. Others
+  // ignore it. Must be called before the first Next().
+  virtual void Shuffle(uint64 seed) {}
+
   // Register a method to create a RecordIterator for the 'type_name'.
   typedef std::function<RecordIterator*(const string&)> FactoryMethod;
   static bool Register(const string& type_name, FactoryMethod method);
@@ -52,6 +59,51 @@ class RecordIterator {
   static RecordIterator* New(const string& type_name, const string& filename);
 };
 
+// Writes a file of the "indexed" record type.
+//
+// An indexed record file is the concatenation of the records followed by a
+// footer: the N + 1 record offsets, N, and a magic string, where N is the
+// number of records and the integers are little-endian 64-bit. The iterator
+// of this type memory-maps the file when the file system supports it, and
+// yields the records of each file in a random order instead of sequentially,
+// determined by the yielder's seed, the epoch and the file name. Thus records
+// are shuffled at the file level without a large buffer.
+class IndexedRecordWriter {
+ public:
+  // Does not take ownership of 'file'.
+  explicit IndexedRecordWriter(WritableFile* file) : file_(file) {}
+
+  // Appends one record.
+  Status WriteRecord(StringPiece record);
+
+  // Writes the footer. No records can be written afterwards.
+  Status Close();
+
+  static const char kMagic[];
+
+ private:
+  WritableFile* file_;
+  std::vector<uint64> offsets_ = {0};
+
+  TF_DISALLOW_COPY_AND_ASSIGN(IndexedRecordWriter);
+};
+
+// Counters describing the progress of a RecordYielder.
+struct RecordYielderStats {
+  // The current epoch number.
+  int64 epoch = 0;
+
+  // Number of records read so far by each file shard.
+  std::vector<int64> shard_records;
+
+  // Number of records in the randomization buffer and its capacity.
+  int64 buf_size = 0;
+  int64 buf_capacity = 0;
+
+  // Total seconds consumers spent blocked in Yield() waiting for records.
+  double wait_seconds = 0;
+};
+
 // RecordYielder defines an interface that should be used for producing value
 // records from files in a random order. Most users should use
 // BasicRecordYielder and BasicRecordYielder::New (see example below).
@@ -83,6 +135,11 @@ class RecordYielder {
 
   // Stop this yielder and then delete it.
   virtual void Close() = 0;
+
+  // Accumulates this yielder's counters into 'stats': the epoch is the
+  // maximum, shard counters are appended and the others are summed up. The
+  // default implementation adds nothing.
+  virtual void GetStats(RecordYielderStats* stats) {}
 };
 
 // BasicRecordYielder is a RecordYielder that implements a main loop and makes
@@ -113,6 +170,13 @@ class BasicRecordYielder : public RecordYielder {
 
     // Uses this many concurrent iterators to iterate through files.
     int32 parallelism = 1;
+
+    // If num_file_shards > 1, only reads the files whose positions in the
+    // sorted list of matched files are file_shard_index modulo
+    // num_file_shards. Yielders with the same file_pattern and different
+    // file_shard_index thus read disjoint sets of files.
+    int32 num_file_shards = 1;
+    int32 file_shard_index = 0;
   };
 
   // Returns a record yielder according to 'opts'. A caller is responsible for
@@ -126,6 +190,8 @@ class BasicRecordYielder : public RecordYielder {
   // Stop this yielder and then delete it.
   void Close() override;
 
+  void GetStats(RecordYielderStats* stats) override;
+
   // Returns the current epoch number.
   int64 current_epoch() const { return epoch_; }
 
@@ -141,6 +207,7 @@ class BasicRecordYielder : public RecordYielder {
     std::vector<string> filenames;  // File names given to this shard.
     Notification done;              // Notified when this shard is done.
     Status status;                  // Shard status.
+    uint64 seed = 0;                // Seeds the record order of each file.
   };
   void ShardLoop(Shard* shard);
   Status MatchFiles(const string& patterns, std::vector<string>* filenames);
@@ -148,8 +215,9 @@ class BasicRecordYielder : public RecordYielder {
   // Returns true iff 's' indicates the yielder should stop.
   bool ShouldFinish(const Status& s);
 
-  // Adds 'values' into the random shuffling buffer buf_.
-  bool Add(std::vector<Rope>* values);
+  // Adds 'values' read by the 'shard_index'-th shard into the random
+  // shuffling buffer buf_.
+  bool Add(int shard_index, std::vector<Rope>* values);
 
  private:
   typedef BasicRecordYielder ME;
@@ -180,6 +248,12 @@ class BasicRecordYielder : public RecordYielder {
 
   int64 num_records_yielded_in_epoch_ = 0;
 
+  // Number of records added to buf_ by each shard.
+  std::vector<int64> shard_records_ GUARDED_BY(mu_);
+
+  // Total seconds spent in WaitForBufEnough().
+  double wait_seconds_ GUARDED_BY(mu_) = 0;
+
   // Trigger when the main loop has exited.
   Notification main_loop_done_;
 
@@ -220,7 +294,8 @@ class BasicRecordYielder : public RecordYielder {
   void Start();
   void MainLoop();
 
-  // For performance debugging.
+  // For performance debugging. Also accumulates the time it blocks into
+  // wait_seconds_.
   void WaitForBufEnough() EXCLUSIVE_LOCKS_REQUIRED(mu_);
 
   TF_DISALLOW_COPY_AND_ASSIGN(BasicRecordYielder);
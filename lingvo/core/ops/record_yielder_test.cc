@@ -19,6 +19,7 @@ limitations under the License.
 #include "tensorflow/core/lib/core/stringpiece.h"
 #include "tensorflow/core/lib/io/path.h"
 #include "tensorflow/core/lib/io/record_writer.h"
+#include "tensorflow/core/lib/strings/numbers.h"
 #include "tensorflow/core/lib/strings/stringprintf.h"
 #include "tensorflow/core/platform/env.h"
 #include "lingvo/core/ops/input_common.h"
@@ -78,6 +79,41 @@ TEST(RecordYielderTest, PlainTextYielderBasicTest) {
   yielder->Close();
 }
 
+TEST(RecordYielderTest, FileShardsTest) {
+  const int N = 10;
+  const int M = 100;
+  const int kNumFileShards = 3;
+  GeneratePlainTextTestData("file_shards", N, M);
+  std::vector<string> vals;
+  for (int shard = 0; shard < kNumFileShards; ++shard) {
+    BasicRecordYielder::Options opts;
+    opts.file_pattern =
+        strings::StrCat("text:", io::JoinPath("/tmp", "file_shards.*"));
+    opts.seed = 301;
+    opts.bufsize = 200;
+    opts.parallelism = 2;
+    opts.num_file_shards = kNumFileShards;
+    opts.file_shard_index = shard;
+
+    BasicRecordYielder* yielder = BasicRecordYielder::New(opts);
+    // Files 0, 3, 6, 9 go to the first shard, and 3 files to the others.
+    const int num_files = (N + kNumFileShards - 1 - shard) / kNumFileShards;
+    Rope v;
+    for (int i = 0; i < num_files * M; ++i) {
+      TF_CHECK_OK(yielder->Yield(&v));
+      vals.emplace_back(string(v));
+    }
+    yielder->Close();
+  }
+
+  // The shards together yield every record exactly once.
+  std::sort(vals.begin(), vals.end());
+  ASSERT_EQ(N * M, vals.size());
+  for (int i = 0; i < N * M; ++i) {
+    EXPECT_EQ(strings::Printf("%010d", i), vals[i]);
+  }
+}
+
 void GenerateTfRecordTestData(const string& prefix, int n, int m) {
   for (int i = 0; i < n; ++i) {
     std::unique_ptr<WritableFile> file;
@@ -145,6 +181,98 @@ TEST(RecordYielderTest, TfRecordYielderBasicTest) {
   yielder->Close();
 }
 
+void GenerateIndexedRecordTestData(const string& prefix, int n, int m) {
+  for (int i = 0; i < n; ++i) {
+    std::unique_ptr<WritableFile> file;
+    TF_CHECK_OK(Env::Default()->NewWritableFile(
+        io::JoinPath("/tmp", strings::StrCat(prefix, ".", i)), &file));
+    IndexedRecordWriter writer(file.get());
+    for (int j = 0; j < m; ++j) {
+      // Records of different lengths.
+      TF_CHECK_OK(writer.WriteRecord(
+          strings::StrCat(string(j % 3, 'x'), m * i + j)));
+    }
+    TF_CHECK_OK(writer.Close());
+    TF_CHECK_OK(file->Close());
+  }
+}
+
+TEST(RecordYielderTest, IndexedRecordIterator) {
+  const int M = 100;
+  GenerateIndexedRecordTestData("indexed_iter", 1, M);
+  const string filename = io::JoinPath("/tmp", "indexed_iter.0");
+  std::unique_ptr<RecordIterator> iter(
+      RecordIterator::New("indexed", filename));
+  iter->Shuffle(301);
+  std::vector<string> vals;
+  string key;
+  Rope v;
+  while (iter->Next(&key, &v)) {
+    int64 i;
+    ASSERT_TRUE(strings::safe_strto64(key, &i));
+    EXPECT_EQ(strings::StrCat(string(i % 3, 'x'), i), v);
+    vals.emplace_back(string(v));
+  }
+  ASSERT_EQ(M, vals.size());
+
+  // Records are not yielded in the order they were written.
+  std::vector<string> sorted_vals;
+  for (int i = 0; i < M; ++i) {
+    sorted_vals.push_back(strings::StrCat(string(i % 3, 'x'), i));
+  }
+  EXPECT_NE(sorted_vals, vals);
+  std::sort(vals.begin(), vals.end());
+  std::sort(sorted_vals.begin(), sorted_vals.end());
+  EXPECT_EQ(sorted_vals, vals);
+}
+
+std::vector<string> ReadIndexedRecords(const string& filename, uint64 seed) {
+  std::unique_ptr<RecordIterator> iter(
+      RecordIterator::New("indexed", filename));
+  iter->Shuffle(seed);
+  std::vector<string> vals;
+  string key;
+  Rope v;
+  while (iter->Next(&key, &v)) vals.emplace_back(string(v));
+  return vals;
+}
+
+TEST(RecordYielderTest, IndexedRecordIteratorSeed) {
+  GenerateIndexedRecordTestData("indexed_seed", 1, 100);
+  const string filename = io::JoinPath("/tmp", "indexed_seed.0");
+  // The order depends only on the seed.
+  EXPECT_EQ(ReadIndexedRecords(filename, 301),
+            ReadIndexedRecords(filename, 301));
+  EXPECT_NE(ReadIndexedRecords(filename, 301),
+            ReadIndexedRecords(filename, 103));
+}
+
+TEST(RecordYielderTest, IndexedRecordYielderBasicTest) {
+  const int N = 10;
+  const int M = 1000;
+  GenerateIndexedRecordTestData("indexed", N, M);
+  BasicRecordYielder::Options opts;
+  opts.file_pattern =
+      strings::StrCat("indexed:", io::JoinPath("/tmp", "indexed.*"));
+  opts.seed = 301;
+  opts.bufsize = 10;
+  opts.parallelism = 2;
+
+  BasicRecordYielder* yielder = BasicRecordYielder::New(opts);
+  for (int epoch = 0; epoch < 3; ++epoch) {
+    std::vector<string> vals;
+    Rope v;
+    for (int i = 0; i < N * M; ++i) {
+      TF_CHECK_OK(yielder->Yield(&v));
+      vals.emplace_back(string(v));
+    }
+    std::sort(vals.begin(), vals.end());
+    // Each epoch yields every record exactly once.
+    ASSERT_EQ(std::unique(vals.begin(), vals.end()), vals.end());
+  }
+  yielder->Close();
+}
+
 int NumMatches(const std::vector<Rope>& vals1,
                const std::vector<Rope>& vals2) {
   CHECK_EQ(vals1.size(), vals2.size());
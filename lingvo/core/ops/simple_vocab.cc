@@ -123,9 +123,54 @@ Status Vocab::Load(const std::vector<string>& lines, bool load_token_ids) {
   sow_id_ = TokenToId(sow_token());
   eow_id_ = TokenToId(eow_token());
   unk_id_ = TokenToId(unk_token());
+  BuildTrie();
   return Status::OK();
 }
 
+void Vocab::BuildTrie() {
+  trie_token_ids_.assign(1, -1);
+  trie_edges_.clear();
+  for (const auto& kv : token_to_id_) {
+    int32 node = 0;
+    for (const char c : kv.first) {
+      auto inserted = trie_edges_.insert(
+          {TrieEdgeKey(node, c), static_cast<int32>(trie_token_ids_.size())});
+      if (inserted.second) trie_token_ids_.push_back(-1);
+      node = inserted.first->second;
+    }
+    if (node != 0) trie_token_ids_[node] = kv.second;
+  }
+}
+
+void Vocab::GreedyMatchStringToTokenId(StringPiece text, int32* token_id,
+                                       int* token_size) const {
+  *token_id = unk_id_;
+  *token_size = 1;  // For <unk>, the input is of length 1 char, but output is
+                    // <unk> (length of 5).
+  int32 node = 0;
+  for (int i = 0; i < text.size(); ++i) {
+    const auto it = trie_edges_.find(TrieEdgeKey(node, text[i]));
+    if (it == trie_edges_.end()) break;
+    node = it->second;
+    if (trie_token_ids_[node] >= 0) {
+      *token_id = trie_token_ids_[node];
+      *token_size = i + 1;
+    }
+  }
+}
+
+std::vector<int32> Vocab::GreedyMatchStringToTokenIds(StringPiece text) const {
+  std::vector<int32> ids;
+  while (!text.empty()) {
+    int32 token_id;
+    int token_size;
+    GreedyMatchStringToTokenId(text, &token_id, &token_size);
+    ids.push_back(token_id);
+    text.remove_prefix(token_size);
+  }
+  return ids;
+}
+
 const char* Vocab::sos_token() const {
   return use_upper_token_symbols_ ? kSosTokenUpper : kSosToken;
 }
@@ -57,25 +57,18 @@ class Vocab {
     return unk_id_;
   }
 
+  // This finds the longest prefix of the "text" in the given list of tokens
+  // and returns the ID of the found token (if nothing found, unk_id_ is
+  // returned) and the length of the found token through input argument
+  // pointers. Runs in time linear in the length of the match, independent of
+  // the vocab size.
   void GreedyMatchStringToTokenId(StringPiece text, int32* token_id,
-                                  int* token_size) const {
-    // This finds the longest prefix of the "text" in the given list of tokens
-    // and returns the ID of the found token (if nothing found, unk_id_ is
-    // returned) and the length of the found token through input argument
-    // pointers.
-    *token_id = unk_id_;
-    *token_size = 1;  // For <unk>, the input is of length 1 char, but output is
-                      // <unk> (length of 5).
-    for (const auto kv : id_to_token_) {
-      if (str_util::StartsWith(text, kv.second)) {
-        // Find the longest matching token.
-        if (*token_id == unk_id_ || *token_size < kv.second.size()) {
-          *token_id = kv.first;
-          *token_size = kv.second.size();
-        }
-      }
-    }
-  }
+                                  int* token_size) const;
+
+  // Splits "text" into the longest matching tokens from left to right and
+  // returns their ids. Bytes that do not start any token are mapped to
+  // unk_id_ one byte at a time.
+  std::vector<int32> GreedyMatchStringToTokenIds(StringPiece text) const;
 
   std::vector<int32> TokensToIds(const std::vector<string>& toks) const {
     std::vector<int32> ids;
@@ -114,6 +107,19 @@ class Vocab {
   std::unordered_map<int32, string> id_to_token_;
   std::unordered_map<string, int32> token_to_id_;
 
+  // A byte-wise prefix trie over all tokens, built in Load(). Node 0 is the
+  // root. trie_token_ids_[n] is the id of the token spelled by the path to
+  // node n, or -1 if no token ends there. Edges are keyed by
+  // TrieEdgeKey(parent node, byte).
+  std::vector<int32> trie_token_ids_;
+  std::unordered_map<uint64, int32> trie_edges_;
+
+  static uint64 TrieEdgeKey(int32 node, char c) {
+    return (static_cast<uint64>(node) << 8) | static_cast<uint8>(c);
+  }
+
+  void BuildTrie();
+
   TF_DISALLOW_COPY_AND_ASSIGN(Vocab);
 };
 
@@ -0,0 +1,140 @@
+/* Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+==============================================================================*/
+
+#include "lingvo/core/ops/simple_vocab.h"
+
+#include <set>
+
+#include <gtest/gtest.h>
+#include "tensorflow/core/lib/random/philox_random.h"
+#include "tensorflow/core/lib/random/simple_philox.h"
+#include "tensorflow/core/platform/env.h"
+#include "tensorflow/core/platform/logging.h"
+
+namespace tensorflow {
+namespace lingvo {
+
+// Vocab lines for the special tokens plus 'num_tokens' random tokens of 1 to
+// 8 lower case letters.
+std::vector<string> RandomVocabLines(int num_tokens, random::SimplePhilox* rnd,
+                                     std::vector<string>* tokens) {
+  std::vector<string> lines = {"<s>", "</s>", "<unk>"};
+  std::set<string> seen(lines.begin(), lines.end());
+  while (tokens->size() < num_tokens) {
+    string tok(1 + rnd->Uniform(8), ' ');
+    for (char& c : tok) c = 'a' + rnd->Uniform(26);
+    if (seen.insert(tok).second) {
+      tokens->push_back(tok);
+      lines.push_back(tok);
+    }
+  }
+  return lines;
+}
+
+// The previous implementation: scans the whole vocab at each position.
+void BruteForceGreedyMatch(const Vocab& vocab,
+                           const std::vector<string>& tokens, StringPiece text,
+                           int32* token_id, int* token_size) {
+  *token_id = vocab.unk_id();
+  *token_size = 1;
+  for (const string& tok : tokens) {
+    if (str_util::StartsWith(text, tok) &&
+        (*token_id == vocab.unk_id() || *token_size < tok.size())) {
+      *token_id = vocab.TokenToId(tok);
+      *token_size = tok.size();
+    }
+  }
+}
+
+string RandomText(int len, random::SimplePhilox* rnd) {
+  string text(len, ' ');
+  for (char& c : text) c = 'a' + rnd->Uniform(27);  // Includes '{' as <unk>.
+  return text;
+}
+
+TEST(SimpleVocab, GreedyMatch) {
+  const std::vector<string> lines = {"<s>", "</s>", "<unk>", "a",
+                                     "ab",  "abc",  "b",     "bcd"};
+  Vocab vocab;
+  TF_CHECK_OK(vocab.Load(lines));
+  // abc|d|ab|bcd|x
+  std::vector<int32> ids = vocab.GreedyMatchStringToTokenIds("abcdabbcdx");
+  EXPECT_EQ(std::vector<int32>({5, vocab.unk_id(), 4, 7, vocab.unk_id()}),
+            ids);
+  int32 token_id;
+  int token_size;
+  vocab.GreedyMatchStringToTokenId("abz", &token_id, &token_size);
+  EXPECT_EQ(4, token_id);
+  EXPECT_EQ(2, token_size);
+  vocab.GreedyMatchStringToTokenId("", &token_id, &token_size);
+  EXPECT_EQ(vocab.unk_id(), token_id);
+  EXPECT_EQ(1, token_size);
+}
+
+TEST(SimpleVocab, GreedyMatchSameAsBruteForce) {
+  random::PhiloxRandom philox(301, 17);
+  random::SimplePhilox rnd(&philox);
+  std::vector<string> tokens;
+  Vocab vocab;
+  TF_CHECK_OK(vocab.Load(RandomVocabLines(2000, &rnd, &tokens)));
+  const string text = RandomText(5000, &rnd);
+  StringPiece rest(text);
+  while (!rest.empty()) {
+    int32 expected_id, actual_id;
+    int expected_size, actual_size;
+    BruteForceGreedyMatch(vocab, tokens, rest, &expected_id, &expected_size);
+    vocab.GreedyMatchStringToTokenId(rest, &actual_id, &actual_size);
+    ASSERT_EQ(expected_id, actual_id);
+    ASSERT_EQ(expected_size, actual_size);
+    rest.remove_prefix(actual_size);
+  }
+}
+
+// Microbenchmark of greedy tokenization with a 32k-entry vocab. Reports the
+// throughput of the trie lookup and of the previous full vocab scan.
+TEST(SimpleVocab, GreedyMatchThroughput32k) {
+  random::PhiloxRandom philox(301, 17);
+  random::SimplePhilox rnd(&philox);
+  std::vector<string> tokens;
+  Vocab vocab;
+  TF_CHECK_OK(vocab.Load(RandomVocabLines(32000, &rnd, &tokens)));
+  const string text = RandomText(1 << 20, &rnd);
+
+  Env* env = Env::Default();
+  uint64 start = env->NowMicros();
+  const std::vector<int32> ids = vocab.GreedyMatchStringToTokenIds(text);
+  const double trie_secs = (env->NowMicros() - start) / 1e6;
+  LOG(INFO) << "Trie: " << text.size() / trie_secs / (1 << 20)
+            << " MB/s, " << ids.size() / trie_secs << " tokens/s";
+
+  // The brute force scan is ~vocab size times slower, so time a short prefix.
+  StringPiece rest(text.data(), 1 << 10);
+  int num_tokens = 0;
+  start = env->NowMicros();
+  while (!rest.empty()) {
+    int32 token_id;
+    int token_size;
+    BruteForceGreedyMatch(vocab, tokens, rest, &token_id, &token_size);
+    rest.remove_prefix(token_size);
+    ++num_tokens;
+  }
+  const double scan_secs = (env->NowMicros() - start) / 1e6;
+  LOG(INFO) << "Vocab scan: " << (1 << 10) / scan_secs / (1 << 20)
+            << " MB/s, " << num_tokens / scan_secs << " tokens/s";
+  EXPECT_FALSE(ids.empty());
+}
+
+}  // namespace lingvo
+}  // namespace tensorflow
@@ -48,6 +48,11 @@ class StrToVocabTokensOp : public OpKernel {
     OP_REQUIRES_OK(ctx, ctx->GetAttr("load_token_ids_from_vocab",
                                      &load_token_ids_from_vocab));
     OP_REQUIRES_OK(ctx, ctx->GetAttr("delimiter", &delimiter_));
+    OP_REQUIRES_OK(ctx, ctx->GetAttr("greedy_match", &greedy_match_));
+    OP_REQUIRES(ctx, !greedy_match_ || delimiter_.empty(),
+                errors::InvalidArgument(
+                    "greedy_match requires an empty delimiter, got: '",
+                    delimiter_, "'"));
     CHECK_GT(maxlen_, 0);
     OP_REQUIRES_OK(ctx,
                    vocab_.Load(vocab_filepath_, load_token_ids_from_vocab));
@@ -75,29 +80,35 @@ class StrToVocabTokensOp : public OpKernel {
 
       string label(t_label(i));
       VLOG(1) << "Label " << label;
-      std::vector<string> tokens;
-      if (delimiter_.length() > 0) {
-        tokens = str_util::Split(label, delimiter_, str_util::SkipWhitespace());
+      std::vector<int32> ids;
+      if (greedy_match_) {
+        ids = vocab_.GreedyMatchStringToTokenIds(label);
       } else {
-        // Split by the empty delimiter.
-        for (int i = 0; i < label.size(); ++i) {
-          tokens.push_back(string(1, label[i]));
+        std::vector<string> tokens;
+        if (delimiter_.length() > 0) {
+          tokens =
+              str_util::Split(label, delimiter_, str_util::SkipWhitespace());
+        } else {
+          // Split by the empty delimiter.
+          for (int i = 0; i < label.size(); ++i) {
+            tokens.push_back(string(1, label[i]));
+          }
         }
+        VLOG(1) << "#Tokens " << tokens.size() << " "
+                << str_util::Join(tokens, "/");
+        ids = vocab_.TokensToIds(tokens);
       }
 
-      VLOG(1) << "#Tokens " << tokens.size() << " "
-              << str_util::Join(tokens, "/");
       int cur_char = 0;
-      for (const auto& token : tokens) {
-        const int token_id = vocab_.TokenToId(token);
+      for (const int32 token_id : ids) {
         t_target_ids(i, cur_char) = token_id;
         t_paddings(i, cur_char) = 0.0;
         // If the number of tokens is longer than the max length - truncate.
         if (cur_char + 1 >= maxlen_) {
           cur_char++;
-          LOG(INFO) << "Label: \"" << label << "\" contained " << tokens.size()
+          LOG(INFO) << "Label: \"" << label << "\" contained " << ids.size()
                     << " tokens, and was truncated to size: " << maxlen_ << " ("
-                    << tokens.size() - maxlen_ << " tokens were ignored).";
+                    << ids.size() - maxlen_ << " tokens were ignored).";
           break;
         }
         t_token_ids(i, cur_char + 1) = token_id;
@@ -141,6 +152,7 @@ class StrToVocabTokensOp : public OpKernel {
   int maxlen_ = 0;
   bool pad_to_maxlen_ = true;
   string delimiter_;
+  bool greedy_match_ = false;
   Vocab vocab_;
 };
 
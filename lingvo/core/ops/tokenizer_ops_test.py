@@ -255,6 +255,24 @@ class TokenizerOpsTest(tf.test.TestCase):
       self.assertEqual(target_ids.tolist(), [[5, 6, 7, 8, 9, 2, 2, 2]])
       self.assertEqual(paddings.tolist(), [[0., 0., 0., 0., 0., 0., 1., 1.]])
 
+  def testStrToVocabTokenGreedyMatch(self):
+    vocab = test_helper.test_src_dir_path('core/ops/testdata/test_vocab.txt')
+    with self.session(use_gpu=False) as sess:
+      token_ids, target_ids, paddings = sess.run(
+          py_x_ops.str_to_vocab_tokens(['theabc', 'über♣x'],
+                                       append_eos=True,
+                                       maxlen=8,
+                                       vocab_filepath=vocab,
+                                       delimiter='',
+                                       greedy_match=True))
+      self.assertEqual(token_ids.tolist(),
+                       [[1, 4, 5, 6, 7, 2, 2, 2], [1, 11, 12, 3, 2, 2, 2, 2]])
+      self.assertEqual(target_ids.tolist(),
+                       [[4, 5, 6, 7, 2, 2, 2, 2], [11, 12, 3, 2, 2, 2, 2, 2]])
+      self.assertEqual(paddings.tolist(),
+                       [[0., 0., 0., 0., 0., 1., 1., 1.],
+                        [0., 0., 0., 0., 1., 1., 1., 1.]])
+
   def testNgramIdToToken(self):
     vocab = test_helper.test_src_dir_path('core/ops/testdata/test_ngrams.txt')
     with self.session(use_gpu=False):
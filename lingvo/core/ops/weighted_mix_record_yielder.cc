@@ -83,5 +83,11 @@ Status WeightedMixRecordYielder::Yield(Rope* value) {
   }
 }
 
+void WeightedMixRecordYielder::GetStats(RecordYielderStats* stats) {
+  for (RecordYielder* yielder : yielders_) {
+    yielder->GetStats(stats);
+  }
+}
+
 }  // namespace lingvo
 }  // namespace tensorflow
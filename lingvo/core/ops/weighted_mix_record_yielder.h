@@ -53,6 +53,7 @@ class WeightedMixRecordYielder : public RecordYielder {
   ~WeightedMixRecordYielder() override;
   void Close() override;
   Status Yield(Rope* value) override;
+  void GetStats(RecordYielderStats* stats) override;
 
   // Creates new WeightedMixRecordYielder and takes ownership over yielders
   // provided. Those yielders should be properly initialized already and will be
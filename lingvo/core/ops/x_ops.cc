@@ -73,6 +73,66 @@ seed: The random seed.
 out: Each output is a vector of size up to batch.
 )doc");
 
+REGISTER_OP("PackSequences")
+    .Input("src_actual_seq_len: int32")
+    .Input("tgt_actual_seq_len: int32")
+    .Output("src_segment_ids: int32")
+    .Output("src_segment_pos: int32")
+    .Output("src_indices_in_input: int32")
+    .Output("tgt_segment_ids: int32")
+    .Output("tgt_segment_pos: int32")
+    .Output("tgt_indices_in_input: int32")
+    .Attr("packed_batch_size: int")
+    .Attr("packed_src_seq_len: int")
+    .Attr("packed_tgt_seq_len: int")
+    .SetShapeFn([](shape_inference::InferenceContext* ctx) {
+      int64 packed_batch_size;
+      int64 packed_src_seq_len;
+      int64 packed_tgt_seq_len;
+      TF_RETURN_IF_ERROR(
+          ctx->GetAttr("packed_batch_size", &packed_batch_size));
+      TF_RETURN_IF_ERROR(
+          ctx->GetAttr("packed_src_seq_len", &packed_src_seq_len));
+      TF_RETURN_IF_ERROR(
+          ctx->GetAttr("packed_tgt_seq_len", &packed_tgt_seq_len));
+      auto src = ctx->Matrix(packed_batch_size, packed_src_seq_len);
+      auto tgt = ctx->Matrix(packed_batch_size, packed_tgt_seq_len);
+      for (int i = 0; i < 3; ++i) {
+        ctx->set_output(i, src);
+        ctx->set_output(3 + i, tgt);
+      }
+      return Status::OK();
+    })
+    .Doc(R"doc(
+Greedily packs (source, target) sequence pairs into fixed-size rows.
+
+Pairs are considered from the longest to the shortest (by the sum of their
+source and target lengths) and each one is put into the first row that still
+has room for both its source and its target. Pairs that fit in no row are
+dropped. Within a row, segments are numbered 0, 1, ... in the order they are
+placed, and the source and target of a pair have the same segment id.
+
+Padded positions at the end of a row have the segment id of the last segment
+in the row (0 for an empty row), position 0 and index -1. Thus the number of
+segments in a row is always max(segment_ids) - min(segment_ids) + 1.
+
+src_actual_seq_len: The source length of each pair. A vector of shape [N].
+tgt_actual_seq_len: The target length of each pair. A vector of shape [N].
+src_segment_ids: The segment id of each source position. The shape is
+    [packed_batch_size, packed_src_seq_len].
+src_segment_pos: The position of each source position within its sequence.
+    The shape is [packed_batch_size, packed_src_seq_len].
+src_indices_in_input: The index in [0, N) of the pair each source position
+    comes from, or -1 for padding. The shape is [packed_batch_size,
+    packed_src_seq_len].
+tgt_segment_ids: Same as src_segment_ids, for the targets.
+tgt_segment_pos: Same as src_segment_pos, for the targets.
+tgt_indices_in_input: Same as src_indices_in_input, for the targets.
+packed_batch_size: The number of output rows.
+packed_src_seq_len: The length of each output source row.
+packed_tgt_seq_len: The length of each output target row.
+)doc");
+
 REGISTER_OP("BestStep")
     .Output("best_step: int64")
     .Attr("hist_file: string")
@@ -123,6 +183,8 @@ REGISTER_OP("BeamSearchStep")
     .Attr("allow_empty_terminated_hyp: bool = true")
     .Attr("ensure_full_beam: bool = false")
     .Attr("force_eos_in_last_step: bool = false")
+    .Attr("atten_vecs_in_hypothesis_protos: bool = true")
+    .Attr("atten_alignment_k: int = 0")
     .SetShapeFn([](shape_inference::InferenceContext* c) {
       c->set_output(0, c->input(2));
       c->set_output(1, c->input(3));
@@ -231,6 +293,14 @@ force_eos_in_last_step: If true, then if decode does not terminate even after
     hypotheses (with a valid eos symbol in the end) are returned. all_done
     is set to true for these partials. If false, which is the default behavior,
     empty hypothesis are returned and all_done is set to false at termination.
+atten_vecs_in_hypothesis_protos: If true, the Hypothesis protos in
+    out_done_hyps contain the attention probs of every step in atten_vecs. If
+    false, they only contain their sum over all steps in
+    cumulative_atten_probs, which is enough to compute the coverage penalty,
+    and are much smaller for long sources.
+atten_alignment_k: If positive, the Hypothesis protos in out_done_hyps contain
+    the atten_alignment_k source positions with the highest attention probs at
+    each step in alignment, e.g., 1 for an argmax alignment.
 )doc");
 
 REGISTER_OP("TopKTerminatedHyps")
@@ -285,6 +355,82 @@ merge_paths: If true, hyps which are identical when epsilons are removed will
     applied for epsilon-emitting models (RNN-T and NT).
 )doc");
 
+REGISTER_OP("TopKTerminatedHypsDense")
+    .Input("in_done_hyps: string")
+    .Input("src_seq_lengths: int32")
+    .Output("out_ids: int32")
+    .Output("out_seq_lens: int32")
+    .Output("out_scores: float32")
+    .Output("out_alignments: int32")
+    .Attr("k: int")
+    .Attr("num_hyps_per_beam: int")
+    .Attr("length_normalization: float")
+    .Attr("coverage_penalty: float")
+    .Attr("target_seq_length_ratio: float=1.0")
+    .Attr("eoc_id: int=-1")
+    .Attr("merge_paths: bool = false")
+    .Attr("max_seq_length: int = 0")
+    .Attr("atten_alignment_k: int = 0")
+    .SetShapeFn([](shape_inference::InferenceContext* c) {
+      auto num_beams = c->Dim(c->input(1), 0);
+      int k;
+      TF_RETURN_IF_ERROR(c->GetAttr("k", &k));
+      shape_inference::DimensionHandle batch_size;
+      TF_RETURN_IF_ERROR(c->Multiply(num_beams, k, &batch_size));
+      int max_seq_length;
+      TF_RETURN_IF_ERROR(c->GetAttr("max_seq_length", &max_seq_length));
+      shape_inference::DimensionOrConstant len_dim = c->UnknownDim();
+      if (max_seq_length > 0) {
+        len_dim = max_seq_length;
+      }
+      int atten_alignment_k;
+      TF_RETURN_IF_ERROR(c->GetAttr("atten_alignment_k", &atten_alignment_k));
+      c->set_output(0, c->Matrix(batch_size, len_dim));
+      c->set_output(1, c->Vector(batch_size));
+      c->set_output(2, c->Vector(batch_size));
+      c->set_output(3, c->MakeShape({batch_size, len_dim, atten_alignment_k}));
+      return Status::OK();
+    })
+    .Doc(R"doc(
+
+Computes the top k terminated hyps of each beam like TopKTerminatedHyps, and
+unpacks them into dense tensors like UnpackHyp, without serializing them.
+
+Let "b" be the number of beams, "h" be the number hyps in each beam, "t" be the
+maximum decoding steps.
+
+in_done_hyps: A tensor of shape [t, h * b]. See TopKTerminatedHyps.
+src_seq_lengths: A tensor of shape [b] of the src sequence lengths.
+out_ids:
+    A matrix of shape [b * k, max_seq_length]. out_ids[i * k + j, :] are the
+    ids of the j-th best hyp of beam i, padded with 0s.
+out_seq_lens:
+    A vector of shape [b * k], the length of each hyp. 0 if a beam has fewer
+    than k terminated hyps.
+out_scores:
+    A vector of shape [b * k], the normalized score of each hyp.
+out_alignments:
+    A tensor of shape [b * k, max_seq_length, atten_alignment_k]. The source
+    positions with the highest attention probs at each step of each hyp,
+    padded with -1. Requires BeamSearchStep to have been run with the same
+    atten_alignment_k.
+k: number of highest scoring hyps to be returned for each beam.
+num_hyps_per_beam: Number of hyps per beam in the input `in_done_hyps`.
+length_normalization: The length normalization ratio.
+coverage_penalty: The alpha value for coverage penalty.
+target_seq_length_ratio: Ratio of the average target sequence length
+    over the average source sequence length.
+eoc_id: Token id of the special end of chunk or blank (epsilon) token. -1 means
+    this model does not use epsilon.
+merge_paths: If true, hyps which are identical when epsilons are removed will
+    be combined into a single hyp. The probability for that combined hyp will
+    be the sum of the probabilities of the component hyps. This can only be
+    applied for epsilon-emitting models (RNN-T and NT).
+max_seq_length: The length of the output sequences. If 0, derive it from the
+    longest of the top k hyps.
+atten_alignment_k: The number of source positions per step in out_alignments.
+)doc");
+
 REGISTER_OP("UnpackHyp")
     .Input("in_hyps: string")
     .Output("out_ids: int32")
@@ -461,6 +607,7 @@ REGISTER_OP("StrToVocabTokens")
     .Attr("vocab_filepath: string")
     .Attr("load_token_ids_from_vocab: bool = true")
     .Attr("delimiter: string = ' '")
+    .Attr("greedy_match: bool = false")
     .SetShapeFn([](shape_inference::InferenceContext* c) {
       auto batch_size = c->Dim(c->input(0), 0);
       int maxlen;
@@ -491,6 +638,9 @@ load_token_ids_from_vocab: Whether token ids are present in vocab (i.e. vocab
     contains two colums, one for IDs and one for words).  If false, line numbers
     are used.
 delimiter: The delimiter to split the labels to tokens by.
+greedy_match: If true, labels are split into the longest vocab tokens matching
+    from left to right, instead of by the delimiter (which must then be empty).
+    Bytes that do not start any vocab token are mapped to <unk>.
 )doc");
 
 REGISTER_OP("IdToAscii")
@@ -622,6 +772,14 @@ processor: A function that processes a string (one record) and returns
     batch dimension. Instead, when multiple samples are merged into a
     batch, GenericInput's implementation expand the batch dimension (dim
     0) and concatenate the corresponding tensors into one tensor.
+    If `process_batch_size` > 1, the function instead processes a string
+    vector of records. Then the last tensor must be an int32 vector of
+    per-record bucket keys and the other tensors' first dimension is the
+    batch dimension. They are split into per-record samples, which are
+    bucketed and merged as above. Padding added across the records processed
+    together is kept in the samples and must be trimmed by the caller if
+    unwanted. If the function fails, it is run again on every record alone
+    and only the records which fail are dropped.
 dynamic_padding_dimensions: If not empty, must be the same length as out.
     Specifies the 0-indexed dimension to pad dynamically for each output.
     The output is padded to the longest tensor in the batch along the dimension.
@@ -630,5 +788,48 @@ dynamic_padding_constants: Must be set if `dynamic_padding_dimension` is
     provided. The constant value to use for padding.
 )doc");
 
+REGISTER_OP("InputStats")
+    .Output("epoch: int64")
+    .Output("records_yielded: int64")
+    .Output("records_skipped: int64")
+    .Output("bucket_batches: int64")
+    .Output("shard_records_per_sec: float")
+    .Output("buffer_fill: float")
+    .Output("yielder_wait_seconds: float")
+    .Output("batcher_wait_seconds: float")
+    .Attr("stats_key: string")
+    .SetIsStateful()
+    .SetShapeFn([](shape_inference::InferenceContext* c) {
+      for (int i = 0; i < c->num_outputs(); ++i) {
+        c->set_output(i, (i == 3 || i == 4) ? c->Vector(c->UnknownDim())
+                                             : c->Scalar());
+      }
+      return Status::OK();
+    })
+    .Doc(R"doc(
+Reports the counters of an input op, e.g., GenericInput, in this process.
+
+The input op is the one with the same non-empty `stats_key` attr. All outputs
+are zeros (or empty) until its kernel is created.
+The counters are cumulative except shard_records_per_sec.
+
+epoch: The epoch number of the input op's file reader.
+records_yielded: Number of records put into buckets so far.
+records_skipped: Number of records skipped so far because their bucket key
+    exceeds the last `bucket_upper_bound`.
+bucket_batches: Number of batches produced by each bucket so far.
+shard_records_per_sec: For each file shard (`file_parallelism` of them per
+    input source), the records read per second since the previous run of this
+    op, or since this op was created for the first run.
+buffer_fill: The fraction of the randomization buffer (`file_buffer_size`)
+    which is filled.
+yielder_wait_seconds: Total seconds the record processing threads were blocked
+    waiting for the file readers.
+batcher_wait_seconds: Total seconds the input op was blocked waiting for a
+    batch. If this increases as fast as the wall time, training is
+    input-bound.
+stats_key: The `stats_key` of the input op.
+)doc");
+
 }  // namespace
 }  // namespace tensorflow
@@ -22,10 +22,15 @@ limitations under the License.
       .Attr("file_random_seed: int = 301")            \
       .Attr("file_buffer_size: int = 10000")          \
       .Attr("file_parallelism: int = 16")             \
+      .Attr("num_file_shards: int = 1")               \
+      .Attr("file_shard_index: int = 0")              \
       .Attr("bucket_upper_bound: list(int)")          \
       .Attr("bucket_batch_limit: list(int)")          \
+      .Attr("bucket_max_tokens: int = 0")             \
       .Attr("flush_every_n: int = 0")                 \
       .Attr("num_threads: int = 1")                   \
+      .Attr("process_batch_size: int = 1")            \
+      .Attr("stats_key: string = ''")                 \
       .SetIsStateful()
 
 #define INPUT_DOCS \
@@ -39,13 +44,26 @@ input_source_weights: A list of input sources weights that control the input\
 file_random_seed: Random seeds used to produce randomized records.\
 file_buffer_size: The randomization shuffling buffer.\
 file_parallelism: How many sstables are opened and concurrently iterated over.\
+num_file_shards: If larger than 1, the files matched by each pattern are \
+  sorted and only every num_file_shards-th one, starting at \
+  file_shard_index, is read. Input ops with different file_shard_index thus \
+  read disjoint slices of the data.\
+file_shard_index: The file shard to read, in [0, num_file_shards).\
 bucket_upper_bound: Bucketing scheme. Specifies each bucket's upper bound.\
 bucket_batch_limit: Batching scheme. Specifies each bucket's maximum batch\
   size.\
+bucket_max_tokens: If positive, a batch is also closed as soon as the next \
+  sample would make it exceed this many padded tokens, i.e., the number of \
+  samples times their largest bucket key.\
 flush_every_n: If non-zero, flushes all batches buffered so far every these\
     many records are yielded.\
 num_threads: Number of threads to use for the record batcher. Each thread fills\
     separate batches based on bucket limits.\
+process_batch_size: If larger than 1, this many records are processed at a \
+    time, which amortizes the per-call overhead of the record processor. \
+    Samples are still bucketed one by one.\
+stats_key: If not empty, a key unique in the process under which InputStats \
+    ops find the counters of this op.\
 )"
 
 #endif  // LINGVO_CORE_OPS_X_OPS_HELPER_H_
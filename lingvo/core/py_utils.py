@@ -21,7 +21,10 @@ from __future__ import print_function
 import contextlib
 import hashlib
 import math
+import multiprocessing.pool
 import re
+import threading
+import time
 import traceback
 
 import numpy as np
@@ -1204,6 +1207,169 @@ def _GetVarsToLoad(all_vars, variable_loading_rules, var_ignore_rules):
   return vars_to_load
 
 
+# Errors on which reading a tensor from a checkpoint is retried, e.g., when a
+# remote file system is temporarily unavailable.
+_CHECKPOINT_READ_RETRY_ERRORS = (tf.errors.UnavailableError,
+                                 tf.errors.DeadlineExceededError,
+                                 tf.errors.AbortedError)
+
+
+class _CheckpointLoader(object):
+  """Loads model variables from several checkpoints concurrently.
+
+  The whole plan, i.e. which checkpoint tensor goes to which variable, is
+  checked against the checkpoints' metadata before any tensor is read. Tensors
+  are then read by a pool of threads, each with its own reader per checkpoint
+  which it reuses for all the tensors it reads from that checkpoint, and
+  assigned to the variables in batches of about `max_batch_bytes`. At most
+  `max_pending_reads` tensors are read ahead of the batch being assigned, so
+  that memory use stays bounded when assigning is slower than reading.
+  """
+
+  def __init__(self,
+               num_threads=8,
+               max_batch_bytes=256 << 20,
+               max_pending_reads=16):
+    assert max_pending_reads > 0
+    self._num_threads = num_threads
+    self._max_batch_bytes = max_batch_bytes
+    self._max_pending_reads = max_pending_reads
+    self._local = threading.local()
+
+  def _GetReader(self, checkpoint_path):
+    """Returns the reader of `checkpoint_path` of the current thread."""
+    if not hasattr(self._local, 'readers'):
+      self._local.readers = {}
+    if checkpoint_path not in self._local.readers:
+      self._local.readers[checkpoint_path] = tf.train.NewCheckpointReader(
+          checkpoint_path)
+    return self._local.readers[checkpoint_path]
+
+  def _Verify(self, vars_to_load_per_ckpt):
+    """Raises ValueError if a tensor is missing or does not match its var."""
+    errors = []
+    for checkpoint_path, vars_to_load in six.iteritems(vars_to_load_per_ckpt):
+      reader = self._GetReader(checkpoint_path)
+      shapes = reader.get_variable_to_shape_map()
+      dtypes = reader.get_variable_to_dtype_map()
+      for checkpoint_var_name, model_var in vars_to_load:
+        slice_info = getattr(model_var, '_save_slice_info', None)
+        if slice_info:
+          expected_shape = list(slice_info.full_shape)
+        else:
+          expected_shape = model_var.shape.as_list()
+        if checkpoint_var_name not in shapes:
+          errors.append('%s is not in %s' % (checkpoint_var_name,
+                                             checkpoint_path))
+        elif shapes[checkpoint_var_name] != expected_shape:
+          errors.append('%s has shape %s in %s, but %s has shape %s' %
+                        (checkpoint_var_name, shapes[checkpoint_var_name],
+                         checkpoint_path, model_var.name, expected_shape))
+        elif dtypes[checkpoint_var_name] != model_var.dtype.base_dtype:
+          errors.append('%s has dtype %s in %s, but %s has dtype %s' %
+                        (checkpoint_var_name, dtypes[checkpoint_var_name].name,
+                         checkpoint_path, model_var.name,
+                         model_var.dtype.base_dtype.name))
+    if errors:
+      raise ValueError('Can not override vars from checkpoints:\n%s' %
+                       '\n'.join(errors))
+
+  def _Read(self, item):
+    """Reads the value of a variable. Runs on a pool thread."""
+    checkpoint_path, checkpoint_var_name, model_var = item
+
+    @retry.Retry(
+        retry_value=_CHECKPOINT_READ_RETRY_ERRORS,
+        max_retries=5,
+        initial_delay_sec=1.0,
+        max_delay_sec=30)
+    def _ReadWithRetry():
+      try:
+        return self._GetReader(checkpoint_path).get_tensor(checkpoint_var_name)
+      except _CHECKPOINT_READ_RETRY_ERRORS:
+        # Reopens the checkpoint on retry.
+        self._local.readers.pop(checkpoint_path, None)
+        raise
+
+    start = time.time()
+    value = _ReadWithRetry()
+    slice_info = getattr(model_var, '_save_slice_info', None)
+    if slice_info:
+      value = value[tuple(
+          slice(offset, offset + size)
+          for offset, size in zip(slice_info.var_offset, slice_info.var_shape))]
+    return checkpoint_path, model_var, value, time.time() - start
+
+  def Load(self, sess, vars_to_load_per_ckpt):
+    """Loads variables.
+
+    Args:
+      sess: Tensorflow session.
+      vars_to_load_per_ckpt: A dict from checkpoint path to a list of
+        (checkpoint var name, model var) pairs, as returned by _GetVarsToLoad.
+
+    Returns:
+      A dict from checkpoint path to (bytes read, seconds spent reading).
+    """
+    self._Verify(vars_to_load_per_ckpt)
+    items = []
+    for checkpoint_path, vars_to_load in six.iteritems(vars_to_load_per_ckpt):
+      items += [(checkpoint_path, k, v) for k, v in vars_to_load]
+    stats = {k: [0, 0.0] for k in vars_to_load_per_ckpt}
+
+    # Assigns through the initializers of the variables, as Variable.load()
+    # does, so that no ops are added to the graph.
+    assign_ops = []
+    feed_dict = {}
+    feed_bytes = 0
+    start = time.time()
+    # The pool takes the next item to read only after the loop below took a
+    # value it read.
+    pending_reads = threading.Semaphore(self._max_pending_reads)
+    stop = threading.Event()
+
+    def _Items():
+      for item in items:
+        pending_reads.acquire()
+        if stop.is_set():
+          return
+        yield item
+
+    pool = multiprocessing.pool.ThreadPool(
+        min(self._num_threads, max(1, len(items))))
+    try:
+      for checkpoint_path, model_var, value, read_secs in pool.imap_unordered(
+          self._Read, _Items()):
+        pending_reads.release()
+        stats[checkpoint_path][0] += value.nbytes
+        stats[checkpoint_path][1] += read_secs
+        assign_ops.append(model_var.initializer)
+        feed_dict[model_var.initializer.inputs[1]] = value
+        feed_bytes += value.nbytes
+        if feed_bytes >= self._max_batch_bytes:
+          sess.run(assign_ops, feed_dict=feed_dict)
+          assign_ops = []
+          feed_dict = {}
+          feed_bytes = 0
+      if assign_ops:
+        sess.run(assign_ops, feed_dict=feed_dict)
+    finally:
+      # Unblocks _Items() if it is waiting, e.g., after an error.
+      stop.set()
+      pending_reads.release()
+      pool.close()
+      pool.join()
+
+    for checkpoint_path, (num_bytes, read_secs) in sorted(six.iteritems(stats)):
+      tf.logging.info(
+          'Read %d bytes of %d vars from checkpoint %s (%.2f thread seconds).',
+          num_bytes, len(vars_to_load_per_ckpt[checkpoint_path]),
+          checkpoint_path, read_secs)
+    tf.logging.info('Overriding vars from %d checkpoints took %.2f seconds.',
+                    len(vars_to_load_per_ckpt), time.time() - start)
+    return {k: tuple(v) for k, v in six.iteritems(stats)}
+
+
 def _OverrideVarsFromCheckpoint(sess, all_vars, checkpoint_path,
                                 variable_loading_rules, var_ignore_rules):
   """Overrides variables from a provided checkpoint."""
@@ -1214,28 +1380,15 @@ def _OverrideVarsFromCheckpoint(sess, all_vars, checkpoint_path,
                       'All known: %r') % [v.name for v in all_vars])
   load_var_names = sorted([v.name for _, v in vars_to_load])
   tf.logging.info('Overriding vars from checkpoint: %r', load_var_names)
-
-  while vars_to_load:
-    # When restoring, it's possible the same value in the checkpoint
-    # can be restored to multiple variables (e.g. during
-    # distillation).  However, tf.train.Saver, since it's used for
-    # both saving and restoring, requires the name in the checkpoint
-    # to be unique for each variable.  So, we call it multiple times
-    # with a unique set of names each time.
-    unique_vars_to_load = {}
-    remaining_vars_to_load = []
-    for k, v in vars_to_load:
-      if k not in unique_vars_to_load:
-        unique_vars_to_load[k] = v
-      else:
-        remaining_vars_to_load.append((k, v))
-    tf.train.Saver(var_list=unique_vars_to_load).restore(sess, checkpoint_path)
-    vars_to_load = remaining_vars_to_load
+  return _CheckpointLoader().Load(sess, {checkpoint_path: vars_to_load})
 
 
 def OverrideVarsFromCheckpoints(session, all_vars, ckpts_loading_rules):
   """Overrides model variables from checkpoints.
 
+  All the variables to override are matched to their checkpoints, and their
+  shapes are checked, before the checkpoints are read concurrently.
+
   Args:
     session: Tensorflow session.
     all_vars: List of all the parameters in the model.
@@ -1248,13 +1401,18 @@ def OverrideVarsFromCheckpoints(session, all_vars, ckpts_loading_rules):
       in the model which should not be overridden, even if they match those in
       the loading rules.
 
+  Returns:
+    A dict from checkpoint path to (bytes read, seconds spent reading).
+
   Raises:
-    ValueError: if colliding vars exist or loading rules is not a list.
+    ValueError: if colliding vars exist, loading rules is not a list, or a var
+      is missing in or has a different shape in its checkpoint.
   """
   if len(ckpts_loading_rules) > 1:
     tf.logging.info('Overriding vars from multiple checkpoints.')
 
   vars_overridden = set()
+  vars_to_load_per_ckpt = {}
   for ckpt_path, loading_rules in ckpts_loading_rules.items():
     tf.logging.info('Overriding vars from checkpoint: %s', ckpt_path)
 
@@ -1267,19 +1425,21 @@ def OverrideVarsFromCheckpoints(session, all_vars, ckpts_loading_rules):
           'Loading rules for %s must be a tuple of two lists!' % ckpt_path)
 
     # Filter the model variables to be overridden.
-    vars_to_override = [
-        var[1]
-        for var in _GetVarsToLoad(all_vars, loading_rules[0], loading_rules[1])
-    ]
+    vars_to_load = _GetVarsToLoad(all_vars, loading_rules[0], loading_rules[1])
+    if not vars_to_load:
+      raise ValueError(('Variable loading rules did not match any vars. '
+                        'All known: %r') % [v.name for v in all_vars])
+    vars_to_override = [var[1] for var in vars_to_load]
 
     overlap = set.intersection(vars_overridden, vars_to_override)
     if overlap:
       raise ValueError('Colliding variables to override: %s' % overlap)
 
-    _OverrideVarsFromCheckpoint(session, all_vars, ckpt_path, loading_rules[0],
-                                loading_rules[1])
+    vars_to_load_per_ckpt[ckpt_path] = vars_to_load
     vars_overridden.update(vars_to_override)
+  stats = _CheckpointLoader().Load(session, vars_to_load_per_ckpt)
   tf.logging.info('Model variables overridden: %s', vars_overridden)
+  return stats
 
 
 def _ComputeGradientsSimple(loss, all_vars):
@@ -20,8 +20,10 @@ from __future__ import print_function
 
 import copy
 import itertools
+import os
 
 import numpy as np
+import six
 from six.moves import range
 from six.moves import zip
 import tensorflow as tf
@@ -911,6 +913,81 @@ class OverrideVarsFromCheckpointsTest(tf.test.TestCase):
           self._GetLeNetVarsFirstVal(sess),
           [0.043092, -0.036722, 0.0])
 
+  def testOverrideVarsFromCheckpoints(self):
+
+    with self.session(use_gpu=False) as sess:
+      tf.set_random_seed(8372749040)
+      cfg = model_registry.GetParams('image.mnist.LeNet5', 'Train')
+      with cluster_factory.ForTestingWorker(mode='sync', job='trainer_client'):
+        cfg.cls(cfg)
+      tf.global_variables_initializer().run()
+      checkpoint_path = test_helper.test_src_dir_path(
+          'core/testdata/lenet_test_model')
+      stats = py_utils.OverrideVarsFromCheckpoints(
+          sess, tf.all_variables(), {
+              checkpoint_path: ([('lenet5/conv0/w/var', 'lenet5/conv0/w/var'),
+                                 ('lenet5/conv1/w/var', 'lenet5/conv1/w/var')],
+                                [])
+          })
+      self.assertAllClose(
+          self._GetLeNetVarsFirstVal(sess), [0.043092, -0.024082, 0.0])
+      self.assertEqual([checkpoint_path], list(stats.keys()))
+      num_bytes, _ = stats[checkpoint_path]
+      self.assertEqual((5 * 5 * 1 * 20 + 5 * 5 * 20 * 50) * 4, num_bytes)
+
+  def testOverrideVarsFromCheckpointsShapeMismatch(self):
+
+    with self.session(use_gpu=False) as sess:
+      tf.set_random_seed(8372749040)
+      cfg = model_registry.GetParams('image.mnist.LeNet5', 'Train')
+      with cluster_factory.ForTestingWorker(mode='sync', job='trainer_client'):
+        cfg.cls(cfg)
+      tf.global_variables_initializer().run()
+      checkpoint_path = test_helper.test_src_dir_path(
+          'core/testdata/lenet_test_model')
+      # conv1 is loaded from conv0, which has a different shape.
+      loading_rules = [('lenet5/conv0/w/var', 'lenet5/conv0/w/var'),
+                       ('lenet5/conv1/w/var', 'lenet5/conv0/w/var')]
+      with self.assertRaisesRegexp(ValueError, 'has shape'):
+        py_utils.OverrideVarsFromCheckpoints(
+            sess, tf.all_variables(), {checkpoint_path: (loading_rules, [])})
+      # Nothing is overridden if any var does not match.
+      self.assertAllClose(
+          self._GetLeNetVarsFirstVal(sess), [-0.005945, -0.036722, 0.0])
+
+  def _SaveCheckpoint(self, name, values):
+    checkpoint_path = os.path.join(self.get_temp_dir(), name, 'ckpt')
+    with self.session(graph=tf.Graph()) as sess:
+      for var_name, value in six.iteritems(values):
+        tf.get_variable(var_name, initializer=tf.constant(value))
+      tf.global_variables_initializer().run()
+      return tf.train.Saver().save(sess, checkpoint_path)
+
+  def testCheckpointLoaderDtypeMismatch(self):
+    checkpoint_path = self._SaveCheckpoint('dtype_mismatch',
+                                           {'x': np.ones([2], np.float32)})
+    with self.session(graph=tf.Graph()) as sess:
+      x = tf.get_variable('x', initializer=tf.zeros([2], tf.int32))
+      tf.global_variables_initializer().run()
+      with self.assertRaisesRegexp(ValueError, 'has dtype'):
+        py_utils._CheckpointLoader().Load(sess, {checkpoint_path: [('x', x)]})
+      self.assertAllEqual([0, 0], x.eval())
+
+  def testCheckpointLoaderPendingReads(self):
+    values = {'x%d' % i: np.full([3], i, np.float32) for i in range(20)}
+    checkpoint_path = self._SaveCheckpoint('pending_reads', values)
+    with self.session(graph=tf.Graph()) as sess:
+      model_vars = {
+          k: tf.get_variable(k, initializer=tf.zeros([3])) for k in values
+      }
+      tf.global_variables_initializer().run()
+      # Reads at most one tensor ahead of the batch being assigned.
+      loader = py_utils._CheckpointLoader(
+          num_threads=4, max_batch_bytes=24, max_pending_reads=1)
+      loader.Load(sess, {checkpoint_path: list(six.iteritems(model_vars))})
+      for k, v in six.iteritems(model_vars):
+        self.assertAllEqual(values[k], v.eval())
+
 
 class NestedMapTest(tf.test.TestCase):
 
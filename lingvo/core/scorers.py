@@ -19,9 +19,13 @@ from __future__ import division
 from __future__ import print_function
 
 import collections
+import itertools
 import math
+import multiprocessing
 import six
+from six.moves import map
 from six.moves import range
+from six.moves import zip
 
 
 def _IsUnicode(s):
@@ -43,6 +47,21 @@ def NGrams(lst, order):
   return (lst[i:i + order] for i in range(len(lst) - order + 1))
 
 
+def _NGramCounts(ids, order):
+  """Returns a Counter of all n-grams of the given order in the id tuple."""
+  if order == 1:
+    return collections.Counter(ids)
+  return collections.Counter(zip(*[ids[i:] for i in range(order)]))
+
+
+# Sufficient statistics of corpus BLEU. Statistics of disjoint sets of sentences
+# are combined by element-wise addition, see BleuScorer.MergeStats().
+BleuStats = collections.namedtuple(
+    'BleuStats',
+    ['hyp_ngram_matches', 'hyp_ngram_counts', 'num_ref_tokens',
+     'num_hyp_tokens'])
+
+
 class Unsegmenter(object):
   """Un-segments (merges) segmented strings.
 
@@ -92,35 +111,108 @@ class BleuScorer(object):
 
   def __init__(self, max_ngram=4, separator_type=None):
     self._max_ngram = max_ngram
+    self._separator_type = separator_type
     self._hyp_ngram_matches = [0 for _ in range(max_ngram)]
     self._hyp_ngram_counts = [0 for _ in range(max_ngram)]
     self._num_ref_tokens = 0
     self._num_hyp_tokens = 0
     self._unsegmenter = Unsegmenter(separator_type)
+    # Tokens are interned to ints so that n-grams are hashed as int tuples.
+    self._token_ids = {}
 
   @property
   def unsegmenter(self):
     return self._unsegmenter
 
+  @property
+  def stats(self):
+    """Returns the accumulated sufficient statistics as a `BleuStats`."""
+    return BleuStats(
+        hyp_ngram_matches=list(self._hyp_ngram_matches),
+        hyp_ngram_counts=list(self._hyp_ngram_counts),
+        num_ref_tokens=self._num_ref_tokens,
+        num_hyp_tokens=self._num_hyp_tokens)
+
+  def MergeStats(self, stats):
+    """Adds `BleuStats` accumulated elsewhere (e.g. another decoder shard)."""
+    if (len(stats.hyp_ngram_matches) != self._max_ngram or
+        len(stats.hyp_ngram_counts) != self._max_ngram):
+      raise ValueError('Cannot merge stats of max_ngram %d into a scorer with '
+                       'max_ngram %d.' %
+                       (len(stats.hyp_ngram_matches), self._max_ngram))
+    for order_idx in range(self._max_ngram):
+      self._hyp_ngram_matches[order_idx] += stats.hyp_ngram_matches[order_idx]
+      self._hyp_ngram_counts[order_idx] += stats.hyp_ngram_counts[order_idx]
+    self._num_ref_tokens += stats.num_ref_tokens
+    self._num_hyp_tokens += stats.num_hyp_tokens
+
+  def _ToIds(self, string):
+    tokens = _Tokenize(self._unsegmenter(string))
+    token_ids = self._token_ids
+    for t in tokens:
+      if t not in token_ids:
+        token_ids[t] = len(token_ids)
+    return tuple(map(token_ids.__getitem__, tokens))
+
   def AddSentence(self, ref_str, hyp_str):
-    """Accumulates ngram statistics for the given ref and hyp string pair."""
-    ref_tokens = tuple(_Tokenize(self._unsegmenter(ref_str)))
-    self._num_ref_tokens += len(ref_tokens)
-    hyp_tokens = tuple(_Tokenize(self._unsegmenter(hyp_str)))
-    self._num_hyp_tokens += len(hyp_tokens)
+    """Accumulates ngram statistics for the given ref and hyp string pair.
+
+    Args:
+      ref_str: The reference string, or a list of reference strings for
+        multi-reference BLEU. With multiple references hyp n-gram counts are
+        clipped by the maximum count over the references, and the reference
+        length closest to the hyp length (the shorter one on ties) is used for
+        the brevity penalty.
+      hyp_str: The hypothesis string.
+    """
+    hyp_ids = self._ToIds(hyp_str)
+    if isinstance(ref_str, (list, tuple)):
+      all_ref_ids = [self._ToIds(r) for r in ref_str]
+      self._num_ref_tokens += min(
+          (len(r) for r in all_ref_ids),
+          key=lambda n: (abs(n - len(hyp_ids)), n))
+    else:
+      all_ref_ids = [self._ToIds(ref_str)]
+      self._num_ref_tokens += len(all_ref_ids[0])
+    self._num_hyp_tokens += len(hyp_ids)
     for order_idx in range(self._max_ngram):
-      ref_counts = collections.Counter(NGrams(ref_tokens, order_idx + 1))
-      hyp_matches = collections.Counter()
-      hyp_count = 0
-      for x in NGrams(hyp_tokens, order_idx + 1):
-        hyp_count += 1
-        count = ref_counts[x]
-        if count:
-          # Clip hyp_matches so ngrams that are repeated more frequently in hyp
-          # than ref are not double counted.
-          hyp_matches[x] = min(hyp_matches[x] + 1, count)
-      self._hyp_ngram_matches[order_idx] += sum(six.itervalues(hyp_matches))
-      self._hyp_ngram_counts[order_idx] += hyp_count
+      hyp_counts = _NGramCounts(hyp_ids, order_idx + 1)
+      ref_counts = _NGramCounts(all_ref_ids[0], order_idx + 1)
+      for ref_ids in all_ref_ids[1:]:
+        ref_counts |= _NGramCounts(ref_ids, order_idx + 1)
+      # Clip hyp matches so ngrams that are repeated more frequently in hyp
+      # than ref are not double counted.
+      self._hyp_ngram_matches[order_idx] += sum(
+          map(min, six.itervalues(hyp_counts),
+              map(ref_counts.get, hyp_counts, itertools.repeat(0))))
+      self._hyp_ngram_counts[order_idx] += max(
+          0, len(hyp_ids) - order_idx)
+
+  def AddSentences(self, ref_strs, hyp_strs, num_workers=1):
+    """Accumulates ngram statistics for a batch of ref and hyp string pairs.
+
+    Args:
+      ref_strs: A list of references, each as accepted by AddSentence().
+      hyp_strs: A list of hypothesis strings of the same length.
+      num_workers: If > 1, the batch is split into that many chunks which are
+        scored in a pool of worker processes and merged into this scorer.
+    """
+    assert len(ref_strs) == len(hyp_strs)
+    if num_workers <= 1 or len(hyp_strs) < 2 * num_workers:
+      for ref_str, hyp_str in zip(ref_strs, hyp_strs):
+        self.AddSentence(ref_str, hyp_str)
+      return
+    chunk_size = (len(hyp_strs) + num_workers - 1) // num_workers
+    chunks = [(self._max_ngram, self._separator_type,
+               ref_strs[i:i + chunk_size], hyp_strs[i:i + chunk_size])
+              for i in range(0, len(hyp_strs), chunk_size)]
+    pool = multiprocessing.Pool(num_workers)
+    try:
+      for stats in pool.map(_ComputeBleuStats, chunks):
+        self.MergeStats(stats)
+    finally:
+      pool.close()
+      pool.join()
 
   def ComputeOverallScore(self):
     """Computes overall BLEU score from the statistics accumulated so far."""
@@ -140,3 +232,11 @@ class BleuScorer(object):
     if self._num_hyp_tokens < self._num_ref_tokens:
       brevity_penalty = math.exp(1 - self._num_ref_tokens/self._num_hyp_tokens)
     return brevity_penalty * precision
+
+
+def _ComputeBleuStats(args):
+  """Returns the `BleuStats` of a chunk of sentences. Used by AddSentences."""
+  max_ngram, separator_type, ref_strs, hyp_strs = args
+  scorer = BleuScorer(max_ngram=max_ngram, separator_type=separator_type)
+  scorer.AddSentences(ref_strs, hyp_strs)
+  return scorer.stats
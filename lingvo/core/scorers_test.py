@@ -96,6 +96,55 @@ class BleuScorerTest(tf.test.TestCase):
         scorer.AddSentence(ref, hyp)
     self.assertAlmostEqual(0.313776, scorer.ComputeOverallScore(), places=5)
 
+  def testBleuScorerAddSentencesMatchesAddSentence(self):
+    filename = test_helper.test_src_dir_path('core/ops/testdata/wmt/sm18.txt')
+    refs = []
+    hyps = []
+    with open(filename, 'rb') as fp:
+      for line in fp:
+        hyp, ref = line[:-1].split('\t')
+        refs.append(ref)
+        hyps.append(hyp)
+    scorer = scorers.BleuScorer()
+    for ref, hyp in zip(refs, hyps):
+      scorer.AddSentence(ref, hyp)
+    batch_scorer = scorers.BleuScorer()
+    batch_scorer.AddSentences(refs, hyps)
+    parallel_scorer = scorers.BleuScorer()
+    parallel_scorer.AddSentences(refs, hyps, num_workers=3)
+    self.assertEqual(scorer.stats, batch_scorer.stats)
+    self.assertEqual(scorer.stats, parallel_scorer.stats)
+    self.assertAlmostEqual(0.313776, parallel_scorer.ComputeOverallScore(),
+                           places=5)
+
+  def testBleuScorerMergeStats(self):
+    scorer = scorers.BleuScorer(max_ngram=4)
+    scorer.AddSentence('hyp matches ref str', 'hyp matches ref str')
+    scorer.AddSentence('almost right', 'almost write')
+    shard0 = scorers.BleuScorer(max_ngram=4)
+    shard0.AddSentence('hyp matches ref str', 'hyp matches ref str')
+    shard1 = scorers.BleuScorer(max_ngram=4)
+    shard1.AddSentence('almost right', 'almost write')
+    merged = scorers.BleuScorer(max_ngram=4)
+    merged.MergeStats(shard0.stats)
+    merged.MergeStats(shard1.stats)
+    self.assertEqual(scorer.stats, merged.stats)
+    self.assertAlmostEqual(scorer.ComputeOverallScore(),
+                           merged.ComputeOverallScore())
+    with self.assertRaises(ValueError):
+      scorers.BleuScorer(max_ngram=2).MergeStats(shard0.stats)
+
+  def testBleuScorerMultipleReferences(self):
+    scorer = scorers.BleuScorer(max_ngram=2)
+    # Unigrams 'a', 'b' match the first ref and 'e' only the second one.
+    # Bigram 'a b' matches and 'b e' does not.
+    scorer.AddSentence(['a b c', 'x e'], 'a b e')
+    stats = scorer.stats
+    self.assertEqual([3, 1], stats.hyp_ngram_matches)
+    self.assertEqual([3, 2], stats.hyp_ngram_counts)
+    # The first reference has the closest length.
+    self.assertEqual(3, stats.num_ref_tokens)
+
 
 if __name__ == '__main__':
   tf.test.main()
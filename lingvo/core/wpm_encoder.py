@@ -29,8 +29,11 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import heapq
+import random
 import sys
 
+import six
 import tensorflow as tf
 
 from lingvo.core.ops import py_x_ops
@@ -44,6 +47,10 @@ SENTENCE_END_STRING = '</s>'
 
 BOW_STR = '▁'
 
+# Max number of distinct words cached by WpmEncoder.EncodeBatch(). The cache is
+# cleared when full to bound memory when streaming over large corpora.
+_MAX_WORD_CACHE_SIZE = 1 << 20
+
 
 class WpmEncoder(object):
 
@@ -62,6 +69,11 @@ class WpmEncoder(object):
         piece = line.strip().split('\t')[0]
         self._pieces.append(piece)
     self._merge_prob = merge_prob
+    # Lookup tables and per-word cache of the native (non-graph) encoder, built
+    # lazily by EncodeBatch().
+    self._piece_to_id = None
+    self._id_to_piece = None
+    self._word_cache = {}
 
   def _TokenToString(self, token):
     return py_x_ops.vocab_id_to_token(token, vocab=self._pieces)
@@ -171,6 +183,106 @@ class WpmEncoder(object):
     ids = ids_ta.stack()
     return ids, self._TokenToString(ids)
 
+  def _BuildNativeLookup(self):
+    """Builds piece <-> id tables with the same ids as the vocab ops."""
+    # Same as Vocab::Load: empty lines are skipped and later duplicates win.
+    self._piece_to_id = {}
+    self._id_to_piece = []
+    for piece in self._pieces:
+      if not piece:
+        continue
+      self._piece_to_id[piece] = len(self._id_to_piece)
+      self._id_to_piece.append(piece)
+
+  def _NativeEncodeWord(self, word):
+    """Encodes one word with a priority queue of merge candidates.
+
+    Produces the same merges as _EncodeToIds(): the candidate whose merged
+    piece has the smallest id is merged first, the leftmost one on ties.
+
+    Args:
+      word: A unicode string, including the beginning-of-word prefix.
+
+    Returns:
+      A list of wordpiece ids.
+    """
+    piece_to_id = self._piece_to_id
+    id_to_piece = self._id_to_piece
+    unk_id = self.unk_id
+    tokens = [piece_to_id.get(c, unk_id) for c in word]
+    # Tokens form a doubly linked list; merged tokens are marked dead. A heap
+    # entry (merged_id, left, right, left_version, right_version) is stale
+    # once either side was merged since the entry was pushed.
+    num_tokens = len(tokens)
+    nexts = list(range(1, num_tokens + 1))
+    prevs = list(range(-1, num_tokens - 1))
+    versions = [0] * num_tokens
+    alive = [True] * num_tokens
+    heap = []
+
+    def _PushCandidate(left, right):
+      merged_id = piece_to_id.get(
+          id_to_piece[tokens[left]] + id_to_piece[tokens[right]])
+      if merged_id is not None:
+        heapq.heappush(
+            heap, (merged_id, left, right, versions[left], versions[right]))
+
+    for i in range(num_tokens - 1):
+      _PushCandidate(i, i + 1)
+    while heap:
+      merged_id, left, right, left_ver, right_ver = heapq.heappop(heap)
+      if (not alive[left] or not alive[right] or versions[left] != left_ver or
+          versions[right] != right_ver):
+        continue
+      if self._merge_prob < 1. and random.random() >= self._merge_prob:
+        break
+      tokens[left] = merged_id
+      versions[left] += 1
+      alive[right] = False
+      nexts[left] = nexts[right]
+      if nexts[left] < num_tokens:
+        prevs[nexts[left]] = left
+      if prevs[left] >= 0:
+        _PushCandidate(prevs[left], left)
+      if nexts[left] < num_tokens:
+        _PushCandidate(left, nexts[left])
+    return [t for t, a in zip(tokens, alive) if a]
+
+  def EncodeBatch(self, texts):
+    """Encodes a batch of strings in Python, without building a TF graph.
+
+    Produces the same ids as Encode(). Words are encoded with a priority queue
+    of merge candidates, and unless merge_prob < 1 the encoding of every
+    distinct word is cached across calls.
+
+    Args:
+      texts: A list of strings (unicode or utf-8 encoded bytes).
+
+    Returns:
+      A list with one (ids, pieces) tuple per text, where ids is a list of
+      wordpiece ids and pieces the list of corresponding unicode strings.
+    """
+    if self._piece_to_id is None:
+      self._BuildNativeLookup()
+    use_cache = self._merge_prob >= 1.
+    bow_str = tf.compat.as_text(BOW_STR)
+    results = []
+    for text in texts:
+      if not isinstance(text, six.text_type):
+        text = text.decode('utf-8')
+      ids = []
+      for word in text.split():
+        word_ids = self._word_cache.get(word) if use_cache else None
+        if word_ids is None:
+          word_ids = self._NativeEncodeWord(bow_str + word)
+          if use_cache:
+            if len(self._word_cache) >= _MAX_WORD_CACHE_SIZE:
+              self._word_cache.clear()
+            self._word_cache[word] = word_ids
+        ids.extend(word_ids)
+      results.append((ids, [self._id_to_piece[i] for i in ids]))
+    return results
+
   def Decode(self, ids):
     txt = tf.strings.reduce_join(self._TokenToString(ids))
     txt = tf.strings.regex_replace(txt, BOW_STR, ' ')
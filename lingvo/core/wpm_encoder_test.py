@@ -104,6 +104,24 @@ class WpmEncoderTest(tf.test.TestCase):
                        tf.strings.reduce_join(strs, separator=' ').eval())
       self.assertEqual('føö', self._enc.Decode(ids).eval())
 
+  def testEncodeBatchMatchesEncode(self):
+    texts = ['Ditto', 'Ditto Ditto', '', '\\', 'føö', 'for fort tort Dior-']
+    batch = self._enc.EncodeBatch(texts)
+    self.assertEqual(len(texts), len(batch))
+    with tf.Session() as sess:
+      for text, (native_ids, native_strs) in zip(texts, batch):
+        ids, strs = sess.run(self._enc.Encode(text))
+        self.assertEqual(ids.tolist(), native_ids)
+        self.assertEqual([s.decode('utf-8') for s in strs], native_strs)
+    # The second call is served from the word cache.
+    self.assertEqual(batch, self._enc.EncodeBatch(texts))
+
+  def testEncodeBatchMergeProb(self):
+    voc = self._CreateVocab()
+    enc = wpm_encoder.WpmEncoder(voc, merge_prob=0.)
+    ((_, strs),) = enc.EncodeBatch(['Ditto'])
+    self.assertEqual(tf.compat.as_text('▁ D i t t o'), ' '.join(strs))
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -17,8 +17,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-import copy
-
+import numpy as np
 import six
 
 import tensorflow as tf
@@ -95,65 +94,176 @@ def EditDistance(ref_str, hyp_str):
     del:         number of deletions.
     total:       total difference length.
   """
+  return _EditDistanceInTokens(Tokenize(ref_str), Tokenize(hyp_str))
 
-  class ErrorStats(object):
-    """Class to keep track of error counts.
 
-    """
+def EditDistanceInIds(ref_ids, hyp_ids):
+  """Computes Levenshtein edit distance between two sequences of token ids.
 
-    def __init__(self, ins, dels, subs, tot):
-      self.ins, self.dels, self.subs, self.total_cost = ins, dels, subs, tot
+  Args:
+    ref_ids: A sequence of integer ids of the ref sentence.
+    hyp_ids: A sequence of integer ids of one actual hyp.
 
-    def __repr__(self):
-      return 'ErrorStats(ins=%d, dels=%d, subs=%d, tot=%d)' % (
-          self.ins, self.dels, self.subs, self.total_cost)
+  Returns:
+    A tuple (ins, subs, dels, total), same as EditDistance.
+  """
+  return _EditDistanceInTokens(list(ref_ids), list(hyp_ids))
 
-  # temp sequence to remember error type and stats.
-  e, cur_e = [], []
-  lst_ref = Tokenize(ref_str)
-  for i in range(len(lst_ref) + 1):
-    e.append(ErrorStats(0, i, 0, i))
-    cur_e.append(ErrorStats(0, 0, 0, 0))
 
-  lst_hyp = Tokenize(hyp_str)
-  for hyp_index in range(1, len(lst_hyp) + 1):
-    cur_e[0] = copy.copy(e[0])
-    cur_e[0].ins += 1
-    cur_e[0].total_cost += 1
+def _EditDistanceInTokens(lst_ref, lst_hyp):
+  """Single pair Levenshtein distance over two lists of comparable tokens.
 
-    for ref_index in range(1, len(lst_ref) + 1):
-      ins_err = e[ref_index].total_cost + 1
-      del_err = cur_e[ref_index - 1].total_cost + 1
-      sub_err = e[ref_index - 1].total_cost
-      if lst_hyp[hyp_index - 1] != lst_ref[ref_index - 1]:
-        sub_err += 1
+  Every cell of the DP holds an (ins, subs, dels, total) tuple. Ties are broken
+  in the order substitution, deletion, insertion, which determines how 'total'
+  is split into the three error types.
 
+  Args:
+    lst_ref: A list of reference tokens.
+    lst_hyp: A list of hypothesis tokens.
+
+  Returns:
+    A tuple (ins, subs, dels, total).
+  """
+  e = [(0, 0, i, i) for i in range(len(lst_ref) + 1)]
+  for hyp_tok in lst_hyp:
+    cur_e = [(e[0][0] + 1, e[0][1], e[0][2], e[0][3] + 1)]
+    for ref_index in range(1, len(lst_ref) + 1):
+      ins_err = e[ref_index][3] + 1
+      del_err = cur_e[ref_index - 1][3] + 1
+      mismatch = int(hyp_tok != lst_ref[ref_index - 1])
+      sub_err = e[ref_index - 1][3] + mismatch
       if sub_err < ins_err and sub_err < del_err:
-        cur_e[ref_index] = copy.copy(e[ref_index - 1])
-        if lst_hyp[hyp_index - 1] != lst_ref[ref_index - 1]:
-          cur_e[ref_index].subs += 1
-        cur_e[ref_index].total_cost = sub_err
+        ins, subs, dels, _ = e[ref_index - 1]
+        cur_e.append((ins, subs + mismatch, dels, sub_err))
       elif del_err < ins_err:
-        cur_e[ref_index] = copy.copy(cur_e[ref_index - 1])
-        cur_e[ref_index].total_cost = del_err
-        cur_e[ref_index].dels += 1
+        ins, subs, dels, _ = cur_e[ref_index - 1]
+        cur_e.append((ins, subs, dels + 1, del_err))
       else:
-        cur_e[ref_index] = copy.copy(e[ref_index])
-        cur_e[ref_index].total_cost = ins_err
-        cur_e[ref_index].ins += 1
+        ins, subs, dels, _ = e[ref_index]
+        cur_e.append((ins + 1, subs, dels, ins_err))
+    e = cur_e
+  return e[-1]
 
-    for i in range(len(e)):
-      e[i] = copy.copy(cur_e[i])
 
-  return e[-1].ins, e[-1].subs, e[-1].dels, e[-1].total_cost
+def BatchEditDistance(ref_strs, hyp_strs, chunk_size=256):
+  """Computes Levenshtein edit distances for many (ref, hyp) string pairs.
 
+  Strings are tokenized with Tokenize() and the tokens are mapped to ids before
+  running BatchEditDistanceInIds.
 
-def EditDistanceInIds(ref_ids, hyp_ids):
-  ref_ids = ['%d' % x for x in ref_ids]
-  hyp_ids = ['%d' % x for x in hyp_ids]
-  ref_str = ' '.join(ref_ids)
-  hyp_str = ' '.join(hyp_ids)
-  return EditDistance(ref_str, hyp_str)
+  Args:
+    ref_strs: A list of N reference strings.
+    hyp_strs: A list of N hypothesis strings.
+    chunk_size: Maximum number of pairs processed by one vectorized sweep.
+
+  Returns:
+    An int64 numpy array of shape [N, 4]. Row i holds (ins, subs, dels, total)
+    for the i-th pair, same as EditDistance(ref_strs[i], hyp_strs[i]).
+  """
+  vocab = {}
+
+  def _ToIds(string):
+    return [vocab.setdefault(t, len(vocab)) for t in Tokenize(string)]
+
+  ref_ids = [_ToIds(s) for s in ref_strs]
+  hyp_ids = [_ToIds(s) for s in hyp_strs]
+  return BatchEditDistanceInIds(ref_ids, hyp_ids, chunk_size=chunk_size)
+
+
+def BatchEditDistanceInIds(ref_ids, hyp_ids, chunk_size=256):
+  """Computes Levenshtein edit distances for many (ref, hyp) id sequence pairs.
+
+  Pairs are sorted by length and processed in chunks. Within a chunk the DP is
+  swept along anti-diagonals, so every numpy op updates one anti-diagonal of
+  every pair in the chunk at once. The results are identical to calling
+  EditDistanceInIds on every pair.
+
+  Args:
+    ref_ids: A list of N sequences of integer reference ids.
+    hyp_ids: A list of N sequences of integer hypothesis ids.
+    chunk_size: Maximum number of pairs processed by one vectorized sweep.
+
+  Returns:
+    An int64 numpy array of shape [N, 4]. Row i holds (ins, subs, dels, total)
+    for the i-th pair.
+  """
+  assert len(ref_ids) == len(hyp_ids)
+  assert chunk_size > 0
+  num_pairs = len(ref_ids)
+  results = np.zeros([num_pairs, 4], dtype=np.int64)
+  order = sorted(
+      range(num_pairs), key=lambda i: (len(ref_ids[i]), len(hyp_ids[i])))
+  for start in range(0, num_pairs, chunk_size):
+    indices = order[start:start + chunk_size]
+    results[indices] = _BatchEditDistanceChunk([ref_ids[i] for i in indices],
+                                               [hyp_ids[i] for i in indices])
+  return results
+
+
+def _PadIds(seqs, pad_id):
+  """Returns a padded [B, max(1, max_len)] int64 array and the lengths."""
+  lens = np.array([len(s) for s in seqs], dtype=np.int64)
+  padded = np.full([len(seqs), max(1, int(lens.max()))], pad_id, np.int64)
+  for i, s in enumerate(seqs):
+    padded[i, :len(s)] = s
+  return padded, lens
+
+
+def _BatchEditDistanceChunk(ref_ids, hyp_ids):
+  """Anti-diagonal DP over one chunk of pairs. See BatchEditDistanceInIds."""
+  # Pad with different ids so that padding never matches. Padded cells are
+  # never read by the cells that lead to a pair's final result.
+  refs, ref_lens = _PadIds(ref_ids, -1)
+  hyps, hyp_lens = _PadIds(hyp_ids, -2)
+  batch = refs.shape[0]
+  max_ref = int(ref_lens.max())
+  max_hyp = int(hyp_lens.max())
+  final_diag = ref_lens + hyp_lens
+  results = np.zeros([batch, 4], dtype=np.int64)
+
+  # Diagonal d holds DP cells (i, j) with i + j = d, indexed by the ref position
+  # j. Every cell holds (ins, subs, dels, total) along the leading axis.
+  ref_pos = np.arange(max_ref + 1)
+  prev2 = np.zeros([4, batch, max_ref + 1], dtype=np.int64)
+  prev = np.zeros([4, batch, max_ref + 1], dtype=np.int64)
+  sub_inc = np.array([0, 1, 0, 1], dtype=np.int64)[:, None, None]
+  del_inc = np.array([0, 0, 1, 1], dtype=np.int64)[:, None, None]
+  ins_inc = np.array([1, 0, 0, 1], dtype=np.int64)[:, None, None]
+  # Reference token for cell column j is refs[:, j - 1].
+  ref_toks = np.concatenate([np.full([batch, 1], -1, np.int64), refs], axis=1)
+  ref_toks = ref_toks[:, :max_ref + 1]
+  for d in range(max_ref + max_hyp + 1):
+    cur = np.zeros_like(prev)
+    if d > 0:
+      # Cell (i - 1, j) is in prev at j, (i, j - 1) is in prev at j - 1 and
+      # (i - 1, j - 1) is in prev2 at j - 1.
+      del_src = np.zeros_like(prev)
+      del_src[:, :, 1:] = prev[:, :, :-1]
+      sub_src = np.zeros_like(prev2)
+      sub_src[:, :, 1:] = prev2[:, :, :-1]
+      hyp_pos = np.clip(d - ref_pos - 1, 0, hyps.shape[1] - 1)
+      mismatch = (hyps[:, hyp_pos] != ref_toks).astype(np.int64)
+      ins_err = prev[3] + 1
+      del_err = del_src[3] + 1
+      sub_err = sub_src[3] + mismatch
+      choose_sub = (sub_err < ins_err) & (sub_err < del_err)
+      choose_del = ~choose_sub & (del_err < ins_err)
+      cur = np.where(
+          choose_sub, sub_src + sub_inc * mismatch,
+          np.where(choose_del, del_src + del_inc, prev + ins_inc))
+      # Boundary cells (d, 0) and (0, d).
+      cur[:, :, 0] = 0
+      cur[0, :, 0] = d
+      cur[3, :, 0] = d
+      if d <= max_ref:
+        cur[:, :, d] = 0
+        cur[2, :, d] = d
+        cur[3, :, d] = d
+    done = np.nonzero(final_diag == d)[0]
+    if done.size:
+      results[done] = cur[:, done, ref_lens[done]].T
+    prev2, prev = prev, cur
+  return results
 
 
 def FilterEpsilon(string):
@@ -17,6 +17,9 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import time
+
+import numpy as np
 import tensorflow as tf
 
 from lingvo.tasks.asr import decoder_utils
@@ -164,6 +167,77 @@ class DecoderUtilsEditDistanceTest(tf.test.TestCase):
     hyp = "a b c d e   f g h"
     self.assertEqual((0, 0, 0, 0), decoder_utils.EditDistance(ref, hyp))
 
+  def testBatchEditDistance(self):
+    refs = [
+        "a b c d e f g h", "a b c d e f g h", "a b c d e f g j h",
+        "a b c d e f g j h", "", "", "a b c d", "a b c d e   f g h"
+    ]
+    hyps = [
+        "a b c d e f g h", "a b d e f g h", "a b c i d e f g h",
+        "a b c i e f g h k", "", "a b c", "", "a b c d e f g h"
+    ]
+    expected = [decoder_utils.EditDistance(r, h) for r, h in zip(refs, hyps)]
+    self.assertAllEqual(expected, decoder_utils.BatchEditDistance(refs, hyps))
+    self.assertAllEqual(
+        np.zeros([0, 4]), decoder_utils.BatchEditDistance([], []))
+
+  def testBatchEditDistanceInIdsMatchesEditDistanceInIds(self):
+    np.random.seed(12345)
+    refs = []
+    hyps = []
+    for _ in range(500):
+      refs.append(np.random.randint(0, 5, size=np.random.randint(0, 12)))
+      hyps.append(np.random.randint(0, 5, size=np.random.randint(0, 12)))
+    expected = [
+        decoder_utils.EditDistanceInIds(r, h) for r, h in zip(refs, hyps)
+    ]
+    # A small chunk size so that several chunks with different lengths are
+    # processed.
+    self.assertAllEqual(
+        expected,
+        decoder_utils.BatchEditDistanceInIds(refs, hyps, chunk_size=37))
+
+
+class DecoderUtilsEditDistanceBenchmark(tf.test.Benchmark):
+  """Benchmarks for batched edit distance.
+
+  Run with --benchmarks=DecoderUtilsEditDistanceBenchmark.
+  """
+
+  def _LibriSpeechLikePairs(self, num_pairs):
+    """Returns pairs with ~LibriSpeech utterance lengths and ~10% WER."""
+    np.random.seed(12345)
+    refs = []
+    hyps = []
+    for _ in range(num_pairs):
+      ref = np.random.randint(0, 10000, size=np.random.randint(5, 60))
+      hyp = [
+          t for t in ref if np.random.rand() > 0.03
+      ] + list(np.random.randint(0, 10000, size=np.random.randint(0, 2)))
+      hyp = np.array(hyp)
+      sub_mask = np.random.rand(len(hyp)) < 0.05
+      hyp[sub_mask] = np.random.randint(0, 10000, size=sub_mask.sum())
+      refs.append(ref)
+      hyps.append(hyp)
+    return refs, hyps
+
+  def benchmarkBatchEditDistanceInIds(self):
+    refs, hyps = self._LibriSpeechLikePairs(10000)
+    start = time.time()
+    batched = decoder_utils.BatchEditDistanceInIds(refs, hyps)
+    batched_time = time.time() - start
+    start = time.time()
+    unbatched = [
+        decoder_utils.EditDistanceInIds(r, h) for r, h in zip(refs, hyps)
+    ]
+    unbatched_time = time.time() - start
+    assert np.array_equal(batched, unbatched)
+    self.report_benchmark(
+        iters=1,
+        wall_time=batched_time,
+        name="BatchEditDistanceInIds_10k",
+        extras={"unbatched_wall_time": unbatched_time})
+
 
 if __name__ == "__main__":
   tf.test.main()
@@ -293,6 +293,29 @@ class AsrModel(base_model.BaseTask):
           return_ids.append(ref_ids[i])
       return return_ids
 
+    num_hyps_per_beam = p.decoder.beam_search.num_hyps_per_beam
+    filtered_refs = []
+    filtered_hyps = []
+    ref_ids_list = []
+    top_hyp_ids_list = []
+    for i in range(len(transcripts)):
+      assert num_hyps_per_beam == len(topk_decoded[i])
+      filtered_ref = decoder_utils.FilterNoise(transcripts[i])
+      filtered_ref = decoder_utils.FilterEpsilon(filtered_ref)
+      for hyp_str in topk_decoded[i]:
+        filtered_hyp = decoder_utils.FilterNoise(hyp_str)
+        filtered_hyp = decoder_utils.FilterEpsilon(filtered_hyp)
+        filtered_refs.append(filtered_ref)
+        filtered_hyps.append(filtered_hyp)
+      ref_ids_list.append(GetRefIds(target_labels[i], target_paddings[i]))
+      hyp_index = i * num_hyps_per_beam
+      top_hyp_ids_list.append(topk_ids[hyp_index][:topk_lens[hyp_index]])
+
+    # Edit distances of all hyps in the batch are computed in one go.
+    word_errs = decoder_utils.BatchEditDistance(filtered_refs, filtered_hyps)
+    token_errs = decoder_utils.BatchEditDistanceInIds(ref_ids_list,
+                                                      top_hyp_ids_list)
+
     total_errs = 0
     total_oracle_errs = 0
     total_ref_words = 0
@@ -307,24 +330,16 @@ class AsrModel(base_model.BaseTask):
       tf.logging.info('utt_id: %s', utt_id[i])
       tf.logging.info('  ref_str: %s', ref_str)
       hyps = topk_decoded[i]
-      ref_ids = GetRefIds(target_labels[i], target_paddings[i])
-      hyp_index = i * p.decoder.beam_search.num_hyps_per_beam
-      top_hyp_ids = topk_ids[hyp_index][:topk_lens[hyp_index]]
-      total_ref_tokens += len(ref_ids)
-      _, _, _, token_errs = decoder_utils.EditDistanceInIds(
-          ref_ids, top_hyp_ids)
-      total_token_errs += token_errs
-
-      assert p.decoder.beam_search.num_hyps_per_beam == len(hyps)
-      filtered_ref = decoder_utils.FilterNoise(ref_str)
-      filtered_ref = decoder_utils.FilterEpsilon(filtered_ref)
+      total_ref_tokens += len(ref_ids_list[i])
+      total_token_errs += token_errs[i][3]
+
       oracle_errs = norm_wer_errors[i][0]
       for n, (score, hyp_str) in enumerate(zip(topk_scores[i], hyps)):
         tf.logging.info('  %f: %s', score, hyp_str)
-        filtered_hyp = decoder_utils.FilterNoise(hyp_str)
-        filtered_hyp = decoder_utils.FilterEpsilon(filtered_hyp)
-        ins, subs, dels, errs = decoder_utils.EditDistance(
-            filtered_ref, filtered_hyp)
+        hyp_index = i * num_hyps_per_beam + n
+        filtered_ref = filtered_refs[hyp_index]
+        filtered_hyp = filtered_hyps[hyp_index]
+        ins, subs, dels, errs = word_errs[hyp_index]
         # Note that these numbers are not consistent with what is used to
         # compute normalized WER.  In particular, these numbers will be inflated
         # when the transcript contains punctuation.
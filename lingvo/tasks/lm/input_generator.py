@@ -21,6 +21,7 @@ from __future__ import print_function
 import tensorflow as tf
 
 from lingvo.core import base_input_generator
+from lingvo.core import input_generator_helper
 from lingvo.core import py_utils
 from lingvo.core import tokenizers
 from lingvo.core.ops import py_x_ops
@@ -43,6 +44,8 @@ class LmInput(base_input_generator.BaseSequenceInputGenerator):
 
     text, self._word_count = self._BuildDataSource()
     self._ids, self._labels, self._paddings = self.StringsToIds(text)
+    if p.packing_factor:
+      self._Pack()
     self._input_batch_size = tf.shape(self._ids)[0]
     tf.summary.histogram('examples/sequence_length',
                          tf.reduce_sum(1.0 - self._paddings, axis=1))
@@ -53,6 +56,8 @@ class LmInput(base_input_generator.BaseSequenceInputGenerator):
       # generator can generate a batch smaller than
       # bucket_batch_limit.
       assert not p.flush_every_n, 'flush_every_n is not allowed on TPU.'
+      assert not p.bucket_max_tokens, (
+          'bucket_max_tokens is not allowed on TPU: batch sizes vary.')
       assert min(self.scaled_bucket_batch_limit) == max(
           self.scaled_bucket_batch_limit)
       bs = min(self.scaled_bucket_batch_limit)
@@ -66,6 +71,37 @@ class LmInput(base_input_generator.BaseSequenceInputGenerator):
       SetShape(self._weights)
       self._word_count.set_shape([bs])
 
+  def _Pack(self):
+    """Packs the sentences into rows of target_max_length.
+
+    The batch gets segment_ids and segment_pos, which the LM must use to keep
+    packed sentences from attending to each other, see
+    TransformerLmNoEmbedding.packed_input.
+    """
+    p = self.params
+    assert min(self.scaled_bucket_batch_limit) == max(
+        self.scaled_bucket_batch_limit), (
+            'Packing requires the same batch limit for all buckets.')
+    lengths = tf.to_int32(tf.reduce_sum(1.0 - self._paddings, 1))
+    segment_ids, self._segment_pos, indices, _, _, _ = py_x_ops.pack_sequences(
+        lengths,
+        lengths,
+        packed_batch_size=min(self.scaled_bucket_batch_limit),
+        packed_src_seq_len=p.target_max_length,
+        packed_tgt_seq_len=p.target_max_length)
+    self._segment_ids = tf.to_float(segment_ids)
+    apply_packing = input_generator_helper.ApplyPacking
+    self._ids = apply_packing(self._ids, 0, indices, self._segment_pos)
+    self._labels = apply_packing(self._labels, 0, indices, self._segment_pos)
+    self._paddings = apply_packing(self._paddings, 1, indices,
+                                   self._segment_pos)
+    # Each row counts the words of all the sentences that start in it.
+    starts = tf.logical_and(
+        tf.greater_equal(indices, 0), tf.equal(self._segment_pos, 0))
+    self._word_count = tf.reduce_sum(
+        tf.where(starts, tf.gather(self._word_count, tf.maximum(indices, 0)),
+                 tf.zeros_like(indices, dtype=self._word_count.dtype)), 1)
+
   def _DataSourceFromFilePattern(self, file_pattern):
 
     def ReadInput(line):
@@ -85,4 +121,7 @@ class LmInput(base_input_generator.BaseSequenceInputGenerator):
     ret.paddings = self._paddings
     ret.weights = self._weights
     ret.word_count = self._word_count
+    if self.params.packing_factor:
+      ret.segment_ids = self._segment_ids
+      ret.segment_pos = self._segment_pos
     return ret
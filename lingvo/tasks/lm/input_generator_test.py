@@ -19,6 +19,7 @@ from __future__ import division
 from __future__ import print_function
 
 import os
+import numpy as np
 import tensorflow as tf
 
 from lingvo.core import test_helper
@@ -57,6 +58,24 @@ class InputGeneratorTest(tf.test.TestCase):
       self.assertEqual(expected_ids, inp_batch.ids.tolist())
       self.assertEqual([[1.0] * 20, [1.0] * 20], inp_batch.weights.tolist())
 
+  def testLmInputGenPacking(self):
+    p = self._InputParams()
+    p.target_max_length = 40
+    p.packing_factor = 2.0
+
+    with self.session(use_gpu=False) as sess:
+      inp = p.cls(p)
+      inp_batch = sess.run(inp.InputBatch())
+      self.assertEqual((2, 40), inp_batch.ids.shape)
+      self.assertEqual((2, 40), inp_batch.segment_ids.shape)
+      self.assertEqual((2,), inp_batch.word_count.shape)
+      for b in range(2):
+        length = int(np.sum(inp_batch.weights[b]))
+        pos = inp_batch.segment_pos[b, :length]
+        # Each packed sentence starts with <s>.
+        self.assertAllEqual(inp_batch.ids[b, :length][pos == 0],
+                            [1] * np.sum(pos == 0))
+
 
 if __name__ == "__main__":
   tf.test.main()
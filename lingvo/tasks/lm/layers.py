@@ -24,6 +24,7 @@ from six.moves import zip
 import tensorflow as tf
 
 from lingvo.core import base_layer
+from lingvo.core import kv_cache
 from lingvo.core import layers
 from lingvo.core import layers_with_attention
 from lingvo.core import py_utils
@@ -775,6 +776,15 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
         'sub-layer.')
     p.Define('softmax', layers.SimpleFullSoftmax.Params(),
              'The softmax layer params.')
+    p.Define(
+        'kv_cache_max_len', 0, 'If > 0, Step() keeps the self-attention keys '
+        'and values of each layer in a preallocated kv_cache of this many '
+        'steps, updated in place, instead of growing them by '
+        'concatenation. Must be at least the number of steps taken.')
+    p.Define(
+        'packed_input', False, 'If True, each row of the input may pack '
+        'several sentences, and FProp() requires their segment_ids and '
+        'segment_pos, so that sentences do not attend to each other.')
 
     # Default config for the transformer layers.
     p.trans_tpl.has_aux_atten = False
@@ -807,6 +817,7 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
       for i in range(p.num_trans_layers):
         params = p.trans_tpl.Copy()
         params.source_dim = p.model_dim
+        params.packed_input = p.packed_input
         params.name = 'layer_%d' % i
         params_trans_layers.append(params)
       self.CreateChildren('trans', params_trans_layers)
@@ -817,6 +828,14 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
 
   def zero_state(self, batch_size):
     p = self.params
+    if p.kv_cache_max_len > 0:
+      state = py_utils.NestedMap({
+          'layer_%d' % layer: kv_cache.ZeroKVCache(
+              p.kv_cache_max_len, batch_size, p.model_dim)
+          for layer in range(p.num_trans_layers)
+      })
+      state.time_step = tf.constant(0)
+      return state
     return py_utils.NestedMap({
         'layer_%d' % layer: py_utils.NestedMap({
             'key': tf.zeros([0, batch_size, p.model_dim]),
@@ -837,7 +856,8 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
         layer and its children layers.
       inputs: a tensor of shape [batch, model_dim].
       paddings: a 0/1 tensor of shape [batch]. Unused here.
-      state0: A `.NestedMap` containing the prefix states up to step t-1.
+      state0: A `.NestedMap` containing the prefix states up to step t-1, and
+        the current step `time_step` if p.kv_cache_max_len > 0.
       *args: optional extra arguments.
       **kwargs: optional extra keyword arguments.
 
@@ -851,11 +871,15 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
         state1:
           The updated prefix states including step t.
     """
-
-    prefix_len, _ = py_utils.GetShape(state0['layer_0'].key, 2)
+    p = self.params
+    if p.kv_cache_max_len > 0:
+      t = state0.time_step
+      prefix_len = t
+    else:
+      t = None
+      prefix_len, _ = py_utils.GetShape(state0['layer_0'].key, 2)
     # [1, model_dim]
-    posit_embs = self.position_emb.FProp(theta.position_emb,
-                                         prefix_len + 1)[-1:, :]
+    posit_embs = self.position_emb.FPropAt(theta.position_emb, prefix_len)
     # [batch, model_dim]
     input_embs = inputs + posit_embs
     input_embs = self.input_dropout.FProp(theta.input_dropout, input_embs)
@@ -868,9 +892,11 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
       layer_prefix_states = state0['layer_%i' % i]
       # [batch, model_dim]
       layer_out, _, updated_prefix_states = layer.ExtendStep(
-          layer_theta, layer_in, layer_prefix_states)
+          layer_theta, layer_in, layer_prefix_states, t=t)
       state1['layer_%i' % i] = updated_prefix_states
       layer_in = layer_out
+    if t is not None:
+      state1.time_step = t + 1
 
     # [batch, vocab_size]
     logits = self.softmax.Logits(theta=theta.softmax, inputs=layer_out)
@@ -878,7 +904,14 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
     output = py_utils.NestedMap(logits=logits, last_hidden=layer_out)
     return output, state1
 
-  def FProp(self, theta, inputs, paddings, state0=None, labels=None):
+  def FProp(self,
+            theta,
+            inputs,
+            paddings,
+            state0=None,
+            labels=None,
+            segment_ids=None,
+            segment_pos=None):
     """Computes xent loss given the language model input activations.
 
     Args:
@@ -895,6 +928,10 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
           the target class labels.
         - class_probabilities, a tensor with shape [time, batch, vocab_size] of
           float values indicating class-membership probabilities.
+      segment_ids: Required if p.packed_input. A tensor of shape [time,
+        batch], the id of the sentence packed at each position.
+      segment_pos: Required if p.packed_input. An int tensor of shape [time,
+        batch], the position of each token in its sentence.
 
     Returns:
       If `labels` is not None, returns (xent_output, None), where
@@ -907,9 +944,18 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
     inputs = py_utils.HasShape(inputs, [seqlen, batch, p.model_dim])
     paddings = py_utils.HasShape(paddings, [seqlen, batch])
 
-    # [time, 1, model_dim]
-    posit_embs = tf.expand_dims(
-        self.position_emb.FProp(theta.position_emb, seqlen), 1)
+    if p.packed_input:
+      assert segment_ids is not None and segment_pos is not None, (
+          'Need segment_ids and segment_pos for packed input.')
+      # [time, batch, model_dim]
+      posit_embs = tf.transpose(
+          self.position_emb.FPropWithPosition(theta.position_emb,
+                                              tf.transpose(segment_pos)),
+          [1, 0, 2])
+    else:
+      # [time, 1, model_dim]
+      posit_embs = tf.expand_dims(
+          self.position_emb.FProp(theta.position_emb, seqlen), 1)
     # [time, batch, model_dim]
     input_embs = inputs + posit_embs
     input_embs = self.input_dropout.FProp(theta.input_dropout, input_embs)
@@ -917,7 +963,8 @@ class TransformerLmNoEmbedding(BaseLanguageModel):
     layer_in = input_embs
     for layer, layer_theta in zip(self.trans, theta.trans):
       # [time, batch, model_dim]
-      layer_out, _ = layer.FProp(layer_theta, layer_in, paddings)
+      layer_out, _ = layer.FProp(
+          layer_theta, layer_in, paddings, source_segment_id=segment_ids)
       layer_in = layer_out
 
     if labels is None:
@@ -1052,7 +1099,14 @@ class TransformerLm(TransformerLmNoEmbedding):
     with tf.variable_scope(p.name):
       self.CreateChild('emb', p.emb)
 
-  def FProp(self, theta, inputs, paddings, state0=None, labels=None):
+  def FProp(self,
+            theta,
+            inputs,
+            paddings,
+            state0=None,
+            labels=None,
+            segment_ids=None,
+            segment_pos=None):
     """Computes xent loss given the language model input activations.
 
     Args:
@@ -1069,6 +1123,8 @@ class TransformerLm(TransformerLmNoEmbedding):
           the target class labels.
         - class_probabilities, a tensor with shape [time, batch, vocab_size] of
           float values indicating class-membership probabilities.
+      segment_ids: See TransformerLmNoEmbedding.FProp().
+      segment_pos: See TransformerLmNoEmbedding.FProp().
 
     Returns:
       If `labels` is not None, returns (xent_output, state1), where
@@ -1080,4 +1136,9 @@ class TransformerLm(TransformerLmNoEmbedding):
     paddings = py_utils.HasShape(paddings, tf.shape(ids))
     activation = self.emb.EmbLookup(theta.emb, ids)
     return super(TransformerLm, self).FProp(
-        theta, activation, paddings, labels=labels)
+        theta,
+        activation,
+        paddings,
+        labels=labels,
+        segment_ids=segment_ids,
+        segment_pos=segment_pos)
@@ -673,6 +673,34 @@ class TransformerLmNoEmbeddingTest(tf.test.TestCase):
       self.assertAllEqual(xent_output_val.per_example_argmax,
                           np.argmax(xent_output_val.logits, axis=-1))
 
+  def testPackedInput(self):
+    p = self._testParams(dtype=tf.float32)
+    p.packed_input = True
+    with self.session(use_gpu=False) as sess:
+      lm = p.cls(p)
+      inputs, _, _ = self._testInputs(dtype=tf.float32)
+      # Packs inputs[:2, 0] and inputs[:3, 1] into one row.
+      packed = tf.expand_dims(
+          tf.concat([inputs[:2, 0, :], inputs[:3, 1, :]], 0), 1)
+      segment_ids = tf.constant([[1], [1], [2], [2], [2]], tf.float32)
+      segment_pos = tf.constant([[0], [1], [0], [1], [2]], tf.int32)
+      packed_output, _ = lm.FPropDefaultTheta(
+          inputs=packed,
+          paddings=tf.zeros([5, 1]),
+          segment_ids=segment_ids,
+          segment_pos=segment_pos)
+      unpacked_output, _ = lm.FPropDefaultTheta(
+          inputs=inputs[:3, :2, :],
+          paddings=tf.zeros([3, 2]),
+          segment_ids=tf.ones([3, 2]),
+          segment_pos=tf.tile(tf.expand_dims(tf.range(3), 1), [1, 2]))
+
+      tf.global_variables_initializer().run()
+      packed_logits, unpacked_logits = sess.run(
+          [packed_output.logits, unpacked_output.logits])
+      self.assertAllClose(unpacked_logits[:2, 0], packed_logits[:2, 0])
+      self.assertAllClose(unpacked_logits[:3, 1], packed_logits[2:, 0])
+
   def testBasicGrad(self):
     p = self._testParams(dtype=tf.float64)
     with self.session(use_gpu=False, graph=tf.Graph()) as sess:
@@ -696,8 +724,9 @@ class TransformerLmNoEmbeddingTest(tf.test.TestCase):
             sess, xent_output.avg_xent, x, delta=1e-6)
         self.assertAllClose(grad_symbolic, grad_numeric, atol=0.005)
 
-  def testStep(self):
+  def _testStep(self, kv_cache_max_len=0):
     p = self._testParams(dtype=tf.float32)
+    p.kv_cache_max_len = kv_cache_max_len
     with self.session(use_gpu=True) as sess:
       lm = p.cls(p)
       inputs, paddings, _ = self._testInputs(dtype=tf.float32, last_padding=0.0)
@@ -721,6 +750,12 @@ class TransformerLmNoEmbeddingTest(tf.test.TestCase):
       print('xformer logits2_v', logits2_v)
       self.assertAllClose(logits1_v, logits2_v)
 
+  def testStep(self):
+    self._testStep()
+
+  def testStepWithKVCache(self):
+    self._testStep(kv_cache_max_len=5)
+
 
 class TransformerLmTest(tf.test.TestCase):
 
@@ -65,13 +65,19 @@ class LanguageModel(base_model.BaseTask):
     assert p.lm.vocab_size == p.input.tokenizer.vocab_size, (
         'lm.vocab_size does not match input.tokenizer.vocab_size: %d vs %d' %
         (p.lm.vocab_size, p.input.tokenizer.vocab_size))
+    if (getattr(p.input, 'packing_factor', None) and
+        not getattr(p.lm, 'packed_input', False)):
+      # Packed sentences would attend to each other.
+      raise ValueError('input.packing_factor requires an lm which supports '
+                       'packed_input, e.g. TransformerLm, with packed_input '
+                       'set.')
 
     with tf.variable_scope(p.name):
       # Construct the model.
       self.CreateChild('lm', p.lm)
 
-  def _TrimIfPossibleThenTranspose(self, ids, paddings, labels, weights):
-    data = (ids, paddings, labels, weights)
+  def _TrimIfPossibleThenTranspose(self, ids, paddings, labels, weights, *args):
+    data = (ids, paddings, labels, weights) + args
     if not py_utils.use_tpu():
       max_seq_len = tf.cast(
           tf.reduce_max(tf.reduce_sum(1.0 - paddings, 1)), tf.int32)
@@ -80,14 +86,24 @@ class LanguageModel(base_model.BaseTask):
 
   def FPropTower(self, theta, input_batch):
     p = self.params
-    ids, paddings, labels_ids, weights = self._TrimIfPossibleThenTranspose(
-        input_batch.ids, input_batch.paddings, input_batch.labels,
-        input_batch.weights)
+    if 'segment_ids' in input_batch:
+      (ids, paddings, labels_ids, weights, segment_ids,
+       segment_pos) = self._TrimIfPossibleThenTranspose(
+           input_batch.ids, input_batch.paddings, input_batch.labels,
+           input_batch.weights, input_batch.segment_ids,
+           input_batch.segment_pos)
+      packed_kwargs = {'segment_ids': segment_ids, 'segment_pos': segment_pos}
+    else:
+      ids, paddings, labels_ids, weights = self._TrimIfPossibleThenTranspose(
+          input_batch.ids, input_batch.paddings, input_batch.labels,
+          input_batch.weights)
+      packed_kwargs = {}
 
     batch_size = tf.shape(ids)[1]
     state0 = self.lm.zero_state(batch_size)
     labels = py_utils.NestedMap(class_ids=labels_ids, class_weights=weights)
-    xent_output, _ = self.lm.FProp(theta.lm, ids, paddings, state0, labels)
+    xent_output, _ = self.lm.FProp(theta.lm, ids, paddings, state0, labels,
+                                   **packed_kwargs)
 
     # +1 to account for the end of sequence symbol.
     num_words = tf.cast(
@@ -107,6 +107,13 @@ class ModelTest(tf.test.TestCase):
         tf.logging.info('%d loss = %f', i, loss_val)
       self.assertLess(loss_val, 3.8)
 
+  def testPackingRequiresPackedInputLm(self):
+    p = self._Params()
+    p.input = self._InputParams(for_training=True)
+    p.input.packing_factor = 2.0
+    with self.assertRaisesRegexp(ValueError, 'packed_input'):
+      p.cls(p)
+
   def testLmInference(self):
     tf.set_random_seed(93820986)
     p = self._Params()
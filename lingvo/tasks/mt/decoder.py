@@ -29,6 +29,7 @@ from lingvo.core import attention
 from lingvo.core import base_decoder
 from lingvo.core import base_layer
 from lingvo.core import cluster_factory
+from lingvo.core import kv_cache
 from lingvo.core import layers
 from lingvo.core import layers_with_attention
 from lingvo.core import model_helper
@@ -750,6 +751,19 @@ class TransformerDecoder(MTBaseDecoder):
     p.Define(
         'is_transparent', False, 'If set, expects a tensor of shape '
         '[time, batch, source_dim, num_trans_layers] as source encodings.')
+    p.Define(
+        'use_kv_cache', False, 'If set, beam search on CPU/GPU keeps the '
+        'self-attention keys and values of each layer in a preallocated '
+        'kv_cache of target_seq_len steps, updated and reordered in place, '
+        'instead of growing them by concatenation. '
+        'Ignored by tpu_beam_search, which uses a fixed-size cache already.')
+    p.Define(
+        'speculative_draft_len', 0, 'If > 1, requires use_kv_cache. A beam '
+        'search step proposes this many tokens per hyp and runs all layers '
+        'once over them by ExtendChunk(). The following steps reuse the log '
+        'probs of the chunk as long as every hyp extends its proposal. The '
+        'hyps are those of one ExtendStep() per step, up to float rounding '
+        'in the batched matmuls.')
 
     # Default config for the token embedding.
     p.token_emb.vocab_size = 32000
@@ -783,6 +797,8 @@ class TransformerDecoder(MTBaseDecoder):
     p = self.params
     assert p.token_emb.vocab_size == p.softmax.num_classes
     assert p.token_emb.embedding_dim == p.position_emb.embedding_dim
+    assert p.speculative_draft_len <= 1 or self._UseKVCache(), (
+        'speculative_draft_len requires use_kv_cache.')
     if p.model_dim != p.token_emb.embedding_dim:
       tf.logging.warning('token_emb.embedding_dim != model_dim (%s vs. %s), '
                          'creating a projection!')
@@ -908,6 +924,10 @@ class TransformerDecoder(MTBaseDecoder):
 
       return layer_out
 
+  def _UseKVCache(self):
+    p = self.params
+    return p.use_kv_cache and p.beam_search.name != 'tpu_beam_search'
+
   def ExtendStep(self, theta, encoder_outputs, new_ids, t, prefix_states):
     """Extend prefix as represented by `prefix_states` by one more step.
 
@@ -948,10 +968,8 @@ class TransformerDecoder(MTBaseDecoder):
       # Embedding layer
       # [batch, time, model_dim]
       token_embs = self.token_emb.EmbLookup(theta.token_emb, new_ids)
-      # [time, model_dim]
-      posit_embs = tf.slice(
-          self.position_emb.FProp(theta.position_emb, p.target_seq_len), [t, 0],
-          [1, p.model_dim])
+      # [1, model_dim]
+      posit_embs = self.position_emb.FPropAt(theta.position_emb, t)
       input_embs = token_embs + posit_embs
 
       if p.model_dim != p.token_emb.embedding_dim:
@@ -968,7 +986,71 @@ class TransformerDecoder(MTBaseDecoder):
         layer_out, _, updated_prefix_states = layer.ExtendStep(
             layer_theta, layer_in, layer_prefix_states, source_encs[i],
             source_paddings,
-            t if p.beam_search.name == 'tpu_beam_search' else None)
+            t if (p.beam_search.name == 'tpu_beam_search' or
+                  kv_cache.IsKVCache(layer_prefix_states)) else None)
+        out_prefix_states['layer_%i' % i] = updated_prefix_states
+        layer_in = layer_out
+
+      return layer_out, out_prefix_states
+
+  def ExtendChunk(self, theta, encoder_outputs, new_ids, t, prefix_states):
+    """Extend prefix as represented by `prefix_states` by k more steps.
+
+    Equivalent to k calls of ExtendStep() at the time steps t, ..., t + k - 1,
+    but runs all layers once over the chunk.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      encoder_outputs: a NestedMap computed by encoder. See ExtendStep().
+      new_ids: new input ids, of shape [batch, k].
+      t: a scalar, the time step of new_ids[:, 0], 0-based.
+      prefix_states: a `.NestedMap` of `kv_cache` KV caches, one per layer,
+        representing the prefix that has already been decoded.
+
+    Returns:
+      A pair (decoder_out, prefix_states), where decoder_out is the output of
+      the last decoder layer of shape [k, batch, model_dim], and
+      `prefix_states` is the update prefix states.
+    """
+    p = self.params
+    source_paddings = encoder_outputs.padding
+    time, batch = py_utils.GetShape(source_paddings, 2)
+    if p.is_transparent:
+      source_encs = py_utils.HasShape(
+          encoder_outputs.encoded,
+          [time, batch, p.source_dim, p.num_trans_layers])
+      source_encs = tf.unstack(source_encs, axis=3)
+    else:
+      source_encs = py_utils.HasShape(encoder_outputs.encoded,
+                                      [time, batch, p.source_dim])
+      source_encs = [source_encs] * p.num_trans_layers
+    with tf.name_scope(p.name):
+      # Embedding layer
+      # [batch, k, model_dim]
+      token_embs = self.token_emb.EmbLookup(theta.token_emb, new_ids)
+      chunk_len = py_utils.GetShape(new_ids)[1]
+      # [k, model_dim]
+      posit_embs = self.position_emb.FPropAt(theta.position_emb,
+                                             tf.range(t, t + chunk_len))
+      input_embs = token_embs + posit_embs
+
+      if p.model_dim != p.token_emb.embedding_dim:
+        input_embs = self.emb_proj.FProp(theta.emb_proj, input_embs)
+
+      # [k, batch, model_dim]
+      input_embs = tf.transpose(input_embs, [1, 0, 2])
+      input_embs = self.input_dropout.FProp(theta.input_dropout, input_embs)
+      # Make a copy of the input.
+      out_prefix_states = prefix_states.Pack(prefix_states.Flatten())
+
+      layer_in = input_embs
+      for i, (layer, layer_theta) in enumerate(zip(self.trans, theta.trans)):
+        layer_prefix_states = prefix_states['layer_%i' % i]
+        # [k, batch, model_dim]
+        layer_out, _, updated_prefix_states = layer.ExtendChunk(
+            layer_theta, layer_in, layer_prefix_states, t, source_encs[i],
+            source_paddings)
         out_prefix_states['layer_%i' % i] = updated_prefix_states
         layer_in = layer_out
 
@@ -1040,6 +1122,31 @@ class TransformerDecoder(MTBaseDecoder):
     else:
       seq_len = 0
 
+    if self._UseKVCache():
+      draft_len = max(p.speculative_draft_len, 1)
+      # A chunk may extend past target_seq_len by up to draft_len - 1 steps.
+      prefix_states = py_utils.NestedMap({
+          'layer_%d' % layer: kv_cache.ZeroKVCache(
+              p.target_seq_len + draft_len - 1, batch_size, atten_hidden_dim,
+              py_utils.FPropDtype(p)) for layer in range(p.num_trans_layers)
+      })
+      states = py_utils.NestedMap({
+          'prefix_states': prefix_states,
+          'time_step': tf.constant(0)
+      })
+      if draft_len > 1:
+        # The ids fed to each hyp so far, from which its proposal is drawn.
+        states.target_ids = tf.zeros([num_hyps, p.target_seq_len],
+                                     dtype=tf.int32)
+        # The proposed ids of the next steps, and their log probs computed by
+        # the last chunk, valid for num_spec_steps more steps.
+        states.spec_ids = tf.zeros([num_hyps, draft_len - 1], dtype=tf.int32)
+        states.spec_log_probs = tf.zeros(
+            [draft_len - 1, num_hyps, p.softmax.num_classes],
+            dtype=py_utils.FPropDtype(p))
+        states.num_spec_steps = tf.constant(0)
+      return initial_results, states
+
     prefix_states = py_utils.NestedMap({
         'layer_%d' % layer: py_utils.NestedMap({
             'key':
@@ -1085,38 +1192,41 @@ class TransformerDecoder(MTBaseDecoder):
              Updated list of decoded ids. [num_hyps, Num of decoded ids].
     """
     p = self.params
+    num_hyps = py_utils.GetShape(step_ids)[0]
+    source_len = py_utils.GetShape(encoder_outputs.padding)[0]
 
-    target_time = states.time_step
-    prefix_states = states.prefix_states
+    if p.speculative_draft_len > 1:
+      log_probs, new_states = self._SpeculativeBeamSearchStep(
+          theta, encoder_outputs, step_ids, states)
+    else:
+      target_time = states.time_step
+      prefix_states = states.prefix_states
 
-    new_states = states.Pack(states.Flatten())
+      new_states = states.Pack(states.Flatten())
 
-    layer_out, updated_prefix_states = self.ExtendStep(theta, encoder_outputs,
-                                                       tf.squeeze(step_ids, 1),
-                                                       target_time,
-                                                       prefix_states)
+      layer_out, updated_prefix_states = self.ExtendStep(
+          theta, encoder_outputs, tf.squeeze(step_ids, 1), target_time,
+          prefix_states)
 
-    new_states.prefix_states = updated_prefix_states
-    new_states.time_step = target_time + 1
+      new_states.prefix_states = updated_prefix_states
+      new_states.time_step = target_time + 1
 
-    softmax_input = tf.reshape(layer_out, [-1, p.softmax.input_dim])
-    logits = self.softmax.Logits(theta.softmax, [softmax_input])
+      softmax_input = tf.reshape(layer_out, [-1, p.softmax.input_dim])
+      logits = self.softmax.Logits(theta.softmax, [softmax_input])
 
-    num_hyps = py_utils.GetShape(step_ids)[0]
-    source_len = py_utils.GetShape(encoder_outputs.padding)[0]
-    # [time * batch, num_classes] -> [time, batch, num_classes]
-    logits = tf.reshape(logits, (-1, num_hyps, p.softmax.num_classes))
-    # [time, batch, num_classes] -> [batch, time, num_classes]
-    logits = tf.transpose(logits, (1, 0, 2))
+      # [time * batch, num_classes] -> [time, batch, num_classes]
+      logits = tf.reshape(logits, (-1, num_hyps, p.softmax.num_classes))
+      # [time, batch, num_classes] -> [batch, time, num_classes]
+      logits = tf.transpose(logits, (1, 0, 2))
+
+      # Only return logits for the last ids
+      log_probs = tf.nn.log_softmax(tf.squeeze(logits, axis=1))
 
     # Dummy attention probs
     atten_probs = (
         tf.ones([num_hyps, source_len], dtype=py_utils.FPropDtype(p)) /
         tf.cast(source_len, py_utils.FPropDtype(p)))
 
-    # Only return logits for the last ids
-    log_probs = tf.nn.log_softmax(tf.squeeze(logits, axis=1))
-
     bs_results = py_utils.NestedMap({
         'atten_probs': atten_probs,
         'log_probs': log_probs,
@@ -1134,3 +1244,107 @@ class TransformerDecoder(MTBaseDecoder):
         self.theta, encoder_outputs, num_hyps_per_beam_override,
         self._InitBeamSearchStateCallback, self._PreBeamSearchStepCallback,
         self._PostBeamSearchStepCallback)
+
+  def _DraftIds(self, ids, t, last_ids, num_draft):
+    """Proposes the ids after `last_ids` by a lookahead in the prefix.
+
+    Finds the latest earlier occurrence of the last decoded id in the decoded
+    prefix, and proposes the ids which followed it, since translations tend
+    to repeat n-grams. The proposal only affects the speed of beam search.
+
+    Args:
+      ids: [max_len, batch] int32, the decoded ids. Only ids[:t] are valid.
+      t: a scalar, the number of decoded ids.
+      last_ids: [batch] int32, the last decoded ids, i.e., ids[t - 1].
+      num_draft: the number of ids to propose.
+
+    Returns:
+      The proposed ids, of shape [batch, num_draft].
+    """
+    max_len, batch = py_utils.GetShape(ids, 2)
+    positions = tf.tile(tf.expand_dims(tf.range(max_len), 1), [1, batch])
+    earlier = tf.logical_and(
+        tf.equal(ids, tf.expand_dims(last_ids, 0)), positions < t - 1)
+    # [batch]. 0 if there is no earlier occurrence.
+    start = 1 + tf.reduce_max(
+        tf.where(earlier, positions, -tf.ones_like(positions)), axis=0)
+    # [num_draft, batch]
+    draft_positions = tf.minimum(
+        tf.expand_dims(start, 0) + tf.expand_dims(tf.range(num_draft), 1),
+        tf.maximum(t - 1, 0))
+    hyp_ids = tf.tile(tf.expand_dims(tf.range(batch), 0), [num_draft, 1])
+    draft_ids = tf.gather_nd(ids, tf.stack([draft_positions, hyp_ids], axis=-1))
+    return tf.transpose(draft_ids)
+
+  def _SpeculativeBeamSearchStep(self, theta, encoder_outputs, step_ids,
+                                 states):
+    """Returns the log probs of a beam search step and the next states.
+
+    If every hyp was extended by the id proposed for it, the log probs of this
+    step were computed by the last chunk, and are reused. Otherwise, proposes
+    p.speculative_draft_len - 1 ids after `step_ids` for each hyp by
+    _DraftIds(), and runs ExtendChunk() over `step_ids` and the proposal. The
+    log probs of the first step of the chunk are returned, and those of the
+    other steps are kept for the following steps.
+
+    Args:
+      theta: A `.NestedMap` object containing weights' values of this layer and
+        its children layers.
+      encoder_outputs: a NestedMap computed by encoder.
+      step_ids: A tensor of shape [tgt_batch, 1].
+      states: A `.NestedMap` of the beam search states.
+
+    Returns:
+      A tuple (log_probs, new_states), where log_probs is of shape
+      [tgt_batch, vocab_size].
+    """
+    p = self.params
+    num_draft = p.speculative_draft_len - 1
+    t = states.time_step
+    last_ids = tf.squeeze(step_ids, 1)
+    num_hyps = py_utils.GetShape(last_ids)[0]
+    target_ids = states.target_ids + tf.expand_dims(last_ids, 1) * tf.one_hot(
+        t, p.target_seq_len, dtype=tf.int32)
+    prefix_states = states.prefix_states
+
+    def _Reuse():
+      """Takes the log probs of the first kept step."""
+      return [
+          states.spec_log_probs[0],
+          tf.concat([states.spec_log_probs[1:], states.spec_log_probs[:1]], 0),
+          tf.concat([states.spec_ids[:, 1:], states.spec_ids[:, :1]], 1),
+          states.num_spec_steps - 1
+      ] + prefix_states.Flatten()
+
+    def _Verify():
+      """Runs a chunk of the last ids and the proposed ones."""
+      # [num_hyps, num_draft]
+      draft_ids = self._DraftIds(
+          tf.transpose(target_ids), t + 1, last_ids, num_draft)
+      layer_out, new_prefix_states = self.ExtendChunk(
+          theta, encoder_outputs, tf.concat([step_ids, draft_ids], 1), t,
+          prefix_states)
+      logits = self.softmax.Logits(
+          theta.softmax, [tf.reshape(layer_out, [-1, p.softmax.input_dim])])
+      # [num_draft + 1, num_hyps, num_classes]
+      log_probs = tf.reshape(
+          tf.nn.log_softmax(logits),
+          [num_draft + 1, num_hyps, p.softmax.num_classes])
+      return [log_probs[0], log_probs[1:], draft_ids,
+              tf.constant(num_draft)] + new_prefix_states.Flatten()
+
+    # The states were reordered, so spec_ids[:, 0] is the id proposed for the
+    # previous hyp of each hyp.
+    reuse = tf.logical_and(
+        states.num_spec_steps > 0,
+        tf.reduce_all(tf.equal(states.spec_ids[:, 0], last_ids)))
+    outs = tf.cond(reuse, _Reuse, _Verify)
+
+    new_states = states.Pack(states.Flatten())
+    new_states.time_step = t + 1
+    new_states.target_ids = target_ids
+    new_states.spec_log_probs = outs[1]
+    new_states.spec_ids = outs[2]
+    new_states.num_spec_steps = outs[3]
+    new_states.prefix_states = prefix_states.Pack(outs[4:])
+    return outs[0], new_states
@@ -575,11 +575,16 @@ class TransformerDecoderTest(TransformerDecoderTestCaseBase):
       self.assertAlmostEqual(
           actual_loss, np.mean([actual_loss1, actual_loss2]), delta=0.0001)
 
-  def testBeamSearchDecode(self, dtype=tf.float32):
+  def _testBeamSearchDecode(self,
+                            dtype=tf.float32,
+                            use_kv_cache=False,
+                            speculative_draft_len=0):
     tf.set_random_seed(_TF_RANDOM_SEED)
     src_batch = 4
     src_time = 5
     p = self._DecoderParams(dtype=dtype)
+    p.use_kv_cache = use_kv_cache
+    p.speculative_draft_len = speculative_draft_len
     p.beam_search.num_hyps_per_beam = 2
     p.beam_search.coverage_penalty = 0
     p.beam_search.length_normalization = 0
@@ -621,6 +626,88 @@ class TransformerDecoderTest(TransformerDecoderTestCaseBase):
     self.assertAllEqual(expected_topk_lens, actual_decode.topk_lens)
     self.assertAllClose(expected_topk_scores, actual_decode.topk_scores)
 
+  def testBeamSearchDecode(self):
+    self._testBeamSearchDecode()
+
+  def testBeamSearchDecodeWithKVCache(self):
+    self._testBeamSearchDecode(use_kv_cache=True)
+
+  def testBeamSearchDecodeSpeculative(self):
+    self._testBeamSearchDecode(use_kv_cache=True, speculative_draft_len=2)
+
+  def testBeamSearchDecodeSpeculativeDraftLen4(self):
+    self._testBeamSearchDecode(use_kv_cache=True, speculative_draft_len=4)
+
+  def _BeamSearchDecodeIds(self, speculative_draft_len):
+    with self.session(use_gpu=True, graph=tf.Graph()) as sess:
+      tf.set_random_seed(_TF_RANDOM_SEED)
+      p = self._DecoderParams()
+      p.target_seq_len = 12
+      p.use_kv_cache = True
+      p.speculative_draft_len = speculative_draft_len
+      p.beam_search.num_hyps_per_beam = 2
+      dec = decoder.TransformerDecoder(p)
+      encoder_outputs, _ = self._Inputs()
+      decode = dec.BeamSearchDecode(encoder_outputs)
+      tf.global_variables_initializer().run()
+      return sess.run([decode.topk_ids, decode.topk_lens, decode.topk_scores])
+
+  def testBeamSearchDecodeSpeculativeLong(self):
+    ids, lens, scores = self._BeamSearchDecodeIds(0)
+    for draft_len in [2, 4]:
+      spec_ids, spec_lens, spec_scores = self._BeamSearchDecodeIds(draft_len)
+      self.assertAllEqual(ids, spec_ids)
+      self.assertAllEqual(lens, spec_lens)
+      self.assertAllClose(scores, spec_scores)
+
+
+class TransformerDecoderBeamSearchBenchmark(tf.test.Benchmark):
+  """Benchmarks the latency per step of beam search on a single sentence.
+
+  Run with --benchmarks=TransformerDecoderBeamSearchBenchmark.
+  """
+
+  def _BenchmarkBeamSearchDecode(self, speculative_draft_len):
+    p = decoder.TransformerDecoder.Params()
+    p.name = 'decoder'
+    p.source_dim = 512
+    p.model_dim = 512
+    p.num_trans_layers = 6
+    p.token_emb.vocab_size = 8000
+    p.token_emb.embedding_dim = 512
+    p.token_emb.max_num_shards = 1
+    p.position_emb.embedding_dim = 512
+    p.trans_tpl.source_dim = 512
+    p.trans_tpl.tr_atten_tpl.source_dim = 512
+    p.trans_tpl.tr_fflayer_tpl.input_dim = 512
+    p.softmax.num_classes = 8000
+    p.softmax.num_shards = 1
+    p.target_seq_len = 100
+    # Never stops early, so that every run decodes target_seq_len steps.
+    p.target_eos_id = -1
+    p.use_kv_cache = True
+    p.speculative_draft_len = speculative_draft_len
+    p.beam_search.num_hyps_per_beam = 4
+    np.random.seed(_NUMPY_RANDOM_SEED)
+    with tf.Graph().as_default(), tf.Session() as sess:
+      tf.set_random_seed(_TF_RANDOM_SEED)
+      dec = decoder.TransformerDecoder(p)
+      encoder_outputs = py_utils.NestedMap(
+          encoded=tf.constant(
+              np.random.normal(size=[20, 1, 512]), dtype=tf.float32),
+          padding=tf.zeros([20, 1]))
+      decode = dec.BeamSearchDecode(encoder_outputs)
+      tf.global_variables_initializer().run()
+      name = 'beam_search_decode_draft_len_%d' % speculative_draft_len
+      wall_time = self.run_op_benchmark(
+          sess, decode.topk_ids, min_iters=5, name=name)['wall_time']
+      self.report_benchmark(
+          name=name + '_per_step', wall_time=wall_time / p.target_seq_len)
+
+  def benchmarkBeamSearchDecode(self):
+    for draft_len in [0, 2, 4]:
+      self._BenchmarkBeamSearchDecode(draft_len)
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -22,6 +22,7 @@ import tensorflow as tf
 
 from lingvo.core import base_input_generator
 from lingvo.core import base_layer
+from lingvo.core import input_generator_helper
 from lingvo.core import py_utils
 from lingvo.core import tokenizers
 from lingvo.core.ops import py_x_ops
@@ -41,22 +42,29 @@ class NmtInput(base_input_generator.BaseSequenceInputGenerator):
         'order if False. The value should be consistent with the underlying '
         'model. Set to True if training or using a natural order model, '
         'otherwise set to False.')
+    p.Define(
+        'process_batch_size', 1,
+        'If larger than 1, records are parsed this many at a time with '
+        'tf.parse_example, which is much faster than parsing them one by '
+        'one. Examples are still bucketed one by one.')
     p.tokenizer = tokenizers.VocabFileTokenizer.Params()
     p.source_max_length = 300
     return p
 
   def _DataSourceFromFilePattern(self, file_pattern):
+    p = self.params
+    outputs = [
+        ('source_id', tf.VarLenFeature(tf.int64)),
+        ('source_padding', tf.VarLenFeature(tf.float32)),
+        ('target_id', tf.VarLenFeature(tf.int64)),
+        ('target_padding', tf.VarLenFeature(tf.float32)),
+        ('target_label', tf.VarLenFeature(tf.int64)),
+        ('target_weight', tf.VarLenFeature(tf.float32)),
+    ]
+    padding_constants = [0, 1, 0, 1, 0, 0]
 
     def Proc(record):
       """Parses a serialized tf.Example record."""
-      outputs = [
-          ('source_id', tf.VarLenFeature(tf.int64)),
-          ('source_padding', tf.VarLenFeature(tf.float32)),
-          ('target_id', tf.VarLenFeature(tf.int64)),
-          ('target_padding', tf.VarLenFeature(tf.float32)),
-          ('target_label', tf.VarLenFeature(tf.int64)),
-          ('target_weight', tf.VarLenFeature(tf.float32)),
-      ]
       features = tf.parse_single_example(record, dict(outputs))
       for k, v in six.iteritems(features):
         features[k] = v.values
@@ -66,11 +74,24 @@ class NmtInput(base_input_generator.BaseSequenceInputGenerator):
               tf.reduce_sum(1.0 - features['target_padding'])))
       return [features[k] for k, _ in outputs] + [bucket_key]
 
+    def ProcBatch(records):
+      """Parses a vector of serialized tf.Example records."""
+      features = tf.parse_example(records, dict(outputs))
+      for (k, _), pad in zip(outputs, padding_constants):
+        features[k] = tf.sparse_tensor_to_dense(
+            features[k], default_value=tf.cast(pad, features[k].dtype))
+      bucket_keys = tf.to_int32(
+          tf.maximum(
+              tf.reduce_sum(1.0 - features['source_padding'], 1),
+              tf.reduce_sum(1.0 - features['target_padding'], 1)))
+      return [features[k] for k, _ in outputs] + [bucket_keys]
+
     return py_x_ops.generic_input(
         file_pattern=file_pattern,
-        processor=Proc,
+        processor=ProcBatch if p.process_batch_size > 1 else Proc,
         dynamic_padding_dimensions=[0] * 6,
-        dynamic_padding_constants=[0, 1, 0, 1, 0, 0],
+        dynamic_padding_constants=padding_constants,
+        process_batch_size=p.process_batch_size,
         **self.CommonInputOpArgs())
 
   @base_layer.initializer
@@ -83,11 +104,18 @@ class NmtInput(base_input_generator.BaseSequenceInputGenerator):
     (self._src_ids, self._src_paddings, self._tgt_ids, self._tgt_paddings,
      self._tgt_labels, self._tgt_weights) = self._BuildDataSource()
 
-    if p.pad_to_max_seq_length:
+    if p.process_batch_size > 1:
+      # Examples parsed together are padded to the longest one among them.
+      self._TrimPaddings()
+
+    if p.packing_factor:
+      self._Pack()
+    elif p.pad_to_max_seq_length:
       assert p.source_max_length
 
-      if min(self.scaled_bucket_batch_limit) == max(
-          self.scaled_bucket_batch_limit):
+      # With a token budget, batches may have fewer examples than the limit.
+      if (not p.bucket_max_tokens and min(self.scaled_bucket_batch_limit) ==
+          max(self.scaled_bucket_batch_limit)):
         source_shape = [
             min(self.scaled_bucket_batch_limit), p.source_max_length
         ]
@@ -114,6 +142,52 @@ class NmtInput(base_input_generator.BaseSequenceInputGenerator):
     self._input_batch_size = tf.shape(self._src_ids)[0]
     self._sample_ids = tf.range(0, self._input_batch_size, 1)
 
+  def _TrimPaddings(self):
+    """Trims the batch to its longest source and target sequences."""
+    src_len = tf.to_int32(
+        tf.reduce_max(tf.reduce_sum(1.0 - self._src_paddings, 1)))
+    tgt_len = tf.to_int32(
+        tf.reduce_max(tf.reduce_sum(1.0 - self._tgt_paddings, 1)))
+    self._src_ids = self._src_ids[:, :src_len]
+    self._src_paddings = self._src_paddings[:, :src_len]
+    self._tgt_ids = self._tgt_ids[:, :tgt_len]
+    self._tgt_paddings = self._tgt_paddings[:, :tgt_len]
+    self._tgt_labels = self._tgt_labels[:, :tgt_len]
+    self._tgt_weights = self._tgt_weights[:, :tgt_len]
+
+  def _Pack(self):
+    """Packs the examples into rows of source/target_max_length."""
+    p = self.params
+    assert p.source_max_length
+    assert min(self.scaled_bucket_batch_limit) == max(
+        self.scaled_bucket_batch_limit), (
+            'Packing requires the same batch limit for all buckets.')
+    src_lengths = tf.to_int32(tf.reduce_sum(1.0 - self._src_paddings, 1))
+    tgt_lengths = tf.to_int32(tf.reduce_sum(1.0 - self._tgt_paddings, 1))
+    (src_segment_ids, self._src_segment_pos, src_indices, tgt_segment_ids,
+     self._tgt_segment_pos, tgt_indices) = py_x_ops.pack_sequences(
+         src_lengths,
+         tgt_lengths,
+         packed_batch_size=min(self.scaled_bucket_batch_limit),
+         packed_src_seq_len=p.source_max_length,
+         packed_tgt_seq_len=p.target_max_length)
+    self._src_segment_ids = tf.to_float(src_segment_ids)
+    self._tgt_segment_ids = tf.to_float(tgt_segment_ids)
+
+    apply_packing = input_generator_helper.ApplyPacking
+    self._src_ids = apply_packing(self._src_ids, 0, src_indices,
+                                  self._src_segment_pos)
+    self._src_paddings = apply_packing(self._src_paddings, 1, src_indices,
+                                       self._src_segment_pos)
+    self._tgt_ids = apply_packing(self._tgt_ids, 0, tgt_indices,
+                                  self._tgt_segment_pos)
+    self._tgt_paddings = apply_packing(self._tgt_paddings, 1, tgt_indices,
+                                       self._tgt_segment_pos)
+    self._tgt_labels = apply_packing(self._tgt_labels, 0, tgt_indices,
+                                     self._tgt_segment_pos)
+    self._tgt_weights = apply_packing(self._tgt_weights, 0, tgt_indices,
+                                      self._tgt_segment_pos)
+
   def InputBatch(self):
     ret = py_utils.NestedMap()
 
@@ -127,6 +201,12 @@ class NmtInput(base_input_generator.BaseSequenceInputGenerator):
     ret.tgt.weights = self._tgt_weights
     ret.tgt.paddings = self._tgt_paddings
 
+    if self.params.packing_factor:
+      ret.src.segment_ids = self._src_segment_ids
+      ret.src.segment_pos = self._src_segment_pos
+      ret.tgt.segment_ids = self._tgt_segment_ids
+      ret.tgt.segment_pos = self._tgt_segment_pos
+
     if (self.params.fprop_dtype is None or
         self.params.dtype == self.params.fprop_dtype):
       return ret
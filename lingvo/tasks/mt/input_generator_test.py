@@ -48,6 +48,22 @@ class InputTest(tf.test.TestCase):
       for _ in range(10):
         sess.run(inp.GetPreprocessedInputBatch())
 
+  def testProcessBatch(self):
+    p = self._CreateNmtInputParams()
+    p.process_batch_size = 16
+    with self.session(use_gpu=False) as sess:
+      inp = input_generator.NmtInput(p)
+      for _ in range(10):
+        fetched = py_utils.NestedMap(sess.run(inp.GetPreprocessedInputBatch()))
+        src_lens = np.sum(1.0 - fetched.src.paddings, 1)
+        tgt_lens = np.sum(1.0 - fetched.tgt.paddings, 1)
+        self.assertLessEqual(fetched.src.ids.shape[0], 8)
+        self.assertLessEqual(max(np.amax(src_lens), np.amax(tgt_lens)), 40)
+        # Batches are trimmed to their longest example.
+        self.assertEqual(fetched.src.ids.shape[1], np.amax(src_lens))
+        self.assertEqual(fetched.tgt.ids.shape[1], np.amax(tgt_lens))
+        self.assertEqual(fetched.tgt.labels.shape, fetched.tgt.ids.shape)
+
   def testPadToMax(self):
     p = self._CreateNmtInputParams()
     p.bucket_upper_bound = [20]
@@ -72,6 +88,58 @@ class InputTest(tf.test.TestCase):
     Check(fetched.tgt.weights, 0)
     Check(fetched.tgt.paddings, 1)
 
+  def testPadToMaxWithTokenBudget(self):
+    p = self._CreateNmtInputParams()
+    p.bucket_upper_bound = [20]
+    p.bucket_batch_limit = [4]
+    p.bucket_max_tokens = 40
+    p.source_max_length = 30
+    p.target_max_length = 30
+    p.pad_to_max_seq_length = True
+    with self.session(use_gpu=False) as sess:
+      inp = input_generator.NmtInput(p)
+      batch = inp.GetPreprocessedInputBatch()
+      # The batch size varies, so it is not static.
+      self.assertIsNone(batch.src.ids.shape[0].value)
+      fetched = py_utils.NestedMap(sess.run(batch))
+    self.assertLessEqual(fetched.src.ids.shape[0], 4)
+    self.assertEqual(fetched.src.ids.shape[1], 30)
+
+  def testPacking(self):
+    p = self._CreateNmtInputParams()
+    p.bucket_upper_bound = [20]
+    p.bucket_batch_limit = [4]
+    p.source_max_length = 30
+    p.target_max_length = 30
+    p.packing_factor = 3.0
+    with self.session(use_gpu=False) as sess:
+      inp = input_generator.NmtInput(p)
+      fetched = py_utils.NestedMap(sess.run(inp.GetPreprocessedInputBatch()))
+
+    for side in (fetched.src, fetched.tgt):
+      for x in side.values():
+        self.assertEqual(x.shape, (4, 30))
+    num_src_segments = []
+    for side in (fetched.src, fetched.tgt):
+      num_segments = []
+      for b in range(4):
+        length = int(np.sum(1 - side.paddings[b]))
+        # Real tokens come first.
+        self.assertAllEqual(side.paddings[b, :length], np.zeros(length))
+        ids = side.segment_ids[b, :length]
+        pos = side.segment_pos[b, :length]
+        starts = np.concatenate([[True], ids[1:] != ids[:-1]])
+        # Positions restart at 0 at each new segment, and count up otherwise.
+        self.assertAllEqual(pos[starts], np.zeros(np.sum(starts)))
+        self.assertAllEqual(pos[1:][~starts[1:]], pos[:-1][~starts[1:]] + 1)
+        self.assertAllEqual(ids[starts], np.arange(np.sum(starts)))
+        num_segments.append(np.sum(starts))
+      num_src_segments.append(num_segments)
+    # The source and target of an example are in the same segment.
+    self.assertAllEqual(num_src_segments[0], num_src_segments[1])
+    # More than one example per row on average.
+    self.assertGreater(np.sum(num_src_segments[0]), 4)
+
   def testSplitSources(self):
     p = self._CreateNmtInputParams()
     num_splits = 2
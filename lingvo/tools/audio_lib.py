@@ -18,8 +18,10 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import struct
 import subprocess
 
+import numpy as np
 import tensorflow as tf
 
 from tensorflow.contrib.framework.python.ops import audio_ops as contrib_audio
@@ -59,6 +61,43 @@ def DecodeWav(input_bytes):
   return result.sample_rate, result.audio
 
 
+def DecodeWavToPcm(input_bytes):
+  """Decodes the contents of a 16-bit PCM wav file in Python.
+
+  Unlike DecodeWav, this does not need a session, and the samples are not
+  rescaled to [-1, 1). A data chunk size that exceeds the input (as written by
+  sox to a pipe) is treated as extending to the end of the input.
+
+  Args:
+    input_bytes: a byte string with the wav file contents.
+
+  Returns:
+    A pair of the sample rate and an int16 numpy array of shape [samples,
+    channels].
+  """
+  riff, _, wave = struct.unpack('<4sI4s', input_bytes[:12])
+  assert riff == b'RIFF' and wave == b'WAVE', 'Not a wav file.'
+  offset = 12
+  sample_rate = channels = None
+  while offset + 8 <= len(input_bytes):
+    chunk_id, chunk_size = struct.unpack('<4sI',
+                                         input_bytes[offset:offset + 8])
+    offset += 8
+    if chunk_id == b'fmt ':
+      audio_format, channels, sample_rate, _, _, bits_per_sample = (
+          struct.unpack('<HHIIHH', input_bytes[offset:offset + 16]))
+      assert audio_format in (1, 0xFFFE), audio_format
+      assert bits_per_sample == 16, bits_per_sample
+    elif chunk_id == b'data':
+      assert sample_rate is not None, 'fmt chunk must precede data chunk.'
+      data = input_bytes[offset:min(offset + chunk_size, len(input_bytes))]
+      data = data[:len(data) - len(data) % (2 * channels)]
+      audio = np.frombuffer(data, dtype='<i2').reshape([-1, channels])
+      return sample_rate, audio
+    offset += chunk_size + (chunk_size & 1)
+  raise ValueError('No data chunk found in wav file.')
+
+
 def AudioToMfcc(sample_rate, audio, window_size_ms, window_stride_ms,
                 num_coefficients):
   window_size_samples = sample_rate * window_size_ms // 1000
@@ -73,6 +112,21 @@ def AudioToMfcc(sample_rate, audio, window_size_ms, window_stride_ms,
   return mfcc
 
 
+def _CreateAsrFrontend():
+  """Parameters corresponding to default ASR frontend."""
+  p = asr_frontend.MelAsrFrontend.Params()
+  p.sample_rate = 16000.
+  p.frame_size_ms = 25.
+  p.frame_step_ms = 10.
+  p.num_bins = 80
+  p.lower_edge_hertz = 125.
+  p.upper_edge_hertz = 7600.
+  p.preemph = 0.97
+  p.noise_scale = 0.
+  p.pad_end = False
+  return p.cls(p)
+
+
 def ExtractLogMelFeatures(wav_bytes_t):
   """Create Log-Mel Filterbank Features from raw bytes.
 
@@ -86,20 +140,6 @@ def ExtractLogMelFeatures(wav_bytes_t):
     every three frames.
   """
 
-  def _CreateAsrFrontend():
-    """Parameters corresponding to default ASR frontend."""
-    p = asr_frontend.MelAsrFrontend.Params()
-    p.sample_rate = 16000.
-    p.frame_size_ms = 25.
-    p.frame_step_ms = 10.
-    p.num_bins = 80
-    p.lower_edge_hertz = 125.
-    p.upper_edge_hertz = 7600.
-    p.preemph = 0.97
-    p.noise_scale = 0.
-    p.pad_end = False
-    return p.cls(p)
-
   sample_rate, audio = DecodeWav(wav_bytes_t)
   audio *= 32768
   # Remove channel dimension, since we have a single channel.
@@ -114,3 +154,24 @@ def ExtractLogMelFeatures(wav_bytes_t):
         py_utils.NestedMap(src_inputs=audio, paddings=tf.zeros_like(audio)))
     log_mel = outputs.src_inputs
   return log_mel
+
+
+def ExtractLogMelFeaturesFromPcm(pcm_t, paddings_t):
+  """Create Log-Mel Filterbank Features for a padded batch of PCM audio.
+
+  Frames are computed independently, so the unpadded frames of each utterance
+  are the same as the frames ExtractLogMelFeatures computes for it alone.
+
+  Args:
+    pcm_t: A float Tensor of shape [batch, samples] with 16KHz mono audio in
+      the int16 range (as returned by DecodeWavToPcm).
+    paddings_t: A 0/1 Tensor of shape [batch, samples].
+
+  Returns:
+    A pair of Tensors: log-Mel filterbank energies of shape [batch, frames, 80,
+    1], and frame paddings of shape [batch, frames].
+  """
+  mel_frontend = _CreateAsrFrontend()
+  outputs = mel_frontend.FPropDefaultTheta(
+      py_utils.NestedMap(src_inputs=pcm_t, paddings=paddings_t))
+  return outputs.src_inputs, outputs.paddings
@@ -21,6 +21,7 @@ from __future__ import print_function
 
 import os
 
+import numpy as np
 import tensorflow as tf
 
 from lingvo.core import test_helper
@@ -91,6 +92,47 @@ class AudioLibTest(tf.test.TestCase):
       # Expect 314, 80 dimensional channels.
       self.assertAllEqual(log_mel.shape, [1, 314, 80, 1])
 
+  def testDecodeWavToPcm(self):
+    with open(
+        test_helper.test_src_dir_path('tools/testdata/gan_or_vae.wav'),
+        'rb') as f:
+      wav = f.read()
+    sample_rate, pcm = audio_lib.DecodeWavToPcm(wav)
+    self.assertEqual(24000, sample_rate)
+    self.assertEqual(np.int16, pcm.dtype)
+    with self.session() as sess:
+      audio = sess.run(audio_lib.DecodeWav(wav)[1])
+    self.assertAllEqual(audio * 32768, pcm)
+
+  def testExtractLogMelFeaturesFromPcm(self):
+    with open(
+        test_helper.test_src_dir_path('tools/testdata/gan_or_vae.16k.wav'),
+        'rb') as f:
+      wav = f.read()
+    _, pcm = audio_lib.DecodeWavToPcm(wav)
+    pcm = pcm[:, 0].astype(np.float32)
+    # A batch of the full utterance and a shorter one padded to its length.
+    short_len = 20000
+    pcm_batch = np.stack(
+        [pcm, np.pad(pcm[:short_len], [0, len(pcm) - short_len], 'constant')])
+    paddings = np.zeros_like(pcm_batch)
+    paddings[1, short_len:] = 1.
+
+    log_mel_t = audio_lib.ExtractLogMelFeatures(tf.constant(wav))
+    batch_log_mel_t, batch_paddings_t = (
+        audio_lib.ExtractLogMelFeaturesFromPcm(
+            tf.constant(pcm_batch), tf.constant(paddings)))
+    with self.session() as sess:
+      log_mel, batch_log_mel, batch_paddings = sess.run(
+          [log_mel_t, batch_log_mel_t, batch_paddings_t])
+    self.assertAllEqual(batch_log_mel.shape, [2, 314, 80, 1])
+    self.assertAllEqual(batch_paddings[0], np.zeros([314]))
+    num_short_frames = int(np.sum(batch_paddings[1] == 0.))
+    self.assertEqual(123, num_short_frames)
+    self.assertAllClose(log_mel[0], batch_log_mel[0])
+    self.assertAllClose(log_mel[0, :num_short_frames],
+                        batch_log_mel[1, :num_short_frames])
+
 
 if __name__ == '__main__':
   tf.test.main()
@@ -18,7 +18,12 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import collections
+import multiprocessing
+
 import numpy as np
+import six
+from six.moves import range
 
 import tensorflow as tf
 
@@ -27,59 +32,149 @@ tf.flags.DEFINE_string('input_filepattern', '',
 tf.flags.DEFINE_integer('frame_size', 1, 'Size of the frame, for reshaping.')
 tf.flags.DEFINE_integer('num_buckets', 8, 'Number of buckets for the length.')
 tf.flags.DEFINE_string('feature_name', None, 'Name of feature to examine.')
+tf.flags.DEFINE_integer(
+    'num_workers', 1,
+    'Number of processes reading the files matching input_filepattern. Each '
+    'file is read by a single process.')
+tf.flags.DEFINE_integer(
+    'tokens_per_batch', 0,
+    'If > 0, recommend bucket_batch_limit values so that each batch holds '
+    'about this many frames (or tokens) when its bucket is full.')
 
 FLAGS = tf.flags.FLAGS
 
 
 class StatsCollector(object):
+  """Accumulates the length histogram and per-dimension moments of a feature.
+
+  Moments are accumulated with Welford/Chan updates, and lengths in a
+  histogram, so memory use does not depend on the number of examples, and
+  collectors over disjoint parts of the data can be combined with Merge().
+  """
 
-  def __init__(self,):
+  def __init__(self, feature_name, frame_size):
+    self._feature_name = feature_name
+    self._frame_size = frame_size
     self._num_examples = 0
-    self._lengths = []
+    # Number of examples per length.
+    self._length_counts = collections.Counter()
     self._num_frames = 0
-    self._mean_acc = np.zeros(FLAGS.frame_size, dtype=np.float64)
-    self._var_acc = np.zeros(FLAGS.frame_size, dtype=np.float64)
+    self._mean = np.zeros(frame_size, dtype=np.float64)
+    # Sum of squared differences from the mean.
+    self._m2 = np.zeros(frame_size, dtype=np.float64)
+
+  @property
+  def num_examples(self):
+    return self._num_examples
+
+  def _MergeMoments(self, num_frames, mean, m2):
+    """Merges the moments of a set of frames (Chan et al.)."""
+    total = self._num_frames + num_frames
+    if total == 0:
+      return
+    delta = mean - self._mean
+    self._mean += delta * (num_frames / total)
+    self._m2 += m2 + delta * delta * (self._num_frames * num_frames / total)
+    self._num_frames = total
 
   def _AccumulateMoments(self, float_list):
-    frames = np.reshape(float_list, [-1, FLAGS.frame_size])
-    self._num_frames += frames.shape[0]
-    self._mean_acc += np.sum(frames, axis=0)
-    self._var_acc += np.sum(frames * frames, axis=0)
+    frames = np.reshape(
+        np.asarray(float_list, dtype=np.float64), [-1, self._frame_size])
+    if not frames.shape[0]:
+      return
+    mean = np.mean(frames, axis=0)
+    centered = frames - mean
+    self._MergeMoments(frames.shape[0], mean,
+                       np.sum(centered * centered, axis=0))
 
   def _ComputeMeanVar(self):
-    mu = self._mean_acc / self._num_frames
+    mu = self._mean
     # The user is in charge of replacing NaNs with a floor value.
-    v = np.sqrt(self._var_acc / self._num_frames - mu * mu)
+    v = np.sqrt(self._m2 / self._num_frames)
     return mu, v
 
   def Accumulate(self, tf_ex):
     self._num_examples += 1
     if 0 == self._num_examples % 10000:
       tf.logging.info('Processing example %u...', self._num_examples)
-    v = tf_ex.features.feature[FLAGS.feature_name]
+    v = tf_ex.features.feature[self._feature_name]
     if v.HasField('float_list'):
-      num_frames = len(v.float_list.value) // FLAGS.frame_size
+      num_frames = len(v.float_list.value) // self._frame_size
       self._AccumulateMoments(v.float_list.value)
     elif v.HasField('int64_list'):
-      num_frames = len(v.int64_list.value) // FLAGS.frame_size
+      num_frames = len(v.int64_list.value) // self._frame_size
     else:
       tf.logging.fatal(
           'Not sure what to do with value. '
           'Only float/int64 lists are supported: %s', v)
-    self._lengths.append(num_frames)
+    self._length_counts[num_frames] += 1
+
+  def Merge(self, other):
+    """Adds the statistics of another StatsCollector to this one."""
+    # pylint: disable=protected-access
+    assert self._frame_size == other._frame_size
+    self._num_examples += other._num_examples
+    self._length_counts.update(other._length_counts)
+    self._MergeMoments(other._num_frames, other._mean, other._m2)
+    # pylint: enable=protected-access
+
+  def LengthQuantiles(self, quantiles):
+    """Returns the smallest lengths with at least the given fraction below.
+
+    Args:
+      quantiles: A list of fractions in [0, 1].
+
+    Returns:
+      A list of lengths, the same as `sorted_lengths[int(n * q)]` for each q if
+      all the n lengths were kept in `sorted_lengths` (the largest length for q
+      = 1).
+    """
+    lengths = sorted(self._length_counts)
+    cumulative = np.cumsum([self._length_counts[l] for l in lengths])
+    n = self._num_examples
+    ranks = [min(int(n * q), n - 1) for q in quantiles]
+    return [
+        lengths[np.searchsorted(cumulative, r, side='right')] for r in ranks
+    ]
+
+  def RecommendBuckets(self, num_buckets, tokens_per_batch):
+    """Recommends bucketing params for BaseSequenceInputGenerator.
+
+    Buckets hold about the same number of examples, and batch limits are set so
+    that a full batch of each bucket holds about tokens_per_batch frames.
+
+    Args:
+      num_buckets: The number of buckets.
+      tokens_per_batch: The number of frames (or tokens) per full batch.
+
+    Returns:
+      A pair of lists (bucket_upper_bound, bucket_batch_limit).
+    """
+    bounds = self.LengthQuantiles(
+        [(i + 1) / num_buckets for i in range(num_buckets)])
+    # Equal-count buckets may share a bound when many examples have one length.
+    bounds = sorted(set(bounds))
+    limits = [max(1, tokens_per_batch // max(1, b)) for b in bounds]
+    return bounds, limits
 
   def _PrintLengthBuckets(self):
-    sorted_lengths = sorted(self._lengths)
     num_buckets = FLAGS.num_buckets
-    n = len(sorted_lengths)
-    idx = (n * (np.array(range(num_buckets - 1)) + 1)) // num_buckets
-    buckets = [sorted_lengths[i] for i in idx] + [sorted_lengths[-1]]
+    buckets = self.LengthQuantiles(
+        [(i + 1) / num_buckets for i in range(num_buckets)])
     tf.logging.info('== Buckets.')
     tf.logging.info('bucket upper limits: %s', buckets)
     tf.logging.info('Other candidates for last bucket:')
-    tf.logging.info('  0.1%% loss: %u', sorted_lengths[int(n * .999)])
-    tf.logging.info('    1%% loss: %u', sorted_lengths[int(n * .99)])
-    tf.logging.info('    2%% loss: %u', sorted_lengths[int(n * .98)])
+    q999, q99, q98 = self.LengthQuantiles([.999, .99, .98])
+    tf.logging.info('  0.1%% loss: %u', q999)
+    tf.logging.info('    1%% loss: %u', q99)
+    tf.logging.info('    2%% loss: %u', q98)
+    if FLAGS.tokens_per_batch > 0:
+      bounds, limits = self.RecommendBuckets(num_buckets,
+                                             FLAGS.tokens_per_batch)
+      tf.logging.info('== Recommended params (%d frames per batch):',
+                      FLAGS.tokens_per_batch)
+      tf.logging.info('p.bucket_upper_bound = %s', bounds)
+      tf.logging.info('p.bucket_batch_limit = %s', limits)
 
   def _PrintMeanVar(self):
     m, v = self._ComputeMeanVar()
@@ -93,7 +188,17 @@ class StatsCollector(object):
   def Print(self):
     tf.logging.info('== Total number of examples: %u', self._num_examples)
     self._PrintLengthBuckets()
-    self._PrintMeanVar()
+    if self._num_frames:
+      self._PrintMeanVar()
+
+
+def _ComputeFileStats(args):
+  """Returns a StatsCollector over all examples of a tfrecord file."""
+  filepath, feature_name, frame_size = args
+  stats = StatsCollector(feature_name, frame_size)
+  for serialized in tf.compat.v1.io.tf_record_iterator(filepath):
+    stats.Accumulate(tf.train.Example.FromString(serialized))
+  return stats
 
 
 def main(_):
@@ -101,13 +206,22 @@ def main(_):
   if not FLAGS.feature_name:
     tf.logging.fatal('Use a --feature_name to specify what to bucketize on. '
                      'For instance, source_id for MT or frames for ASR.')
-  stats = StatsCollector()
-  for filepath in tf.gfile.Glob(FLAGS.input_filepattern):
-    records = tf.compat.v1.io.tf_record_iterator(filepath)
-    for serialized in records:
-      ex = tf.train.Example()
-      ex.ParseFromString(serialized)
-      stats.Accumulate(ex)
+  filepaths = tf.gfile.Glob(FLAGS.input_filepattern)
+  args = [(f, FLAGS.feature_name, FLAGS.frame_size) for f in filepaths]
+  stats = StatsCollector(FLAGS.feature_name, FLAGS.frame_size)
+  if FLAGS.num_workers > 1:
+    pool = multiprocessing.Pool(FLAGS.num_workers)
+    file_stats = pool.imap_unordered(_ComputeFileStats, args)
+  else:
+    pool = None
+    file_stats = six.moves.map(_ComputeFileStats, args)
+  for i, s in enumerate(file_stats):
+    stats.Merge(s)
+    tf.logging.info('Done with %d/%d files, %d examples.', i + 1,
+                    len(filepaths), stats.num_examples)
+  if pool:
+    pool.close()
+    pool.join()
   stats.Print()
 
 
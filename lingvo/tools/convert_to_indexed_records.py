@@ -0,0 +1,87 @@
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Convert tfrecord files to the "indexed" record format.
+
+Indexed record files are read by input generators with a file pattern such as
+'indexed:/path/train.indexed-*'. Records of each file are read in a random
+order, so a small file_buffer_size suffices for a good shuffle. See
+IndexedRecordWriter in lingvo/core/ops/record_yielder.h for the format.
+"""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import struct
+
+import tensorflow as tf
+
+tf.flags.DEFINE_string('input_filepattern', '',
+                       'File pattern of binary tfrecord files.')
+tf.flags.DEFINE_string(
+    'output_dir', '', 'Where to write the indexed record files. Each one has '
+    'the name of its input file, with output_suffix appended.')
+tf.flags.DEFINE_string('output_suffix', '.indexed',
+                       'Suffix of the output file names.')
+
+FLAGS = tf.flags.FLAGS
+
+_MAGIC = b'LVIDXREC'
+
+
+class IndexedRecordWriter(object):
+  """Writes records in the indexed record format."""
+
+  def __init__(self, filepath):
+    self._file = tf.gfile.Open(filepath, 'wb')
+    self._offsets = [0]
+
+  def __enter__(self):
+    return self
+
+  def __exit__(self, *args):
+    self.close()
+
+  def write(self, record):
+    self._file.write(record)
+    self._offsets.append(self._offsets[-1] + len(record))
+
+  def close(self):
+    num_records = len(self._offsets) - 1
+    self._file.write(
+        struct.pack('<%dQ' % (num_records + 2), *(self._offsets +
+                                                  [num_records])))
+    self._file.write(_MAGIC)
+    self._file.close()
+
+
+def main(_):
+  tf.logging.set_verbosity(tf.logging.INFO)
+  tf.gfile.MakeDirs(FLAGS.output_dir)
+  for filepath in tf.gfile.Glob(FLAGS.input_filepattern):
+    output_filepath = os.path.join(
+        FLAGS.output_dir,
+        os.path.basename(filepath) + FLAGS.output_suffix)
+    n = 0
+    with IndexedRecordWriter(output_filepath) as outf:
+      for record in tf.python_io.tf_record_iterator(filepath):
+        outf.write(record)
+        n += 1
+    tf.logging.info('Wrote %d records to %s', n, output_filepath)
+
+
+if __name__ == '__main__':
+  tf.app.run(main)
@@ -18,13 +18,18 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
 import numpy as np
 import os
 import random
 import re
 
 import tarfile
+import threading
+import time
 
+from six.moves import queue
+from six.moves import range
 import tensorflow as tf
 
 from lingvo.tools import audio_lib
@@ -49,6 +54,26 @@ tf.flags.DEFINE_integer('output_range_end', -1, 'End of output shard IDs.')
 tf.flags.DEFINE_integer('num_output_shards', -1,
                         'Total number of output shards.')
 
+tf.flags.DEFINE_integer(
+    'num_workers', 0,
+    'If > 0, --generate_tfrecords reads the tarball once and fans the '
+    'utterances out to this many feature extraction processes, which compute '
+    'log-mel features in padded batches. --num_shards and --shard_id are then '
+    'optional, and the output range defaults to all output shards.')
+tf.flags.DEFINE_integer(
+    'batch_size', 16,
+    'When num_workers > 0: number of utterances per log-mel batch.')
+tf.flags.DEFINE_integer(
+    'queue_size_per_worker', 4,
+    'When num_workers > 0: max number of batches buffered per worker.')
+tf.flags.DEFINE_integer(
+    'report_interval_secs', 60,
+    'When num_workers > 0: seconds between progress and throughput logs.')
+tf.flags.DEFINE_bool(
+    'resume', False,
+    'When num_workers > 0: keep the utterances already written to the output '
+    'shards by an interrupted run and skip them.')
+
 FLAGS = tf.flags.FLAGS
 
 
@@ -156,6 +181,70 @@ def _CloseSubShards(files):
     f.close()
 
 
+class _ResumableShardWriter(object):
+  """Writes an output shard that can be resumed after an interruption.
+
+  Records go to a hidden staging file that is renamed to the shard's filepath
+  on Close(). When resuming, the valid records of the largest of the shard,
+  its staging file and its resume file (the copy source of an earlier resume)
+  are copied to a new staging file first, and their uttids are collected in
+  `uttids`. At every point the largest of the three files holds all the
+  records written so far, so a resume can itself be interrupted.
+  """
+
+  def __init__(self, filepath, resume):
+    self._filepath = filepath
+    dirname, basename = os.path.split(filepath)
+    self._staging_filepath = os.path.join(dirname, '.%s.inprogress' % basename)
+    self._resume_filepath = os.path.join(dirname, '.%s.resume' % basename)
+    self.uttids = set()
+    if resume:
+      self._MoveLargestToResumeFile()
+    self._writer = tf.python_io.TFRecordWriter(self._staging_filepath)
+    if resume and tf.gfile.Exists(self._resume_filepath):
+      self._CopyResumeFile()
+
+  def _MoveLargestToResumeFile(self):
+    filepaths = [
+        f for f in (self._filepath, self._staging_filepath,
+                    self._resume_filepath) if tf.gfile.Exists(f)
+    ]
+    if not filepaths:
+      return
+    largest = max(filepaths, key=lambda f: tf.gfile.Stat(f).length)
+    if largest != self._resume_filepath:
+      tf.gfile.Rename(largest, self._resume_filepath, overwrite=True)
+    for f in (self._filepath, self._staging_filepath):
+      if tf.gfile.Exists(f):
+        tf.gfile.Remove(f)
+
+  def _CopyResumeFile(self):
+    try:
+      for record in tf.python_io.tf_record_iterator(self._resume_filepath):
+        ex = tf.train.Example.FromString(record)
+        uttid = ex.features.feature['uttid'].bytes_list.value[0]
+        self._writer.write(record)
+        self.uttids.add(tf.compat.as_text(uttid))
+    except tf.errors.DataLossError:
+      tf.logging.warning('Dropping the truncated tail of %s',
+                         self._resume_filepath)
+    tf.logging.info('Resuming %s with %d utterances', self._filepath,
+                    len(self.uttids))
+
+  def write(self, record):
+    self._writer.write(record)
+
+  def abandon(self):
+    """Closes the staging file without renaming it, for a later resume."""
+    self._writer.close()
+
+  def close(self):
+    self._writer.close()
+    tf.gfile.Rename(self._staging_filepath, self._filepath, overwrite=True)
+    if tf.gfile.Exists(self._resume_filepath):
+      tf.gfile.Remove(self._resume_filepath)
+
+
 def _SelectRandomShard(files):
   subshard = random.randint(0, len(files) - 1)
   return files[subshard]
@@ -200,10 +289,187 @@ def _CreateAsrFeatures():
   _CloseSubShards(recordio_writers)
 
 
+def _ComputeBatchFeatures(sess, pcm_t, paddings_t, log_mel_t, frame_paddings_t,
+                          batch):
+  """Returns serialized tf.Examples of a batch of (uttid, text, flac bytes)."""
+  audios = []
+  for uttid, _, flac_bytes in batch:
+    sample_rate, audio = audio_lib.DecodeWavToPcm(
+        audio_lib.DecodeFlacToWav(flac_bytes))
+    assert sample_rate == 16000, (uttid, sample_rate)
+    # Keep the first channel, like ExtractLogMelFeatures.
+    audios.append(audio[:, 0])
+  max_len = max(len(a) for a in audios)
+  pcm = np.zeros([len(audios), max_len], dtype=np.float32)
+  paddings = np.ones([len(audios), max_len], dtype=np.float32)
+  for i, audio in enumerate(audios):
+    pcm[i, :len(audio)] = audio
+    paddings[i, :len(audio)] = 0.
+  log_mel, frame_paddings = sess.run([log_mel_t, frame_paddings_t],
+                                     feed_dict={
+                                         pcm_t: pcm,
+                                         paddings_t: paddings
+                                     })
+  records = []
+  for i, (uttid, text, _) in enumerate(batch):
+    num_frames = int(np.sum(frame_paddings[i] == 0.))
+    # Same [1, frames, 80, 1] layout as ExtractLogMelFeatures.
+    frames = log_mel[i:i + 1, :num_frames]
+    records.append(_MakeTfExample(uttid, frames, text).SerializeToString())
+  return records
+
+
+def _FeatureWorker(batch_queue, record_queue):
+  """Feature extraction process: utterance batches to serialized records."""
+  # Each process builds its own graph and session, after the fork.
+  with tf.Graph().as_default():
+    pcm_t = tf.placeholder(dtype=tf.float32, shape=[None, None])
+    paddings_t = tf.placeholder(dtype=tf.float32, shape=[None, None])
+    log_mel_t, frame_paddings_t = audio_lib.ExtractLogMelFeaturesFromPcm(
+        pcm_t, paddings_t)
+    tfconf = tf.ConfigProto()
+    tfconf.gpu_options.allow_growth = True
+    with tf.Session(config=tfconf) as sess:
+      while True:
+        batch = batch_queue.get()
+        if batch is None:
+          record_queue.put(None)
+          return
+        record_queue.put(
+            _ComputeBatchFeatures(sess, pcm_t, paddings_t, log_mel_t,
+                                  frame_paddings_t, batch))
+
+
+def _CreateAsrFeaturesInParallel():
+  """Creates the features with one tar reader and a pool of worker processes.
+
+  A reader thread streams the flac files of the tarball (once) in batches of
+  --batch_size into a bounded queue, --num_workers processes decode them and
+  compute log-mel features over padded batches, and the main thread writes the
+  records to random output shards. With --resume, utterances that are already
+  in the output shards are skipped.
+  """
+  if os.path.exists(FLAGS.transcripts_filepath):
+    trans = _LoadTranscriptionsFromFile()
+  else:
+    tf.logging.info('Running first pass on the fly')
+    trans = _ReadTranscriptions()
+  tf.logging.info('Total transcripts: %d', len(trans))
+
+  if FLAGS.output_range_begin < 0:
+    output_range = range(FLAGS.num_output_shards)
+  else:
+    output_range = range(FLAGS.output_range_begin, FLAGS.output_range_end)
+  writers = []
+  for s in output_range:
+    filepath = FLAGS.output_template % (s, FLAGS.num_output_shards)
+    tf.logging.info('Opening output shard: %s', filepath)
+    writers.append(_ResumableShardWriter(filepath, FLAGS.resume))
+  done_uttids = set()
+  for w in writers:
+    done_uttids |= w.uttids
+  if FLAGS.resume:
+    tf.logging.info('Skipping %d utterances already written',
+                    len(done_uttids))
+
+  num_workers = FLAGS.num_workers
+  queue_size = FLAGS.queue_size_per_worker * num_workers
+  batch_queue = multiprocessing.Queue(queue_size)
+  record_queue = multiprocessing.Queue(queue_size)
+
+  workers = [
+      multiprocessing.Process(
+          target=_FeatureWorker, args=(batch_queue, record_queue))
+      for _ in range(num_workers)
+  ]
+  for w in workers:
+    w.daemon = True
+    w.start()
+
+  def _Read():
+    """Puts batches of (uttid, transcript, flac bytes) into batch_queue."""
+    tar = tarfile.open(FLAGS.input_tarball, mode='r:gz')
+    n = 0
+    batch = []
+    for tarinfo in tar:
+      if not tarinfo.name.endswith('.flac'):
+        continue
+      n += 1
+      if FLAGS.num_shards > 0 and n % FLAGS.num_shards != FLAGS.shard_id:
+        continue
+      uttid = re.sub('.*/(.+)\\.flac', '\\1', tarinfo.name)
+      if uttid in done_uttids:
+        continue
+      assert uttid in trans, uttid
+      f = tar.extractfile(tarinfo)
+      batch.append((uttid, trans[uttid], f.read()))
+      f.close()
+      if len(batch) == FLAGS.batch_size:
+        batch_queue.put(batch)
+        batch = []
+    tar.close()
+    if batch:
+      batch_queue.put(batch)
+    for _ in range(num_workers):
+      batch_queue.put(None)
+    reader_done.set()
+
+  reader_done = threading.Event()
+  reader = threading.Thread(target=_Read)
+  reader.daemon = True
+  reader.start()
+
+  start_time = time.time()
+  last_report_time = start_time
+  num_utts = 0
+  num_finished_workers = 0
+  try:
+    while num_finished_workers < num_workers:
+      try:
+        records = record_queue.get(timeout=FLAGS.report_interval_secs)
+      except queue.Empty:
+        if not all(w.is_alive() or w.exitcode == 0 for w in workers):
+          raise RuntimeError('A feature extraction worker died unexpectedly.')
+        if not reader.is_alive() and not reader_done.is_set():
+          raise RuntimeError('The tarball reader failed.')
+        continue
+      if records is None:
+        num_finished_workers += 1
+        continue
+      for record in records:
+        _SelectRandomShard(writers).write(record)
+      num_utts += len(records)
+      now = time.time()
+      if now - last_report_time >= FLAGS.report_interval_secs:
+        last_report_time = now
+        tf.logging.info('Wrote %d utterances (%.1f utts/sec).', num_utts,
+                        num_utts / (now - start_time))
+  except:  # pylint: disable=bare-except
+    for w in workers:
+      w.terminate()
+    # Don't block exit on flushing batches that no worker will read.
+    batch_queue.cancel_join_thread()
+    # Only complete shards are renamed into place, the staging files are kept
+    # for --resume.
+    for w in writers:
+      w.abandon()
+    raise
+
+  _CloseSubShards(writers)
+  reader.join()
+  for w in workers:
+    w.join()
+  elapsed = time.time() - start_time
+  tf.logging.info('Done: wrote %d utterances in %.1fs (%.1f utts/sec).',
+                  num_utts, elapsed, num_utts / max(elapsed, 1e-6))
+
+
 def main(_):
   tf.logging.set_verbosity(tf.logging.INFO)
   if FLAGS.dump_transcripts:
     _DumpTranscripts()
+  elif FLAGS.generate_tfrecords and FLAGS.num_workers > 0:
+    _CreateAsrFeaturesInParallel()
   elif FLAGS.generate_tfrecords:
     _CreateAsrFeatures()
   else:
@@ -18,7 +18,14 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import multiprocessing
+import threading
+import time
+
 import numpy as np
+from six.moves import queue
+from six.moves import range
+from six.moves import zip
 
 import tensorflow as tf
 
@@ -37,6 +44,25 @@ tf.flags.DEFINE_integer(
     'max_len', 0,
     'Drop sentence if src/tgt tokens exceed max length, counting <s> and </s>. '
     'Only use during training. A value of 0 does not filter.')
+tf.flags.DEFINE_integer(
+    'batch_size', 0,
+    'If > 0, sentence pairs are encoded in batches of this size with the '
+    'native (non-graph) encoder in a streaming pipeline of worker processes, '
+    'instead of one session.run per pair.')
+tf.flags.DEFINE_integer(
+    'num_workers', 1,
+    'Number of encoding processes when batch_size > 0.')
+tf.flags.DEFINE_integer(
+    'num_output_shards', 0,
+    'When batch_size > 0: if > 0, output is spread over this many files named '
+    'output_filepath-?????-of-?????. Otherwise output_filepath is written.')
+tf.flags.DEFINE_integer(
+    'queue_size_per_worker', 4,
+    'When batch_size > 0: max number of batches buffered per encoding worker '
+    'and per output shard.')
+tf.flags.DEFINE_integer(
+    'report_interval_secs', 60,
+    'When batch_size > 0: seconds between progress and throughput logs.')
 
 FLAGS = tf.flags.FLAGS
 
@@ -94,6 +120,35 @@ def _Preprocess(text):
   return text
 
 
+def _ReadTextPairs():
+  """Lazily yields preprocessed (source, target) text pairs of this shard.
+
+  Files are streamed line by line, so memory use does not depend on the size
+  of the corpus. If --num_shards > 0, only every num_shards-th pair starting
+  at --shard_id is yielded.
+  """
+  file_pairs = zip(
+      FLAGS.source_filepaths.split(','), FLAGS.target_filepaths.split(','))
+  n = 0
+  for p in file_pairs:
+    with tf.gfile.Open(p[0], 'r') as sourcef:
+      with tf.gfile.Open(p[1], 'r') as targetf:
+        for textp in zip(sourcef, targetf):
+          n += 1
+          if n % 10000 == 0:
+            tf.logging.info('Watermark[%d]: %d', FLAGS.shard_id, n)
+          if FLAGS.num_shards > 0 and n % FLAGS.num_shards != FLAGS.shard_id:
+            continue
+          source_text = _Preprocess(textp[0])
+          target_text = _Preprocess(textp[1])
+          # By convention:
+          # * source always ends in </s>, never starts with <s>.
+          # * target never ends in </s>, always starts with <s>.
+          _AssertTextFormat(source_text)
+          _AssertTextFormat(target_text)
+          yield source_text, target_text
+
+
 def _RunEncoding():
   sess = tf.Session()
   enc = wpm_encoder.WpmEncoder(FLAGS.wpm_filepath)
@@ -101,43 +156,223 @@ def _RunEncoding():
   src_encode_op = enc.Encode(src_txt_placeholder)
   tgt_txt_placeholder = tf.placeholder(tf.string, [])
   tgt_encode_op = enc.Encode(tgt_txt_placeholder)
-  pairs = zip(
-      FLAGS.source_filepaths.split(','), FLAGS.target_filepaths.split(','))
   with tf.python_io.TFRecordWriter(FLAGS.output_filepath) as outf:
-    n = 0
-    for p in pairs:
-      with tf.gfile.Open(p[0], 'r') as sourcef:
-        with tf.gfile.Open(p[1], 'r') as targetf:
-          for textp in zip(sourcef.readlines(), targetf.readlines()):
-            n += 1
-            if n % 10000 == 0:
-              tf.logging.info('Watermark[%d]: %d', FLAGS.shard_id, n)
-            if n % FLAGS.num_shards != FLAGS.shard_id:
-              continue
-            source_text = _Preprocess(textp[0])
-            target_text = _Preprocess(textp[1])
-            # By convention:
-            # * source always ends in </s>, never starts with <s>.
-            # * target never ends in </s>, always starts with <s>.
-            _AssertTextFormat(source_text)
-            _AssertTextFormat(target_text)
-            ((src_i, src_s), (tgt_i, tgt_s)) = sess.run(
-                [src_encode_op, tgt_encode_op],
-                feed_dict={
-                    src_txt_placeholder: source_text,
-                    tgt_txt_placeholder: target_text
-                },
-            )
-            ex = _MakeTfExample(enc, src_i, src_s, tgt_i, tgt_s)
-            if not ex:  # Too long.
-              continue
-            encoded = ex.SerializeToString()
-            outf.write(encoded)
+    for source_text, target_text in _ReadTextPairs():
+      ((src_i, src_s), (tgt_i, tgt_s)) = sess.run(
+          [src_encode_op, tgt_encode_op],
+          feed_dict={
+              src_txt_placeholder: source_text,
+              tgt_txt_placeholder: target_text
+          },
+      )
+      ex = _MakeTfExample(enc, src_i, src_s, tgt_i, tgt_s)
+      if not ex:  # Too long.
+        continue
+      encoded = ex.SerializeToString()
+      outf.write(encoded)
+
+
+def _EncodeBatch(enc, text_pairs):
+  """Returns serialized tf.Examples of a batch of (source, target) pairs."""
+  encoded_sources = enc.EncodeBatch([p[0] for p in text_pairs])
+  encoded_targets = enc.EncodeBatch([p[1] for p in text_pairs])
+  records = []
+  for (src_i, src_s), (tgt_i, tgt_s) in zip(encoded_sources, encoded_targets):
+    ex = _MakeTfExample(enc, src_i, src_s, tgt_i, tgt_s)
+    if ex:  # Not too long.
+      records.append(ex.SerializeToString())
+  return records
+
+
+def _EncodeWorker(wpm_filepath, batch_queue, record_queue):
+  """Encoding process: batches from batch_queue to records in record_queue."""
+  enc = wpm_encoder.WpmEncoder(wpm_filepath)
+  while True:
+    item = batch_queue.get()
+    if item is None:
+      record_queue.put(None)
+      return
+    batch_id, text_pairs = item
+    record_queue.put((batch_id, len(text_pairs),
+                      _EncodeBatch(enc, text_pairs)))
+
+
+def _ShardWriter(filepath, record_queue, errors):
+  """Writer thread: writes lists of records from record_queue to filepath.
+
+  An exception is appended to `errors`, so that the main thread re-raises it.
+  """
+  try:
+    with tf.python_io.TFRecordWriter(filepath) as outf:
+      while True:
+        records = record_queue.get()
+        if records is None:
+          return
+        for encoded in records:
+          outf.write(encoded)
+  except Exception as e:  # pylint: disable=broad-except
+    errors.append(e)
+
+
+def _PutToWriter(record_queue, writer, errors, records):
+  """Puts `records` for `writer`, failing if the writer thread has died."""
+  while True:
+    if errors:
+      raise errors[0]
+    if not writer.is_alive():
+      raise RuntimeError('An output shard writer died unexpectedly.')
+    try:
+      record_queue.put(records, timeout=1)
+      return
+    except queue.Full:
+      pass
+
+
+def _OutputFilepaths():
+  if FLAGS.num_output_shards <= 0:
+    return [FLAGS.output_filepath]
+  return [
+      '%s-%05d-of-%05d' % (FLAGS.output_filepath, i, FLAGS.num_output_shards)
+      for i in range(FLAGS.num_output_shards)
+  ]
+
+
+def _RunStreamingEncoding():
+  """Encodes with a bounded pipeline of reader, encoders and shard writers.
+
+  A reader thread streams text pairs in batches of --batch_size into a bounded
+  queue, --num_workers processes encode them with WpmEncoder.EncodeBatch, and
+  one writer thread per output shard writes the records. All queues are
+  bounded, so memory use is constant in the size of the corpus. Batch i is
+  written to output shard i % num_output_shards.
+
+  The records of a batch are written together, in input order, but batches
+  are written in the order the workers finish them, so the order of the
+  records in a shard is only deterministic with --num_workers=1.
+  """
+  num_workers = max(1, FLAGS.num_workers)
+  queue_size = FLAGS.queue_size_per_worker * num_workers
+  batch_queue = multiprocessing.Queue(queue_size)
+  record_queue = multiprocessing.Queue(queue_size)
+
+  def _Read():
+    """Puts batches of text pairs into batch_queue.
+
+    An exception is appended to `reader_errors`, so that the main thread
+    re-raises it. The workers are always told to finish.
+    """
+    try:
+      batch = []
+      batch_id = 0
+      for text_pair in _ReadTextPairs():
+        batch.append(text_pair)
+        if len(batch) == FLAGS.batch_size:
+          batch_queue.put((batch_id, batch))
+          batch_id += 1
+          batch = []
+      if batch:
+        batch_queue.put((batch_id, batch))
+      reader_done.set()
+    except Exception as e:  # pylint: disable=broad-except
+      reader_errors.append(e)
+    finally:
+      for _ in range(num_workers):
+        batch_queue.put(None)
+
+  workers = [
+      multiprocessing.Process(
+          target=_EncodeWorker,
+          args=(FLAGS.wpm_filepath, batch_queue, record_queue))
+      for _ in range(num_workers)
+  ]
+  for w in workers:
+    w.daemon = True
+    w.start()
+  reader_errors = []
+  reader_done = threading.Event()
+  reader = threading.Thread(target=_Read)
+  reader.daemon = True
+  reader.start()
+
+  writer_queues = []
+  writers = []
+  writer_errors = []
+  for filepath in _OutputFilepaths():
+    writer_queues.append(queue.Queue(FLAGS.queue_size_per_worker))
+    writers.append(
+        threading.Thread(
+            target=_ShardWriter,
+            args=(filepath, writer_queues[-1], writer_errors)))
+    writers[-1].start()
+
+  start_time = time.time()
+  last_report_time = start_time
+  num_pairs = 0
+  num_records = 0
+  num_finished_workers = 0
+  try:
+    while num_finished_workers < num_workers:
+      try:
+        # A short timeout, so that a dead worker is noticed promptly.
+        item = record_queue.get(timeout=1)
+      except queue.Empty:
+        if reader_errors:
+          raise reader_errors[0]
+        if not reader.is_alive() and not reader_done.is_set():
+          raise RuntimeError('The text reader died unexpectedly.')
+        if not all(w.is_alive() or w.exitcode == 0 for w in workers):
+          raise RuntimeError('An encoding worker died unexpectedly.')
+        continue
+      if item is None:
+        num_finished_workers += 1
+        continue
+      batch_id, batch_size, records = item
+      shard = batch_id % len(writer_queues)
+      _PutToWriter(writer_queues[shard], writers[shard], writer_errors,
+                   records)
+      num_pairs += batch_size
+      num_records += len(records)
+      now = time.time()
+      if now - last_report_time >= FLAGS.report_interval_secs:
+        last_report_time = now
+        tf.logging.info(
+            'Encoded %d pairs, wrote %d records (%.1f pairs/sec).', num_pairs,
+            num_records, num_pairs / (now - start_time))
+    # The workers also finish when the reader fails.
+    if reader_errors:
+      raise reader_errors[0]
+  except:  # pylint: disable=bare-except
+    for w in workers:
+      w.terminate()
+    # Don't block exit on flushing batches that no worker will read.
+    batch_queue.cancel_join_thread()
+    raise
+  finally:
+    # Writers flush and close their files even if encoding failed. A dead
+    # writer does not read its queue, so it is not waited for.
+    for q, t in zip(writer_queues, writers):
+      if t.is_alive():
+        q.put(None)
+    for t in writers:
+      t.join()
+  if writer_errors:
+    raise writer_errors[0]
+
+  reader.join()
+  for w in workers:
+    w.join()
+  elapsed = time.time() - start_time
+  tf.logging.info('Done: encoded %d pairs, wrote %d records in %.1fs '
+                  '(%.1f pairs/sec).', num_pairs, num_records, elapsed,
+                  num_pairs / max(elapsed, 1e-6))
 
 
 def main(_):
   tf.logging.set_verbosity(tf.logging.INFO)
-  _RunEncoding()
+  if FLAGS.batch_size > 0:
+    _RunStreamingEncoding()
+  else:
+    _RunEncoding()
 
 
 if __name__ == '__main__':
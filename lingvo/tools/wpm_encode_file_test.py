@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Copyright 2018 The TensorFlow Authors. All Rights Reserved.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+"""Tests for wpm_encode_file."""
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+
+import tensorflow as tf
+
+from lingvo.tools import wpm_encode_file
+
+FLAGS = tf.flags.FLAGS
+
+
+class WpmEncodeFileTest(tf.test.TestCase):
+
+  def setUp(self):
+    super(WpmEncodeFileTest, self).setUp()
+    self._tmpdir = os.path.join(tf.test.get_temp_dir(), self._testMethodName)
+    tf.gfile.MakeDirs(self._tmpdir)
+    FLAGS.wpm_filepath = self._WriteLines(
+        'wpm.voc', ['<unk>', '<s>', '</s>', 't', 'i', 'o', 'to', 'it', '▁'])
+    FLAGS.output_filepath = os.path.join(self._tmpdir, 'out.tfrecord')
+    FLAGS.batch_size = 2
+    FLAGS.num_workers = 2
+    FLAGS.num_output_shards = 0
+
+  def _WriteLines(self, name, lines):
+    path = os.path.join(self._tmpdir, name)
+    with tf.gfile.Open(path, 'w') as f:
+      f.write(''.join(line + '\n' for line in lines))
+    return path
+
+  def testStreamingEncoding(self):
+    FLAGS.source_filepaths = self._WriteLines(
+        'src.txt', ['to it', 'it', 'tot </s>'])
+    FLAGS.target_filepaths = self._WriteLines('tgt.txt', ['it', 'to', 'o'])
+    wpm_encode_file._RunStreamingEncoding()
+    records = list(tf.python_io.tf_record_iterator(FLAGS.output_filepath))
+    self.assertEqual(3, len(records))
+
+  def testStreamingEncodingUnreadableInput(self):
+    FLAGS.source_filepaths = os.path.join(self._tmpdir, 'missing.txt')
+    FLAGS.target_filepaths = self._WriteLines('tgt.txt', ['it'])
+    # The reader fails instead of leaving the workers waiting for batches.
+    with self.assertRaises(tf.errors.NotFoundError):
+      wpm_encode_file._RunStreamingEncoding()
+
+
+if __name__ == '__main__':
+  tf.test.main()
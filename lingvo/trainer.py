@@ -33,12 +33,15 @@ from __future__ import print_function
 
 import inspect
 import os
+import pickle
 import re
+import sys
 import threading
 import time
 
 import numpy as np
 import six
+from six.moves import queue
 from six.moves import zip
 import tensorflow as tf
 
@@ -47,10 +50,13 @@ from tensorflow.contrib.tpu.python.tpu import tpu_function
 from tensorflow.core.protobuf import config_pb2
 from lingvo import base_trial
 from lingvo import model_registry
+from lingvo.core import async_checkpointer
 from lingvo.core import base_model
 from lingvo.core import base_model_params
+from lingvo.core import checkpoint_watcher
 from lingvo.core import cluster_factory
 from lingvo.core import inference_graph_exporter
+from lingvo.core import key_value_io
 from lingvo.core import metrics
 from lingvo.core import py_utils
 
@@ -126,6 +132,44 @@ tf.flags.DEFINE_string(
     'evaler_dev and decoder_dev will only match the corresponding '
     'jobs that are on the dev set.')
 
+tf.flags.DEFINE_bool(
+    'async_checkpoint', False,
+    'If True, the controller snapshots the variables into host memory and '
+    'writes checkpoints on a background thread, so that slow file systems '
+    'do not stall its summaries and stop checks.')
+tf.flags.DEFINE_integer(
+    'async_checkpoint_max_pending', 1,
+    'With --async_checkpoint, the maximum number of snapshots which are '
+    'not completely written yet. Checkpoints are skipped while there are '
+    'this many.')
+
+tf.flags.DEFINE_integer(
+    'decoder_out_num_shards', 1,
+    'The number of shards of the decoder output table of each checkpoint. '
+    'See lingvo.core.key_value_io.')
+tf.flags.DEFINE_integer(
+    'evaler_num_shards', 1,
+    'If larger than 1, evaler tasks 0 to evaler_num_shards - 1 of an eval '
+    'type each evaluate a disjoint slice of the eval data for the '
+    'checkpoints chosen by task 0, which combines their metrics into the '
+    'summaries. Requires an input generator reading from files.')
+tf.flags.DEFINE_integer(
+    'evaler_shard_timeout_secs', 3600,
+    'With --evaler_num_shards, the maximum number of seconds evaler task 0 '
+    'waits for the metrics of the other shards of a checkpoint. Summaries '
+    'are written from the shards done by then.')
+tf.flags.DEFINE_bool(
+    'multiplex_eval_jobs', False,
+    'If True, the evaler_* and decoder_* jobs in --job share one copy of the '
+    'variables through the container of the --tf_master server. Each '
+    'checkpoint is restored once, and then evaluated or decoded by each job '
+    'in turn on one thread. Requires a grpc --tf_master, e.g., with '
+    '--run_locally, and no trainer job in the same process.')
+tf.flags.DEFINE_integer(
+    'decoder_post_process_queue_size', 2,
+    'The maximum number of decoded batches waiting to be post-processed '
+    'while the decoder runs the next batch.')
+
 FLAGS = tf.flags.FLAGS
 
 
@@ -196,6 +240,16 @@ class Controller(base_runner.BaseRunner):
         self._saver = self._GetSaver()
         self._summary_op = tf.summary.merge_all()
         self._vars = tf.get_collection(tf.GraphKeys.GLOBAL_VARIABLES)
+        self._checkpointer = None
+        if FLAGS.async_checkpoint:
+          self._checkpointer = async_checkpointer.AsyncCheckpointer(
+              self._vars,
+              self._model.global_step,
+              self._save_path,
+              max_pending=FLAGS.async_checkpoint_max_pending,
+              max_to_keep=FLAGS.saver_max_to_keep,
+              keep_checkpoint_every_n_hours=0.5,  # one per 30 minutes
+              done_callback=self._CheckpointDone)
         self._uninitialized = tf.report_uninitialized_variables(self._vars)
         self._initialize_all = tf.global_variables_initializer()
         self.initialize_tables = tf.tables_initializer()
@@ -255,7 +309,12 @@ class Controller(base_runner.BaseRunner):
                                                        total_examples)
         if self._trial.ShouldStop() or self._ShouldStop(sess, global_step):
           tf.logging.info('Training finished.')
-          self._saver.save(sess, self._save_path, gsteps)
+          if self._checkpointer:
+            self._checkpointer.Save(sess, block=True)
+            self._checkpointer.Wait()
+          else:
+            self._saver.save(sess, self._save_path, gsteps)
+            checkpoint_watcher.NotifyNewCheckpoint(self._train_dir)
           # Close all the queues so the enqueue threads can also finish.
           for close_op in self.close_queue_ops:
             sess.run(close_op)
@@ -264,10 +323,16 @@ class Controller(base_runner.BaseRunner):
 
         # Checkpoint.
         if now >= next_checkpoint_seconds:
-          tf.logging.info('Save checkpoint')
-          path = self._saver.save(sess, self._save_path, gsteps)
-          tf.logging.info('Save checkpoint done: %s', path)
-          next_checkpoint_seconds = now + save_interval_seconds
+          if self._checkpointer:
+            # Retries in the next iteration if the snapshot is skipped.
+            if self._checkpointer.Save(sess):
+              next_checkpoint_seconds = now + save_interval_seconds
+          else:
+            tf.logging.info('Save checkpoint')
+            path = self._saver.save(sess, self._save_path, gsteps)
+            tf.logging.info('Save checkpoint done: %s', path)
+            checkpoint_watcher.NotifyNewCheckpoint(self._train_dir)
+            next_checkpoint_seconds = now + save_interval_seconds
 
         # Summary.
         if self._summary_op is not None and global_step >= next_summary_step:
@@ -347,6 +412,19 @@ class Controller(base_runner.BaseRunner):
                     [v.name for v in uninitialized_vars])
     sess.run(tf.variables_initializer(uninitialized_vars))
 
+  def _CheckpointDone(self, global_step, path, snapshot_seconds,
+                      write_seconds):
+    """Called by self._checkpointer after a checkpoint is written."""
+    del path  # Unused.
+    checkpoint_watcher.NotifyNewCheckpoint(self._train_dir)
+    self._SummarizeValue(global_step, 'checkpoint/snapshot_seconds',
+                         snapshot_seconds)
+    self._SummarizeValue(global_step, 'checkpoint/write_seconds',
+                         write_seconds)
+    self._ExportMetrics(
+        checkpoint_snapshot_seconds=snapshot_seconds,
+        checkpoint_write_seconds=write_seconds)
+
   def _SummarizeValue(self, steps, tag, value):
     self._summary_writer.add_summary(
         metrics.CreateScalarSummary(tag, value), steps)
@@ -379,11 +457,22 @@ class Trainer(base_runner.BaseRunner):
 
   def __init__(self, *args, **kwargs):
     super(Trainer, self).__init__(*args, **kwargs)
+    self._steps_per_loop = min(self.params.train.steps_per_loop,
+                               self.params.train.max_steps)
+    # Multi-task models sample the task to train in python before every step,
+    # which a tf.while_loop cannot do.
+    if (self._steps_per_loop > 1 and
+        issubclass(self.params.cls, base_model.MultiTaskModel)):
+      raise ValueError('train.steps_per_loop > 1 requires a single-task '
+                       'model, got %s.' % self.params.cls.__name__)
     with self._graph.as_default(), tf.container(self._container_id):
       with self._cluster, tf.device(self._cluster.GetPlacer()):
-        self._model = self.params.cls(self.params)
+        if self._steps_per_loop > 1:
+          self._BuildTrainLoop()
+        else:
+          self._model = self.params.cls(self.params)
+          self._model.ConstructFPropBPropGraph()
         self._params = self._model.params
-        self._model.ConstructFPropBPropGraph()
       self.initialize_tables = tf.tables_initializer()
       self._initialize_local_vars = tf.local_variables_initializer()
       self.enqueue_ops = tf.get_collection(py_utils.ENQUEUE_OPS)
@@ -412,6 +501,41 @@ class Trainer(base_runner.BaseRunner):
     self._start_up_delay_steps = (((worker_id + 1) * worker_id / 2) *
                                   self.params.train.start_up_delay_steps)
 
+  def _BuildTrainLoop(self):
+    """Builds a tf.while_loop running self._steps_per_loop train steps."""
+    tf.logging.info('Creating Trainer with %d steps_per_loop',
+                    self._steps_per_loop)
+    self._eval_metrics = metrics.LoopEvalMetrics()
+
+    def LoopCond(i, *args):
+      del args
+      return i < self._steps_per_loop
+
+    def LoopBody(i, *args):
+      """Runs one train step and adds its metrics to the summed `args`."""
+      self._model = self.params.cls(self.params)
+      self._model.ConstructFPropBPropGraph()
+      task = self._model.GetTask()
+      per_step_eval_metrics = self._eval_metrics.SetMetrics(
+          task.eval_metrics, args)
+      summed_metrics = []
+      with tf.control_dependencies([task.train_op]):
+        for x, y in zip(per_step_eval_metrics, args):
+          summed_metrics.append(x + y)
+      return [i + 1] + summed_metrics
+
+    loop_result = tf.while_loop(
+        LoopCond,
+        LoopBody, [tf.constant(0)] + self._eval_metrics.initial_values,
+        parallel_iterations=1,
+        back_prop=False,
+        name='train_loop')
+    # Final metrics are the avg across self._steps_per_loop steps.
+    loop_metrics = self._eval_metrics.FinalizeMetrics(list(loop_result[1:]))
+    with tf.control_dependencies(loop_metrics):
+      global_step = tf.identity(self._model.global_step)
+    self._train_loop_ops = [loop_metrics, global_step]
+
   def _SummarizeValue(self, steps, tag, value, writer):
     if writer:
       writer.add_summary(metrics.CreateScalarSummary(tag, value), steps)
@@ -480,33 +604,15 @@ class Trainer(base_runner.BaseRunner):
             time.sleep(300)  # controller hangs if it doesn't finish first
           return
 
-        # If a task is explicitly specified, only train that task.
-        if self._model_task_name:
-          model_task = self._model.GetTask(self._model_task_name)
+        if self._steps_per_loop > 1:
+          model_task = self._model.GetTask()
+          values, global_step = sess.run(self._train_loop_ops)
+          eval_metrics = self._eval_metrics.PackMetricsValues(values)
+          per_example_tensors = {}
         else:
-          # Note: This is a slightly stale global_step value from the previous
-          # sess.run() call.
-          # For multi-task models, `self._model.task_schedule.cur_probs` will
-          # be updated.
-          model_task = self._model.SampleTask(global_step)
-          if self._task_probs_summary_writers:
-            for index, prob in enumerate(self._model.task_schedule.cur_probs):
-              self._SummarizeValue(global_step, 'task_probability', prob,
-                                   self._task_probs_summary_writers[index])
-            try:
-              for index, task in enumerate(self._model.tasks):
-                self._SummarizeValue(global_step, 'task_weight',
-                                     sess.run(task.vars.task_weight),
-                                     self._task_probs_summary_writers[index])
-            except AttributeError:
-              pass
-
-        _, global_step, eval_metrics, per_example_tensors = sess.run([
-            model_task.train_op,
-            self._model.global_step,
-            model_task.eval_metrics,
-            model_task.per_example_tensors,
-        ])
+          model_task, global_step, eval_metrics, per_example_tensors = (
+              self._RunTrainStep(sess, global_step))
+
         msg = 'step:%6d' % (global_step)
         for key, (val, _) in sorted(six.iteritems(eval_metrics)):
           msg += ' %s:%.8g' % (key, val)
@@ -521,6 +627,46 @@ class Trainer(base_runner.BaseRunner):
         self._model.ProcessFPropResults(sess, global_step, eval_metrics,
                                         per_example_tensors)
 
+  def _RunTrainStep(self, sess, global_step):
+    """Runs one train step.
+
+    Args:
+      sess: The session.
+      global_step: The global step before this train step.
+
+    Returns:
+      A tuple (model_task, global_step, eval_metrics, per_example_tensors) of
+      the task trained and the fetched values.
+    """
+    # If a task is explicitly specified, only train that task.
+    if self._model_task_name:
+      model_task = self._model.GetTask(self._model_task_name)
+    else:
+      # Note: This is a slightly stale global_step value from the previous
+      # sess.run() call.
+      # For multi-task models, `self._model.task_schedule.cur_probs` will
+      # be updated.
+      model_task = self._model.SampleTask(global_step)
+      if self._task_probs_summary_writers:
+        for index, prob in enumerate(self._model.task_schedule.cur_probs):
+          self._SummarizeValue(global_step, 'task_probability', prob,
+                               self._task_probs_summary_writers[index])
+        try:
+          for index, task in enumerate(self._model.tasks):
+            self._SummarizeValue(global_step, 'task_weight',
+                                 sess.run(task.vars.task_weight),
+                                 self._task_probs_summary_writers[index])
+        except AttributeError:
+          pass
+
+    _, global_step, eval_metrics, per_example_tensors = sess.run([
+        model_task.train_op,
+        self._model.global_step,
+        model_task.eval_metrics,
+        model_task.per_example_tensors,
+    ])
+    return model_task, global_step, eval_metrics, per_example_tensors
+
 
 class TrainerTpu(base_runner.BaseRunner):
   """Trainer on TPU."""
@@ -817,6 +963,10 @@ class Evaler(base_runner.BaseRunner):
     self._summary_writer = self._CreateSummaryWriter(self._eval_dir)
     self._should_report_metrics = self._job_name.startswith(
         FLAGS.vizier_reporting_job)
+    self._num_shards = FLAGS.evaler_num_shards
+    self._shard_index = self.params.cluster.task
+    if self._num_shards > 1:
+      self._ShardInput()
 
     with self._graph.as_default(), tf.container(self._container_id):
       with self._cluster, tf.device(self._cluster.GetPlacer()):
@@ -839,6 +989,20 @@ class Evaler(base_runner.BaseRunner):
       tf.train.write_graph(self._graph.as_graph_def(), self._eval_dir,
                            '%s.pbtxt' % self._output_name)
 
+  def _ShardInput(self):
+    """Makes this task read only its own slice of the eval data."""
+    assert self._shard_index < self._num_shards, (
+        'Evaler task %d does not fit into %d shards.' % (self._shard_index,
+                                                         self._num_shards))
+    input_params = self.params.input
+    if self._model_task_name:
+      input_params = input_params.Get(self._model_task_name)
+    if 'num_file_shards' not in input_params:
+      raise ValueError('--evaler_num_shards requires an input generator '
+                       'reading from files, got %s.' % input_params.cls)
+    input_params.num_file_shards = self._num_shards
+    input_params.file_shard_index = self._shard_index
+
   def Start(self):
     self._RunLoop(self._job_name, self._Loop)
 
@@ -849,13 +1013,24 @@ class Evaler(base_runner.BaseRunner):
       sess.run(self.initialize_tables)
       # This initializes local variables.
       sess.run(self._initialize_local_vars)
+      if self._num_shards > 1 and self._shard_index == 0:
+        # Removes the marker of a previous run of the job.
+        self._RemoveShardsStop()
       path = None
       while True:
-        path = self._FindNewCheckpoint(path, sess)
+        if self._num_shards > 1 and self._shard_index != 0:
+          path = self._WaitForAssignedCheckpoint(path)
+        else:
+          path = self._FindNewCheckpoint(path, sess)
         if not path or self._EvalOnce(path, sess):
           break
 
+    if self._num_shards > 1 and self._shard_index != 0:
+      tf.logging.info('Evaluation finished.')
+      return
     self.EvalLatestCheckpoint(path)
+    if self._num_shards > 1:
+      self._StopShards()
     if self._should_report_metrics:
       self._trial.ReportDone()
     tf.logging.info('Evaluation finished.')
@@ -886,6 +1061,8 @@ class Evaler(base_runner.BaseRunner):
     Returns:
       should_stop.
     """
+    if self._num_shards > 1 and self._shard_index == 0:
+      self._AssignCheckpoint(path)
     if not FLAGS.evaler_in_same_address_as_controller:
       self._LoadCheckpointForEval(sess, path)
 
@@ -894,8 +1071,11 @@ class Evaler(base_runner.BaseRunner):
         name: metrics.AverageMetric() for name in self._model_task.eval_metrics
     }
     num_samples_metric = metrics_dict['num_samples_in_batch']
-    while (num_samples_metric.total_value <
-           self._model_task.params.eval.samples_per_summary):
+    samples_per_summary = self._model_task.params.eval.samples_per_summary
+    if self._num_shards > 1:
+      samples_per_summary = (
+          samples_per_summary + self._num_shards - 1) // self._num_shards
+    while num_samples_metric.total_value < samples_per_summary:
       # NOTE: We intentionally do not let FProp generate summaries by default,
       # because evaler calls FProp multiple times for each checkpoint. Multiple
       # summaries at the same step is often confusing. Instead, models should
@@ -904,8 +1084,14 @@ class Evaler(base_runner.BaseRunner):
       for name, (value, weight) in six.iteritems(ans):
         metrics_dict[name].Update(value, weight)
       tf.logging.info('Total examples done: %d/%d',
-                      num_samples_metric.total_value,
-                      self._model_task.params.eval.samples_per_summary)
+                      num_samples_metric.total_value, samples_per_summary)
+
+    should_stop = global_step >= self.params.train.max_steps
+    if self._num_shards > 1:
+      if self._shard_index != 0:
+        self._WriteShardMetrics(path, metrics_dict)
+        return should_stop
+      self._MergeShardMetrics(path, metrics_dict)
 
     # Replace average values with total values for certain metrics.
     if 'num_predictions' in metrics_dict:
@@ -921,13 +1107,127 @@ class Evaler(base_runner.BaseRunner):
         text_filename=os.path.join(self._eval_dir,
                                    'score-{:08d}.txt'.format(global_step)))
 
-    should_stop = global_step >= self.params.train.max_steps
     if self._should_report_metrics:
       trial_should_stop = self._trial.ReportEvalMeasure(global_step,
                                                         metrics_dict, path)
       should_stop = should_stop or trial_should_stop
     return should_stop
 
+  def _GetShardsDir(self):
+    return os.path.join(self._eval_dir, 'shards')
+
+  def _GetShardMetricsPath(self, checkpoint_path, shard_index):
+    return os.path.join(
+        self._GetShardsDir(),
+        'metrics-%s-%05d-of-%05d' % (os.path.basename(checkpoint_path),
+                                     shard_index, self._num_shards))
+
+  def _AssignCheckpoint(self, checkpoint_path):
+    """Makes the other shards evaluate `checkpoint_path` next."""
+    path = os.path.join(self._GetShardsDir(), 'checkpoint')
+    tf.gfile.MakeDirs(os.path.dirname(path))
+    tmp_path = path + '.tmp'
+    with tf.gfile.Open(tmp_path, 'w') as f:
+      f.write(checkpoint_path)
+    tf.gfile.Rename(tmp_path, path, overwrite=True)
+
+  def _GetShardsStopPath(self):
+    return os.path.join(self._GetShardsDir(), 'stop')
+
+  def _StopShards(self):
+    """Makes the other shards stop once they evaluated their checkpoint."""
+    path = self._GetShardsStopPath()
+    tf.gfile.MakeDirs(os.path.dirname(path))
+    with tf.gfile.Open(path, 'w') as f:
+      f.write('')
+
+  def _RemoveShardsStop(self):
+    path = self._GetShardsStopPath()
+    if tf.gfile.Exists(path):
+      tf.gfile.Remove(path)
+
+  def _WaitForAssignedCheckpoint(self, prev_path):
+    """Waits until task 0 assigns a checkpoint other than `prev_path`.
+
+    Args:
+      prev_path: The previously evaluated checkpoint, or None.
+
+    Returns:
+      The path to the checkpoint task 0 evaluates, or None if the job should
+      stop, i.e., task 0 stopped after assigning `prev_path`.
+    """
+    path = os.path.join(self._GetShardsDir(), 'checkpoint')
+    while not self._trial.ShouldStop():
+      if tf.gfile.Exists(path):
+        with tf.gfile.Open(path, 'r') as f:
+          checkpoint_path = f.read()
+        if checkpoint_path != prev_path:
+          return checkpoint_path
+      # Task 0 assigns its last checkpoint before it stops, so that one is
+      # still evaluated.
+      if tf.gfile.Exists(self._GetShardsStopPath()):
+        return None
+      time.sleep(10)
+    return None
+
+  def _WriteShardMetrics(self, checkpoint_path, metrics_dict):
+    """Writes the metrics of this shard for task 0 to merge."""
+    path = self._GetShardMetricsPath(checkpoint_path, self._shard_index)
+    tf.gfile.MakeDirs(os.path.dirname(path))
+    # Writes to a temporary file first, so that task 0 never reads a partially
+    # written file.
+    tmp_path = path + '.tmp'
+    with tf.gfile.Open(tmp_path, 'wb') as f:
+      pickle.dump(metrics_dict, f, pickle.HIGHEST_PROTOCOL)
+    try:
+      tf.gfile.Rename(tmp_path, path, overwrite=True)
+    except tf.errors.NotFoundError:
+      # Task 0 gave up on this checkpoint and removed the file.
+      tf.logging.warning('Eval shard metrics of %s are too late.',
+                         checkpoint_path)
+
+  def _MergeShardMetrics(self, checkpoint_path, metrics_dict):
+    """Merges the metrics of the other shards into `metrics_dict`.
+
+    Waits up to --evaler_shard_timeout_secs for them, and then removes the
+    metrics files of this and any earlier checkpoint.
+
+    Args:
+      checkpoint_path: The checkpoint evaluated.
+      metrics_dict: The metrics of shard 0, to be updated.
+    """
+    pending = set(range(1, self._num_shards))
+    deadline = time.time() + FLAGS.evaler_shard_timeout_secs
+    while True:
+      for shard_index in sorted(pending):
+        path = self._GetShardMetricsPath(checkpoint_path, shard_index)
+        if not tf.gfile.Exists(path):
+          continue
+        with tf.gfile.Open(path, 'rb') as f:
+          shard_metrics = pickle.load(f)
+        for name, metric in six.iteritems(shard_metrics):
+          metrics_dict[name].Merge(metric)
+        tf.gfile.Remove(path)
+        pending.remove(shard_index)
+      if not pending:
+        break
+      if time.time() >= deadline:
+        tf.logging.warning(
+            'Timed out waiting for the metrics of eval shards %s of %s.',
+            sorted(pending), checkpoint_path)
+        break
+      time.sleep(10)
+
+    # Shards which timed out may still write their metrics, or may have
+    # evaluated an earlier checkpoint only.
+    for path in tf.gfile.Glob(os.path.join(self._GetShardsDir(), 'metrics-*')):
+      tf.logging.info('Removing orphaned eval shard metrics %s', path)
+      try:
+        tf.gfile.Remove(path)
+      except tf.errors.NotFoundError:
+        # A temporary file which was just renamed.
+        pass
+
 
 def GetDecoderDir(logdir, decoder_type, model_task_name):
   if model_task_name:
@@ -1028,7 +1328,10 @@ class Decoder(base_runner.BaseRunner):
 
   @classmethod
   def GetDecodeOutPath(cls, decoder_dir, checkpoint_id):
-    """Gets the path to decode out file."""
+    """Gets the path prefix of the decode out table.
+
+    The table can be read with `key_value_io.ShardedKeyValueReader`.
+    """
     out_dir = cls._GetTtlDir(decoder_dir, duration='7d')
     return os.path.join(out_dir, 'decoder_out_%09d' % checkpoint_id)
 
@@ -1042,38 +1345,133 @@ class Decoder(base_runner.BaseRunner):
 
     global_step = sess.run(self._model.global_step)
     dec_metrics = self._model_task.CreateDecoderMetrics()
-    buffered_decode_out = []
+    # global_step and the checkpoint id from the checkpoint file might be
+    # different. For consistency of checkpoint filename and decoder_out
+    # file, use the checkpoint id as derived from the checkpoint filename.
+    checkpoint_id = _GetCheckpointIdForDecodeOut(checkpoint_path, global_step)
+    decode_out_path = self.GetDecodeOutPath(self._decoder_dir, checkpoint_id)
     num_examples_metric = dec_metrics['num_samples_in_batch']
+
+    # Batches are post-processed on a separate thread while the next ones are
+    # decoded. They are post-processed in order, and batches decoded after
+    # `samples_per_summary` examples are done are dropped, so the metrics are
+    # the same as if decoding and post-processing were run serially. To not
+    # decode batches which would be dropped, a batch is only fetched if the
+    # ones in flight, i.e., fetched but not post-processed yet, are unlikely
+    # to complete `samples_per_summary` examples, judging by the largest
+    # batch post-processed so far.
+    post_process_queue = queue.Queue(
+        maxsize=max(1, FLAGS.decoder_post_process_queue_size))
+    done = threading.Event()
+    in_flight_cv = threading.Condition()
+    post_process_state = {
+        'seconds': 0.0,
+        'exc_info': None,
+        'in_flight': 0,
+        'max_batch_size': 0,
+    }
+
+    def _FinishBatch(batch_size):
+      with in_flight_cv:
+        post_process_state['in_flight'] -= 1
+        post_process_state['max_batch_size'] = max(
+            post_process_state['max_batch_size'], batch_size)
+        in_flight_cv.notify()
+
+    def _ShouldFetch():
+      """Waits until another batch may be needed. Returns False if not."""
+      with in_flight_cv:
+        while not done.is_set() and post_process_state['in_flight'] > 0:
+          max_samples_in_flight = (
+              post_process_state['in_flight'] *
+              post_process_state['max_batch_size'])
+          if (post_process_state['max_batch_size'] > 0 and
+              num_examples_metric.total_value + max_samples_in_flight <
+              samples_per_summary):
+            break
+          in_flight_cv.wait()
+        if done.is_set():
+          return False
+        post_process_state['in_flight'] += 1
+        return True
+
+    def _PostProcess():
+      while True:
+        dec_out = post_process_queue.get()
+        if dec_out is None:
+          return
+        if done.is_set():
+          _FinishBatch(0)
+          continue
+        post_process_start = time.time()
+        num_examples_before = num_examples_metric.total_value
+        try:
+          decode_out = self._model_task.PostProcessDecodeOut(
+              dec_out, dec_metrics)
+          if decode_out:
+            decode_out_writer.WriteAll(decode_out)
+        except Exception:  # pylint: disable=broad-except
+          post_process_state['exc_info'] = sys.exc_info()
+          done.set()
+          _FinishBatch(0)
+          continue
+        post_process_secs = time.time() - post_process_start
+        post_process_state['seconds'] += post_process_secs
+        tf.logging.info(
+            'Total examples done: %d/%d '
+            '(%f seconds decode postprocess)', num_examples_metric.total_value,
+            samples_per_summary, post_process_secs)
+        if num_examples_metric.total_value >= samples_per_summary:
+          done.set()
+        _FinishBatch(num_examples_metric.total_value - num_examples_before)
+
+    if num_examples_metric.total_value >= samples_per_summary:
+      done.set()
+    post_process_thread = threading.Thread(target=_PostProcess)
+    post_process_thread.daemon = True
+    fetch_secs = 0.0
     start_time = time.time()
-    while num_examples_metric.total_value < samples_per_summary:
-      tf.logging.info('Fetching dec_output.')
-      fetch_start = time.time()
-      run_options = config_pb2.RunOptions(
-          report_tensor_allocations_upon_oom=False)
-      if self._summary_op is None:
-        # No summaries were collected.
-        dec_out = sess.run(self._dec_output, options=run_options)
-      else:
-        dec_out, summary = sess.run([self._dec_output, self._summary_op],
-                                    options=run_options)
-        self._summary_writer.add_summary(summary, global_step)
-      post_process_start = time.time()
-      tf.logging.info(
-          'Done fetching (%f seconds)' % (post_process_start - fetch_start))
-      decode_out = self._model_task.PostProcessDecodeOut(dec_out, dec_metrics)
-      if decode_out:
-        buffered_decode_out.extend(decode_out)
-      tf.logging.info(
-          'Total examples done: %d/%d '
-          '(%f seconds decode postprocess)', num_examples_metric.total_value,
-          samples_per_summary,
-          time.time() - post_process_start)
+    with key_value_io.ShardedKeyValueWriter(
+        decode_out_path,
+        num_shards=FLAGS.decoder_out_num_shards) as decode_out_writer:
+      post_process_thread.start()
+      try:
+        while _ShouldFetch():
+          tf.logging.info('Fetching dec_output.')
+          fetch_start = time.time()
+          run_options = config_pb2.RunOptions(
+              report_tensor_allocations_upon_oom=False)
+          if self._summary_op is None:
+            # No summaries were collected.
+            dec_out = sess.run(self._dec_output, options=run_options)
+          else:
+            dec_out, summary = sess.run([self._dec_output, self._summary_op],
+                                        options=run_options)
+            self._summary_writer.add_summary(summary, global_step)
+          fetch_end = time.time()
+          fetch_secs += fetch_end - fetch_start
+          tf.logging.info(
+              'Done fetching (%f seconds)' % (fetch_end - fetch_start))
+          post_process_queue.put(dec_out)
+      finally:
+        post_process_queue.put(None)
+        post_process_thread.join()
+    if post_process_state['exc_info']:
+      six.reraise(*post_process_state['exc_info'])
 
     summaries = {k: v.Summary(k) for k, v in six.iteritems(dec_metrics)}
     elapsed_secs = time.time() - start_time
     example_rate = num_examples_metric.total_value / elapsed_secs
+    # The fractions of the wall time spent decoding on the device and
+    # post-processing on the host.
+    decode_utilization = fetch_secs / elapsed_secs
+    post_process_utilization = post_process_state['seconds'] / elapsed_secs
     summaries['examples/sec'] = metrics.CreateScalarSummary(
         'examples/sec', example_rate)
+    summaries['utilization/decode'] = metrics.CreateScalarSummary(
+        'utilization/decode', decode_utilization)
+    summaries['utilization/post_process'] = metrics.CreateScalarSummary(
+        'utilization/post_process', post_process_utilization)
     self._WriteSummaries(
         self._summary_writer,
         os.path.basename(self._decoder_dir),
@@ -1084,15 +1482,9 @@ class Decoder(base_runner.BaseRunner):
     self._ExportMetrics(
         decode_checkpoint=global_step,
         dec_metrics=dec_metrics,
-        example_rate=example_rate)
-    if buffered_decode_out:
-      # global_step and the checkpoint id from the checkpoint file might be
-      # different. For consistency of checkpoint filename and decoder_out
-      # file, use the checkpoint id as derived from the checkpoint filename.
-      checkpoint_id = _GetCheckpointIdForDecodeOut(checkpoint_path, global_step)
-      decode_out_path = self.GetDecodeOutPath(self._decoder_dir, checkpoint_id)
-      self._WriteKeyValuePairs(decode_out_path, buffered_decode_out)
-
+        example_rate=example_rate,
+        decode_utilization=decode_utilization,
+        post_process_utilization=post_process_utilization)
     should_stop = global_step >= self.params.train.max_steps
     if self._should_report_metrics:
       trial_should_stop = self._trial.ReportEvalMeasure(
@@ -1117,6 +1509,81 @@ class Decoder(base_runner.BaseRunner):
       self.DecodeCheckpoint(sess, path)
 
 
+class EvalMultiplexer(object):
+  """Runs co-located evalers and decoders over one copy of the variables.
+
+  The graphs of the runners create their variables under the same names in
+  the same container, so with a distributed session they all use the
+  variables stored in the --tf_master server. The multiplexer restores each
+  checkpoint into them once, with the saver of the first runner, and then
+  runs the runners on it one after another. A runner is thus never running
+  while the variables are restored.
+  """
+
+  def __init__(self, runners):
+    assert runners
+    self._runners = runners
+    self._lead = runners[0]
+    for runner in runners:
+      # pylint: disable=protected-access
+      if not runner._tf_master.startswith('grpc://'):
+        raise ValueError('--multiplex_eval_jobs requires a grpc tf_master, got '
+                         '%r.' % runner._tf_master)
+      runner._skip_checkpoint_restore = True
+    self.enqueue_ops = []
+
+  def _RunOnCheckpoint(self, runner, sess, path):
+    """Evaluates or decodes `path`. Returns should_stop."""
+    # pylint: disable=protected-access
+    if isinstance(runner, Evaler):
+      return runner._EvalOnce(path, sess)
+    return runner.DecodeCheckpoint(sess, path)
+
+  def _RunAll(self, sessions, path):
+    """Restores `path` and runs all runners on it. Returns should_stop."""
+    # pylint: disable=protected-access
+    tf.logging.info('Load from checkpoint %s.', path)
+    self._lead._saver.restore(sessions[0], path)
+    tf.logging.info('Load checkpoint done.')
+    should_stop = False
+    for runner, sess in zip(self._runners, sessions):
+      should_stop = self._RunOnCheckpoint(runner, sess, path) or should_stop
+    return should_stop
+
+  def Start(self):
+    # pylint: disable=protected-access
+    self._lead._RunLoop('eval_multiplexer', self._Loop)
+
+  def _Loop(self):
+    """The main loop."""
+    # pylint: disable=protected-access
+    sessions = []
+    try:
+      for runner in self._runners:
+        if isinstance(runner, Decoder):
+          sess = runner._GetSession(inline=False)
+        else:
+          sess = runner._GetSession()
+        sessions.append(sess)
+        sess.run(runner.initialize_tables)
+        sess.run(runner._initialize_local_vars)
+      path = None
+      while True:
+        path = self._lead._FindNewCheckpoint(path, sessions[0])
+        if not path or self._RunAll(sessions, path):
+          break
+      latest_path = tf.train.latest_checkpoint(self._lead._train_dir)
+      if latest_path and latest_path != path:
+        self._RunAll(sessions, latest_path)
+    finally:
+      for sess in sessions:
+        sess.close()
+    for runner in self._runners:
+      if runner._should_report_metrics:
+        runner._trial.ReportDone()
+    tf.logging.info('Multiplexed evaluation finished.')
+
+
 class RunnerManager(object):
   """Helper class for managing runners."""
 
@@ -1129,6 +1596,7 @@ class RunnerManager(object):
   TrainerTpu = TrainerTpu
   Evaler = Evaler
   Decoder = Decoder
+  EvalMultiplexer = EvalMultiplexer
 
   def __init__(self, model):
     self._model_name = model
@@ -1309,8 +1777,21 @@ class RunnerManager(object):
       runner = self._CreateRunner(j, FLAGS.model_task_name, logdir, tf_master,
                                   trial)
       runners.append(runner)
+    if FLAGS.multiplex_eval_jobs:
+      runners = self._MultiplexEvalRunners(runners)
     return runners
 
+  def _MultiplexEvalRunners(self, runners):
+    """Replaces the evalers and decoders in `runners` by an EvalMultiplexer."""
+    eval_runners = [r for r in runners if isinstance(r, (Evaler, Decoder))]
+    if len(eval_runners) < 2:
+      return runners
+    if any(isinstance(r, (Trainer, TrainerTpu)) for r in runners):
+      raise ValueError('--multiplex_eval_jobs does not support trainer jobs in '
+                       'the same process.')
+    return ([r for r in runners if r not in eval_runners] +
+            [self.EvalMultiplexer(eval_runners)])
+
   def StartRunners(self, runners):
     """Runs `runners` in parallel threads.
 
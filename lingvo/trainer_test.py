@@ -32,6 +32,7 @@ from lingvo import trainer
 from lingvo.core import base_input_generator
 from lingvo.core import base_layer
 from lingvo.core import base_model
+from lingvo.core import metrics
 from lingvo.core import py_utils
 from lingvo.core import trainer_test_utils
 from lingvo.tasks.image.input_generator import FakeMnistData
@@ -336,5 +337,310 @@ class ProcessFPropResultsTest(BaseTrainerTest):
                     10.0)
 
 
+class TrainerStepsPerLoopTest(BaseTrainerTest):
+
+  def _Params(self, steps, steps_per_loop):
+    cfg = trainer_test_utils.IdentityRegressionModel.Params()
+    cfg.cluster.task = 0
+    cfg.cluster.mode = 'sync'
+    cfg.cluster.job = 'trainer_client'
+    cfg.cluster.worker.name = '/job:local'
+    cfg.cluster.worker.replicas = 1
+    cfg.cluster.worker.gpus_per_replica = 0
+    cfg.cluster.ps.name = '/job:local'
+    cfg.cluster.ps.replicas = 1
+    cfg.cluster.ps.gpus_per_replica = 0
+    cfg.train.max_steps = steps
+    cfg.train.steps_per_loop = steps_per_loop
+    cfg.task.train.learning_rate = 0.025
+    return cfg
+
+  def testIdentityRegressionModel(self):
+    logdir = os.path.join(tf.test.get_temp_dir(),
+                          'steps_per_loop_test' + str(random.random()))
+    FLAGS.logdir = logdir
+
+    steps = 100
+    steps_per_loop = 10
+    cfg = self._Params(steps, steps_per_loop)
+
+    runners = [self._CreateController(cfg), self._CreateTrainer(cfg)]
+
+    runner_manager = trainer.RunnerManager(cfg.name)
+    runner_manager.StartRunners(runners)
+    train = runners[1]
+
+    # ProcessFPropResults should have been called once per loop, with the
+    # metrics averaged over the loop and no per-example tensors.
+    num_loops = steps // steps_per_loop
+    expected_samples_in_batch = [
+        (2, 1.0 * steps_per_loop) for _ in range(num_loops)
+    ]
+    self.assertAllEqual(
+        expected_samples_in_batch,
+        [m['num_samples_in_batch'] for m in train._model.metrics])
+    self.assertAllEqual(
+        expected_samples_in_batch,
+        [m['num_samples_in_batch'] for m in train._model._task.metrics])
+    self.assertEqual([{}] * num_loops, train._model.result_per_example_tensors)
+
+    # Global steps should increment by steps_per_loop for each loop.
+    expected_global_steps = [(i + 1) * steps_per_loop for i in range(num_loops)]
+    self.assertAllEqual(expected_global_steps, train._model.global_steps)
+    self.assertAllEqual(expected_global_steps, train._model._task.global_steps)
+
+  def testMultiTaskModelRaises(self):
+    FLAGS.logdir = os.path.join(tf.test.get_temp_dir(),
+                                'steps_per_loop_multi_task_test' +
+                                str(random.random()))
+    cfg = self._Params(steps=100, steps_per_loop=10)
+    cfg.cls = base_model.MultiTaskModel
+    with self.assertRaisesRegexp(ValueError, 'single-task'):
+      self._CreateTrainer(cfg)
+
+
+class EvalerShardsTest(tf.test.TestCase):
+
+  def _CreateEvaler(self, eval_dir, shard_index, num_shards=3):
+    # Only sets what the methods handling the files of the shards use.
+    evaler = trainer.Evaler.__new__(trainer.Evaler)
+    evaler._eval_dir = eval_dir
+    evaler._shard_index = shard_index
+    evaler._num_shards = num_shards
+    evaler._trial = base_trial.NoOpTrial()
+    return evaler
+
+  def _Metrics(self, value, weight):
+    metric = metrics.AverageMetric()
+    metric.Update(value, weight)
+    return {'loss': metric}
+
+  def testAssignCheckpoint(self):
+    eval_dir = os.path.join(self.get_temp_dir(), 'assign_checkpoint')
+    self._CreateEvaler(eval_dir, 0)._AssignCheckpoint('/train/ckpt-00000100')
+    shard = self._CreateEvaler(eval_dir, 1)
+    self.assertEqual('/train/ckpt-00000100',
+                     shard._WaitForAssignedCheckpoint(None))
+
+  def testStopShards(self):
+    eval_dir = os.path.join(self.get_temp_dir(), 'stop_shards')
+    task0 = self._CreateEvaler(eval_dir, 0)
+    shard = self._CreateEvaler(eval_dir, 1)
+    task0._AssignCheckpoint('/train/ckpt-00000100')
+    task0._StopShards()
+    # The last assigned checkpoint is still evaluated.
+    self.assertEqual('/train/ckpt-00000100',
+                     shard._WaitForAssignedCheckpoint(None))
+    self.assertIsNone(
+        shard._WaitForAssignedCheckpoint('/train/ckpt-00000100'))
+    # A new run of the job removes the marker.
+    task0._RemoveShardsStop()
+    task0._AssignCheckpoint('/train/ckpt-00000200')
+    self.assertEqual(
+        '/train/ckpt-00000200',
+        shard._WaitForAssignedCheckpoint('/train/ckpt-00000100'))
+
+  def testWriteAndMerge(self):
+    eval_dir = os.path.join(self.get_temp_dir(), 'write_and_merge')
+    # Written by a shard which fell behind.
+    self._CreateEvaler(eval_dir, 2)._WriteShardMetrics(
+        '/train/ckpt-00000050', self._Metrics(100.0, 1.0))
+    for shard_index in (1, 2):
+      self._CreateEvaler(eval_dir, shard_index)._WriteShardMetrics(
+          '/train/ckpt-00000100', self._Metrics(float(shard_index), 1.0))
+    metrics_dict = self._Metrics(0.0, 2.0)
+    self._CreateEvaler(eval_dir, 0)._MergeShardMetrics('/train/ckpt-00000100',
+                                                       metrics_dict)
+    self.assertEqual(4.0, metrics_dict['loss'].total_weight)
+    self.assertAllClose(0.75, metrics_dict['loss'].value)
+    # Consumed and orphaned files are removed.
+    self.assertEqual([], tf.gfile.Glob(os.path.join(eval_dir, 'shards',
+                                                    'metrics-*')))
+
+  def testMergeTimeout(self):
+    eval_dir = os.path.join(self.get_temp_dir(), 'merge_timeout')
+    self._CreateEvaler(eval_dir, 1)._WriteShardMetrics(
+        '/train/ckpt-00000100', self._Metrics(1.0, 1.0))
+    metrics_dict = self._Metrics(0.0, 1.0)
+    timeout_secs = FLAGS.evaler_shard_timeout_secs
+    FLAGS.evaler_shard_timeout_secs = 0
+    try:
+      self._CreateEvaler(eval_dir, 0)._MergeShardMetrics(
+          '/train/ckpt-00000100', metrics_dict)
+    finally:
+      FLAGS.evaler_shard_timeout_secs = timeout_secs
+    # Only shard 2 is missing.
+    self.assertEqual(2.0, metrics_dict['loss'].total_weight)
+    self.assertAllClose(0.5, metrics_dict['loss'].value)
+    self.assertEqual([], tf.gfile.Glob(os.path.join(eval_dir, 'shards',
+                                                    'metrics-*')))
+
+
+class _FakeSession(object):
+  """Records when it is closed."""
+
+  def __init__(self, name, events):
+    self._name = name
+    self._events = events
+
+  def run(self, fetches):
+    del fetches
+
+  def close(self):
+    self._events.append(('close', self._name))
+
+
+class _FakeSaver(object):
+  """Records the checkpoints it restores."""
+
+  def __init__(self, events):
+    self._events = events
+
+  def restore(self, sess, path):
+    del sess
+    self._events.append(('restore', path))
+
+
+def _InitFakeRunner(runner, name, events, train_dir, error):
+  runner._name = name
+  runner._events = events
+  runner._error = error
+  runner._tf_master = 'grpc://localhost:1234'
+  runner._train_dir = train_dir
+  runner._saver = _FakeSaver(events)
+  runner._trial = base_trial.NoOpTrial()
+  runner._should_report_metrics = False
+  runner.initialize_tables = None
+  runner._initialize_local_vars = None
+
+
+class _FakeEvaler(trainer.Evaler):
+  """Records the checkpoints it evaluates, without building a model."""
+
+  def __init__(self, name, events, train_dir='', error=None, paths=()):
+    _InitFakeRunner(self, name, events, train_dir, error)
+    self._paths = list(paths)
+
+  def _GetSession(self):
+    return _FakeSession(self._name, self._events)
+
+  def _FindNewCheckpoint(self, prev_path, sess):
+    del prev_path, sess
+    return self._paths.pop(0) if self._paths else None
+
+  def _EvalOnce(self, path, sess):
+    self._events.append((self._name, path))
+    if self._error:
+      raise self._error
+    return False
+
+
+class _FakeDecoder(trainer.Decoder):
+  """Records the checkpoints it decodes, without building a model."""
+
+  def __init__(self, name, events, train_dir='', error=None):
+    _InitFakeRunner(self, name, events, train_dir, error)
+
+  def _GetSession(self, inline=True):
+    del inline
+    return _FakeSession(self._name, self._events)
+
+  def DecodeCheckpoint(self, sess, checkpoint_path):
+    self._events.append((self._name, checkpoint_path))
+    if self._error:
+      raise self._error
+    return False
+
+
+class EvalMultiplexerTest(tf.test.TestCase):
+
+  def _TrainDir(self):
+    # Without checkpoints.
+    return os.path.join(self.get_temp_dir(), 'eval_multiplexer')
+
+  def testRoundRobin(self):
+    events = []
+    runners = [
+        _FakeEvaler(
+            'evaler', events, self._TrainDir(), paths=['ckpt-1', 'ckpt-2']),
+        _FakeDecoder('decoder', events),
+        _FakeEvaler('evaler_test', events),
+    ]
+    trainer.EvalMultiplexer(runners)._Loop()
+    # Each checkpoint is restored once and then run by every runner in turn.
+    self.assertEqual([
+        ('restore', 'ckpt-1'),
+        ('evaler', 'ckpt-1'),
+        ('decoder', 'ckpt-1'),
+        ('evaler_test', 'ckpt-1'),
+        ('restore', 'ckpt-2'),
+        ('evaler', 'ckpt-2'),
+        ('decoder', 'ckpt-2'),
+        ('evaler_test', 'ckpt-2'),
+        ('close', 'evaler'),
+        ('close', 'decoder'),
+        ('close', 'evaler_test'),
+    ], events)
+
+  def testRunnerRaises(self):
+    events = []
+    runners = [
+        _FakeEvaler('evaler', events, self._TrainDir(), paths=['ckpt-1']),
+        _FakeDecoder('decoder', events, error=ValueError('decode failed')),
+        _FakeEvaler('evaler_test', events),
+    ]
+    with self.assertRaisesRegexp(ValueError, 'decode failed'):
+      trainer.EvalMultiplexer(runners)._Loop()
+    # The error stops the loop, but all sessions are still closed.
+    self.assertEqual([
+        ('restore', 'ckpt-1'),
+        ('evaler', 'ckpt-1'),
+        ('decoder', 'ckpt-1'),
+        ('close', 'evaler'),
+        ('close', 'decoder'),
+        ('close', 'evaler_test'),
+    ], events)
+
+  def testShutdown(self):
+    events = []
+    runners = [
+        _FakeEvaler('evaler', events, self._TrainDir()),
+        _FakeDecoder('decoder', events),
+    ]
+    for runner in runners:
+      runner._should_report_metrics = True
+      runner._trial = tf.test.mock.create_autospec(
+          base_trial.Trial, instance=True)
+    # No checkpoint: the runners are not run and report they are done.
+    trainer.EvalMultiplexer(runners)._Loop()
+    self.assertEqual([('close', 'evaler'), ('close', 'decoder')], events)
+    for runner in runners:
+      runner._trial.ReportDone.assert_called_once_with()
+
+  def testRequiresGrpcMaster(self):
+    events = []
+    runners = [_FakeEvaler('evaler', events), _FakeDecoder('decoder', events)]
+    runners[1]._tf_master = 'local'
+    with self.assertRaisesRegexp(ValueError, 'grpc'):
+      trainer.EvalMultiplexer(runners)
+
+  def testMultiplexEvalRunners(self):
+    manager = trainer.RunnerManager('test')
+    events = []
+    evaler = _FakeEvaler('evaler', events)
+    decoder = _FakeDecoder('decoder', events)
+    controller = trainer.Controller.__new__(trainer.Controller)
+    # A single eval runner is left alone.
+    self.assertEqual([controller, evaler],
+                     manager._MultiplexEvalRunners([controller, evaler]))
+    runners = manager._MultiplexEvalRunners([evaler, controller, decoder])
+    self.assertEqual(2, len(runners))
+    self.assertIs(controller, runners[0])
+    self.assertIsInstance(runners[1], trainer.EvalMultiplexer)
+    with self.assertRaisesRegexp(ValueError, 'trainer'):
+      manager._MultiplexEvalRunners(
+          [evaler, decoder, trainer.Trainer.__new__(trainer.Trainer)])
+
+
 if __name__ == '__main__':
   tf.test.main()